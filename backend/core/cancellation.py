@@ -0,0 +1,246 @@
+"""取消令牌
+
+`/api/agents/cancel` 与任务取消接口只负责置位；真正停止上游生成需要把令牌一路传到发起 LLM 请求的地方：
+- 同步流用 `iterate_cancellable` 在后台线程读取，令牌触发后调用方立即返回，读取线程在下一个分片到达时关闭上游
+- 异步代码用 `wait_cancellable` / `aiter_cancellable` 让等待与取消赛跑，取消后退出 `async with` 以关闭连接
+- 后台任务线程通过 `cancel_scope` 绑定当前令牌，AI 微服务客户端无需逐层传参即可感知取消
+"""
+
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class OperationCancelled(BaseException):
+    """操作已被取消
+
+    与 asyncio.CancelledError 一样继承 BaseException，避免被各处通用的 `except Exception` 吞掉后继续执行。
+    """
+
+
+class CancellationToken:
+    """线程安全的取消令牌"""
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """触发取消并执行已登记的回调（只执行一次）"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"⚠️ 取消回调执行失败 ({self.name}): {str(e)}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """登记取消回调，返回注销函数；已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return unregister
+        callback()
+        return lambda: None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise OperationCancelled(self.name)
+
+
+# ==================== 按 ID 登记（Agent 流程 run_id / 后台任务 task_id） ====================
+
+_tokens_lock = threading.Lock()
+_tokens: Dict[str, CancellationToken] = {}
+
+
+def get_cancel_token(key: str) -> CancellationToken:
+    """获取（不存在则创建）指定 ID 的取消令牌"""
+    with _tokens_lock:
+        token = _tokens.get(key)
+        if token is None:
+            token = CancellationToken(key)
+            _tokens[key] = token
+        return token
+
+
+def find_cancel_token(key: str) -> Optional[CancellationToken]:
+    """查找已登记的令牌（不创建）"""
+    with _tokens_lock:
+        return _tokens.get(key)
+
+
+def request_cancel(key: str) -> bool:
+    """触发指定 ID 的取消令牌；返回 False 表示该 ID 没有正在运行的操作"""
+    with _tokens_lock:
+        token = _tokens.get(key)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+
+def release_cancel_token(key: str) -> None:
+    """运行结束后移除令牌"""
+    with _tokens_lock:
+        _tokens.pop(key, None)
+
+
+# ==================== 当前线程/协程的令牌 ====================
+
+_current_token: contextvars.ContextVar[Optional[CancellationToken]] = contextvars.ContextVar(
+    "cancellation_token", default=None
+)
+
+
+@contextmanager
+def cancel_scope(token: Optional[CancellationToken]):
+    """在作用域内绑定当前令牌（asyncio.run 会复制上下文，协程内同样可见）"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def current_token() -> Optional[CancellationToken]:
+    return _current_token.get()
+
+
+def raise_if_cancelled(token: Optional[CancellationToken] = None) -> None:
+    """检查点：令牌（默认当前令牌）已取消时抛出 OperationCancelled"""
+    token = token or current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def _cancel_future(token: CancellationToken) -> "asyncio.Future":
+    """把令牌桥接成当前事件循环上的 Future（令牌可能在其他线程触发）"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def _set():
+        if not future.done():
+            future.set_result(None)
+
+    unregister = token.on_cancel(lambda: loop.call_soon_threadsafe(_set))
+    future.add_done_callback(lambda _: unregister())
+    return future
+
+
+async def wait_cancellable(awaitable: Awaitable[Any], token: Optional[CancellationToken]) -> Any:
+    """等待 awaitable；令牌先触发时取消它并抛出 OperationCancelled"""
+    if token is None:
+        return await awaitable
+    token.raise_if_cancelled()
+    task = asyncio.ensure_future(awaitable)
+    cancelled = _cancel_future(token)
+    try:
+        await asyncio.wait({task, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        # 外层协程自身被取消时一并取消内部请求
+        task.cancel()
+        raise
+    finally:
+        if not cancelled.done():
+            cancelled.cancel()
+    if task.done():
+        return task.result()
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+    raise OperationCancelled(token.name)
+
+
+async def aiter_cancellable(iterator: AsyncIterator[Any], token: Optional[CancellationToken]) -> AsyncIterator[Any]:
+    """逐项读取异步迭代器；令牌触发时立即中断正在等待的读取并抛出 OperationCancelled"""
+    if token is None:
+        async for item in iterator:
+            yield item
+        return
+    while True:
+        try:
+            item = await wait_cancellable(iterator.__anext__(), token)
+        except StopAsyncIteration:
+            return
+        yield item
+
+
+_PUMP_END = object()
+_PUMP_CANCELLED = object()
+
+
+def iterate_cancellable(iterable: Iterable[Any], token: Optional[CancellationToken]) -> Iterator[Any]:
+    """逐项读取同步迭代器；令牌触发时立即抛出 OperationCancelled
+
+    阻塞的网络读取无法从其他线程安全打断，因此读取放到后台线程：调用方不再等待，
+    读取线程在下一个分片到达时停止并关闭迭代器（从而关闭上游 HTTP 流）。
+    """
+    if token is None:
+        yield from iterable
+        return
+    token.raise_if_cancelled()
+
+    items: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+
+    def pump():
+        iterator = iter(iterable)
+        error = None
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                items.put((item, None))
+        except BaseException as e:
+            error = e
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+        items.put((_PUMP_END, error))
+
+    unregister = token.on_cancel(lambda: items.put((_PUMP_CANCELLED, None)))
+    threading.Thread(target=pump, daemon=True, name=f"cancellable-{token.name}"[:48]).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _PUMP_CANCELLED:
+                raise OperationCancelled(token.name)
+            if item is _PUMP_END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        unregister()
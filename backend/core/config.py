@@ -35,6 +35,8 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 # WARP 代理地址（Cloudflare WARP HTTP 代理默认端口是 40000）
 # 格式: http://127.0.0.1:40000
 GEMINI_PROXY = os.getenv("GEMINI_PROXY", "http://127.0.0.1:40000")
+# Gemini REST 接口地址（Agent LLM 网关使用）
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com")
 
 # ==================== 环境检测 ====================
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
@@ -54,12 +56,35 @@ AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://localhost:8001")
 AI_SERVICE_TIMEOUT = int(os.getenv("AI_SERVICE_TIMEOUT", "300"))
 AI_SERVICE_PROVIDER = os.getenv("AI_SERVICE_PROVIDER", "gemini")
 DEFAULT_AI_PROVIDER = os.getenv("DEFAULT_AI_PROVIDER", AI_SERVICE_PROVIDER)
+# 批量写章时把小说级稳定前缀登记到提供商上下文缓存（开启后角色/世界观不再按章节裁剪）
+AI_PROMPT_CACHE_ENABLED = os.getenv("AI_PROMPT_CACHE_ENABLED", "false").lower() == "true"
 
 # ==================== DeepSeek API configuration (agent usage) ====================
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-reasoner")
 DEEPSEEK_TIMEOUT_MS = int(os.getenv("DEEPSEEK_TIMEOUT_MS", "300000"))
+# 多 Agent 流程默认开启推测执行（Archivist 与 Critic 并行，Critic 要求重写时丢弃 Archivist 结果）
+AGENT_FLOW_SPECULATIVE = os.getenv("AGENT_FLOW_SPECULATIVE", "false").lower() == "true"
+# 推测执行的后台线程数（各流程共享）
+AGENT_SPECULATION_WORKERS = int(os.getenv("AGENT_SPECULATION_WORKERS", "4"))
+# Critic 不通过时的默认修订方式: rewrite（整篇重写）或 paragraph（只重写 Critic 标记的段落）
+AGENT_FLOW_REVISION_MODE = os.getenv("AGENT_FLOW_REVISION_MODE", "rewrite").lower()
+# Agent 使用 Gemini 时的默认模型
+AGENT_GEMINI_MODEL = os.getenv("AGENT_GEMINI_MODEL", "gemini-2.0-flash")
+# 每个 Agent 的提供商与模型，格式: "agent:provider[/model]"，逗号分隔（default 为兜底，未写模型名用提供商默认模型）
+# 例如: "writer:deepseek/deepseek-chat,critic:gemini/gemini-2.0-flash,default:gemini"
+AGENT_MODELS_STR = os.getenv("AGENT_MODELS", "")
+AGENT_MODELS = {}
+for _item in AGENT_MODELS_STR.split(","):
+    _agent, _, _target = _item.partition(":")
+    _provider, _, _model = _target.strip().partition("/")
+    if _agent.strip() and _provider.strip():
+        AGENT_MODELS[_agent.strip().lower()] = (_provider.strip().lower(), _model.strip())
+# Agent LLM 网关：每个提供商连接池的最大连接数、可重试错误（429/5xx/网络错误）的重试次数与退避基数（秒）
+AGENT_LLM_MAX_CONNECTIONS = int(os.getenv("AGENT_LLM_MAX_CONNECTIONS", "20"))
+AGENT_LLM_MAX_RETRIES = int(os.getenv("AGENT_LLM_MAX_RETRIES", "2"))
+AGENT_LLM_RETRY_BASE_SECONDS = float(os.getenv("AGENT_LLM_RETRY_BASE_SECONDS", "0.5"))
 
 # ==================== Neo4j Graph Config ====================
 NEO4J_ENABLED = os.getenv("NEO4J_ENABLED", "false").lower() == "true"
@@ -67,3 +92,113 @@ NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "neo4j")
 
+
+# ==================== 上下文 token 预算 ====================
+# 每个模型的提示词上下文预算，格式: "模型名:预算,模型名:预算"
+CONTEXT_DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_DEFAULT_TOKEN_BUDGET", "12000"))
+CONTEXT_TOKEN_BUDGETS_STR = os.getenv(
+    "CONTEXT_TOKEN_BUDGETS",
+    "gemini-2.0-flash:16000,gemini-3-pro-preview:24000,deepseek-reasoner:12000,deepseek-chat:12000"
+)
+CONTEXT_TOKEN_BUDGETS = {
+    name.strip().lower(): int(budget)
+    for name, _, budget in (item.partition(":") for item in CONTEXT_TOKEN_BUDGETS_STR.split(","))
+    if name.strip() and budget.strip().isdigit()
+}
+# 章节正文生成时，背景资料（角色/世界观/前文）的预算
+CHAPTER_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAPTER_CONTEXT_TOKEN_BUDGET", "10000"))
+
+# ==================== 章节生成实体检索 ====================
+# 每章最多带入的相关角色 / 世界观设定数量（点名角色不受限制）
+CHAPTER_CHARACTER_TOP_K = int(os.getenv("CHAPTER_CHARACTER_TOP_K", "12"))
+CHAPTER_WORLD_SETTING_TOP_K = int(os.getenv("CHAPTER_WORLD_SETTING_TOP_K", "8"))
+
+# ==================== 上游限流 ====================
+# 每个 提供商[/模型] 的限额，格式: "名称:每秒请求数:突发容量:最大并发"，逗号分隔（default 为兜底）
+UPSTREAM_RATE_LIMITS_STR = os.getenv(
+    "UPSTREAM_RATE_LIMITS",
+    "default:2:5:4,gemini:2:5:4,gemini/text-embedding-004:10:20:8,deepseek:2:5:4"
+)
+UPSTREAM_RATE_LIMITS = {}
+for _item in UPSTREAM_RATE_LIMITS_STR.split(","):
+    _parts = [p.strip() for p in _item.split(":")]
+    if len(_parts) == 4 and _parts[0]:
+        try:
+            UPSTREAM_RATE_LIMITS[_parts[0].lower()] = (float(_parts[1]), int(_parts[2]), int(_parts[3]))
+        except ValueError:
+            pass
+# 令牌桶存储: memory（单进程）或 postgres（多 worker 共享，advisory lock 保护）
+UPSTREAM_RATE_LIMIT_BACKEND = os.getenv("UPSTREAM_RATE_LIMIT_BACKEND", "memory").lower()
+# 排队等待上游配额的最长时间（秒），0 表示一直等待
+UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS", "120"))
+
+# ==================== 共享运行状态 ====================
+# 取消标记、流程归属、接口限速、验证码的存储: memory（单进程）或 postgres（多 worker / 多主机共享，LISTEN/NOTIFY 广播取消）
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory").lower()
+# 流程归属与取消标记的保留时间（秒）
+RUN_STATE_TTL_SECONDS = float(os.getenv("RUN_STATE_TTL_SECONDS", "21600"))
+
+# ==================== 可续传的 SSE 事件日志 ====================
+# 每个运行在内存中保留的事件数，超出部分溢出到 EVENT_LOG_SPILL_BACKEND（postgres 或 none）
+EVENT_LOG_MAX_EVENTS = int(os.getenv("EVENT_LOG_MAX_EVENTS", "2000"))
+EVENT_LOG_SPILL_BACKEND = os.getenv("EVENT_LOG_SPILL_BACKEND", "postgres").lower()
+# 运行结束后保留事件日志供断线重连补发的时间（秒）
+EVENT_LOG_RETENTION_SECONDS = float(os.getenv("EVENT_LOG_RETENTION_SECONDS", "600"))
+# 每个进程同时运行的后台生成线程上限（0 表示不限）
+EVENT_LOG_MAX_PRODUCERS = int(os.getenv("EVENT_LOG_MAX_PRODUCERS", "32"))
+# 生成者租约的有效期（秒），生成期间每 1/3 有效期续期一次；worker 崩溃后过期即可在其他 worker 恢复
+EVENT_LOG_LEASE_SECONDS = float(os.getenv("EVENT_LOG_LEASE_SECONDS", "60"))
+
+# ==================== SSE 分片合并 ====================
+# 模型输出分片在该时间窗口（毫秒）内合并成一个 SSE 事件，0 表示逐片发送
+SSE_COALESCE_WINDOW_MS = float(os.getenv("SSE_COALESCE_WINDOW_MS", "40"))
+# 缓冲达到该字符数时不等窗口结束立即发送
+SSE_COALESCE_MAX_CHARS = int(os.getenv("SSE_COALESCE_MAX_CHARS", "512"))
+
+# ==================== 已认证用户缓存 ====================
+# 认证时缓存用户快照的时间（秒），0 表示关闭（每个请求查库）
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+# 每个进程最多缓存的用户数
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+# ==================== 小说向量内存索引 ====================
+# 每个进程缓存热门小说章节/段落向量的内存上限（MB），0 表示关闭（每次检索走 pgvector）
+VECTOR_INDEX_CACHE_MB = float(os.getenv("VECTOR_INDEX_CACHE_MB", "256"))
+# 索引的最长保留时间（秒），0 表示只在向量写入时失效
+VECTOR_INDEX_TTL_SECONDS = float(os.getenv("VECTOR_INDEX_TTL_SECONDS", "600"))
+
+# ==================== 段落近重复检测 ====================
+# 段落 MinHash 估计的 Jaccard 相似度达到该值视为近重复
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.6"))
+# 每个进程最多保留索引的小说数
+NEAR_DUPLICATE_MAX_NOVELS = int(os.getenv("NEAR_DUPLICATE_MAX_NOVELS", "200"))
+
+# ==================== 分层摘要 ====================
+# 摘要任务同时发往 AI 微服务的最大请求数
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))
+# 章节 / 卷 / 全书摘要的最大字数
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "400"))
+# 汇总时每次合并的下级摘要数（需保证 扇出 × 摘要字数 不超过微服务单次摘要的输入上限 4000 字）
+SUMMARY_ROLLUP_FANOUT = int(os.getenv("SUMMARY_ROLLUP_FANOUT", "8"))
+# “前情提要”带入的最近章节摘要数
+STORY_SO_FAR_RECENT_CHAPTERS = int(os.getenv("STORY_SO_FAR_RECENT_CHAPTERS", "3"))
+
+# ==================== 完整大纲流水线 ====================
+# 完整大纲完成后，角色 / 世界观 / 时间线 / 伏笔最多同时生成的阶段数（1 表示按顺序执行）
+OUTLINE_PIPELINE_MAX_PARALLEL = int(os.getenv("OUTLINE_PIPELINE_MAX_PARALLEL", "4"))
+
+# ==================== 章节列表批量生成 ====================
+# 一键生成全部章节列表时是否按卷并行（默认按卷顺序生成，每卷参考上一卷结尾章节）
+CHAPTER_OUTLINE_PARALLEL = os.getenv("CHAPTER_OUTLINE_PARALLEL", "false").lower() == "true"
+# 并行模式下最多同时生成的卷数（同时受提供商限流器的并发上限约束）
+CHAPTER_OUTLINE_MAX_PARALLEL = int(os.getenv("CHAPTER_OUTLINE_MAX_PARALLEL", "4"))
+# 并行生成后是否检查相邻卷交界的衔接（只修改后一卷开头几章的摘要和写作提示）
+CHAPTER_OUTLINE_STITCH = os.getenv("CHAPTER_OUTLINE_STITCH", "true").lower() == "true"
+
+# ==================== 结构化生成 ====================
+# 章节列表 / 角色 / 世界观 / 时间线使用 AI 微服务的流式接口，每生成完一项就写入数据库（false 时等完整结果后一次写入）
+STRUCTURED_STREAMING = os.getenv("STRUCTURED_STREAMING", "true").lower() == "true"
+
+# ==================== 章节正文写作模式 ====================
+# single：整章一次生成；scenes：先规划场景，再由 AI 微服务并发写作各场景并润色交界（单次请求可用 draft_mode 覆盖）
+CHAPTER_DRAFT_MODE = os.getenv("CHAPTER_DRAFT_MODE", "single").lower()
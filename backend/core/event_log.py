@@ -0,0 +1,406 @@
+"""可续传的 SSE 事件日志
+
+流程的生成不再绑定在 HTTP 响应上：生成在后台线程中运行，每个 SSE 事件编号（`id:` 行）后写入该运行的事件日志，
+响应只是日志的一个订阅者。浏览器断线后带 `Last-Event-ID` 重连，先补发错过的事件，再接上仍在进行的生成，
+已生成的内容不会重新生成一遍。
+- 内存中每个运行最多保留 EVENT_LOG_MAX_EVENTS 个事件，超出的旧事件按批溢出到 Postgres（UNLOGGED 表）
+- 运行结束后日志再保留 EVENT_LOG_RETENTION_SECONDS 秒供重连补发，之后连同溢出的行一起清理
+- 日志只在生成它的进程内存中；生成期间在共享状态中持有该运行的租约（定期续期），
+  重连落到其他 worker 时不会再启动第二个生成者；每个进程同时运行的生成线程数有上限
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 订阅者空闲时发送注释行的间隔（秒），保持代理连接并尽早发现断开的客户端
+HEARTBEAT_SECONDS = 15.0
+# 生成者租约在共享状态中的命名空间
+PRODUCER_LEASE_NAMESPACE = "run_producer"
+
+
+class RunAlreadyActive(Exception):
+    """该运行正在其他 worker 上生成"""
+
+
+class ProducerLimitReached(Exception):
+    """本进程同时运行的生成线程已达上限"""
+
+Event = Tuple[int, str]
+
+
+class PostgresEventSpill:
+    """溢出事件的 Postgres 存储"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._initialized = False
+
+    def _ensure_table(self, conn) -> None:
+        if self._initialized:
+            return
+        from sqlalchemy import text
+        conn.execute(text(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS agent_run_events (
+                run_id VARCHAR(36) NOT NULL,
+                seq INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                created_at DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (run_id, seq)
+            )
+            """
+        ))
+        self._initialized = True
+
+    def write(self, run_id: str, events: List[Event]) -> None:
+        from sqlalchemy import text
+        now = time.time()
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(
+                text("""
+                    INSERT INTO agent_run_events (run_id, seq, payload, created_at)
+                    VALUES (:run_id, :seq, :payload, :created_at)
+                    ON CONFLICT (run_id, seq) DO NOTHING
+                """),
+                [{"run_id": run_id, "seq": seq, "payload": payload, "created_at": now} for seq, payload in events]
+            )
+
+    def read(self, run_id: str, after_seq: int, until_seq: int) -> List[Event]:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            rows = conn.execute(
+                text("""
+                    SELECT seq, payload FROM agent_run_events
+                    WHERE run_id = :run_id AND seq > :after_seq AND seq <= :until_seq
+                    ORDER BY seq
+                """),
+                {"run_id": run_id, "after_seq": after_seq, "until_seq": until_seq}
+            ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def delete(self, run_id: str) -> None:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(text("DELETE FROM agent_run_events WHERE run_id = :run_id"), {"run_id": run_id})
+
+
+class RunEventLog:
+    """单个运行的事件日志（一个写入者，多个订阅者）"""
+
+    def __init__(
+        self,
+        run_id: str,
+        user_id: str,
+        max_events: int,
+        spill: Optional[PostgresEventSpill] = None,
+        start_seq: int = 0,
+    ):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.max_events = max(1, max_events)
+        self.first_seq = start_seq
+        self.last_seq = start_seq
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.spilled = 0
+        self._spill = spill
+        self._events: Deque[Event] = deque()
+        self._cond = threading.Condition()
+
+    def append(self, raw_event: str) -> int:
+        """编号并写入一个 SSE 事件，返回事件编号"""
+        with self._cond:
+            self.last_seq += 1
+            self._events.append((self.last_seq, f"id: {self.last_seq}\n{raw_event}"))
+            if len(self._events) > self.max_events:
+                # 按批溢出（在锁内完成，订阅者看到内存窗口前移时旧事件一定已可从溢出存储读取）
+                batch = [self._events.popleft() for _ in range(max(1, self.max_events // 4))]
+                self._spill_events(batch)
+            self._cond.notify_all()
+            return self.last_seq
+
+    def _spill_events(self, batch: List[Event]) -> None:
+        if self._spill is None:
+            return
+        try:
+            self._spill.write(self.run_id, batch)
+            self.spilled += len(batch)
+        except Exception as e:
+            logger.warning(f"⚠️ 事件日志溢出写入失败，重连时将跳过这些事件 ({self.run_id}): {str(e)}")
+
+    def finish(self) -> None:
+        with self._cond:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def _window(self, cursor: int) -> Tuple[int, List[Event], bool, int]:
+        head = self._events[0][0] if self._events else self.last_seq + 1
+        start = max(0, cursor + 1 - head)
+        live = [self._events[i] for i in range(start, len(self._events))]
+        return head, live, self.finished, self.last_seq
+
+    def iter_events(self, after_seq: int = 0, heartbeat: float = HEARTBEAT_SECONDS) -> Iterator[str]:
+        """补发 after_seq 之后的事件，然后跟随生成直到运行结束"""
+        cursor = max(after_seq, self.first_seq)
+        while True:
+            with self._cond:
+                head, live, finished, last_seq = self._window(cursor)
+                if not live and cursor + 1 >= head and not finished:
+                    self._cond.wait(heartbeat)
+                    head, live, finished, last_seq = self._window(cursor)
+            if cursor + 1 < head:
+                replayed = self._spill.read(self.run_id, cursor, head - 1) if self._spill is not None else []
+                for seq, payload in replayed:
+                    yield payload
+                    cursor = seq
+                if cursor < head - 1:
+                    gap = {"run_id": self.run_id, "from": cursor + 1, "to": head - 1}
+                    yield f"event: gap\ndata: {json.dumps(gap)}\n\n"
+                    cursor = head - 1
+            for seq, payload in live:
+                if seq > cursor:
+                    yield payload
+                    cursor = seq
+            if finished and cursor >= last_seq:
+                return
+            if not live:
+                yield ": keep-alive\n\n"
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._cond:
+            return {
+                "run_id": self.run_id,
+                "last_seq": self.last_seq,
+                "in_memory": len(self._events),
+                "spilled": self.spilled,
+                "finished": self.finished,
+            }
+
+
+class EventLogRegistry:
+    """进程内的运行事件日志表；结束超过保留时间的日志在访问时清理
+
+    同时管理生成者：每个生成者占用一个名额（max_producers，0 表示不限），
+    并在 lease_store（共享状态）中持有运行的租约，后台线程每 lease_seconds / 3 秒续期一次。
+    """
+
+    def __init__(
+        self,
+        max_events: int,
+        retention: float,
+        spill: Optional[PostgresEventSpill] = None,
+        max_producers: int = 0,
+        lease_store=None,
+        lease_seconds: float = 60.0,
+    ):
+        self.max_events = max_events
+        self.retention = retention
+        self.spill = spill
+        self.max_producers = max_producers
+        self.lease_store = lease_store
+        self.lease_seconds = lease_seconds
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._logs: Dict[str, RunEventLog] = {}
+        self._producers: Set[str] = set()
+        self._renewer: Optional[threading.Thread] = None
+
+    def _sweep(self) -> List[RunEventLog]:
+        now = time.monotonic()
+        expired = [
+            log for log in self._logs.values()
+            if log.finished and log.finished_at is not None and now - log.finished_at > self.retention
+        ]
+        for log in expired:
+            del self._logs[log.run_id]
+        return expired
+
+    def _drop_spilled(self, logs: List[RunEventLog]) -> None:
+        for log in logs:
+            if log.spilled and self.spill is not None:
+                try:
+                    self.spill.delete(log.run_id)
+                except Exception as e:
+                    logger.warning(f"⚠️ 清理溢出事件失败 ({log.run_id}): {str(e)}")
+
+    def open(self, run_id: str, user_id: str) -> RunEventLog:
+        """为一次生成创建日志；同一运行再次生成（恢复流程）时编号接着上一次继续"""
+        with self._lock:
+            expired = self._sweep()
+            previous = self._logs.get(run_id)
+            log = RunEventLog(
+                run_id, user_id, self.max_events, spill=self.spill,
+                start_seq=previous.last_seq if previous else 0,
+            )
+            if previous is not None:
+                # 上一次生成溢出的行随新日志一起清理
+                log.spilled = previous.spilled
+            self._logs[run_id] = log
+        self._drop_spilled(expired)
+        return log
+
+    def get(self, run_id: str) -> Optional[RunEventLog]:
+        with self._lock:
+            expired = self._sweep()
+            log = self._logs.get(run_id)
+        self._drop_spilled(expired)
+        return log
+
+    def begin_producer(self, run_id: str) -> None:
+        """为运行占用一个生成名额并取得租约；名额已满或其他 worker 正在生成时抛出异常"""
+        with self._lock:
+            if run_id in self._producers:
+                raise RunAlreadyActive(f"运行正在生成: {run_id}")
+            if self.max_producers and len(self._producers) >= self.max_producers:
+                raise ProducerLimitReached(f"同时生成的运行数已达上限 {self.max_producers}")
+            self._producers.add(run_id)
+        try:
+            claimed = self._claim(run_id)
+        except Exception as e:
+            # 共享状态不可用时不阻塞生成（与取消标记的降级方式一致）
+            logger.warning(f"⚠️ 生成者租约不可用，跳过跨 worker 检查 ({run_id}): {str(e)}")
+            claimed = True
+        if not claimed:
+            with self._lock:
+                self._producers.discard(run_id)
+            raise RunAlreadyActive(f"运行正在其他 worker 上生成: {run_id}")
+        self._start_renewer()
+
+    def end_producer(self, run_id: str) -> None:
+        """释放生成名额与租约"""
+        with self._lock:
+            self._producers.discard(run_id)
+        if self.lease_store is None:
+            return
+        try:
+            self.lease_store.release(PRODUCER_LEASE_NAMESPACE, run_id, self.instance_id)
+        except Exception as e:
+            logger.warning(f"⚠️ 释放生成者租约失败，将随 TTL 过期 ({run_id}): {str(e)}")
+
+    def _claim(self, run_id: str) -> bool:
+        if self.lease_store is None:
+            return True
+        return self.lease_store.claim(PRODUCER_LEASE_NAMESPACE, run_id, self.instance_id, self.lease_seconds)
+
+    def _start_renewer(self) -> None:
+        if self.lease_store is None:
+            return
+        with self._lock:
+            if self._renewer is not None:
+                return
+            self._renewer = threading.Thread(target=self._renew_forever, daemon=True, name="run-event-leases")
+        self._renewer.start()
+
+    def _renew_forever(self) -> None:
+        while True:
+            time.sleep(max(1.0, self.lease_seconds / 3))
+            with self._lock:
+                run_ids = list(self._producers)
+            for run_id in run_ids:
+                try:
+                    if not self._claim(run_id):
+                        logger.warning(f"⚠️ 生成者租约已被其他 worker 取得: {run_id}")
+                except Exception as e:
+                    logger.warning(f"⚠️ 续期生成者租约失败 ({run_id}): {str(e)}")
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            logs = list(self._logs.values())
+            producers = len(self._producers)
+        return {
+            "runs": len(logs),
+            "active": sum(1 for log in logs if not log.finished),
+            "spilled_events": sum(log.spilled for log in logs),
+            "producers": producers,
+            "max_producers": self.max_producers,
+        }
+
+
+_registry: Optional[EventLogRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_event_logs() -> EventLogRegistry:
+    """获取进程级事件日志表（按配置决定是否溢出到 Postgres）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from core.config import (
+                    EVENT_LOG_LEASE_SECONDS,
+                    EVENT_LOG_MAX_EVENTS,
+                    EVENT_LOG_MAX_PRODUCERS,
+                    EVENT_LOG_RETENTION_SECONDS,
+                    EVENT_LOG_SPILL_BACKEND,
+                )
+                from core.shared_state import get_shared_state
+
+                spill = None
+                if EVENT_LOG_SPILL_BACKEND == "postgres":
+                    from core.database import engine
+                    spill = PostgresEventSpill(engine)
+                _registry = EventLogRegistry(
+                    EVENT_LOG_MAX_EVENTS,
+                    EVENT_LOG_RETENTION_SECONDS,
+                    spill=spill,
+                    max_producers=EVENT_LOG_MAX_PRODUCERS,
+                    lease_store=get_shared_state(),
+                    lease_seconds=EVENT_LOG_LEASE_SECONDS,
+                )
+    return _registry
+
+
+def start_logged_stream(
+    run_id: str,
+    user_id: str,
+    produce: Callable[[], Iterable[str]],
+    registry: Optional[EventLogRegistry] = None,
+) -> RunEventLog:
+    """在后台线程运行生成器，事件写入日志；客户端断开不影响生成
+
+    Raises:
+        RunAlreadyActive: 该运行正在生成（本进程或其他 worker）
+        ProducerLimitReached: 本进程同时运行的生成线程已达上限
+    """
+    registry = registry or get_event_logs()
+    registry.begin_producer(run_id)
+    try:
+        log = registry.open(run_id, user_id)
+
+        def pump():
+            try:
+                for raw_event in produce():
+                    log.append(raw_event)
+            except BaseException as e:
+                logger.warning(f"⚠️ 后台生成异常结束 ({run_id}): {str(e)}")
+            finally:
+                # 先释放名额再标记结束：看到已结束日志的重连请求一定能启动新的生成
+                registry.end_producer(run_id)
+                log.finish()
+
+        threading.Thread(target=pump, daemon=True, name=f"run-events-{run_id[:8]}").start()
+    except BaseException:
+        registry.end_producer(run_id)
+        raise
+    return log
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """解析 Last-Event-ID 请求头（无效值视为从头开始）"""
+    try:
+        return max(0, int((value or "").strip()))
+    except ValueError:
+        return 0
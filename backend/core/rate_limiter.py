@@ -0,0 +1,457 @@
+"""
+上游自适应限流
+按 (提供商, 模型, API Key) 维护令牌桶 + AIMD 并发上限：
+- 令牌桶控制请求速率；遇到 429/503 时速率减半，并按 Retry-After 暂停整个桶，之后随时间线性恢复
+- 并发上限成功时加性增长（每次 +1/limit），被限流时乘性减半
+令牌桶状态可放在进程内存，也可放在 Postgres（advisory lock 保护），供多个 worker 进程共享。
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 被限流时速率最低降到基准速率的比例
+MIN_RATE_FACTOR = 0.1
+# 速率每秒恢复基准速率的比例（加性恢复）
+RATE_RECOVERY_PER_SECOND = 0.05
+# 两次乘性减小之间的最短间隔（同一波 429 只减一次）
+DECREASE_INTERVAL_SECONDS = 1.0
+# 没有 Retry-After 时的默认暂停时间
+DEFAULT_THROTTLE_PAUSE_SECONDS = 2.0
+# 等待令牌时单次休眠上限
+MAX_SLEEP_SECONDS = 0.5
+
+_RETRY_DELAY_PATTERN = re.compile(
+    r"retry(?:[ _-]?(?:delay|after)|\s+in)['\"]?\s*[:=]?\s*['\"]?(\d+(?:\.\d+)?)\s*s",
+    re.IGNORECASE
+)
+
+
+class RateLimitTimeout(Exception):
+    """等待上游配额超时"""
+
+
+def api_key_fingerprint(api_key: Optional[str]) -> str:
+    """API Key 指纹（只用于区分限流桶，不记录原文）"""
+    if not api_key:
+        return "-"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for candidate in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if isinstance(candidate, int):
+            return candidate
+    return None
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """是否为上游限流/过载错误（429 / 503）"""
+    status = _status_code(error)
+    if status is not None:
+        return status in (429, 503)
+    message = str(error).upper()
+    return any(marker in message for marker in ("429", "RESOURCE_EXHAUSTED", "503", "UNAVAILABLE", "RATE LIMIT"))
+
+
+def retry_after_from_error(error: BaseException) -> Optional[float]:
+    """从 Retry-After 响应头或错误信息（如 retryDelay: "7s"）中解析建议等待秒数"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = None
+    if headers is not None:
+        try:
+            value = headers.get("Retry-After") or headers.get("retry-after")
+        except Exception:
+            value = None
+    if value:
+        value = str(value).strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except Exception:
+                pass
+
+    match = _RETRY_DELAY_PATTERN.search(str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+# ==================== 令牌桶状态 ====================
+
+def _new_state(now: float, base_rate: float, burst: int) -> Dict[str, float]:
+    return {"tokens": float(burst), "rate": base_rate, "updated_at": now, "blocked_until": 0.0}
+
+
+def _refill(state: Dict[str, float], now: float, base_rate: float, burst: int) -> None:
+    elapsed = max(0.0, now - state["updated_at"])
+    state["rate"] = min(base_rate, state["rate"] + base_rate * RATE_RECOVERY_PER_SECOND * elapsed)
+    state["tokens"] = min(float(burst), state["tokens"] + elapsed * state["rate"])
+    state["updated_at"] = now
+
+
+def _take(state: Dict[str, float], now: float, base_rate: float, burst: int) -> float:
+    """尝试取一个令牌，返回需要等待的秒数（0 表示已取得）"""
+    _refill(state, now, base_rate, burst)
+    if now < state["blocked_until"]:
+        return state["blocked_until"] - now
+    if state["tokens"] >= 1:
+        state["tokens"] -= 1
+        return 0.0
+    return (1 - state["tokens"]) / max(state["rate"], 1e-6)
+
+
+def _penalize(state: Dict[str, float], now: float, base_rate: float, burst: int, pause: float) -> None:
+    """乘性减小速率，清空令牌并暂停整个桶"""
+    _refill(state, now, base_rate, burst)
+    state["rate"] = max(base_rate * MIN_RATE_FACTOR, state["rate"] / 2)
+    state["tokens"] = min(state["tokens"], 0.0)
+    state["blocked_until"] = max(state["blocked_until"], now + pause)
+
+
+class MemoryBucketStore:
+    """进程内令牌桶存储（同进程多线程共享）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, float]] = {}
+
+    def _state(self, key: str, now: float, base_rate: float, burst: int) -> Dict[str, float]:
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _new_state(now, base_rate, burst)
+        return state
+
+    def take(self, key: str, base_rate: float, burst: int) -> float:
+        with self._lock:
+            now = time.time()
+            return _take(self._state(key, now, base_rate, burst), now, base_rate, burst)
+
+    def penalize(self, key: str, base_rate: float, burst: int, pause: float) -> None:
+        with self._lock:
+            now = time.time()
+            _penalize(self._state(key, now, base_rate, burst), now, base_rate, burst, pause)
+
+    def peek(self, key: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            state = self._states.get(key)
+            return dict(state) if state else None
+
+
+class PostgresBucketStore:
+    """Postgres 令牌桶存储（多个 worker 进程共享）
+
+    每次读写在一个事务内完成，并用 pg_advisory_xact_lock 串行化同一个桶；
+    时间取数据库时钟，避免各进程时钟偏差。表为 UNLOGGED，重启后丢失无妨。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._initialized = False
+
+    def _ensure_table(self, conn) -> None:
+        if self._initialized:
+            return
+        from sqlalchemy import text
+        conn.execute(text(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS upstream_rate_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens DOUBLE PRECISION NOT NULL,
+                rate DOUBLE PRECISION NOT NULL,
+                updated_at DOUBLE PRECISION NOT NULL,
+                blocked_until DOUBLE PRECISION NOT NULL DEFAULT 0
+            )
+            """
+        ))
+        self._initialized = True
+
+    def _mutate(self, key: str, base_rate: float, burst: int, apply):
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": key})
+            now = float(conn.execute(text("SELECT EXTRACT(EPOCH FROM clock_timestamp())")).scalar())
+            row = conn.execute(
+                text("SELECT tokens, rate, updated_at, blocked_until FROM upstream_rate_buckets WHERE bucket_key = :key"),
+                {"key": key}
+            ).fetchone()
+            if row:
+                state = {"tokens": row[0], "rate": row[1], "updated_at": row[2], "blocked_until": row[3]}
+            else:
+                state = _new_state(now, base_rate, burst)
+            result = apply(state, now)
+            conn.execute(
+                text("""
+                    INSERT INTO upstream_rate_buckets (bucket_key, tokens, rate, updated_at, blocked_until)
+                    VALUES (:key, :tokens, :rate, :updated_at, :blocked_until)
+                    ON CONFLICT (bucket_key) DO UPDATE SET
+                        tokens = EXCLUDED.tokens,
+                        rate = EXCLUDED.rate,
+                        updated_at = EXCLUDED.updated_at,
+                        blocked_until = EXCLUDED.blocked_until
+                """),
+                {"key": key, **state}
+            )
+            return result
+
+    def take(self, key: str, base_rate: float, burst: int) -> float:
+        return self._mutate(key, base_rate, burst, lambda state, now: _take(state, now, base_rate, burst))
+
+    def penalize(self, key: str, base_rate: float, burst: int, pause: float) -> None:
+        self._mutate(key, base_rate, burst, lambda state, now: _penalize(state, now, base_rate, burst, pause))
+
+    def peek(self, key: str) -> Optional[Dict[str, float]]:
+        from sqlalchemy import text
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(
+                    text("SELECT tokens, rate, updated_at, blocked_until FROM upstream_rate_buckets WHERE bucket_key = :key"),
+                    {"key": key}
+                ).fetchone()
+        except Exception:
+            return None
+        if not row:
+            return None
+        return {"tokens": row[0], "rate": row[1], "updated_at": row[2], "blocked_until": row[3]}
+
+
+# ==================== 限流器 ====================
+
+class AdaptiveRateLimiter:
+    """令牌桶 + AIMD 并发控制的上游限流器"""
+
+    def __init__(
+        self,
+        key: str,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        store=None,
+        max_wait_seconds: Optional[float] = None
+    ):
+        """
+        Args:
+            key: 桶键（提供商/模型/Key 指纹）
+            rate: 基准速率（请求/秒）
+            burst: 令牌桶容量
+            max_concurrency: 并发上限的上界
+            min_concurrency: 并发上限的下界
+            store: 令牌桶存储（默认进程内存）
+            max_wait_seconds: 排队等待上限，超时抛出 RateLimitTimeout（None 表示一直等）
+        """
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.store = store or MemoryBucketStore()
+        self.max_wait_seconds = max_wait_seconds
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.stats = {"acquired": 0, "throttled": 0, "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    def _take_token(self) -> float:
+        try:
+            return self.store.take(self.key, self.rate, self.burst)
+        except Exception as e:
+            # 共享存储不可用时不阻塞业务，只靠并发上限兜底
+            logger.warning(f"⚠️  限流存储不可用，跳过令牌桶: {str(e)}")
+            return 0.0
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """占用一个并发槽并取得一个令牌，返回排队等待的秒数"""
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= max(1, int(self.concurrency_limit)):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise RateLimitTimeout(f"等待上游并发槽超时: {self.key}")
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+        try:
+            while True:
+                wait = self._take_token()
+                if wait <= 0:
+                    break
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    with self._cond:
+                        self.stats["timeouts"] += 1
+                    raise RateLimitTimeout(f"等待上游配额超时: {self.key}")
+                time.sleep(min(wait, MAX_SLEEP_SECONDS))
+        except BaseException:
+            self.release()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self.stats["acquired"] += 1
+            self.stats["wait_ms_total"] += waited * 1000
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], waited * 1000)
+        return waited
+
+    def release(self) -> None:
+        """归还并发槽"""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify()
+
+    def on_success(self) -> None:
+        """成功：并发上限加性增长"""
+        with self._cond:
+            before = int(self.concurrency_limit)
+            self.concurrency_limit = min(
+                float(self.max_concurrency),
+                self.concurrency_limit + 1.0 / max(self.concurrency_limit, 1.0)
+            )
+            if int(self.concurrency_limit) > before:
+                self._cond.notify()
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        """被限流：并发上限与速率乘性减小，并按 Retry-After 暂停"""
+        pause = retry_after if retry_after is not None else DEFAULT_THROTTLE_PAUSE_SECONDS
+        now = time.monotonic()
+        with self._cond:
+            self.stats["throttled"] += 1
+            decrease = now - self._last_decrease >= DECREASE_INTERVAL_SECONDS
+            if decrease:
+                self._last_decrease = now
+                self.concurrency_limit = max(float(self.min_concurrency), self.concurrency_limit / 2)
+        if not decrease:
+            return
+        try:
+            self.store.penalize(self.key, self.rate, self.burst, pause)
+        except Exception as e:
+            logger.warning(f"⚠️  限流存储不可用，无法记录限流: {str(e)}")
+        logger.warning(
+            f"⚠️  上游限流: {self.key}, 暂停 {pause:.1f}s, 并发上限 {self.concurrency_limit:.1f}"
+        )
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        """
+        在限流保护下执行一次上游调用（流式调用应在迭代结束后才退出）
+
+        429/503 异常会触发 on_throttle 后继续抛出；正常结束触发 on_success。
+        """
+        self.acquire(timeout)
+        try:
+            yield self
+        except BaseException as e:
+            if isinstance(e, Exception) and is_throttle_error(e):
+                self.on_throttle(retry_after_from_error(e))
+            raise
+        else:
+            self.on_success()
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前限额与排队指标"""
+        with self._cond:
+            acquired = self.stats["acquired"]
+            data = {
+                "key": self.key,
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "base_rate": self.rate,
+                "burst": self.burst,
+                "acquired": acquired,
+                "throttled": self.stats["throttled"],
+                "timeouts": self.stats["timeouts"],
+                "queue_wait_ms_avg": round(self.stats["wait_ms_total"] / acquired, 2) if acquired else 0.0,
+                "queue_wait_ms_max": round(self.stats["wait_ms_max"], 2),
+            }
+        state = self.store.peek(self.key)
+        if state:
+            data["current_rate"] = round(state["rate"], 3)
+            data["tokens"] = round(state["tokens"], 2)
+            data["blocked_for_seconds"] = round(max(0.0, state["blocked_until"] - time.time()), 2)
+        return data
+
+
+# ==================== 进程级登记表 ====================
+
+_limiters: Dict[Tuple[str, str, str], AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+_store = None
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        from core.config import UPSTREAM_RATE_LIMIT_BACKEND
+
+        if UPSTREAM_RATE_LIMIT_BACKEND == "postgres":
+            from core.database import engine
+            _store = PostgresBucketStore(engine)
+            logger.info("✅ 上游限流使用 Postgres 共享令牌桶")
+        else:
+            _store = MemoryBucketStore()
+    return _store
+
+
+def _limit_config(provider: str, model: str) -> Tuple[float, int, int]:
+    from core.config import UPSTREAM_RATE_LIMITS
+
+    model_name = model.split("/")[-1] if model else ""
+    for name in (f"{provider}/{model_name}", provider, "default"):
+        if name in UPSTREAM_RATE_LIMITS:
+            return UPSTREAM_RATE_LIMITS[name]
+    return (2.0, 5, 4)
+
+
+def get_rate_limiter(provider: str, model: str = "", api_key: Optional[str] = None) -> AdaptiveRateLimiter:
+    """获取 (提供商, 模型, API Key) 对应的限流器"""
+    from core.config import UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS
+
+    provider = (provider or "").lower()
+    ident = (provider, model or "", api_key_fingerprint(api_key))
+    with _limiters_lock:
+        limiter = _limiters.get(ident)
+        if limiter is None:
+            rate, burst, concurrency = _limit_config(provider, model or "")
+            limiter = AdaptiveRateLimiter(
+                key=":".join(ident),
+                rate=rate,
+                burst=burst,
+                max_concurrency=concurrency,
+                store=_get_store(),
+                max_wait_seconds=UPSTREAM_RATE_LIMIT_MAX_WAIT_SECONDS or None,
+            )
+            _limiters[ident] = limiter
+        return limiter
+
+
+def get_rate_limiter_stats() -> List[Dict[str, Any]]:
+    """所有限流器的指标"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.snapshot() for limiter in limiters]
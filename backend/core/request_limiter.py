@@ -0,0 +1,46 @@
+"""接口限速（登录/刷新、高成本任务等）
+
+基于共享存储的 GCRA：每个键只保存一个理论到达时间，判定为 O(1)，空闲键随 TTL 清理；
+键可以是 IP、用户或账号，多 worker 下按共享存储合计。
+"""
+
+import math
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from core.shared_state import get_shared_state
+
+
+def client_ip(request: Optional[Request]) -> str:
+    if request is None or request.client is None:
+        return "unknown"
+    return request.client.host
+
+
+class RequestRateLimiter:
+    """窗口 window 秒内最多 limit 次（允许一次性突发 limit 次）"""
+
+    def __init__(self, namespace: str, limit: int, window: float, store=None):
+        self.namespace = namespace
+        self.limit = limit
+        self.window = window
+        self._store = store
+
+    @property
+    def store(self):
+        return self._store or get_shared_state()
+
+    def check(self, key: str) -> float:
+        """记一次请求；返回 0 表示放行，否则为需等待的秒数"""
+        return self.store.throttle(self.namespace, key, self.limit, self.window)
+
+    def enforce(self, key: str, detail: str) -> None:
+        """超限时抛出 429，并在 Retry-After 中给出等待秒数"""
+        retry_after = self.check(key)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail=detail,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
@@ -0,0 +1,91 @@
+"""运行控制面：Agent 流程归属与取消信号
+
+取消请求可能落在任意 worker 上：
+- 取消标记写入共享存储（带 TTL），并通过广播通知所有 worker，持有该运行的 worker 立即触发本地取消令牌
+- 流式循环每个分片都会检查取消，检查优先看本地令牌；广播丢失时（监听连接重连期间）按间隔回查共享存储
+后台任务（task_id）与 Agent 流程（run_id）共用同一套信号。
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from core.cancellation import find_cancel_token, get_cancel_token, release_cancel_token, request_cancel
+from core.shared_state import get_shared_state
+
+logger = logging.getLogger(__name__)
+
+CANCEL_CHANNEL = "novawrite_cancel"
+# 回查共享存储中取消标记的最小间隔（秒）
+CANCEL_RECHECK_SECONDS = 1.0
+
+_recheck_lock = threading.Lock()
+_last_recheck: Dict[str, float] = {}
+_started = False
+
+
+def _ttl() -> float:
+    from core.config import RUN_STATE_TTL_SECONDS
+    return RUN_STATE_TTL_SECONDS
+
+
+def _on_cancel_signal(key: str) -> None:
+    if request_cancel(key):
+        logger.info(f"✅ 收到取消广播，已中断本进程中的运行: {key}")
+
+
+def start_run_control() -> None:
+    """订阅取消广播（进程启动时调用一次）"""
+    global _started
+    if _started:
+        return
+    _started = True
+    get_shared_state().subscribe(CANCEL_CHANNEL, _on_cancel_signal)
+
+
+def register_run_owner(run_id: str, user_id: str) -> None:
+    get_shared_state().set("run_owner", run_id, user_id, _ttl())
+    get_cancel_token(run_id)
+
+
+def get_run_owner(run_id: str) -> Optional[str]:
+    return get_shared_state().get("run_owner", run_id)
+
+
+def broadcast_cancel(key: str) -> bool:
+    """请求取消运行或任务；返回 True 表示本进程中正有该运行"""
+    local = request_cancel(key)
+    store = get_shared_state()
+    store.set("cancel", key, "1", _ttl())
+    try:
+        store.publish(CANCEL_CHANNEL, key)
+    except Exception as e:
+        # 广播失败时其他 worker 仍会按间隔回查取消标记
+        logger.warning(f"⚠️ 取消广播失败: {str(e)}")
+    return local
+
+
+def is_cancelled(key: str) -> bool:
+    token = find_cancel_token(key)
+    if token is not None and token.cancelled:
+        return True
+    now = time.monotonic()
+    with _recheck_lock:
+        if now - _last_recheck.get(key, 0.0) < CANCEL_RECHECK_SECONDS:
+            return False
+        _last_recheck[key] = now
+    if get_shared_state().get("cancel", key) is None:
+        return False
+    request_cancel(key)
+    return True
+
+
+def clear_run(key: str) -> None:
+    """运行结束后清理归属、取消标记与本地令牌"""
+    store = get_shared_state()
+    store.delete("run_owner", key)
+    store.delete("cancel", key)
+    release_cancel_token(key)
+    with _recheck_lock:
+        _last_recheck.pop(key, None)
@@ -12,6 +12,8 @@ from fastapi.security import OAuth2PasswordBearer
 from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
 from models import User
 from .database import get_db
+from .shared_state import get_shared_state
+from .user_cache import get_user_cache, invalidate_user, token_version
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
@@ -68,6 +70,20 @@ def verify_refresh_token(token: str) -> Optional[str]:
         return None
 
 
+def token_claims(user: User) -> dict:
+    """令牌载荷：用户 ID + 凭据版本（修改密码后旧令牌失效）"""
+    return {"sub": user.id, "ver": token_version(user)}
+
+
+def token_matches_user(token: str, user: User) -> bool:
+    """令牌中的凭据版本与用户当前凭据一致（旧令牌不带版本时放行）"""
+    try:
+        version = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("ver")
+    except JWTError:
+        return False
+    return version is None or version == token_version(user)
+
+
 def get_user_by_username_or_email(db: Session, username_or_email: str) -> Optional[User]:
     """根据用户名或邮箱获取用户"""
     user = db.query(User).filter(
@@ -77,7 +93,7 @@ def get_user_by_username_or_email(db: Session, username_or_email: str) -> Option
 
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    """获取当前登录用户"""
+    """获取当前登录用户（优先读用户缓存，命中时不访问数据库）"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="无效的认证凭据",
@@ -86,15 +102,24 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
+        version: Optional[str] = payload.get("ver")
         if user_id is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
+    cache = get_user_cache()
+    user = cache.get(user_id, version)
+    if user is not None:
+        return user
+    
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise credentials_exception
-    return user
+    # 令牌签发后密码已修改
+    if version is not None and version != token_version(user):
+        raise credentials_exception
+    return cache.put(user)
 
 
 def generate_uuid() -> str:
@@ -128,17 +153,21 @@ def handle_login_failure(
         user.locked_until = current_time + LOCK_DURATION_MS
     
     db.commit()
+    
+    if user.locked_until and user.locked_until > current_time:
+        invalidate_user(user.id)
 
 
 # 验证码模块（临时简化版）
-_captcha_store: Dict[str, str] = {}
+# 验证码存放在共享存储中（多 worker 下可在任意 worker 校验），过期自动清理
+CAPTCHA_TTL_SECONDS = 300
 
 
 def generate_captcha() -> Dict[str, str]:
     """生成验证码（简化版，返回空图片）"""
     captcha_id = str(uuid.uuid4())
     code = "1234"  # 固定验证码
-    _captcha_store[captcha_id] = code
+    get_shared_state().set("captcha", captcha_id, code, CAPTCHA_TTL_SECONDS)
     return {
         "captcha_id": captcha_id,
         "image": ""  # 空图片
@@ -147,10 +176,9 @@ def generate_captcha() -> Dict[str, str]:
 
 def verify_captcha(captcha_id: str, code: str) -> bool:
     """验证验证码"""
-    stored_code = _captcha_store.get(captcha_id)
+    # 读取即删除，验证码只能使用一次
+    stored_code = get_shared_state().pop("captcha", captcha_id)
     if stored_code:
-        # 验证成功后删除
-        del _captcha_store[captcha_id]
         return stored_code == code
     return False
 
@@ -0,0 +1,386 @@
+"""多 worker 共享的运行状态
+
+取消标记、流程归属、接口限速窗口、验证码原本是各进程内的字典：多 worker 部署时，
+落到其他 worker 的取消请求会被忽略，部分字典也从不清理。这里提供带 TTL 的键值存储，
+以及 GCRA 限速（每个键只保存一个时间戳，空闲的键随 TTL 清理）：
+- MemoryStateStore：单进程模式（默认）
+- PostgresStateStore：UNLOGGED 表保存状态，LISTEN/NOTIFY 广播信号，多个 worker / 主机共享
+"""
+
+import logging
+import select
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 过期数据的清理间隔（秒）
+SWEEP_INTERVAL_SECONDS = 60
+
+Subscriber = Callable[[str], None]
+
+
+def _gcra(tat: Optional[float], now: float, limit: int, window: float) -> Tuple[Optional[float], float]:
+    """GCRA（通用信元速率算法）：窗口内最多 limit 次，允许一次性突发 limit 次
+
+    返回 (新的理论到达时间, 需等待秒数)；允许时等待为 0，拒绝时新时间为 None（状态不变）。
+    """
+    interval = window / limit
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - window
+    if allow_at > now:
+        return None, allow_at - now
+    return new_tat, 0.0
+
+
+class MemoryStateStore:
+    """进程内存储（单 worker）"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._next_sweep = 0.0
+
+    def _sweep(self, now: float) -> None:
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+        expired = [k for k, (_, expires_at) in self._data.items() if expires_at <= now]
+        for k in expired:
+            del self._data[k]
+
+    def _live(self, namespace: str, key: str, now: float) -> Optional[Any]:
+        entry = self._data.get((namespace, key))
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._data[(namespace, key)]
+            return None
+        return value
+
+    def set(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._data[(namespace, key)] = (value, now + ttl)
+            self._sweep(now)
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(namespace, key, time.time())
+
+    def pop(self, namespace: str, key: str) -> Optional[str]:
+        """读取并删除（一次性数据，如验证码）"""
+        with self._lock:
+            value = self._live(namespace, key, time.time())
+            self._data.pop((namespace, key), None)
+            return value
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def claim(self, namespace: str, key: str, value: str, ttl: float) -> bool:
+        """租约：键不存在、已过期或已由 value 持有（续期）时写入并返回 True，否则返回 False"""
+        now = time.time()
+        with self._lock:
+            current = self._live(namespace, key, now)
+            if current is not None and current != value:
+                return False
+            self._data[(namespace, key)] = (value, now + ttl)
+            self._sweep(now)
+            return True
+
+    def release(self, namespace: str, key: str, value: str) -> None:
+        """释放租约（只删除仍由 value 持有的键）"""
+        with self._lock:
+            if self._live(namespace, key, time.time()) == value:
+                self._data.pop((namespace, key), None)
+
+    def throttle(self, namespace: str, key: str, limit: int, window: float) -> float:
+        """限速：允许时记一次并返回 0，否则返回需等待的秒数（O(1)，每个键一个浮点数）"""
+        now = time.time()
+        with self._lock:
+            new_tat, retry_after = _gcra(self._live(namespace, key, now), now, limit, window)
+            if new_tat is not None:
+                # 理论到达时间过去后键即空闲，随 TTL 清理
+                self._data[(namespace, key)] = (new_tat, new_tat)
+                self._sweep(now)
+            return retry_after
+
+    def publish(self, channel: str, payload: str) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, []))
+        for callback in subscribers:
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.warning(f"⚠️ 处理共享信号失败 ({channel}): {str(e)}")
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.backend, "entries": len(self._data)}
+
+
+class PostgresStateStore:
+    """Postgres 存储（多 worker / 多主机共享）
+
+    状态放在 UNLOGGED 表里（重启丢失无妨），时间取数据库时钟；
+    信号通过 NOTIFY 广播，每个进程用一条独立连接 LISTEN，断线后自动重连。
+    """
+
+    backend = "postgres"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._initialized = False
+        self._next_sweep = 0.0
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._subscribers_lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._listening: set = set()
+        self.stats = {"notifications": 0, "listener_reconnects": 0}
+
+    def _ensure_table(self, conn) -> None:
+        if self._initialized:
+            return
+        from sqlalchemy import text
+        conn.execute(text(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS shared_state (
+                namespace TEXT NOT NULL,
+                state_key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (namespace, state_key)
+            )
+            """
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_shared_state_expires_at ON shared_state (expires_at)"))
+        self._initialized = True
+
+    def _sweep(self, conn) -> None:
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+        from sqlalchemy import text
+        conn.execute(text("DELETE FROM shared_state WHERE expires_at <= EXTRACT(EPOCH FROM clock_timestamp())"))
+
+    def set(self, namespace: str, key: str, value: str, ttl: float) -> None:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(
+                text("""
+                    INSERT INTO shared_state (namespace, state_key, value, expires_at)
+                    VALUES (:namespace, :key, :value, EXTRACT(EPOCH FROM clock_timestamp()) + :ttl)
+                    ON CONFLICT (namespace, state_key) DO UPDATE SET
+                        value = EXCLUDED.value,
+                        expires_at = EXCLUDED.expires_at
+                """),
+                {"namespace": namespace, "key": key, "value": value, "ttl": ttl}
+            )
+            self._sweep(conn)
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            return conn.execute(
+                text("""
+                    SELECT value FROM shared_state
+                    WHERE namespace = :namespace AND state_key = :key
+                      AND expires_at > EXTRACT(EPOCH FROM clock_timestamp())
+                """),
+                {"namespace": namespace, "key": key}
+            ).scalar()
+
+    def pop(self, namespace: str, key: str) -> Optional[str]:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            row = conn.execute(
+                text("""
+                    DELETE FROM shared_state WHERE namespace = :namespace AND state_key = :key
+                    RETURNING value, expires_at > EXTRACT(EPOCH FROM clock_timestamp())
+                """),
+                {"namespace": namespace, "key": key}
+            ).fetchone()
+        if row and row[1]:
+            return row[0]
+        return None
+
+    def delete(self, namespace: str, key: str) -> None:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(
+                text("DELETE FROM shared_state WHERE namespace = :namespace AND state_key = :key"),
+                {"namespace": namespace, "key": key}
+            )
+
+    def claim(self, namespace: str, key: str, value: str, ttl: float) -> bool:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            row = conn.execute(
+                text("""
+                    INSERT INTO shared_state (namespace, state_key, value, expires_at)
+                    VALUES (:namespace, :key, :value, EXTRACT(EPOCH FROM clock_timestamp()) + :ttl)
+                    ON CONFLICT (namespace, state_key) DO UPDATE SET
+                        value = EXCLUDED.value,
+                        expires_at = EXCLUDED.expires_at
+                    WHERE shared_state.value = EXCLUDED.value
+                       OR shared_state.expires_at <= EXTRACT(EPOCH FROM clock_timestamp())
+                    RETURNING value
+                """),
+                {"namespace": namespace, "key": key, "value": value, "ttl": ttl}
+            ).fetchone()
+            self._sweep(conn)
+        return row is not None
+
+    def release(self, namespace: str, key: str, value: str) -> None:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(
+                text("DELETE FROM shared_state WHERE namespace = :namespace AND state_key = :key AND value = :value"),
+                {"namespace": namespace, "key": key, "value": value}
+            )
+
+    def throttle(self, namespace: str, key: str, limit: int, window: float) -> float:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext(:lock_key))"),
+                {"lock_key": f"{namespace}:{key}"}
+            )
+            now = float(conn.execute(text("SELECT EXTRACT(EPOCH FROM clock_timestamp())")).scalar())
+            raw = conn.execute(
+                text("""
+                    SELECT value FROM shared_state
+                    WHERE namespace = :namespace AND state_key = :key AND expires_at > :now
+                """),
+                {"namespace": namespace, "key": key, "now": now}
+            ).scalar()
+            new_tat, retry_after = _gcra(float(raw) if raw else None, now, limit, window)
+            if new_tat is not None:
+                conn.execute(
+                    text("""
+                        INSERT INTO shared_state (namespace, state_key, value, expires_at)
+                        VALUES (:namespace, :key, :value, :expires_at)
+                        ON CONFLICT (namespace, state_key) DO UPDATE SET
+                            value = EXCLUDED.value,
+                            expires_at = EXCLUDED.expires_at
+                    """),
+                    {"namespace": namespace, "key": key, "value": repr(new_tat), "expires_at": new_tat}
+                )
+                self._sweep(conn)
+            return retry_after
+
+    def publish(self, channel: str, payload: str) -> None:
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        with self._subscribers_lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen_forever, daemon=True, name="shared-state-listener")
+                self._listener.start()
+
+    def _connect(self):
+        """监听专用的 DBAPI 连接（不占用连接池）"""
+        cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+        conn = self.engine.dialect.connect(*cargs, **cparams)
+        conn.autocommit = True
+        return conn
+
+    def _listen_forever(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                self._listening = set()
+                while True:
+                    with self._subscribers_lock:
+                        channels = [c for c in self._subscribers if c not in self._listening]
+                    for channel in channels:
+                        with conn.cursor() as cursor:
+                            cursor.execute(f'LISTEN "{channel}"')
+                        self._listening.add(channel)
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.stats["notifications"] += 1
+                        self._dispatch(notify.channel, notify.payload)
+            except Exception as e:
+                self.stats["listener_reconnects"] += 1
+                logger.warning(f"⚠️ 共享状态监听连接断开，2 秒后重连: {str(e)}")
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _dispatch(self, channel: str, payload: str) -> None:
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers.get(channel, []))
+        for callback in subscribers:
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.warning(f"⚠️ 处理共享信号失败 ({channel}): {str(e)}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        entries = None
+        try:
+            from sqlalchemy import text
+            with self.engine.begin() as conn:
+                self._ensure_table(conn)
+                entries = conn.execute(text("SELECT COUNT(*) FROM shared_state")).scalar()
+        except Exception:
+            pass
+        return {
+            "backend": self.backend,
+            "entries": entries,
+            "listening": sorted(self._listening),
+            **self.stats,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_shared_state():
+    """获取进程级共享状态存储（按 SHARED_STATE_BACKEND 选择实现）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                from core.config import SHARED_STATE_BACKEND
+
+                if SHARED_STATE_BACKEND == "postgres":
+                    from core.database import engine
+                    _store = PostgresStateStore(engine)
+                    logger.info("✅ 运行状态使用 Postgres 共享存储（LISTEN/NOTIFY 广播取消信号）")
+                else:
+                    _store = MemoryStateStore()
+    return _store
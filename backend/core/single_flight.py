@@ -0,0 +1,69 @@
+"""
+单飞（single-flight）合并
+同一时刻对同一个键的重复调用只执行一次上游请求，其余调用方等待并共享结果或异常。
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """线程安全的单飞合并器"""
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.stats = {"calls": 0, "executed": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        执行 fn；若同键调用正在进行，则等待并返回它的结果（或抛出它的异常）
+
+        Args:
+            key: 合并键（相同键视为相同请求）
+            fn: 实际执行的无参函数
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self.stats["executed"] += 1
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def snapshot(self) -> Dict[str, int]:
+        """合并统计"""
+        with self._lock:
+            return {**self.stats, "in_flight": len(self._calls)}
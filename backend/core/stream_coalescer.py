@@ -0,0 +1,112 @@
+"""流式分片合并
+
+快速模型每秒产出上千个很小的分片，逐片包装成 SSE 事件会带来同样多次的 JSON 编码、HTTP 分块和前端重绘。
+这里把分片在时间窗口（SSE_COALESCE_WINDOW_MS）内或累计到 SSE_COALESCE_MAX_CHARS 个字符时合并成一片：
+- 上游读取在后台线程中进行，窗口到期即输出，不依赖下一个分片到达（上游停顿时不会积压）
+- 上游结束或出错时先输出已缓冲的内容，因此阶段边界（流结束后的 status/done 事件）前一定已经冲刷
+- 调用方提前关闭时停止读取，并在下一个分片到达时关闭上游迭代器
+"""
+
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional
+
+
+class _Buffer:
+    """读取线程与调用方共享的缓冲区：读取线程只在缓冲区由空变为非空、达到上限或遇到检查点时唤醒调用方"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks: List[str] = []
+        self.chars = 0
+        self.started_at: Optional[float] = None
+        self.checkpoint = False
+        self.finished = False
+        self.error: Optional[BaseException] = None
+
+
+def _split_checkpoints(chunks: List[str]) -> Iterator[str]:
+    """按空分片（检查点）切开合并：检查点前的内容先输出，检查点本身原样输出"""
+    pending: List[str] = []
+    for chunk in chunks:
+        if chunk:
+            pending.append(chunk)
+            continue
+        if pending:
+            yield "".join(pending)
+            pending = []
+        yield chunk
+    if pending:
+        yield "".join(pending)
+
+
+def coalesce_chunks(
+    chunks: Iterable[str],
+    window_seconds: float,
+    max_chars: int,
+    name: str = "stream",
+) -> Iterator[str]:
+    """按时间窗口或字符数合并文本分片；窗口不大于 0 时原样透传
+
+    空分片是调用方的检查点（例如取消后的空分片），先冲刷已缓冲的内容再原样传递。
+    """
+    if window_seconds <= 0:
+        yield from chunks
+        return
+
+    buffer = _Buffer()
+    stop = threading.Event()
+
+    def pump():
+        iterator = iter(chunks)
+        error = None
+        try:
+            for chunk in iterator:
+                if stop.is_set():
+                    break
+                with buffer.cond:
+                    buffer.chunks.append(chunk)
+                    buffer.chars += len(chunk)
+                    if not chunk:
+                        buffer.checkpoint = True
+                        buffer.cond.notify()
+                    elif buffer.started_at is None:
+                        buffer.started_at = time.monotonic()
+                        buffer.cond.notify()
+                    elif buffer.chars >= max_chars:
+                        buffer.cond.notify()
+        except BaseException as e:
+            error = e
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+        with buffer.cond:
+            buffer.finished = True
+            buffer.error = error
+            buffer.cond.notify()
+
+    threading.Thread(target=pump, daemon=True, name=f"coalesce-{name}"[:48]).start()
+
+    try:
+        while True:
+            with buffer.cond:
+                while not buffer.chunks and not buffer.finished:
+                    buffer.cond.wait()
+                while not (buffer.finished or buffer.checkpoint or buffer.chars >= max_chars):
+                    remaining = buffer.started_at + window_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    buffer.cond.wait(remaining)
+                taken, finished, error = buffer.chunks, buffer.finished, buffer.error
+                buffer.chunks, buffer.chars, buffer.started_at, buffer.checkpoint = [], 0, None, False
+            yield from _split_checkpoints(taken)
+            if finished:
+                if error is not None:
+                    raise error
+                return
+    finally:
+        stop.set()
@@ -0,0 +1,123 @@
+"""已认证用户缓存
+
+`get_current_user` 原本每个请求都查一次 users 表，任务轮询、SSE 重连等高频接口都要付出这次往返。
+这里按用户 ID 缓存用户快照（短 TTL、LRU 限制条目数），命中时整条认证路径不访问数据库：
+- 访问/刷新令牌携带 `ver`（由密码哈希派生的凭据版本），修改密码后旧令牌与缓存条目一并失效
+- 锁定、登录成功等登录安全字段变化时调用 `invalidate_user`，通过共享存储广播给所有 worker
+- 缓存的是脱离会话的瞬态 User 对象，调用方只读取字段，不应再挂回会话修改
+"""
+
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import inspect
+
+from models import User
+from .shared_state import get_shared_state
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "novawrite_user_invalidate"
+
+
+def token_version(user: User) -> str:
+    """凭据版本：密码哈希的 HMAC 摘要（不暴露哈希本身，修改密码即变化）"""
+    from .config import SECRET_KEY
+    digest = hmac.new(SECRET_KEY.encode("utf-8"), (user.password_hash or "").encode("utf-8"), hashlib.sha256)
+    return digest.hexdigest()[:16]
+
+
+def _snapshot(user: User) -> User:
+    """复制列属性为瞬态对象，不随原会话提交/关闭而过期"""
+    return User(**{attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+
+
+class UserCache:
+    """按用户 ID 的 LRU + TTL 缓存，条目记录该用户当前的凭据版本"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, User, float]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, user_id: str, version: Optional[str]) -> Optional[User]:
+        """命中条件：未过期且令牌版本与当前凭据版本一致（旧令牌不带版本时只校验用户 ID）"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                current_version, user, expires_at = entry
+                if expires_at <= now:
+                    del self._entries[user_id]
+                elif version is None or version == current_version:
+                    self._entries.move_to_end(user_id)
+                    self.stats["hits"] += 1
+                    return user
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, user: User) -> User:
+        """缓存用户快照并返回快照"""
+        snapshot = _snapshot(user)
+        if not self.enabled:
+            return snapshot
+        with self._lock:
+            self._entries[snapshot.id] = (token_version(snapshot), snapshot, time.monotonic() + self.ttl)
+            self._entries.move_to_end(snapshot.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def evict(self, user_id: str) -> None:
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl, **self.stats}
+
+
+_cache: Optional[UserCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache() -> UserCache:
+    """获取进程级用户缓存（首次使用时订阅失效广播）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from .config import USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS
+
+                cache = UserCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+                get_shared_state().subscribe(INVALIDATE_CHANNEL, cache.evict)
+                _cache = cache
+    return _cache
+
+
+def invalidate_user(user_id: str) -> None:
+    """用户的凭据或登录安全状态变化后调用：清除本进程缓存并通知其他 worker"""
+    get_user_cache().evict(user_id)
+    try:
+        get_shared_state().publish(INVALIDATE_CHANNEL, user_id)
+    except Exception as e:
+        # 广播失败时其他 worker 的条目最多保留一个 TTL
+        logger.warning(f"⚠️ 用户缓存失效广播失败: {str(e)}")
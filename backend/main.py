@@ -2,9 +2,10 @@
 NovaWrite AI 后端主应用
 包含所有 API 路由
 """
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Query, Request
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy import and_, or_, text, func, bindparam
@@ -12,19 +13,41 @@ from typing import List, Optional, Dict, Any, Iterable
 import time
 import json
 import uuid
+import contextlib
 import logging
 import threading
-import httpx
 import asyncio
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from core.config import CORS_ORIGINS, DEBUG, NEO4J_ENABLED
+from core.config import (
+    AI_SERVICE_PROVIDER, CHAPTER_OUTLINE_MAX_PARALLEL, CHAPTER_OUTLINE_PARALLEL, CHAPTER_OUTLINE_STITCH,
+    CORS_ORIGINS, DEBUG, NEO4J_ENABLED, OUTLINE_PIPELINE_MAX_PARALLEL, STRUCTURED_STREAMING,
+)
 from core.database import get_db, SessionLocal
+from core.rate_limiter import get_rate_limiter, get_rate_limiter_stats
+from core.cancellation import (
+    CancellationToken, OperationCancelled, get_cancel_token, iterate_cancellable, raise_if_cancelled
+)
+from core.run_control import (
+    broadcast_cancel, clear_run, get_run_owner, is_cancelled, register_run_owner, start_run_control
+)
+from core.shared_state import get_shared_state
+from core.event_log import (
+    ProducerLimitReached,
+    RunAlreadyActive,
+    RunEventLog,
+    get_event_logs,
+    parse_last_event_id,
+    start_logged_stream,
+)
+from core.request_limiter import RequestRateLimiter, client_ip
 from core.security import (
     get_current_user, create_access_token, create_refresh_token,
     verify_refresh_token, get_password_hash, verify_password,
-    get_user_by_username_or_email, generate_uuid
+    get_user_by_username_or_email, generate_uuid, token_claims, token_matches_user
 )
+from core.user_cache import get_user_cache, invalidate_user
 from models import (
     User, Novel, Volume, Chapter, Character, WorldSetting,
     TimelineEvent, Foreshadowing, UserCurrentNovel, Task
@@ -66,15 +89,44 @@ from services.ai.gemini_service import (
     write_chapter_content as write_chapter_content_impl,
     generate_characters, generate_character_relations,
     generate_world_settings, generate_timeline_events,
+    generate_chapter_outline_stream, generate_characters_stream,
+    generate_world_settings_stream, generate_timeline_events_stream,
     generate_foreshadowings_from_outline, modify_outline_by_dialogue,
-    summarize_chapter_content
+    summarize_chapter_content, extract_foreshadowings_from_chapter
+)
+from services.ai.ai_service_client import bypass_response_cache
+from services.task.task_service import (
+    create_task, get_task_executor, ProgressCallback, request_task_cancel, mark_task_cancelled
 )
-from services.task.task_service import create_task, get_task_executor, ProgressCallback
+from services.task.dag_scheduler import DagProgress, Stage, run_stages
 from services.embedding.vector_helper import (
     store_chapter_embedding_async, store_character_embedding,
     store_world_setting_embedding
 )
+from services.embedding.vector_index import invalidate_novel_vectors
 from services.embedding.embedding_service import EmbeddingService
+from services.analysis.near_duplicate import (
+    find_near_duplicates, forget_chapter, invalidate_near_duplicates, record_chapter_content
+)
+from services.ai.context_assembler import (
+    AssembledContext, ContextAssembler, get_context_budget, make_embedding_similarity_fn
+)
+from services.ai.draft_revision import (
+    RevisionSpan, build_patch_prompt, issue_texts, number_paragraphs, paragraph_separator,
+    patch_token_budget, plan_revision, splice_patches, split_paragraphs
+)
+from services.ai.llm_gateway import AgentModel, get_llm_gateway, resolve_agent_model
+from services.ai.summary_hierarchy import (
+    SummaryInEventLoopError,
+    record_chapter_summary,
+    story_so_far,
+    summarize_novel,
+)
+from services.ai.chapter_outline_batch import (
+    PREVIOUS_TAIL_CHAPTERS, STITCH_CHAPTERS, VolumeChapterJob, VolumeChapterResult,
+    boundaries_to_stitch, chapter_count_from_outline, generate_volumes_parallel,
+    normalize_chapter_title, stitch_boundaries,
+)
 from services.ai.chapter_writing_service import (
     write_and_save_chapter,
     prepare_chapter_writing_context,
@@ -89,30 +141,21 @@ from services.graph.neo4j_client import run_cypher
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-_cancel_lock = threading.Lock()
-_cancel_flags: Dict[str, bool] = {}
-_run_owners: Dict[str, str] = {}
-
-
 def _register_run_owner(run_id: str, user_id: str) -> None:
-    with _cancel_lock:
-        _run_owners[run_id] = user_id
+    register_run_owner(run_id, user_id)
 
 
 def _request_cancel(run_id: str) -> None:
-    with _cancel_lock:
-        _cancel_flags[run_id] = True
+    # 写入共享取消标记并广播，持有该流程的 worker 立即中断正在读取的 LLM 流
+    broadcast_cancel(run_id)
 
 
 def _is_cancelled(run_id: str) -> bool:
-    with _cancel_lock:
-        return _cancel_flags.get(run_id, False)
+    return is_cancelled(run_id)
 
 
 def _clear_cancel(run_id: str) -> None:
-    with _cancel_lock:
-        _cancel_flags.pop(run_id, None)
-        _run_owners.pop(run_id, None)
+    clear_run(run_id)
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -139,7 +182,10 @@ def _resume_pending_tasks() -> None:
         executor = get_task_executor()
         for task in pending:
             logger.info(f"恢复待执行完整大纲任务: {task.id}")
-            executor.submit(lambda task_id=task.id, novel_id=task.novel_id: _execute_complete_outline_task(task_id, novel_id))
+            executor.submit(
+                lambda task_id=task.id, novel_id=task.novel_id: _execute_complete_outline_task(task_id, novel_id),
+                task_id=task.id,
+            )
     except Exception as exc:
         logger.error(f"恢复任务失败: {exc}", exc_info=True)
     finally:
@@ -148,13 +194,22 @@ def _resume_pending_tasks() -> None:
 
 @app.on_event("startup")
 async def _on_startup_resume_tasks():
+    start_run_control()
     _resume_pending_tasks()
+
+
+@app.on_event("shutdown")
+async def _on_shutdown_close_llm_gateway():
+    get_llm_gateway().close()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 前端断线重连时需要读取流程 ID
+    expose_headers=["X-Run-Id"],
 )
 
 # 基础安全头 & HSTS（假设部署于 HTTPS）
@@ -177,39 +232,24 @@ async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled error: {str(exc)}", exc_info=True)
     return JSONResponse(status_code=500, content={"detail": "服务器开小差，请稍后重试"})
 
-# 简单内存限速（每进程），用于登录/刷新等高敏接口
-rate_lock = threading.Lock()
-rate_buckets: Dict[str, list] = {}
+# 高敏接口限速（登录/刷新等），按 IP 计数；登录同时按账号计数，防止换 IP 撞库
 RATE_WINDOW = 60  # 秒
-RATE_LIMIT = 20   # 同一 IP 窗口内允许请求数
-
-def rate_limit_auth(request: Request):
-    client_ip = request.client.host if request.client else "unknown"
-    now = time.time()
-    with rate_lock:
-        bucket = rate_buckets.get(client_ip, [])
-        bucket = [ts for ts in bucket if now - ts < RATE_WINDOW]
-        if len(bucket) >= RATE_LIMIT:
-            raise HTTPException(status_code=429, detail="请求过于频繁，请稍后再试")
-        bucket.append(now)
-        rate_buckets[client_ip] = bucket
-
-# 高成本任务限速（生成大纲/批量写作等）
-rate_lock_heavy = threading.Lock()
-rate_buckets_heavy: Dict[str, list] = {}
+RATE_LIMIT = 20   # 同一 IP / 账号窗口内允许请求数
+auth_rate_limiter = RequestRateLimiter("rate_auth", RATE_LIMIT, RATE_WINDOW)
+
+def rate_limit_auth(request: Request, account: Optional[str] = None):
+    auth_rate_limiter.enforce(f"ip:{client_ip(request)}", "请求过于频繁，请稍后再试")
+    if account:
+        auth_rate_limiter.enforce(f"account:{account.strip().lower()}", "请求过于频繁，请稍后再试")
+
+# 高成本任务限速（生成大纲/批量写作等），已登录时按用户计数
 HEAVY_WINDOW = 300  # 秒
-HEAVY_LIMIT = 10    # 同一 IP 窗口内允许创建的任务数
-
-def rate_limit_heavy(request: Request):
-    client_ip = request.client.host if request.client else "unknown"
-    now = time.time()
-    with rate_lock_heavy:
-        bucket = rate_buckets_heavy.get(client_ip, [])
-        bucket = [ts for ts in bucket if now - ts < HEAVY_WINDOW]
-        if len(bucket) >= HEAVY_LIMIT:
-            raise HTTPException(status_code=429, detail="生成请求过于频繁，请稍后重试")
-        bucket.append(now)
-        rate_buckets_heavy[client_ip] = bucket
+HEAVY_LIMIT = 10    # 同一用户 / IP 窗口内允许创建的任务数
+heavy_rate_limiter = RequestRateLimiter("rate_heavy", HEAVY_LIMIT, HEAVY_WINDOW)
+
+def rate_limit_heavy(request: Request, user_id: Optional[str] = None):
+    key = f"user:{user_id}" if user_id else f"ip:{client_ip(request)}"
+    heavy_rate_limiter.enforce(key, "生成请求过于频繁，请稍后重试")
 
 # ==================== 辅助函数 ====================
 
@@ -231,6 +271,26 @@ def run_async(coro):
     """Run an async coroutine in a sync context."""
     return asyncio.run(coro)
 
+def consume_structured_items(stream_fn, list_fn, kwargs: Dict[str, Any], on_item) -> int:
+    """
+    逐项处理结构化生成结果（章节列表、角色等），返回处理的项数
+
+    STRUCTURED_STREAMING 开启时使用微服务的流式接口，每项生成完即回调 on_item(item, index)，可边生成边入库；
+    关闭时等完整列表返回后再依次回调。
+    """
+    async def consume() -> int:
+        count = 0
+        if STRUCTURED_STREAMING:
+            async for item in stream_fn(**kwargs):
+                on_item(item, count)
+                count += 1
+        else:
+            for item in await list_fn(**kwargs) or []:
+                on_item(item, count)
+                count += 1
+        return count
+    return run_async(consume())
+
 def trigger_graph_sync(novel_id: str) -> None:
     """Sync novel graph data to Neo4j in background."""
     if not NEO4J_ENABLED:
@@ -277,8 +337,8 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     db.refresh(user)
     
     # 生成令牌
-    access_token = create_access_token(data={"sub": user.id})
-    refresh_token = create_refresh_token(data={"sub": user.id})
+    access_token = create_access_token(data=token_claims(user))
+    refresh_token = create_refresh_token(data=token_claims(user))
     
     return {
         "access_token": access_token,
@@ -314,7 +374,7 @@ async def check_login_status_endpoint(
 @app.post("/api/auth/login", response_model=Token)
 async def login(login_data: UserLogin, request: Request, db: Session = Depends(get_db)):
     """用户登录"""
-    rate_limit_auth(request)
+    rate_limit_auth(request, account=login_data.username_or_email)
     user = get_user_by_username_or_email(db, login_data.username_or_email)
     if not user:
         raise HTTPException(status_code=401, detail="用户名或密码错误")
@@ -348,10 +408,11 @@ async def login(login_data: UserLogin, request: Request, db: Session = Depends(g
     user.locked_until = None
     user.last_login_at = int(time.time() * 1000)
     db.commit()
+    invalidate_user(user.id)
     
     # 生成令牌
-    access_token = create_access_token(data={"sub": user.id})
-    refresh_token = create_refresh_token(data={"sub": user.id})
+    access_token = create_access_token(data=token_claims(user))
+    refresh_token = create_refresh_token(data=token_claims(user))
     
     return {
         "access_token": access_token,
@@ -381,10 +442,12 @@ async def refresh_token(
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=401, detail="用户不存在")
+    if not token_matches_user(refresh_data.refresh_token, user):
+        raise HTTPException(status_code=401, detail="无效的刷新令牌")
     
     # 生成新令牌
-    access_token = create_access_token(data={"sub": user.id})
-    new_refresh_token = create_refresh_token(data={"sub": user.id})
+    access_token = create_access_token(data=token_claims(user))
+    new_refresh_token = create_refresh_token(data=token_claims(user))
     
     return {
         "access_token": access_token,
@@ -1002,6 +1065,7 @@ async def sync_novel(
                 db.delete(foreshadowing)
     
     db.commit()
+    invalidate_near_duplicates(novel_id)
     trigger_graph_sync(novel_id)
     return await get_novel(novel_id, current_user, db)
 
@@ -1165,6 +1229,7 @@ async def delete_volume(
     
     db.delete(volume)
     db.commit()
+    invalidate_near_duplicates(novel_id)
     trigger_graph_sync(novel_id)
     return {"message": "卷已删除"}
 
@@ -1252,6 +1317,9 @@ async def create_chapters(
             )
     
     db.commit()
+    for chapter in created_chapters:
+        if chapter.content and chapter.content.strip():
+            record_chapter_content(volume.novel_id, chapter.id, chapter.title, chapter.content)
     
     result = []
     for chapter in created_chapters:
@@ -1311,6 +1379,8 @@ async def update_chapter(
     
     db.commit()
     db.refresh(chapter)
+    if chapter_data.content is not None and chapter.content != old_content:
+        record_chapter_content(chapter.volume.novel_id, chapter.id, chapter.title, chapter.content)
     trigger_graph_sync(chapter.volume.novel_id)
     
     chapter_dict = {
@@ -1342,9 +1412,12 @@ async def delete_chapter(
     if not chapter:
         raise HTTPException(status_code=404, detail="章节不存在")
     
+    novel_id = chapter.volume.novel_id
     db.delete(chapter)
     db.commit()
-    trigger_graph_sync(chapter.volume.novel_id)
+    invalidate_novel_vectors(novel_id)
+    forget_chapter(novel_id, chapter_id)
+    trigger_graph_sync(novel_id)
     return {"message": "章节已删除"}
 
 @app.post("/api/chapters/{chapter_id}/store-embedding-sync")
@@ -1400,6 +1473,106 @@ async def store_chapter_embedding_sync(
             detail=f"向量存储失败: {str(e)}"
         )
 
+@app.post("/api/chapters/{chapter_id}/consistency-check")
+async def check_chapter_consistency(
+    chapter_id: str,
+    foreshadowing_threshold: float = 0.75,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    一次检查章节与全部角色设定的一致性，并匹配章节可能解决的伏笔
+    章节向量只生成一次，候选向量一次取回后在进程内批量计算相似度
+    """
+    chapter = db.query(Chapter).join(Volume).join(Novel).filter(
+        Chapter.id == chapter_id,
+        Novel.user_id == current_user.id
+    ).first()
+    if not chapter:
+        raise HTTPException(status_code=404, detail="章节不存在")
+    if not chapter.content or not chapter.content.strip():
+        return {"chapter_id": chapter_id, "characters": [], "inconsistent_characters": [], "foreshadowings": []}
+
+    try:
+        from services.analysis.consistency_checker import ConsistencyChecker
+        return ConsistencyChecker().check_chapter_consistency(
+            db=db,
+            novel_id=chapter.volume.novel_id,
+            chapter_id=chapter.id,
+            chapter_content=chapter.content,
+            foreshadowing_threshold=foreshadowing_threshold
+        )
+    except Exception as e:
+        logger.error(f"章节一致性检查失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"一致性检查失败: {str(e)}")
+
+@app.get("/api/chapters/{chapter_id}/near-duplicates")
+async def get_chapter_near_duplicates(
+    chapter_id: str,
+    threshold: Optional[float] = Query(None, ge=0.0, le=1.0, description="段落近重复阈值（估计的 Jaccard 相似度）"),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    检测章节中与本小说其他章节近重复的段落
+    使用本地 MinHash 索引，不调用任何 API
+    """
+    chapter = db.query(Chapter).join(Volume).join(Novel).filter(
+        Chapter.id == chapter_id,
+        Novel.user_id == current_user.id
+    ).first()
+    if not chapter:
+        raise HTTPException(status_code=404, detail="章节不存在")
+
+    duplicates = find_near_duplicates(
+        db,
+        chapter.volume.novel_id,
+        chapter.content or "",
+        exclude_chapter_id=chapter.id,
+        threshold=threshold,
+        limit=limit
+    )
+    return {
+        "chapter_id": chapter.id,
+        "has_duplicate_content": bool(duplicates),
+        "duplicate_paragraphs": duplicates
+    }
+
+
+@app.post("/api/novels/{novel_id}/summaries/refresh")
+def refresh_novel_summaries(
+    novel_id: str,
+    overwrite: bool = Query(False, description="是否覆盖已有的章节摘要（正文未改动的章节仍然跳过）"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    刷新分层摘要：并发摘要正文改动过的章节，再汇总为卷摘要和全书梗概
+    （overwrite 为用户主动重新生成，跳过微服务的响应缓存）
+    """
+    novel = db.query(Novel).filter(Novel.id == novel_id, Novel.user_id == current_user.id).first()
+    if not novel:
+        raise HTTPException(status_code=404, detail="小说不存在")
+    with (bypass_response_cache() if overwrite else contextlib.nullcontext()):
+        return summarize_novel(db, novel_id, overwrite=overwrite)
+
+
+@app.get("/api/novels/{novel_id}/story-so-far")
+def get_story_so_far(
+    novel_id: str,
+    before_chapter_id: Optional[str] = Query(None, description="只使用该章之前的内容"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    获取固定长度的前情提要（读取摘要缓存，不调用 API）
+    """
+    novel = db.query(Novel).filter(Novel.id == novel_id, Novel.user_id == current_user.id).first()
+    if not novel:
+        raise HTTPException(status_code=404, detail="小说不存在")
+    return {"novel_id": novel_id, "story_so_far": story_so_far(db, novel_id, before_chapter_id=before_chapter_id)}
+
 # ==================== 角色路由 ====================
 
 @app.get("/api/novels/{novel_id}/characters", response_model=List[CharacterResponse])
@@ -2151,7 +2324,7 @@ async def generate_outline(
                     task_db.close()
         
         executor = get_task_executor()
-        executor.submit(execute_task)
+        executor.submit(execute_task, task_id=task.id)
         
         return {
             "task_id": task.id,
@@ -2245,7 +2418,8 @@ async def write_chapter(
         previous_chapters_context=request.previous_chapters_context,
         novel_id=novel_id,
         current_chapter_id=None,
-        db_session=db
+        db_session=db,
+        draft_mode=request.draft_mode
     )
     
     return StreamingResponse(
@@ -2263,6 +2437,7 @@ async def write_all_chapters_in_volume(
     novel_id: str,
     volume_id: str,
     from_start: bool = Query(False, description="是否从第一章开始（覆盖已有内容）"),
+    draft_mode: Optional[str] = Query(None, description="正文写作模式：single（整章单次生成）/ scenes（场景并行），默认取 CHAPTER_DRAFT_MODE"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -2354,8 +2529,12 @@ async def write_all_chapters_in_volume(
             total_to_write = len(need_write)
             written = 0
             failed = 0
+            duplicate_reports: Dict[str, Any] = {}
+            generation_ms: Dict[str, Any] = {}
 
             for idx, chapter in enumerate(chapters):
+                # 取消检查点：已完成的章节均已入库，取消后保留
+                raise_if_cancelled()
                 # 如果是从第一章开始，跳过检查；否则只处理未写作的章节
                 if not from_start and (chapter.content or "").strip():
                     continue
@@ -2393,13 +2572,17 @@ async def write_all_chapters_in_volume(
                     result = write_and_save_chapter(
                         context,
                         progress_callback=progress_callback,
-                        next_chapter=next_chapter_for_hook
+                        next_chapter=next_chapter_for_hook,
+                        draft_mode=draft_mode
                     )
                     
                     if not result["success"]:
                         raise Exception(result.get("error", "章节生成失败"))
 
                     written += 1
+                    if result.get("duplicate_report"):
+                        duplicate_reports[chapter.id] = result["duplicate_report"]
+                    generation_ms[chapter.id] = result.get("generation_ms")
                     
                     # 更新进度（在章节生成完成后）
                     progress = int((written + failed) / total_to_write * 100) if total_to_write > 0 else 0
@@ -2447,7 +2630,9 @@ async def write_all_chapters_in_volume(
                             "chapter_id": ch.id,
                             "chapter_title": ch.title,
                             "foreshadowings": foreshadowings_list,
-                            "next_chapter_hook": hook
+                            "next_chapter_hook": hook,
+                            "duplicate_report": duplicate_reports.get(ch.id),
+                            "generation_ms": generation_ms.get(ch.id)
                         })
                 
                 task_obj.result = json.dumps({
@@ -2456,7 +2641,11 @@ async def write_all_chapters_in_volume(
                     "skipped": skipped,
                     "volume_id": volume_id,
                     "volume_title": volume_obj.title,
-                    "chapters_info": chapters_info  # 包含每章的伏笔和钩子
+                    "chapters_info": chapters_info,  # 包含每章的伏笔、钩子和段落重复检查结果
+                    "duplicate_chapters": [
+                        chapter_id for chapter_id, report in duplicate_reports.items()
+                        if report.get("has_duplicate_content")
+                    ]
                 })
                 task_obj.completed_at = int(time.time() * 1000)
                 task_db.commit()
@@ -2473,7 +2662,7 @@ async def write_all_chapters_in_volume(
             task_db.close()
 
     executor = get_task_executor()
-    executor.submit(execute_write_volume)
+    executor.submit(execute_write_volume, task_id=task.id)
     
     return {
         "task_id": task.id,
@@ -2486,6 +2675,7 @@ async def write_next_chapter(
     novel_id: str,
     volume_id: str,
     chapter_id: str,
+    draft_mode: Optional[str] = Query(None, description="正文写作模式：single（整章单次生成）/ scenes（场景并行），默认取 CHAPTER_DRAFT_MODE"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -2573,7 +2763,8 @@ async def write_next_chapter(
             result = write_and_save_chapter(
                 context,
                 progress_callback=progress_callback,
-                next_chapter=next_next_chapter
+                next_chapter=next_next_chapter,
+                draft_mode=draft_mode
             )
 
             if not result["success"]:
@@ -2588,7 +2779,10 @@ async def write_next_chapter(
                     "next_chapter_id": context.chapter.id,
                     "next_chapter_title": context.chapter.title,
                     "foreshadowings": result["foreshadowings"],
-                    "next_chapter_hook": result["next_chapter_hook"]
+                    "next_chapter_hook": result["next_chapter_hook"],
+                    "duplicate_report": result.get("duplicate_report"),
+                    "draft_mode": result.get("draft_mode"),
+                    "generation_ms": result.get("generation_ms")
                 })
                 task_obj.completed_at = int(time.time() * 1000)
                 task_db.commit()
@@ -2606,7 +2800,7 @@ async def write_next_chapter(
             task_db.close()
 
     executor = get_task_executor()
-    executor.submit(execute_write_next_chapter)
+    executor.submit(execute_write_next_chapter, task_id=task.id)
     
     return {
         "task_id": task.id,
@@ -2619,6 +2813,7 @@ async def write_chapter_task(
     novel_id: str,
     volume_id: str,
     chapter_id: str,
+    draft_mode: Optional[str] = Query(None, description="正文写作模式：single（整章单次生成）/ scenes（场景并行），默认取 CHAPTER_DRAFT_MODE"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -2694,7 +2889,8 @@ async def write_chapter_task(
             result = write_and_save_chapter(
                 context,
                 progress_callback=progress_callback,
-                next_chapter=next_chapter
+                next_chapter=next_chapter,
+                draft_mode=draft_mode
             )
 
             if not result["success"]:
@@ -2709,7 +2905,10 @@ async def write_chapter_task(
                     "chapter_id": context.chapter.id,
                     "chapter_title": context.chapter.title,
                     "foreshadowings": result["foreshadowings"],
-                    "next_chapter_hook": result["next_chapter_hook"]
+                    "next_chapter_hook": result["next_chapter_hook"],
+                    "duplicate_report": result.get("duplicate_report"),
+                    "draft_mode": result.get("draft_mode"),
+                    "generation_ms": result.get("generation_ms")
                 })
                 task_obj.completed_at = int(time.time() * 1000)
                 task_db.commit()
@@ -2727,7 +2926,7 @@ async def write_chapter_task(
             task_db.close()
 
     executor = get_task_executor()
-    executor.submit(execute_write_chapter)
+    executor.submit(execute_write_chapter, task_id=task.id)
     
     return {
         "task_id": task.id,
@@ -2791,7 +2990,7 @@ async def generate_characters_endpoint(
                     task_db.close()
         
         executor = get_task_executor()
-        executor.submit(execute_task)
+        executor.submit(execute_task, task_id=task.id)
         
         return {
             "task_id": task.id,
@@ -2863,7 +3062,7 @@ async def generate_world_settings_endpoint(
                     task_db.close()
         
         executor = get_task_executor()
-        executor.submit(execute_task)
+        executor.submit(execute_task, task_id=task.id)
         
         return {
             "task_id": task.id,
@@ -2935,7 +3134,7 @@ async def generate_timeline_events_endpoint(
                     task_db.close()
         
         executor = get_task_executor()
-        executor.submit(execute_task)
+        executor.submit(execute_task, task_id=task.id)
         
         return {
             "task_id": task.id,
@@ -3007,7 +3206,7 @@ async def generate_foreshadowings_endpoint(
                     task_db.close()
         
         executor = get_task_executor()
-        executor.submit(execute_task)
+        executor.submit(execute_task, task_id=task.id)
         
         return {
             "task_id": task.id,
@@ -3035,78 +3234,77 @@ async def extract_foreshadowings_from_chapter_endpoint(
     request: ExtractForeshadowingsRequest,
     current_user: User = Depends(get_current_user)
 ):
-    """从章节内容提取伏笔"""
-    result = extract_foreshadowings_from_chapter(
-        title=request.title,
-        genre=request.genre,
-        chapter_title=request.chapter_title,
-        chapter_content=request.chapter_content,
-        existing_foreshadowings=request.existing_foreshadowings
-    )
+    """从章节内容提取伏笔（用户主动发起，跳过微服务的响应缓存）"""
+    with bypass_response_cache():
+        result = await extract_foreshadowings_from_chapter(
+            title=request.title,
+            genre=request.genre,
+            chapter_title=request.chapter_title,
+            chapter_content=request.chapter_content,
+            existing_foreshadowings=request.existing_foreshadowings
+        )
     return convert_to_camel_case(result)
 
 
-class StageProgressTracker:
-    def __init__(self, task_id: str, min_progress: int, max_progress: int):
-        self.callback = ProgressCallback(task_id)
-        self.min_progress = min_progress
-        self.max_progress = max_progress
-        self.span = max(0, max_progress - min_progress)
-
-    def update(self, progress: int, message: str):
-        normalized = max(0, min(100, progress))
-        mapped = self.min_progress
-        if self.span > 0:
-            mapped = self.min_progress + int((normalized / 100) * self.span)
-        mapped = min(self.min_progress + self.span, mapped)
-        self.callback.update(mapped, message)
+_COMPLETE_OUTLINE_STAGE_MODELS = {
+    "outline": (Volume,),
+    "characters": (Character,),
+    "world_settings": (WorldSetting,),
+    "timeline": (TimelineEvent,),
+    "foreshadowings": (Foreshadowing,),
+}
 
 
-def _execute_complete_outline_task(task_id: str, novel_id: str) -> None:
-    task_db = SessionLocal()
+def _load_outline_checkpoint(task_obj: Optional[Task]) -> Dict[str, Any]:
+    """读取完整大纲任务的断点：{"completed": [阶段], "timings": {阶段: 毫秒}}"""
     try:
-        logger.info(f"开始执行完整大纲任务：task_id={task_id} novel_id={novel_id}")
+        data = json.loads(task_obj.task_data or "{}") if task_obj else {}
+    except (TypeError, ValueError):
+        data = {}
+    checkpoint = data.get("checkpoint") or {}
+    return {
+        "completed": [name for name in checkpoint.get("completed") or [] if name in _COMPLETE_OUTLINE_STAGE_MODELS],
+        "timings": checkpoint.get("timings") or {},
+    }
 
-        task_obj = task_db.query(Task).filter(Task.id == task_id).first()
-        if task_obj:
-            task_obj.status = "running"
-            task_obj.started_at = int(time.time() * 1000)
-            task_obj.progress_message = "任务已启动"
-            task_obj.updated_at = int(time.time() * 1000)
-            task_db.commit()
 
-        novel_obj = task_db.query(Novel).filter(Novel.id == novel_id).first()
-        if not novel_obj:
-            raise Exception("小说不存在")
+def _save_outline_checkpoint(task_db: Session, task_id: str, checkpoint: Dict[str, Any]) -> None:
+    task_obj = task_db.query(Task).filter(Task.id == task_id).first()
+    if not task_obj:
+        return
+    try:
+        data = json.loads(task_obj.task_data or "{}")
+    except (TypeError, ValueError):
+        data = {}
+    data["checkpoint"] = checkpoint
+    task_obj.task_data = json.dumps(data, ensure_ascii=False)
+    task_obj.updated_at = int(time.time() * 1000)
+    task_db.commit()
 
-        current_time = int(time.time() * 1000)
 
-        logger.info("开始清理旧数据...")
-        task_db.query(Volume).filter(Volume.novel_id == novel_id).delete()
-        task_db.query(Character).filter(Character.novel_id == novel_id).delete()
-        task_db.query(WorldSetting).filter(WorldSetting.novel_id == novel_id).delete()
-        task_db.query(TimelineEvent).filter(TimelineEvent.novel_id == novel_id).delete()
-        task_db.query(Foreshadowing).filter(Foreshadowing.novel_id == novel_id).delete()
-        task_db.commit()
-        logger.info("旧数据清理完成")
+def _outline_stage_novel(stage_db: Session, novel_id: str) -> Novel:
+    novel_obj = stage_db.query(Novel).filter(Novel.id == novel_id).first()
+    if not novel_obj:
+        raise Exception("小说不存在")
+    return novel_obj
+
 
-        logger.info("第 1/6：生成完整大纲并同步卷结构")
-        update_task_progress(task_db, task_id, 5, "正在生成完整大纲...")
-        outline_progress = StageProgressTracker(task_id, 6, 19)
+def _run_outline_stage(novel_id: str, progress) -> int:
+    """阶段：生成完整大纲并同步卷结构"""
+    stage_db = SessionLocal()
+    try:
+        novel_obj = _outline_stage_novel(stage_db, novel_id)
         outline_result = run_async(generate_full_outline(
             title=novel_obj.title,
             genre=novel_obj.genre,
             synopsis=novel_obj.synopsis,
-            progress_callback=outline_progress
+            progress_callback=progress
         ))
-
+        current_time = int(time.time() * 1000)
         novel_obj.full_outline = outline_result.get("outline", "")
-        task_db.commit()
-        update_task_progress(task_db, task_id, 20, "完整大纲生成完成")
-
         volumes_data = outline_result.get("volumes", [])
         for idx, volume_data in enumerate(volumes_data):
-            volume = Volume(
+            stage_db.add(Volume(
                 id=generate_uuid(),
                 novel_id=novel_id,
                 title=volume_data.get("title", f"?{idx+1}?"),
@@ -3115,119 +3313,182 @@ def _execute_complete_outline_task(task_id: str, novel_id: str) -> None:
                 volume_order=idx,
                 created_at=current_time,
                 updated_at=current_time
-            )
-            task_db.add(volume)
-        task_db.commit()
+            ))
+        stage_db.commit()
+        return len(volumes_data)
+    finally:
+        stage_db.close()
 
-        logger.info("第 2/6：生成角色信息")
-        update_task_progress(task_db, task_id, 25, "正在生成角色...")
-        characters_progress = StageProgressTracker(task_id, 26, 39)
-        characters_result = run_async(generate_characters(
-            title=novel_obj.title,
-            genre=novel_obj.genre,
-            synopsis=novel_obj.synopsis,
-            outline=novel_obj.full_outline,
-            progress_callback=characters_progress
-        ))
 
-        for idx, char_data in enumerate(characters_result):
-            character = Character(
-                id=generate_uuid(),
-                novel_id=novel_id,
-                name=char_data.get("name", ""),
-                age=char_data.get("age", ""),
-                role=char_data.get("role", ""),
-                personality=char_data.get("personality", ""),
-                background=char_data.get("background", ""),
-                goals=char_data.get("goals", ""),
-                character_order=idx,
-                created_at=current_time,
-                updated_at=current_time
-            )
-            task_db.add(character)
-        task_db.commit()
-        update_task_progress(task_db, task_id, 40, "角色生成完成")
+def _outline_entity_row(stage: str, novel_id: str, data: Dict[str, Any], idx: int):
+    """完整大纲流水线中角色 / 世界观 / 时间线 / 伏笔阶段的一条生成结果对应的数据库行"""
+    current_time = int(time.time() * 1000)
+    if stage == "characters":
+        return Character(
+            id=generate_uuid(),
+            novel_id=novel_id,
+            name=data.get("name", ""),
+            age=data.get("age", ""),
+            role=data.get("role", ""),
+            personality=data.get("personality", ""),
+            background=data.get("background", ""),
+            goals=data.get("goals", ""),
+            character_order=idx,
+            created_at=current_time,
+            updated_at=current_time
+        )
+    if stage == "world_settings":
+        return WorldSetting(
+            id=generate_uuid(),
+            novel_id=novel_id,
+            title=data.get("title", ""),
+            description=data.get("description", ""),
+            category=data.get("category", "其他"),
+            setting_order=idx,
+            created_at=current_time,
+            updated_at=current_time
+        )
+    if stage == "timeline":
+        return TimelineEvent(
+            id=generate_uuid(),
+            novel_id=novel_id,
+            time=data.get("time", ""),
+            event=data.get("event", ""),
+            impact=data.get("impact", ""),
+            event_order=idx,
+            created_at=current_time,
+            updated_at=current_time
+        )
+    return Foreshadowing(
+        id=generate_uuid(),
+        novel_id=novel_id,
+        content=data.get("content", ""),
+        chapter_id=None,
+        resolved_chapter_id=None,
+        is_resolved="false",
+        foreshadowing_order=idx,
+        created_at=current_time,
+        updated_at=current_time
+    )
 
-        logger.info("第 3/6：生成世界观设定")
-        update_task_progress(task_db, task_id, 45, "正在生成世界观...")
-        world_progress = StageProgressTracker(task_id, 46, 59)
-        world_settings_result = run_async(generate_world_settings(
-            title=novel_obj.title,
-            genre=novel_obj.genre,
-            synopsis=novel_obj.synopsis,
-            outline=novel_obj.full_outline,
-            progress_callback=world_progress
-        ))
 
-        for idx, ws_data in enumerate(world_settings_result):
-            world_setting = WorldSetting(
-                id=generate_uuid(),
-                novel_id=novel_id,
-                title=ws_data.get("title", ""),
-                description=ws_data.get("description", ""),
-                category=ws_data.get("category", "其他"),
-                setting_order=idx,
-                created_at=current_time,
-                updated_at=current_time
-            )
-            task_db.add(world_setting)
-        task_db.commit()
-        update_task_progress(task_db, task_id, 60, "世界观生成完成")
+def _run_outline_entity_stage(novel_id: str, stage: str, progress) -> int:
+    """
+    阶段：基于完整大纲生成角色 / 世界观 / 时间线 / 伏笔（各自独立的会话，可并行）
 
-        logger.info("第 4/6：生成时间线事件")
-        update_task_progress(task_db, task_id, 65, "正在生成时间线...")
-        timeline_progress = StageProgressTracker(task_id, 66, 74)
-        timeline_result = run_async(generate_timeline_events(
-            title=novel_obj.title,
-            genre=novel_obj.genre,
-            synopsis=novel_obj.synopsis,
-            outline=novel_obj.full_outline,
-            progress_callback=timeline_progress
-        ))
+    角色、世界观、时间线使用流式接口，每生成完一项即写入并提交；阶段中途失败时已写入的行
+    由断点续跑清理（未完成阶段的数据会在重新执行前删除）。
+    """
+    generators = {
+        "characters": generate_characters,
+        "world_settings": generate_world_settings,
+        "timeline": generate_timeline_events,
+        "foreshadowings": generate_foreshadowings_from_outline,
+    }
+    stream_generators = {
+        "characters": generate_characters_stream,
+        "world_settings": generate_world_settings_stream,
+        "timeline": generate_timeline_events_stream,
+    }
+    stage_db = SessionLocal()
+    try:
+        novel_obj = _outline_stage_novel(stage_db, novel_id)
+        kwargs = {
+            "title": novel_obj.title,
+            "genre": novel_obj.genre,
+            "synopsis": novel_obj.synopsis,
+            "outline": novel_obj.full_outline,
+        }
 
-        for idx, event_data in enumerate(timeline_result):
-            timeline_event = TimelineEvent(
-                id=generate_uuid(),
-                novel_id=novel_id,
-                time=event_data.get("time", ""),
-                event=event_data.get("event", ""),
-                impact=event_data.get("impact", ""),
-                event_order=idx,
-                created_at=current_time,
-                updated_at=current_time
-            )
-            task_db.add(timeline_event)
-        task_db.commit()
-        update_task_progress(task_db, task_id, 75, "时间线生成完成")
+        def on_item(data: Dict[str, Any], idx: int) -> None:
+            stage_db.add(_outline_entity_row(stage, novel_id, data, idx))
+            if STRUCTURED_STREAMING:
+                stage_db.commit()
+                if progress:
+                    progress.update(min(90, 10 + (idx + 1) * 10), f"已生成 {idx + 1} 项")
+
+        if stage in stream_generators:
+            count = consume_structured_items(stream_generators[stage], generators[stage], kwargs, on_item)
+        else:
+            items = run_async(generators[stage](**kwargs, progress_callback=progress))
+            for idx, data in enumerate(items):
+                stage_db.add(_outline_entity_row(stage, novel_id, data, idx))
+            count = len(items)
+        stage_db.commit()
+        return count
+    finally:
+        stage_db.close()
+
+
+def _complete_outline_stages(novel_id: str) -> List[Stage]:
+    """完整大纲流水线：完整大纲完成后，角色、世界观、时间线、伏笔互不依赖，并行生成"""
+    def entity_stage(name: str, label: str, weight: float) -> Stage:
+        return Stage(
+            name=name,
+            label=label,
+            deps=("outline",),
+            weight=weight,
+            run=lambda progress: _run_outline_entity_stage(novel_id, name, progress),
+        )
 
-        logger.info("第 5/6：生成伏笔线索")
-        update_task_progress(task_db, task_id, 80, "正在生成伏笔...")
-        foreshadowings_progress = StageProgressTracker(task_id, 81, 89)
-        foreshadowings_result = run_async(generate_foreshadowings_from_outline(
-            title=novel_obj.title,
-            genre=novel_obj.genre,
-            synopsis=novel_obj.synopsis,
-            outline=novel_obj.full_outline,
-            progress_callback=foreshadowings_progress
-        ))
+    return [
+        Stage(name="outline", label="完整大纲", weight=3, run=lambda progress: _run_outline_stage(novel_id, progress)),
+        entity_stage("characters", "角色", 2),
+        entity_stage("world_settings", "世界观", 2),
+        entity_stage("timeline", "时间线", 1),
+        entity_stage("foreshadowings", "伏笔", 1),
+    ]
 
-        for idx, foreshadowing_data in enumerate(foreshadowings_result):
-            foreshadowing = Foreshadowing(
-                id=generate_uuid(),
-                novel_id=novel_id,
-                content=foreshadowing_data.get("content", ""),
-                chapter_id=None,
-                resolved_chapter_id=None,
-                is_resolved="false",
-                foreshadowing_order=idx,
-                created_at=current_time,
-                updated_at=current_time
-            )
-            task_db.add(foreshadowing)
+
+def _execute_complete_outline_task(task_id: str, novel_id: str) -> None:
+    task_db = SessionLocal()
+    try:
+        logger.info(f"开始执行完整大纲任务：task_id={task_id} novel_id={novel_id}")
+
+        task_obj = task_db.query(Task).filter(Task.id == task_id).first()
+        checkpoint = _load_outline_checkpoint(task_obj)
+        if task_obj:
+            task_obj.status = "running"
+            task_obj.started_at = task_obj.started_at or int(time.time() * 1000)
+            task_obj.progress_message = "任务已启动"
+            task_obj.updated_at = int(time.time() * 1000)
+            task_db.commit()
+
+        novel_obj = task_db.query(Novel).filter(Novel.id == novel_id).first()
+        if not novel_obj:
+            raise Exception("小说不存在")
+
+        # 清理未完成阶段可能残留的数据；完整大纲未完成时其他阶段的结果也作废
+        if "outline" not in checkpoint["completed"]:
+            checkpoint = {"completed": [], "timings": {}}
+        stale = [name for name in _COMPLETE_OUTLINE_STAGE_MODELS if name not in checkpoint["completed"]]
+        logger.info(f"开始清理未完成阶段的数据: {stale}（已完成: {checkpoint['completed']}）")
+        for name in stale:
+            for model in _COMPLETE_OUTLINE_STAGE_MODELS[name]:
+                task_db.query(model).filter(model.novel_id == novel_id).delete()
         task_db.commit()
-        update_task_progress(task_db, task_id, 90, "伏笔生成完成")
+        _save_outline_checkpoint(task_db, task_id, checkpoint)
+
+        stages = _complete_outline_stages(novel_id)
+        update_task_progress(task_db, task_id, 5, "正在生成完整大纲..." if "outline" in stale else "从断点继续生成...")
+        progress_callback = ProgressCallback(task_id)
+        progress = DagProgress(stages, progress_callback.update, start=5, end=95, completed=checkpoint["completed"])
+
+        def on_stage_done(result) -> None:
+            checkpoint["completed"].append(result.name)
+            checkpoint["timings"][result.name] = result.elapsed_ms
+            _save_outline_checkpoint(task_db, task_id, checkpoint)
+
+        run_stages(
+            stages,
+            max_workers=OUTLINE_PIPELINE_MAX_PARALLEL,
+            completed=checkpoint["completed"],
+            progress=progress,
+            on_stage_done=on_stage_done
+        )
 
-        logger.info("第 6/6：任务完成")
+        logger.info(f"完整大纲各阶段耗时(ms): {checkpoint['timings']}")
+        current_time = int(time.time() * 1000)
         task_obj = task_db.query(Task).filter(Task.id == task_id).first()
         if task_obj:
             task_obj.status = "completed"
@@ -3235,7 +3496,8 @@ def _execute_complete_outline_task(task_id: str, novel_id: str) -> None:
             task_obj.progress_message = "完整大纲生成完成"
             task_obj.result = json.dumps({
                 "message": "完整大纲生成成功",
-                "novel_id": novel_id
+                "novel_id": novel_id,
+                "stage_timings": checkpoint["timings"]
             }, ensure_ascii=False)
             task_obj.completed_at = current_time
             task_obj.updated_at = current_time
@@ -3245,6 +3507,7 @@ def _execute_complete_outline_task(task_id: str, novel_id: str) -> None:
 
     except Exception as e:
         logger.error(f"完整大纲处理失败: {str(e)}", exc_info=True)
+        task_db.rollback()
         task_obj = task_db.query(Task).filter(Task.id == task_id).first()
         if task_obj:
             task_obj.status = "failed"
@@ -3291,7 +3554,7 @@ async def generate_complete_outline(
         _execute_complete_outline_task(task.id, novel_id)
 
     executor = get_task_executor()
-    executor.submit(execute_complete_outline_generation)
+    executor.submit(execute_complete_outline_generation, task_id=task.id)
     
     return {
         "task_id": task.id,
@@ -3419,7 +3682,7 @@ async def generate_volume_outline_task(
             raise
     
     executor = get_task_executor()
-    executor.submit(execute_volume_outline_generation)
+    executor.submit(execute_volume_outline_generation, task_id=task.id)
     
     return {
         "task_id": task.id,
@@ -3441,7 +3704,7 @@ async def generate_all_volume_outlines_task(
     """
     # 限流：高成本任务
     if request:
-        rate_limit_heavy(request)
+        rate_limit_heavy(request, user_id=current_user.id)
 
     # 验证小说存在
     novel = db.query(Novel).filter(
@@ -3502,6 +3765,7 @@ async def generate_all_volume_outlines_task(
             progress.update(5, f"准备生成全部卷大纲（共 {total} 卷）...")
 
             for idx, volume_obj in enumerate(volumes_obj):
+                raise_if_cancelled()
                 current_progress = 5 + int(((idx) / max(total, 1)) * 90)
                 vol_title = volume_obj.title or f"第{volume_obj.volume_order + 1}卷"
 
@@ -3577,7 +3841,7 @@ async def generate_all_volume_outlines_task(
             task_db.close()
 
     executor = get_task_executor()
-    executor.submit(execute_all_volume_outlines_generation)
+    executor.submit(execute_all_volume_outlines_generation, task_id=task.id)
 
     return {
         "task_id": task.id,
@@ -3585,11 +3849,72 @@ async def generate_all_volume_outlines_task(
         "message": f"全部卷大纲生成任务已创建，正在后台执行（共 {len(volumes)} 卷）"
     }
 
+def _generate_volume_chapters(
+    db: Session,
+    volume_obj: Volume,
+    outline_kwargs: Dict[str, Any],
+    progress=None,
+    start: int = 0,
+    end: int = 100,
+    label: str = ""
+) -> int:
+    """
+    生成一卷的章节列表并保存，返回章节数
+
+    卷内还没有章节时每章生成完即写入并提交，前端刷新就能看到已生成的章节；卷内已有章节（覆盖生成）时
+    先缓冲新章节，全部生成成功后再一次替换，避免中途失败把旧章节清空。生成失败或取消时删除本次已写入的章节。
+    """
+    replace_existing = db.query(Chapter).filter(Chapter.volume_id == volume_obj.id).count() > 0
+    expected = outline_kwargs.get("chapter_count") or 0
+    buffered: List[Chapter] = []
+    written_ids: List[str] = []
+
+    def on_chapter(chapter_data: Dict[str, Any], idx: int) -> None:
+        current_time = int(time.time() * 1000)
+        chapter = Chapter(
+            id=generate_uuid(),
+            volume_id=volume_obj.id,
+            title=normalize_chapter_title(chapter_data.get("title"), idx),
+            summary=chapter_data.get("summary", ""),
+            content="",
+            ai_prompt_hints=chapter_data.get("aiPromptHints", ""),
+            chapter_order=idx,
+            created_at=current_time,
+            updated_at=current_time
+        )
+        if replace_existing:
+            buffered.append(chapter)
+        else:
+            db.add(chapter)
+            db.commit()
+            written_ids.append(chapter.id)
+        if progress:
+            value = start + int((end - start) * min(idx + 1, expected) / expected) if expected else start
+            progress.update(value, f"{label}已生成第 {idx + 1} 章《{chapter.title}》")
+
+    try:
+        count = consume_structured_items(
+            generate_chapter_outline_stream, generate_chapter_outline_impl, outline_kwargs, on_chapter
+        )
+        if replace_existing:
+            db.query(Chapter).filter(Chapter.volume_id == volume_obj.id).delete()
+            db.add_all(buffered)
+            db.commit()
+        return count
+    except BaseException:
+        db.rollback()
+        if written_ids:
+            db.query(Chapter).filter(Chapter.id.in_(written_ids)).delete(synchronize_session=False)
+            db.commit()
+        raise
+
+
 @app.post("/api/novels/{novel_id}/generate-all-chapters")
 async def generate_all_chapters_task(
     novel_id: str,
     force: bool = Query(False),
     chapter_count: Optional[int] = Query(None),
+    parallel: Optional[bool] = Query(None),
     request: Request = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -3598,10 +3923,11 @@ async def generate_all_chapters_task(
     一键生成所有卷的章节列表并保存到数据库
     - 默认只生成没有章节的卷；force=true 时会覆盖已存在章节列表
     - chapter_count: 可选，指定“每卷”生成的章节数量（1-50）
+    - parallel: 可选，各卷按卷大纲并行生成后再检查卷交界衔接（默认取 CHAPTER_OUTLINE_PARALLEL）
     """
     # 限流：高成本任务
     if request:
-        rate_limit_heavy(request)
+        rate_limit_heavy(request, user_id=current_user.id)
 
     # 验证小说存在
     novel = db.query(Novel).filter(
@@ -3620,6 +3946,8 @@ async def generate_all_chapters_task(
     if chapter_count is not None and (chapter_count < 1 or chapter_count > 50):
         raise HTTPException(status_code=400, detail="chapter_count 必须在 1-50 之间")
 
+    parallel_mode = CHAPTER_OUTLINE_PARALLEL if parallel is None else parallel
+
     task = create_task(
         db=db,
         novel_id=novel_id,
@@ -3628,7 +3956,8 @@ async def generate_all_chapters_task(
         task_data={
             "force": force,
             "chapter_count": chapter_count,
-            "volume_count": len(volumes)
+            "volume_count": len(volumes),
+            "parallel": parallel_mode
         }
     )
 
@@ -3666,10 +3995,210 @@ async def generate_all_chapters_task(
             generated_chapter_count = 0
             skipped_chapter_count = 0
             skipped_no_outline_count = 0
+            stitched_chapter_count = 0
 
-            progress.update(5, f"准备生成全部章节列表（共 {total} 卷）...")
+            def chapter_outline_kwargs(volume_obj: Volume, previous_volumes_info: List[Dict[str, Any]]) -> Dict[str, Any]:
+                vol_index = volume_obj.volume_order
+                # 构建“后续卷规划（避雷）”：避免把后续卷大事件提前写到本卷
+                future_volumes_info = [
+                    {
+                        "title": next_vol.title,
+                        "summary": next_vol.summary or "",
+                        "outline": (next_vol.outline or "")[:1200]
+                    }
+                    for next_vol in volumes_obj
+                    if next_vol.volume_order > vol_index
+                ][:3]
+                # 如果没有指定 chapter_count，尝试从卷大纲中提取【章节规划】
+                final_chapter_count = chapter_count
+                if not final_chapter_count and volume_obj.outline:
+                    final_chapter_count = chapter_count_from_outline(volume_obj.outline)
+                    if final_chapter_count:
+                        logger.info(f"第 {vol_index + 1} 卷：从卷大纲中提取到章节规划：{final_chapter_count} 章")
+                return {
+                    "novel_title": novel_obj.title,
+                    "genre": novel_obj.genre,
+                    "full_outline": novel_obj.full_outline or "",
+                    "volume_title": volume_obj.title or f"第{vol_index + 1}卷",
+                    "volume_summary": volume_obj.summary or "",
+                    "volume_outline": volume_obj.outline or "",
+                    "characters": characters_data,
+                    "volume_index": vol_index,
+                    "chapter_count": final_chapter_count,
+                    "previous_volumes_info": previous_volumes_info or None,
+                    "future_volumes_info": future_volumes_info or None,
+                }
+
+            def previous_volume_tail(prev_vol: Volume) -> List[Dict[str, Any]]:
+                # 构建“上一卷参考信息”：只取上一卷最后若干章（标题+摘要），确保连贯且不重复
+                prev_chapters = task_db.query(Chapter).filter(
+                    Chapter.volume_id == prev_vol.id
+                ).order_by(Chapter.chapter_order).all()
+                if not prev_chapters:
+                    return []
+                return [{
+                    "title": prev_vol.title,
+                    "summary": prev_vol.summary or "",
+                    "chapters": [{
+                        "title": ch.title,
+                        "summary": ch.summary or ""
+                    } for ch in prev_chapters[-PREVIOUS_TAIL_CHAPTERS:]]
+                }]
+
+            def save_volume_chapters(volume_obj: Volume, chapters_data: List[Dict[str, Any]], existing_chapter_count: int) -> None:
+                # 删除旧章节并写入新章节（一次性提交，避免中途失败导致章节被清空）
+                if existing_chapter_count > 0:
+                    task_db.query(Chapter).filter(Chapter.volume_id == volume_obj.id).delete()
+                current_time = int(time.time() * 1000)
+                for ch_idx, chapter_data in enumerate(chapters_data):
+                    task_db.add(Chapter(
+                        id=generate_uuid(),
+                        volume_id=volume_obj.id,
+                        title=normalize_chapter_title(chapter_data.get("title"), ch_idx),
+                        summary=chapter_data.get("summary", ""),
+                        content="",
+                        ai_prompt_hints=chapter_data.get("aiPromptHints", ""),
+                        chapter_order=ch_idx,
+                        created_at=current_time,
+                        updated_at=current_time
+                    ))
+                task_db.commit()
 
-            for idx, volume_obj in enumerate(volumes_obj):
+            progress.update(5, f"准备生成全部章节列表（共 {total} 卷{'，并行模式' if parallel_mode else ''}）...")
+
+            if parallel_mode:
+                # 并行模式：所有有卷大纲的卷同时按卷大纲生成，完成后检查相邻卷交界
+                jobs: List[VolumeChapterJob] = []
+                regenerating = set()
+                existing_counts = {}
+                for volume_obj in volumes_obj:
+                    existing_counts[volume_obj.id] = task_db.query(Chapter).filter(Chapter.volume_id == volume_obj.id).count()
+                    if not force and existing_counts[volume_obj.id] > 0:
+                        skipped_volume_count += 1
+                        skipped_chapter_count += existing_counts[volume_obj.id]
+                        continue
+                    if not (volume_obj.outline or "").strip():
+                        skipped_no_outline_count += 1
+                        continue
+                    regenerating.add(volume_obj.id)
+
+                for idx, volume_obj in enumerate(volumes_obj):
+                    if volume_obj.id not in regenerating:
+                        continue
+                    # 上一卷不在本次生成范围且已有章节时，仍带入其结尾章节；否则只依赖卷大纲，交界留给衔接检查
+                    prev_vol = volumes_obj[idx - 1] if idx > 0 else None
+                    previous_info = previous_volume_tail(prev_vol) if prev_vol and prev_vol.id not in regenerating else []
+                    jobs.append(VolumeChapterJob(
+                        volume_id=volume_obj.id,
+                        volume_index=volume_obj.volume_order,
+                        title=volume_obj.title or f"第{volume_obj.volume_order + 1}卷",
+                        kwargs=chapter_outline_kwargs(volume_obj, previous_info),
+                        used_previous_chapters=bool(previous_info),
+                        existing_chapter_count=existing_counts[volume_obj.id]
+                    ))
+
+                volumes_by_id = {v.id: v for v in volumes_obj}
+                generated: Dict[str, bool] = {}
+                max_parallel = max(1, min(
+                    CHAPTER_OUTLINE_MAX_PARALLEL,
+                    int(get_rate_limiter(AI_SERVICE_PROVIDER).concurrency_limit)
+                ))
+                progress.update(8, f"并行生成 {len(jobs)} 卷章节列表（并发 {max_parallel}）...")
+
+                def on_volume_done(result: VolumeChapterResult) -> None:
+                    nonlocal generated_volume_count, generated_chapter_count, failed_volume_count
+                    job = result.job
+                    try:
+                        if result.error is not None:
+                            raise result.error
+                        save_volume_chapters(volumes_by_id[job.volume_id], result.chapters, job.existing_chapter_count)
+                        generated[job.volume_id] = job.used_previous_chapters
+                        generated_volume_count += 1
+                        generated_chapter_count += len(result.chapters)
+                    except Exception as e:
+                        task_db.rollback()
+                        failed_volume_count += 1
+                        errors.append({
+                            "volume_index": job.volume_index,
+                            "volume_title": job.title,
+                            "error": str(e)
+                        })
+                    finished = generated_volume_count + failed_volume_count
+                    progress.update(
+                        8 + int(finished / max(len(jobs), 1) * 77),
+                        f"已完成 {finished}/{len(jobs)} 卷（第 {job.volume_index + 1} 卷《{job.title}》"
+                        f"{'生成失败' if result.error is not None else f'{len(result.chapters)} 章'}）"
+                    )
+
+                if jobs:
+                    generate_volumes_parallel(
+                        jobs,
+                        generate_chapter_outline_impl,
+                        max_parallel=max_parallel,
+                        provider=AI_SERVICE_PROVIDER,
+                        on_result=on_volume_done
+                    )
+
+                if CHAPTER_OUTLINE_STITCH and generated:
+                    raise_if_cancelled()
+                    try:
+                        chapters_by_volume: Dict[str, List[Chapter]] = {}
+                        for chapter in task_db.query(Chapter).filter(
+                            Chapter.volume_id.in_(list(volumes_by_id))
+                        ).order_by(Chapter.chapter_order).all():
+                            chapters_by_volume.setdefault(chapter.volume_id, []).append(chapter)
+                        pairs = boundaries_to_stitch(
+                            [v.id for v in volumes_obj],
+                            generated,
+                            {vid: bool(chapters) for vid, chapters in chapters_by_volume.items()}
+                        )
+                        progress.update(88, f"检查 {len(pairs)} 处卷交界的衔接...")
+                        boundaries = [
+                            {
+                                "novel_title": novel_obj.title,
+                                "prev_title": volumes_by_id[prev_id].title,
+                                "prev_tail": [
+                                    {"title": ch.title, "summary": ch.summary or ""}
+                                    for ch in chapters_by_volume[prev_id][-STITCH_CHAPTERS:]
+                                ],
+                                "next_volume_id": next_id,
+                                "next_title": volumes_by_id[next_id].title,
+                                "next_summary": volumes_by_id[next_id].summary or "",
+                                "next_head": [
+                                    {"title": ch.title, "summary": ch.summary or "", "ai_prompt_hints": ch.ai_prompt_hints or ""}
+                                    for ch in chapters_by_volume[next_id][:STITCH_CHAPTERS]
+                                ],
+                            }
+                            for prev_id, next_id in pairs
+                        ]
+                        stitch_route = _resolve_agent_model("stitcher")
+                        revisions = stitch_boundaries(
+                            boundaries,
+                            lambda prompt: get_llm_gateway().generate(stitch_route, prompt, temperature=0.3, max_tokens=1500),
+                            max_parallel=max_parallel
+                        )
+                        current_time = int(time.time() * 1000)
+                        for next_id, items in revisions.items():
+                            head = chapters_by_volume[next_id]
+                            for item in items:
+                                chapter = head[item["index"]]
+                                chapter.summary = item["summary"]
+                                if item["ai_prompt_hints"]:
+                                    chapter.ai_prompt_hints = "\n".join(
+                                        v for v in [f"【跨卷衔接】{item['ai_prompt_hints']}", chapter.ai_prompt_hints or ""] if v
+                                    )
+                                chapter.updated_at = current_time
+                                stitched_chapter_count += 1
+                        task_db.commit()
+                        logger.info(f"✅ 卷交界衔接检查完成：{len(pairs)} 处交界，修改 {stitched_chapter_count} 章")
+                    except Exception as e:
+                        # 衔接检查只是润色，失败时保留各卷独立生成的章节列表
+                        task_db.rollback()
+                        stitched_chapter_count = 0
+                        logger.warning(f"⚠️ 卷交界衔接检查失败，保留独立生成的章节列表: {e}")
+
+            for idx, volume_obj in enumerate(volumes_obj if not parallel_mode else []):
+                raise_if_cancelled()
                 base_progress = 5 + int(((idx) / max(total, 1)) * 90)
                 vol_index = volume_obj.volume_order
                 vol_title = volume_obj.title or f"第{vol_index + 1}卷"
@@ -3683,18 +4212,11 @@ async def generate_all_chapters_task(
                         continue
 
                     # 为保证跨卷衔接：除第一卷外，要求上一卷已有章节列表
-                    if vol_index > 0:
-                        prev_volume = task_db.query(Volume).filter(
-                            Volume.novel_id == novel_id,
-                            Volume.volume_order == vol_index - 1
-                        ).first()
-                        prev_chapter_count = 0
-                        if prev_volume:
-                            prev_chapter_count = task_db.query(Chapter).filter(Chapter.volume_id == prev_volume.id).count()
-                        if prev_chapter_count == 0:
-                            skipped_volume_count += 1
-                            progress.update(base_progress, f"跳过第 {vol_index + 1} 卷《{vol_title}》（上一卷尚无章节列表，先生成上一卷章节以保证连贯）")
-                            continue
+                    previous_volumes_info = previous_volume_tail(volumes_obj[idx - 1]) if idx > 0 else []
+                    if idx > 0 and not previous_volumes_info:
+                        skipped_volume_count += 1
+                        progress.update(base_progress, f"跳过第 {vol_index + 1} 卷《{vol_title}》（上一卷尚无章节列表，先生成上一卷章节以保证连贯）")
+                        continue
 
                     # 仅生成“已有卷大纲”的卷；没有卷大纲则跳过，避免无边界生成导致串卷/重复
                     if not (volume_obj.outline or "").strip():
@@ -3702,101 +4224,20 @@ async def generate_all_chapters_task(
                         progress.update(base_progress, f"跳过第 {vol_index + 1} 卷《{vol_title}》（缺少卷大纲，先生成卷大纲后再生成章节）")
                         continue
 
-                    # 构建“上一卷参考信息”：只取上一卷最后若干章（标题+摘要），确保连贯且不重复
-                    previous_volumes_info = []
-                    if vol_index > 0:
-                        prev_vol = task_db.query(Volume).filter(
-                            Volume.novel_id == novel_id,
-                            Volume.volume_order == vol_index - 1
-                        ).first()
-                        if prev_vol:
-                            prev_chapters = task_db.query(Chapter).filter(
-                                Chapter.volume_id == prev_vol.id
-                            ).order_by(Chapter.chapter_order).all()
-                            tail_chapters = prev_chapters[-12:] if len(prev_chapters) > 12 else prev_chapters
-                            previous_volumes_info.append({
-                                "title": prev_vol.title,
-                                "summary": prev_vol.summary or "",
-                                "chapters": [{
-                                    "title": ch.title,
-                                    "summary": ch.summary or ""
-                                } for ch in tail_chapters]
-                            })
-
-                    # 构建“后续卷规划（避雷）”：避免把后续卷大事件提前写到本卷
-                    future_volumes_info = []
-                    next_vols = task_db.query(Volume).filter(
-                        Volume.novel_id == novel_id,
-                        Volume.volume_order > vol_index
-                    ).order_by(Volume.volume_order).limit(3).all()
-                    for next_vol in next_vols:
-                        future_volumes_info.append({
-                            "title": next_vol.title,
-                            "summary": next_vol.summary or "",
-                            "outline": (next_vol.outline or "")[:1200]
-                        })
-
                     progress.update(base_progress, f"生成第 {vol_index + 1} 卷《{vol_title}》章节列表... ({idx + 1}/{total})")
 
-                    # 如果没有指定 chapter_count，尝试从卷大纲中提取【章节规划】
-                    final_chapter_count = chapter_count
-                    if not final_chapter_count and volume_obj.outline:
-                        import re
-                        # 支持多种格式，包括 Markdown 加粗：**【章节规划】：** 75章、【章节规划】：10章、章节规划：10章等
-                        chapter_match = re.search(r'\*?\*?[【]?章节规划[】]?[：:\s]*\*?\*?\s*(\d+)\s*章', volume_obj.outline)
-                        if chapter_match:
-                            extracted_count = int(chapter_match.group(1))
-                            final_chapter_count = extracted_count
-                            logger.info(f"第 {vol_index + 1} 卷：从卷大纲中提取到章节规划：{final_chapter_count} 章（原文：{chapter_match.group(0)}）")
-
-                    chapters_data = run_async(generate_chapter_outline_impl(
-                        novel_title=novel_obj.title,
-                        genre=novel_obj.genre,
-                        full_outline=novel_obj.full_outline or "",
-                        volume_title=vol_title,
-                        volume_summary=volume_obj.summary or "",
-                        volume_outline=volume_obj.outline or "",
-                        characters=characters_data,
-                        volume_index=vol_index,
-                        chapter_count=final_chapter_count,
-                        previous_volumes_info=previous_volumes_info if previous_volumes_info else None,
-                        future_volumes_info=future_volumes_info if future_volumes_info else None
-                    ))
-
-                    progress.update(base_progress + 5, f"已生成 {len(chapters_data)} 章，正在保存到数据库...")
-
-                    # 删除旧章节并写入新章节（一次性提交，避免中途失败导致章节被清空）
-                    if existing_chapter_count > 0:
-                        task_db.query(Chapter).filter(Chapter.volume_id == volume_obj.id).delete()
-
-                    current_time = int(time.time() * 1000)
-                    for ch_idx, chapter_data in enumerate(chapters_data):
-                        # 标题规范化：避免模型把“第X章”写进 title，导致跨卷章号显示错乱
-                        raw_title = (chapter_data.get("title") or "").strip()
-                        normalized_title = raw_title
-                        if raw_title:
-                            import re
-                            normalized_title = re.sub(r'^\s*第\s*[0-9一二三四五六七八九十百千]+\s*章\s*[:：\-—\.\s]*', '', raw_title).strip()
-                            normalized_title = re.sub(r'^\s*\d+\s*[\.\-：:\s]+', '', normalized_title).strip()
-                        if not normalized_title:
-                            normalized_title = f"第{ch_idx+1}章"
-
-                        chapter = Chapter(
-                            id=generate_uuid(),
-                            volume_id=volume_obj.id,
-                            title=normalized_title,
-                            summary=chapter_data.get("summary", ""),
-                            content="",
-                            ai_prompt_hints=chapter_data.get("aiPromptHints", ""),
-                            chapter_order=ch_idx,
-                            created_at=current_time,
-                            updated_at=current_time
-                        )
-                        task_db.add(chapter)
-                    task_db.commit()
+                    volume_chapter_count = _generate_volume_chapters(
+                        task_db,
+                        volume_obj,
+                        chapter_outline_kwargs(volume_obj, previous_volumes_info),
+                        progress,
+                        start=base_progress,
+                        end=5 + int(((idx + 1) / max(total, 1)) * 90),
+                        label=f"第 {vol_index + 1} 卷《{vol_title}》"
+                    )
 
                     generated_volume_count += 1
-                    generated_chapter_count += len(chapters_data)
+                    generated_chapter_count += volume_chapter_count
                 except Exception as e:
                     task_db.rollback()
                     failed_volume_count += 1
@@ -3835,7 +4276,9 @@ async def generate_all_chapters_task(
                     "skipped_chapter_count": skipped_chapter_count,
                     "volume_count": total,
                     "force": force,
-                    "chapter_count": chapter_count
+                    "chapter_count": chapter_count,
+                    "parallel": parallel_mode,
+                    "stitched_chapter_count": stitched_chapter_count
                 })
                 task_obj.completed_at = int(time.time() * 1000)
                 task_db.commit()
@@ -3855,7 +4298,7 @@ async def generate_all_chapters_task(
             task_db.close()
 
     executor = get_task_executor()
-    executor.submit(execute_all_chapters_generation)
+    executor.submit(execute_all_chapters_generation, task_id=task.id)
 
     return {
         "task_id": task.id,
@@ -4011,66 +4454,42 @@ async def generate_chapters_task(
                     logger.info(f"从卷大纲中提取到章节规划：{final_chapter_count} 章（原文：{chapter_match.group(0)}）")
                     progress.update(16, f"从卷大纲中检测到章节规划：{final_chapter_count} 章")
 
-            # 生成章节列表
-            chapters_data = run_async(generate_chapter_outline_impl(
-                novel_title=novel_obj.title,
-                genre=novel_obj.genre,
-                full_outline=novel_obj.full_outline or "",
-                volume_title=volume_obj.title,
-                volume_summary=volume_obj.summary or "",
-                volume_outline=volume_obj.outline or "",
-                characters=characters_data,
-                volume_index=volume_index,
-                chapter_count=final_chapter_count,
-                previous_volumes_info=previous_volumes_info if previous_volumes_info else None,
-                future_volumes_info=future_volumes_info if future_volumes_info else None
-            ))
-            
-            progress.update(80, f"已生成 {len(chapters_data)} 个章节，正在保存到数据库...")
-            
-            # 删除该卷的旧章节
-            task_db.query(Chapter).filter(Chapter.volume_id == volume_obj.id).delete()
-            
-            # 保存新章节到数据库
-            current_time = int(time.time() * 1000)
-            for idx, chapter_data in enumerate(chapters_data):
-                raw_title = (chapter_data.get("title") or "").strip()
-                normalized_title = raw_title
-                if raw_title:
-                    import re
-                    normalized_title = re.sub(r'^\s*第\s*[0-9一二三四五六七八九十百千]+\s*章\s*[:：\-—\.\s]*', '', raw_title).strip()
-                    normalized_title = re.sub(r'^\s*\d+\s*[\.\-：:\s]+', '', normalized_title).strip()
-                if not normalized_title:
-                    normalized_title = f"第{idx+1}章"
-
-                chapter = Chapter(
-                    id=generate_uuid(),
-                    volume_id=volume_obj.id,
-                    title=normalized_title,
-                    summary=chapter_data.get("summary", ""),
-                    content="",
-                    ai_prompt_hints=chapter_data.get("aiPromptHints", ""),
-                    chapter_order=idx,
-                    created_at=current_time,
-                    updated_at=current_time
-                )
-                task_db.add(chapter)
-            task_db.commit()
-            
-            progress.update(100, f"章节列表生成完成，共 {len(chapters_data)} 个章节")
+            # 生成章节列表（逐章写入）
+            generated_count = _generate_volume_chapters(
+                task_db,
+                volume_obj,
+                {
+                    "novel_title": novel_obj.title,
+                    "genre": novel_obj.genre,
+                    "full_outline": novel_obj.full_outline or "",
+                    "volume_title": volume_obj.title,
+                    "volume_summary": volume_obj.summary or "",
+                    "volume_outline": volume_obj.outline or "",
+                    "characters": characters_data,
+                    "volume_index": volume_index,
+                    "chapter_count": final_chapter_count,
+                    "previous_volumes_info": previous_volumes_info if previous_volumes_info else None,
+                    "future_volumes_info": future_volumes_info if future_volumes_info else None
+                },
+                progress,
+                start=17,
+                end=95
+            )
+
+            progress.update(100, f"章节列表生成完成，共 {generated_count} 个章节")
             
             # 更新任务状态
             task_obj = task_db.query(Task).filter(Task.id == task.id).first()
             if task_obj:
                 task_obj.status = "completed"
                 task_obj.progress = 100
-                task_obj.progress_message = f"章节列表生成完成，共 {len(chapters_data)} 个章节"
+                task_obj.progress_message = f"章节列表生成完成，共 {generated_count} 个章节"
                 task_obj.result = json.dumps({
                     "success": True,
                     "message": "章节列表已生成并保存",
                     "volume_index": volume_index,
                     "volume_title": volume_obj.title,
-                    "chapter_count": len(chapters_data)
+                    "chapter_count": generated_count
                 })
                 task_obj.completed_at = int(time.time() * 1000)
                 task_db.commit()
@@ -4089,7 +4508,7 @@ async def generate_chapters_task(
             raise
     
     executor = get_task_executor()
-    executor.submit(execute_chapters_generation)
+    executor.submit(execute_chapters_generation, task_id=task.id)
     
     return {
         "task_id": task.id,
@@ -4341,7 +4760,7 @@ async def modify_outline_by_dialogue_endpoint(
                 task_db.close()
     
     executor = get_task_executor()
-    executor.submit(execute_task)
+    executor.submit(execute_task, task_id=task.id)
     
     return {
         "task_id": task.id,
@@ -4487,6 +4906,60 @@ async def get_task_by_id(
     }
     return task_dict
 
+@app.post("/api/tasks/{task_id}/cancel")
+async def cancel_task(
+    task_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """取消后台任务（进行中的 AI 请求立即中断，已生成并入库的部分保留）"""
+    task = db.query(Task).filter(
+        Task.id == task_id,
+        Task.user_id == current_user.id
+    ).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.status not in ("pending", "running", "processing"):
+        raise HTTPException(status_code=400, detail=f"任务已结束（{task.status}），无法取消")
+
+    running_here = request_task_cancel(task_id)
+    if task.status == "pending" or not running_here:
+        # 尚未开始执行，或不在本进程中（其他 worker 收到广播后自行停止；重启后遗留的任务无人执行）：直接标记为已取消
+        mark_task_cancelled(task_id)
+    logger.info(f"✅ 已请求取消任务: task_id={task_id}, status={task.status}")
+    return {"status": "ok", "task_id": task_id}
+
+@app.post("/api/tasks/{task_id}/resume")
+async def resume_task(
+    task_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """从断点继续失败或已取消的完整大纲任务（已完成的阶段不再重新生成）"""
+    task = db.query(Task).filter(
+        Task.id == task_id,
+        Task.user_id == current_user.id
+    ).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.task_type != "generate_complete_outline":
+        raise HTTPException(status_code=400, detail="该任务类型不支持断点续跑")
+    if task.status not in ("failed", "cancelled"):
+        raise HTTPException(status_code=400, detail=f"任务状态为 {task.status}，无法继续")
+
+    task.status = "pending"
+    task.error_message = None
+    task.completed_at = None
+    task.progress_message = "等待从断点继续"
+    task.updated_at = int(time.time() * 1000)
+    db.commit()
+    novel_id = task.novel_id
+    # 取消不在本进程中运行的任务时，共享存储中的取消标记会保留到 TTL 过期，续跑前先清除，否则任务一开始就被再次取消
+    clear_run(task_id)
+    get_task_executor().submit(lambda: _execute_complete_outline_task(task_id, novel_id), task_id=task_id)
+    logger.info(f"✅ 已从断点继续任务: task_id={task_id}")
+    return {"status": "pending", "task_id": task_id}
+
 @app.get("/api/tasks/novel/{novel_id}", response_model=List[TaskResponse])
 async def get_novel_tasks(
     novel_id: str,
@@ -5296,6 +5769,10 @@ class AgentFlowRequest(BaseModel):
     summarize_chapters: bool = True
     overwrite_summaries: bool = False
     provider: Optional[str] = None
+    # 推测执行：Archivist 与 Critic 并行（未指定时取 AGENT_FLOW_SPECULATIVE）
+    speculative: Optional[bool] = None
+    # Critic 不通过时的修订方式：paragraph（只重写被标记的段落）或 rewrite（整篇重写），未指定时取 AGENT_FLOW_REVISION_MODE
+    revision_mode: Optional[str] = None
 
 
 class AgentFlowResumeRequest(BaseModel):
@@ -5852,6 +6329,13 @@ def _save_flow_output_to_chapter(
     chapter.ai_prompt_hints = _build_ai_prompt_hints(user_message, director)
     chapter.updated_at = int(time.time() * 1000)
     db.commit()
+    record_chapter_content(novel_id, chapter.id, chapter.title, writer_output)
+    try:
+        record_chapter_summary(db, novel_id, chapter.id, chapter.title, writer_output, summary)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ 记录章节摘要哈希失败（继续）: {str(e)}")
     return chapter.id
 
 def _get_agent_run_by_id(db: Session, run_id: str, user_id: str) -> Optional[Dict[str, Any]]:
@@ -5972,6 +6456,7 @@ def _build_agent_context(db: Session, novel_id: str) -> Dict[str, Any]:
     )
     chapters = [
         {
+            "id": chapter.id,
             "title": chapter.title,
             "summary": chapter.summary or "",
             "content": chapter.content or "",
@@ -5991,6 +6476,12 @@ def _build_agent_context(db: Session, novel_id: str) -> Dict[str, Any]:
         .all()
     )
     foreshadowings = db.query(Foreshadowing).filter(Foreshadowing.novel_id == novel_id).all()
+    try:
+        recap = story_so_far(db, novel_id)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ 读取前情提要失败（继续）: {str(e)}")
+        recap = ""
     relations = []
     if NEO4J_ENABLED:
         relations = run_cypher(
@@ -6007,6 +6498,7 @@ def _build_agent_context(db: Session, novel_id: str) -> Dict[str, Any]:
         )
     return {
         "novel": {
+            "id": novel.id,
             "title": novel.title,
             "genre": novel.genre,
             "synopsis": novel.synopsis or "",
@@ -6024,6 +6516,7 @@ def _build_agent_context(db: Session, novel_id: str) -> Dict[str, Any]:
         "chapters": chapters,
         "characters": [
             {
+                "id": c.id,
                 "name": c.name,
                 "age": c.age or "",
                 "role": c.role or "",
@@ -6034,22 +6527,51 @@ def _build_agent_context(db: Session, novel_id: str) -> Dict[str, Any]:
             for c in characters
         ],
         "world_settings": [
-            {"title": w.title, "category": w.category, "description": w.description}
+            {"id": w.id, "title": w.title, "category": w.category, "description": w.description}
             for w in world_settings
         ],
         "timeline": [
             {"time": t.time, "event": t.event, "impact": t.impact or ""} for t in timeline
         ],
         "foreshadowings": [
-            {"content": f.content, "is_resolved": f.is_resolved} for f in foreshadowings
+            {"id": f.id, "content": f.content, "is_resolved": f.is_resolved} for f in foreshadowings
         ],
         "relations": relations or [],
+        "story_so_far": recap,
     }
 
 
-def _format_agent_context(context: Dict[str, Any]) -> str:
+def _agent_model_name(provider: Optional[str], agent: str = "writer") -> str:
+    try:
+        return resolve_agent_model(agent, provider).model
+    except ValueError:
+        return resolve_agent_model(agent, "gemini").model
+
+
+def _split_outline_blocks(value: str, block_chars: int = 600) -> List[str]:
+    blocks: List[str] = []
+    current = ""
+    for paragraph in (value or "").split("\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > block_chars:
+            blocks.append(current)
+            current = ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def _assemble_agent_context(
+    context: Dict[str, Any],
+    query: str = "",
+    provider: Optional[str] = None,
+    db: Optional[Session] = None,
+) -> Optional[AssembledContext]:
     if not context:
-        return ""
+        return None
     def _truncate(value: str, limit: int) -> str:
         text = (value or "").strip()
         if not text:
@@ -6058,66 +6580,105 @@ def _format_agent_context(context: Dict[str, Any]) -> str:
             return text
         return text[:limit] + "..."
 
-    parts = []
     novel = context.get("novel") or {}
-    parts.append(f"标题: {novel.get('title', '')}")
-    parts.append(f"类型: {novel.get('genre', '')}")
-    synopsis = novel.get("synopsis", "")
-    if synopsis:
-        parts.append(f"简介: {synopsis}")
-    full_outline = _truncate(novel.get("full_outline", ""), 4000)
-    if full_outline:
-        parts.append("全书大纲:")
-        parts.append(full_outline)
-    if context.get("volumes"):
-        parts.append("卷大纲:")
-        for v in context["volumes"][:20]:
-            title = v.get("title") or "未命名卷"
-            summary = _truncate(v.get("summary", ""), 400)
-            outline = _truncate(v.get("outline", ""), 800)
-            line = f"- {title}"
-            if summary:
-                line += f" | 简述: {summary}"
-            parts.append(line)
-            if outline:
-                parts.append(f"  详细: {outline}")
-    if context.get("characters"):
-        parts.append("角色:")
-        for c in context["characters"]:
-            parts.append(f"- {c.get('name')} | {c.get('role')} | {c.get('age')}")
-    if context.get("relations"):
-        parts.append("角色关系:")
-        for r in context["relations"]:
-            parts.append(f"- {r.get('source')} -> {r.get('target')} ({r.get('relation_type')})")
-    if context.get("world_settings"):
-        parts.append("世界观/规则:")
-        for w in context["world_settings"][:20]:
-            parts.append(f"- {w.get('title')}: {w.get('description')}")
-    if context.get("timeline"):
-        parts.append("时间线:")
-        for t in context["timeline"][:20]:
-            parts.append(f"- {t.get('time')}: {t.get('event')}")
-    if context.get("foreshadowings"):
-        parts.append("伏笔:")
-        for f in context["foreshadowings"][:30]:
-            status = "已回收" if str(f.get("is_resolved")).lower() == "true" else "未回收"
-            parts.append(f"- {f.get('content')} ({status})")
-    if context.get("chapters"):
-        parts.append("前文章节（最近5章）:")
-        recent = context["chapters"][-5:]
-        for ch in recent:
-            title = ch.get("title") or "未命名章节"
-            summary = _truncate(ch.get("summary", ""), 500)
-            content = _truncate(ch.get("content", ""), 1200)
-            hints = _truncate(ch.get("ai_prompt_hints", ""), 300)
-            parts.append(f"- {title}（{ch.get('volume_title', '')}）")
-            if summary:
-                parts.append(f"  摘要: {summary}")
-            if hints:
-                parts.append(f"  提示: {hints}")
-            if content:
-                parts.append(f"  正文摘录: {content}")
-    return "\n".join(parts)
+    similarity_fn = make_embedding_similarity_fn(db, novel["id"]) if db is not None and novel.get("id") else None
+    assembler = ContextAssembler(
+        budget_tokens=get_context_budget(_agent_model_name(provider)),
+        similarity_fn=similarity_fn,
+        section_order=[
+            "novel", "story_so_far", "outline", "volumes", "characters", "relations",
+            "world_settings", "timeline", "foreshadowings", "chapters",
+        ],
+        section_titles={
+            "story_so_far": "前情提要:",
+            "outline": "全书大纲:",
+            "volumes": "卷大纲:",
+            "characters": "角色:",
+            "relations": "角色关系:",
+            "world_settings": "世界观/规则:",
+            "timeline": "时间线:",
+            "foreshadowings": "伏笔:",
+            "chapters": "前文章节:",
+        },
+    )
+
+    header = [f"标题: {novel.get('title', '')}", f"类型: {novel.get('genre', '')}"]
+    if novel.get("synopsis"):
+        header.append(f"简介: {novel.get('synopsis')}")
+    assembler.add("novel", "\n".join(header), pinned=True)
+    if context.get("story_so_far"):
+        # 分层摘要缓存的前情提要，长度固定，不随章节数增长
+        assembler.add("story_so_far", context["story_so_far"], pinned=True)
+    assembler.add_many("outline", _split_outline_blocks(novel.get("full_outline", "")), newest_last=False)
+
+    volume_lines = []
+    for v in context.get("volumes") or []:
+        line = f"- {v.get('title') or '未命名卷'}"
+        summary = _truncate(v.get("summary", ""), 400)
+        outline = _truncate(v.get("outline", ""), 800)
+        if summary:
+            line += f" | 简述: {summary}"
+        if outline:
+            line += f"\n  详细: {outline}"
+        volume_lines.append(line)
+    assembler.add_many("volumes", volume_lines)
+
+    characters = context.get("characters") or []
+    for c in characters:
+        name = c.get("name") or ""
+        assembler.add(
+            "characters",
+            f"- {name} | {c.get('role')} | {c.get('age')}",
+            recency=1.0,
+            pinned=bool(name) and name in query,
+            key=c.get("id"),
+        )
+    assembler.add_many(
+        "relations",
+        [f"- {r.get('source')} -> {r.get('target')} ({r.get('relation_type')})" for r in context.get("relations") or []],
+    )
+    for w in context.get("world_settings") or []:
+        assembler.add("world_settings", f"- {w.get('title')}: {w.get('description')}", recency=0.5, key=w.get("id"))
+    assembler.add_many("timeline", [f"- {t.get('time')}: {t.get('event')}" for t in context.get("timeline") or []])
+    for f in context.get("foreshadowings") or []:
+        resolved = str(f.get("is_resolved")).lower() == "true"
+        assembler.add(
+            "foreshadowings",
+            f"- {f.get('content')} ({'已回收' if resolved else '未回收'})",
+            recency=0.2 if resolved else 0.8,
+            key=f.get("id"),
+        )
+
+    chapters = context.get("chapters") or []
+    for idx, ch in enumerate(chapters):
+        lines = [f"- {ch.get('title') or '未命名章节'}（{ch.get('volume_title', '')}）"]
+        summary = _truncate(ch.get("summary", ""), 500)
+        hints = _truncate(ch.get("ai_prompt_hints", ""), 300)
+        # 正文摘录只取最近 5 章，更早的章节以摘要参与竞争
+        content = _truncate(ch.get("content", ""), 1200) if idx >= len(chapters) - 5 else ""
+        if summary:
+            lines.append(f"  摘要: {summary}")
+        if hints:
+            lines.append(f"  提示: {hints}")
+        if content:
+            lines.append(f"  正文摘录: {content}")
+        recency = 1.0 if len(chapters) == 1 else idx / (len(chapters) - 1)
+        assembler.add("chapters", "\n".join(lines), recency=recency, key=ch.get("id"))
+
+    return assembler.pack(query)
+
+
+def _format_agent_context(
+    context: Dict[str, Any],
+    query: str = "",
+    provider: Optional[str] = None,
+    db: Optional[Session] = None,
+) -> str:
+    assembled = _assemble_agent_context(context, query=query, provider=provider, db=db)
+    if not assembled:
+        return ""
+    logger.info(f"Agent 上下文预算: {assembled.report()}")
+    return assembled.text
 
 
 def _get_agent_system_hint(agent: str) -> str:
@@ -6157,6 +6718,8 @@ def _get_agent_system_hint(agent: str) -> str:
             "检查维度：逻辑漏洞、人物一致性、世界观冲突、时间线矛盾、叙事节奏、语言质量。\n"
             "只返回 JSON："
             "{\"score\":0-100,\"issues\":[\"问题:...; 建议:...\"],\"verdict\":\"pass\"|\"fail\"}。"
+            "若正文段落带有 [P编号] 标记，issues 每项改为 "
+            "{\"paragraphs\":[段落编号],\"issue\":\"问题:...; 建议:...\"}，只标出确实需要修改的段落。"
         )
     if agent == "archivist":
         return (
@@ -6185,152 +6748,163 @@ def _build_agent_prompt(agent: str, message: str, context_text: str) -> str:
     )
 
 
-def _resolve_agent_provider(provider: Optional[str]) -> str:
-    from core.config import DEFAULT_AI_PROVIDER
+def _resolve_agent_model(agent: str, provider: Optional[str] = None) -> AgentModel:
+    """Agent 的提供商与模型（AGENT_MODELS），并确认对应的 API Key 已配置"""
+    from core.config import DEEPSEEK_API_KEY, GEMINI_API_KEY
+
+    try:
+        route = resolve_agent_model(agent, provider)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if route.provider == "gemini" and not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
+    if route.provider == "deepseek" and not DEEPSEEK_API_KEY:
+        raise HTTPException(status_code=500, detail="DEEPSEEK_API_KEY not configured")
+    return route
+
+
+def _run_agent_llm(
+    agent: str,
+    message: str,
+    context_text: str,
+    provider: Optional[str] = None,
+    max_tokens: int = 4096,
+) -> Dict[str, Any]:
+    route = _resolve_agent_model(agent, provider)
+    prompt = _build_agent_prompt(agent, message, context_text)
+    return {"text": get_llm_gateway().generate(route, prompt, temperature=0.6, max_tokens=max_tokens)}
 
-    name = (provider or DEFAULT_AI_PROVIDER or "gemini").lower().strip()
-    if name not in {"gemini", "deepseek"}:
-        raise HTTPException(status_code=400, detail=f"Unsupported provider: {name}")
-    return name
 
+_agent_executor: Optional[ThreadPoolExecutor] = None
+_agent_executor_lock = threading.Lock()
 
-def _deepseek_endpoint(base_url: str) -> str:
-    base = base_url.rstrip("/")
-    if base.endswith("/v1"):
-        return f"{base}/chat/completions"
-    return f"{base}/v1/chat/completions"
 
+def _get_agent_executor() -> ThreadPoolExecutor:
+    """流程内并行 Agent 调用（推测执行、段落补丁）共用的线程池"""
+    global _agent_executor
+    if _agent_executor is None:
+        with _agent_executor_lock:
+            if _agent_executor is None:
+                from core.config import AGENT_SPECULATION_WORKERS
+                _agent_executor = ThreadPoolExecutor(
+                    max_workers=AGENT_SPECULATION_WORKERS, thread_name_prefix="agent-parallel"
+                )
+    return _agent_executor
 
-def _extract_openai_text(data: Dict[str, Any]) -> str:
-    choices = data.get("choices") or []
-    parts: List[str] = []
-    for choice in choices:
-        message = choice.get("message") or {}
-        content = message.get("content") or choice.get("text") or ""
-        parts.append(content)
-    return "".join(parts)
 
+def _submit_speculative_agent(
+    agent: str, message: str, context_text: str, provider: Optional[str] = None
+) -> Future:
+    """在后台线程提前运行 Agent（非流式），Future 结果为 (文本, 耗时毫秒)
 
-def _run_agent_llm(agent: str, message: str, context_text: str, provider: Optional[str] = None) -> Dict[str, Any]:
-    provider_name = _resolve_agent_provider(provider)
-    prompt = _build_agent_prompt(agent, message, context_text)
+    调用方决定是否采用结果；丢弃时已发出的上游请求仍会完成，只是结果不再使用。
+    """
+    def run():
+        started = time.monotonic()
+        text_output = _run_agent_llm(agent, message, context_text, provider=provider).get("text", "")
+        return text_output, int((time.monotonic() - started) * 1000)
 
-    if provider_name == "gemini":
-        import os
-        from google import genai
-        from core.config import GEMINI_API_KEY, GEMINI_PROXY
-
-        if not GEMINI_API_KEY:
-            raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
-
-        # Configure proxy for Gemini
-        if GEMINI_PROXY:
-            proxy_url = GEMINI_PROXY.strip()
-            os.environ['HTTP_PROXY'] = proxy_url
-            os.environ['HTTPS_PROXY'] = proxy_url
-            os.environ['ALL_PROXY'] = proxy_url
-
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-            config={"temperature": 0.6, "max_output_tokens": 4096},
-        )
-        text_output = response.text if response.text else ""
-        return {"text": text_output}
+    return _get_agent_executor().submit(run)
 
-    from core.config import DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL, DEEPSEEK_TIMEOUT_MS
 
-    if not DEEPSEEK_API_KEY:
-        raise HTTPException(status_code=500, detail="DEEPSEEK_API_KEY not configured")
+def _use_paragraph_revision(revision_mode: Optional[str]) -> bool:
+    from core.config import AGENT_FLOW_REVISION_MODE
+    return (revision_mode or AGENT_FLOW_REVISION_MODE).lower().strip() == "paragraph"
 
-    payload = {
-        "model": DEEPSEEK_MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.6,
-        "max_tokens": 4096,
-    }
 
-    headers = {"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"}
-    with httpx.Client(timeout=DEEPSEEK_TIMEOUT_MS / 1000, trust_env=False) as client:
-        response = client.post(_deepseek_endpoint(DEEPSEEK_BASE_URL), json=payload, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+def _plan_paragraph_revision(draft: str, critic_json: Any) -> Optional[List[RevisionSpan]]:
+    """Critic 给出段落定位时返回待修订区间，否则返回 None（整篇重写）"""
+    if not isinstance(critic_json, dict):
+        return None
+    return plan_revision(critic_json.get("issues") or [], len(split_paragraphs(draft)))
+
 
-    return {"text": _extract_openai_text(data)}
+def _run_paragraph_revision(
+    draft: str, spans: List[RevisionSpan], context_text: str, provider: Optional[str] = None
+) -> str:
+    """并行重写被标记的区间并拼回原稿，每个补丁的输出预算按原段落长度设定"""
+    paragraphs = split_paragraphs(draft)
+    futures = [
+        _get_agent_executor().submit(
+            _run_agent_llm,
+            "writer",
+            build_patch_prompt(paragraphs, span),
+            context_text,
+            provider,
+            patch_token_budget(paragraphs, span),
+        )
+        for span in spans
+    ]
+    patches = [future.result().get("text", "") for future in futures]
+    return splice_patches(paragraphs, spans, patches, paragraph_separator(draft))
 
 
 def _run_agent_llm_stream(
-    agent: str, message: str, context_text: str, provider: Optional[str] = None
+    agent: str,
+    message: str,
+    context_text: str,
+    provider: Optional[str] = None,
+    cancel_token: Optional[CancellationToken] = None,
 ) -> Iterable[str]:
-    provider_name = _resolve_agent_provider(provider)
-    prompt = _build_agent_prompt(agent, message, context_text)
+    """流式运行 Agent
 
-    if provider_name == "gemini":
-        import os
-        from google import genai
-        from core.config import GEMINI_API_KEY, GEMINI_PROXY
-
-        if not GEMINI_API_KEY:
-            raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
-
-        # Configure proxy for Gemini
-        if GEMINI_PROXY:
-            proxy_url = GEMINI_PROXY.strip()
-            os.environ['HTTP_PROXY'] = proxy_url
-            os.environ['HTTPS_PROXY'] = proxy_url
-            os.environ['ALL_PROXY'] = proxy_url
-
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        stream = client.models.generate_content_stream(
-            model="gemini-2.0-flash",
-            contents=prompt,
-            config={"temperature": 0.6, "max_output_tokens": 4096},
-        )
-        for chunk in stream:
-            if chunk.text:
-                yield chunk.text
-        return
+    传入取消令牌时，上游读取在后台线程中进行：令牌触发后立即停止输出，读取线程在下一个分片到达时关闭上游连接，
+    不再继续消耗令牌。取消后先产出一个空分片再结束，使调用方循环内的取消检查立即生效并保存已生成的部分。
+    上游分片按 SSE_COALESCE_WINDOW_MS 时间窗口合并后再产出，流结束（阶段边界）时立即冲刷。
+    """
+    from core.config import SSE_COALESCE_MAX_CHARS, SSE_COALESCE_WINDOW_MS
+    from core.stream_coalescer import coalesce_chunks
 
-    from core.config import DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL, DEEPSEEK_TIMEOUT_MS
+    chunks = iterate_cancellable(_agent_llm_stream_chunks(agent, message, context_text, provider), cancel_token)
+    try:
+        for text in coalesce_chunks(chunks, SSE_COALESCE_WINDOW_MS / 1000, SSE_COALESCE_MAX_CHARS, name=agent):
+            yield text
+    except OperationCancelled:
+        logger.info(f"✅ Agent 流已取消，停止读取上游: agent={agent}")
+        yield ""
 
-    if not DEEPSEEK_API_KEY:
-        raise HTTPException(status_code=500, detail="DEEPSEEK_API_KEY not configured")
 
-    payload = {
-        "model": DEEPSEEK_MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.6,
-        "max_tokens": 4096,
-        "stream": True,
-    }
-    headers = {"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"}
-    with httpx.Client(timeout=DEEPSEEK_TIMEOUT_MS / 1000, trust_env=False) as client:
-        with client.stream("POST", _deepseek_endpoint(DEEPSEEK_BASE_URL), json=payload, headers=headers) as response:
-            response.raise_for_status()
-            for line in response.iter_lines():
-                if not line:
-                    continue
-                if line.startswith("data:"):
-                    data = line[len("data:"):].strip()
-                    if data == "[DONE]":
-                        break
-                    try:
-                        chunk_data = json.loads(data)
-                    except json.JSONDecodeError:
-                        continue
-                    choices = chunk_data.get("choices") or []
-                    for choice in choices:
-                        delta = choice.get("delta") or {}
-                        text = delta.get("content")
-                        if text:
-                            yield text
+def _agent_llm_stream_chunks(
+    agent: str, message: str, context_text: str, provider: Optional[str] = None
+) -> Iterable[str]:
+    route = _resolve_agent_model(agent, provider)
+    prompt = _build_agent_prompt(agent, message, context_text)
+    return get_llm_gateway().stream(route, prompt, temperature=0.6, max_tokens=4096)
 
 
 def _sse_event(event: str, payload: Dict[str, Any]) -> str:
     return f"event: {event}\n" f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
 
+def _event_log_response(log: RunEventLog, after_seq: int) -> StreamingResponse:
+    return StreamingResponse(
+        log.iter_events(after_seq),
+        media_type="text/event-stream; charset=utf-8",
+        headers={"X-Run-Id": log.run_id, "Cache-Control": "no-cache"},
+    )
+
+
+def _logged_stream_response(run_id: str, user_id: str, generator_fn) -> StreamingResponse:
+    """在后台运行流程生成器（使用独立的数据库会话），响应订阅其事件日志
+
+    客户端断开后生成继续进行，重连时按 Last-Event-ID 补发，不会为已生成的内容重复付费。
+    """
+    def produce():
+        run_db = SessionLocal()
+        try:
+            yield from generator_fn(run_db)
+        finally:
+            run_db.close()
+
+    try:
+        log = start_logged_stream(run_id, user_id, produce)
+    except RunAlreadyActive:
+        raise HTTPException(status_code=409, detail="流程仍在生成中，请稍后携带 Last-Event-ID 重连")
+    except ProducerLimitReached:
+        raise HTTPException(status_code=503, detail="当前生成任务过多，请稍后重试")
+    return _event_log_response(log, log.first_seq)
+
+
 @app.post("/api/agents/cancel")
 async def cancel_agent_run(
     request: AgentCancelRequest,
@@ -6343,8 +6917,7 @@ async def cancel_agent_run(
         if run.get("user_id") != current_user.id:
             raise HTTPException(status_code=403, detail="无权限取消该流程")
     else:
-        with _cancel_lock:
-            owner = _run_owners.get(request.run_id)
+        owner = get_run_owner(request.run_id)
         if owner and owner != current_user.id:
             raise HTTPException(status_code=403, detail="无权限取消该流程")
     _request_cancel(request.run_id)
@@ -6360,7 +6933,7 @@ async def run_agent(
     """运行单个 Agent"""
     require_novel_owner(db, request.novel_id, current_user.id)
     context = _build_agent_context(db, request.novel_id) if request.use_context else {}
-    context_text = _format_agent_context(context)
+    context_text = _format_agent_context(context, query=request.message, provider=request.provider, db=db)
     result = _run_agent_llm(request.agent, request.message, context_text, provider=request.provider)
     output_text = result.get("text", "")
     score = None
@@ -6417,7 +6990,7 @@ async def run_agent_stream(
     """运行单个 Agent（流式输出）"""
     require_novel_owner(db, request.novel_id, current_user.id)
     context = _build_agent_context(db, request.novel_id) if request.use_context else {}
-    context_text = _format_agent_context(context)
+    context_text = _format_agent_context(context, query=request.message, provider=request.provider, db=db)
 
     def event_generator():
         run_id = generate_uuid()
@@ -6426,7 +6999,8 @@ async def run_agent_stream(
         output_parts: List[str] = []
         try:
             for chunk in _run_agent_llm_stream(
-                request.agent, request.message, context_text, provider=request.provider
+                request.agent, request.message, context_text, provider=request.provider,
+                cancel_token=get_cancel_token(run_id),
             ):
                 if _is_cancelled(run_id):
                     output_text = "".join(output_parts)
@@ -6556,7 +7130,7 @@ async def run_agent_flow(
     """运行多 Agent 工作流"""
     require_novel_owner(db, request.novel_id, current_user.id)
     context = _build_agent_context(db, request.novel_id)
-    context_text = _format_agent_context(context)
+    context_text = _format_agent_context(context, query=request.message or "", provider=request.provider, db=db)
     user_message = request.message or "Write the next scene."
     provider_name = request.provider
     director = _run_agent_llm("director", user_message, context_text, provider=provider_name).get("text", "")
@@ -6568,19 +7142,29 @@ async def run_agent_flow(
     retries = 0
     max_retries = max(0, request.max_retries)
     threshold = max(0, min(100, request.critic_threshold))
+    paragraph_revision = _use_paragraph_revision(request.revision_mode)
+    revision_spans: Optional[List[RevisionSpan]] = None
     while retries <= max_retries:
-        writer_output = _run_agent_llm("writer", writer_prompt, context_text, provider=provider_name).get("text", "")
-        critic_output = _run_agent_llm("critic", writer_output, context_text, provider=provider_name).get("text", "")
+        if revision_spans is not None:
+            writer_output = _run_paragraph_revision(writer_output, revision_spans, context_text, provider_name)
+            revision_spans = None
+        else:
+            writer_output = _run_agent_llm("writer", writer_prompt, context_text, provider=provider_name).get("text", "")
+        critic_input = number_paragraphs(split_paragraphs(writer_output)) if paragraph_revision else writer_output
+        critic_output = _run_agent_llm("critic", critic_input, context_text, provider=provider_name).get("text", "")
         try:
             critic_json = json.loads(critic_output)
             critic_score = int(critic_json.get("score") or 0)
-            critic_issues = critic_json.get("issues") or []
+            critic_issues = issue_texts(critic_json.get("issues") or [])
         except Exception:
+            critic_json = None
             critic_score = 0
             critic_issues = ["critic_parse_failed"]
         if critic_score >= threshold:
             break
         retries += 1
+        if paragraph_revision and retries <= max_retries:
+            revision_spans = _plan_paragraph_revision(writer_output, critic_json)
         writer_prompt = f"Rewrite due to issues: {critic_issues}\n\nOriginal:\n{writer_output}"
     archivist_output = _run_agent_llm("archivist", writer_output, context_text, provider=provider_name).get("text", "")
     parsed_archivist = _parse_json_output(archivist_output)
@@ -6588,7 +7172,8 @@ async def run_agent_flow(
         _apply_archivist_payload(db, request.novel_id, parsed_archivist)
     summary_count = 0
     if request.summarize_chapters:
-        summary_count = _summarize_chapters(db, request.novel_id, request.overwrite_summaries)
+        # summarize_novel 内部用 asyncio.run 发起并发摘要，不能在事件循环线程上调用
+        summary_count = await run_in_threadpool(_summarize_chapters, db, request.novel_id, request.overwrite_summaries)
     flow_id = generate_uuid()
     _save_agent_run(
         db,
@@ -6649,11 +7234,12 @@ async def run_agent_flow_stream(
     """运行多 Agent 工作流（流式输出）"""
     require_novel_owner(db, request.novel_id, current_user.id)
     context = _build_agent_context(db, request.novel_id)
-    context_text = _format_agent_context(context)
+    context_text = _format_agent_context(context, query=request.message or "", provider=request.provider, db=db)
 
-    def event_generator():
-        flow_id = generate_uuid()
-        _register_run_owner(flow_id, current_user.id)
+    flow_id = generate_uuid()
+    _register_run_owner(flow_id, current_user.id)
+
+    def event_generator(db: Session):
         user_message = request.message or "Write the next scene."
         max_retries = max(0, request.max_retries)
         threshold = max(0, min(100, request.critic_threshold))
@@ -6669,6 +7255,28 @@ async def run_agent_flow_stream(
         provider_name = request.provider
         selected_volume_id = request.volume_id
         selected_chapter_id = request.chapter_id
+        if request.speculative is None:
+            from core.config import AGENT_FLOW_SPECULATIVE
+            speculative = AGENT_FLOW_SPECULATIVE
+        else:
+            speculative = request.speculative
+        # 推测执行的 Archivist 及其对应的草稿（草稿被重写后结果作废）
+        archivist_future: Optional[Future] = None
+        archivist_draft: Optional[str] = None
+        paragraph_revision = _use_paragraph_revision(request.revision_mode)
+        # 下一轮只重写这些段落（None 表示整篇重写）
+        revision_spans: Optional[List[RevisionSpan]] = None
+        flow_started = time.monotonic()
+        stage_timings: Dict[str, int] = {}
+
+        def _stage_done(stage_value: str, started: float, **extra: Any) -> str:
+            """阶段结束的 status 事件（含耗时），同一阶段多次执行时累计"""
+            elapsed_ms = int((time.monotonic() - started) * 1000)
+            stage_timings[stage_value] = stage_timings.get(stage_value, 0) + elapsed_ms
+            return _sse_event(
+                "status",
+                {"stage": stage_value, "status": "done", "elapsed_ms": elapsed_ms, "run_id": flow_id, **extra},
+            )
 
         def _persist_flow_state(stage_value: str) -> None:
             output_payload = json.dumps(
@@ -6770,10 +7378,12 @@ async def run_agent_flow_stream(
                 yield _sse_event("cancelled", {"run_id": flow_id, "stage": stage_completed})
                 _clear_cancel(flow_id)
                 return
+            stage_started = time.monotonic()
             director = _run_agent_llm(
                 "director", user_message, context_text, provider=provider_name
             ).get("text", "")
             stage_completed = "director"
+            yield _stage_done("director", stage_started)
             yield _sse_event("stage_output", {"stage": "director", "text": director})
             _persist_flow_state("director")
 
@@ -6846,71 +7456,92 @@ async def run_agent_flow_stream(
                     status="start",
                     attempt=retries + 1,
                 )
-                writer_chunks: List[str] = []
-                for chunk in _run_agent_llm_stream(
-                    "writer", writer_prompt, context_text, provider=provider_name
-                ):
-                    if _is_cancelled(flow_id):
-                        output_payload = json.dumps(
-                            {
-                                "stage": stage_completed,
-                                "user_message": user_message,
-                                "director": director,
-                                "writer": writer_output,
-                                "critic": critic_output,
-                                "archivist": archivist_output,
-                                "score": critic_score,
-                                "issues": critic_issues,
-                                "retries": retries,
-                                "max_retries": max_retries,
-                                "critic_threshold": threshold,
-                                "writer_prompt": writer_prompt,
-                                "summarize_chapters": request.summarize_chapters,
-                                "overwrite_summaries": request.overwrite_summaries,
-                            },
-                            ensure_ascii=False,
-                        )
-                        _persist_agent_run(
-                            db,
-                            run_id=flow_id,
-                            novel_id=request.novel_id,
-                            user_id=current_user.id,
-                            agent="flow",
-                            input_text=user_message,
-                            output=output_payload,
-                            status_text="cancelled",
-                            score=critic_score,
-                            issues=json.dumps(critic_issues, ensure_ascii=False),
-                        )
-                        _save_flow_messages_preserve_system(
-                            db,
-                            run_id=flow_id,
-                            novel_id=request.novel_id,
-                            user_id=current_user.id,
-                            user_text=user_message,
-                            director=director,
-                            writer=writer_output,
-                            critic=critic_output,
-                            archivist=archivist_output,
-                        )
-                        _save_flow_status_message(
-                            db,
-                            run_id=flow_id,
-                            novel_id=request.novel_id,
-                            user_id=current_user.id,
-                            stage=stage_completed,
-                            status="cancelled",
-                        )
-                        yield _sse_event("cancelled", {"run_id": flow_id, "stage": stage_completed})
-                        _clear_cancel(flow_id)
-                        return
-                    writer_chunks.append(chunk)
-                    yield _sse_event("chunk", {"stage": "writer", "text": chunk})
-                writer_output = "".join(writer_chunks)
+                if revision_spans is not None:
+                    stage_started = time.monotonic()
+                    writer_output = _run_paragraph_revision(
+                        writer_output, revision_spans, context_text, provider_name
+                    )
+                    revision_spans = None
+                else:
+                    writer_chunks: List[str] = []
+                    stage_started = time.monotonic()
+                    for chunk in _run_agent_llm_stream(
+                        "writer", writer_prompt, context_text, provider=provider_name,
+                        cancel_token=get_cancel_token(flow_id),
+                    ):
+                        if _is_cancelled(flow_id):
+                            writer_output = "".join(writer_chunks)
+                            output_payload = json.dumps(
+                                {
+                                    "stage": stage_completed,
+                                    "user_message": user_message,
+                                    "director": director,
+                                    "writer": writer_output,
+                                    "critic": critic_output,
+                                    "archivist": archivist_output,
+                                    "score": critic_score,
+                                    "issues": critic_issues,
+                                    "retries": retries,
+                                    "max_retries": max_retries,
+                                    "critic_threshold": threshold,
+                                    "writer_prompt": writer_prompt,
+                                    "summarize_chapters": request.summarize_chapters,
+                                    "overwrite_summaries": request.overwrite_summaries,
+                                },
+                                ensure_ascii=False,
+                            )
+                            _persist_agent_run(
+                                db,
+                                run_id=flow_id,
+                                novel_id=request.novel_id,
+                                user_id=current_user.id,
+                                agent="flow",
+                                input_text=user_message,
+                                output=output_payload,
+                                status_text="cancelled",
+                                score=critic_score,
+                                issues=json.dumps(critic_issues, ensure_ascii=False),
+                            )
+                            _save_flow_messages_preserve_system(
+                                db,
+                                run_id=flow_id,
+                                novel_id=request.novel_id,
+                                user_id=current_user.id,
+                                user_text=user_message,
+                                director=director,
+                                writer=writer_output,
+                                critic=critic_output,
+                                archivist=archivist_output,
+                            )
+                            _save_flow_status_message(
+                                db,
+                                run_id=flow_id,
+                                novel_id=request.novel_id,
+                                user_id=current_user.id,
+                                stage=stage_completed,
+                                status="cancelled",
+                            )
+                            yield _sse_event("cancelled", {"run_id": flow_id, "stage": stage_completed})
+                            _clear_cancel(flow_id)
+                            return
+                        writer_chunks.append(chunk)
+                        yield _sse_event("chunk", {"stage": "writer", "text": chunk})
+                    writer_output = "".join(writer_chunks)
                 stage_completed = "writer"
+                yield _stage_done("writer", stage_started, attempt=retries + 1)
                 yield _sse_event("stage_output", {"stage": "writer", "text": writer_output})
                 _persist_flow_state("writer")
 
+                if speculative:
+                    archivist_future = _submit_speculative_agent(
+                        "archivist", writer_output, context_text, provider=provider_name
+                    )
+                    archivist_draft = writer_output
+                    yield _sse_event(
+                        "status",
+                        {"stage": "archivist", "status": "start", "speculative": True, "run_id": flow_id},
+                    )
+
                 yield _sse_event(
                     "status",
                     {"stage": "critic", "status": "start", "attempt": retries + 1, "run_id": flow_id},
@@ -6924,34 +7555,51 @@ async def run_agent_flow_stream(
                     status="start",
                     attempt=retries + 1,
                 )
+                stage_started = time.monotonic()
+                critic_input = (
+                    number_paragraphs(split_paragraphs(writer_output)) if paragraph_revision else writer_output
+                )
                 critic_output = _run_agent_llm(
-                    "critic", writer_output, context_text, provider=provider_name
+                    "critic", critic_input, context_text, provider=provider_name
                 ).get("text", "")
                 stage_completed = "critic"
+                yield _stage_done("critic", stage_started, attempt=retries + 1)
                 yield _sse_event("stage_output", {"stage": "critic", "text": critic_output})
                 _persist_flow_state("critic")
                 try:
                     critic_json = json.loads(critic_output)
                     critic_score = int(critic_json.get("score") or 0)
-                    critic_issues = critic_json.get("issues") or []
+                    critic_issues = issue_texts(critic_json.get("issues") or [])
                 except Exception:
+                    critic_json = None
                     critic_score = 0
                     critic_issues = ["critic_parse_failed"]
 
                 if critic_score >= threshold:
                     break
                 retries += 1
+                # 超过重试次数时不再重写，推测的 Archivist 结果对应最终草稿，继续保留
+                if archivist_future is not None and retries <= max_retries:
+                    archivist_future.cancel()
+                    archivist_future = None
+                    yield _sse_event(
+                        "status",
+                        {"stage": "archivist", "status": "discarded", "speculative": True, "run_id": flow_id},
+                    )
+                if paragraph_revision and retries <= max_retries:
+                    revision_spans = _plan_paragraph_revision(writer_output, critic_json)
                 writer_prompt = f"Rewrite due to issues: {critic_issues}\n\nOriginal:\n{writer_output}"
-                yield _sse_event(
-                    "status",
-                    {
-                        "stage": "writer",
-                        "status": "retry",
-                        "attempt": retries + 1,
-                        "issues": critic_issues,
-                        "run_id": flow_id,
-                    },
-                )
+                retry_event: Dict[str, Any] = {
+                    "stage": "writer",
+                    "status": "retry",
+                    "attempt": retries + 1,
+                    "issues": critic_issues,
+                    "run_id": flow_id,
+                }
+                if revision_spans is not None:
+                    retry_event["mode"] = "paragraph"
+                    retry_event["paragraphs"] = [span.label for span in revision_spans]
+                yield _sse_event("status", retry_event)
                 _save_flow_status_message(
                     db,
                     run_id=flow_id,
@@ -6986,7 +7634,8 @@ async def run_agent_flow_stream(
                     status="saved",
                     chapter_id=saved_chapter_id,
                 )
-            yield _sse_event("status", {"stage": "archivist", "status": "start", "run_id": flow_id})
+            if archivist_future is None or archivist_draft is not writer_output:
+                yield _sse_event("status", {"stage": "archivist", "status": "start", "run_id": flow_id})
             _save_flow_status_message(
                 db,
                 run_id=flow_id,
@@ -6995,9 +7644,29 @@ async def run_agent_flow_stream(
                 stage="archivist",
                 status="start",
             )
-            archivist_output = _run_agent_llm(
-                "archivist", writer_output, context_text, provider=provider_name
-            ).get("text", "")
+            stage_started = time.monotonic()
+            if archivist_future is not None and archivist_draft is writer_output:
+                # Critic 期间已在运行，这里只等待剩余部分
+                archivist_output, archivist_elapsed_ms = archivist_future.result()
+                archivist_future = None
+                waited_ms = int((time.monotonic() - stage_started) * 1000)
+                stage_timings["archivist"] = waited_ms
+                yield _sse_event(
+                    "status",
+                    {
+                        "stage": "archivist",
+                        "status": "done",
+                        "elapsed_ms": archivist_elapsed_ms,
+                        "waited_ms": waited_ms,
+                        "speculative": True,
+                        "run_id": flow_id,
+                    },
+                )
+            else:
+                archivist_output = _run_agent_llm(
+                    "archivist", writer_output, context_text, provider=provider_name
+                ).get("text", "")
+                yield _stage_done("archivist", stage_started)
             stage_completed = "archivist"
             yield _sse_event("stage_output", {"stage": "archivist", "text": archivist_output})
             _persist_flow_state("archivist")
@@ -7007,7 +7676,10 @@ async def run_agent_flow_stream(
 
             summary_count = 0
             if request.summarize_chapters:
+                stage_started = time.monotonic()
                 summary_count = _summarize_chapters(db, request.novel_id, request.overwrite_summaries)
+                yield _stage_done("summaries", stage_started)
+            total_ms = int((time.monotonic() - flow_started) * 1000)
 
             output_payload = json.dumps(
                 {
@@ -7075,6 +7747,8 @@ async def run_agent_flow_stream(
                     "score": critic_score,
                     "issues": critic_issues,
                     "summaries": summary_count,
+                    "speculative": speculative,
+                    "timings": {**stage_timings, "total": total_ms},
                 },
             )
         except Exception as exc:
@@ -7138,21 +7812,24 @@ async def run_agent_flow_stream(
                 },
             )
         finally:
+            if archivist_future is not None:
+                archivist_future.cancel()
             _clear_cancel(flow_id)
 
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream; charset=utf-8",
-    )
+    return _logged_stream_response(flow_id, current_user.id, event_generator)
 
 
 @app.post("/api/agents/flow/resume/stream")
 async def run_agent_flow_resume_stream(
     request: AgentFlowResumeRequest,
+    last_event_id: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    """恢复多 Agent 工作流（流式输出）"""
+    """恢复多 Agent 工作流（流式输出）
+
+    生成仍在进行（客户端只是断线）时不重新运行，补发 Last-Event-ID 之后的事件并接上当前生成。
+    """
     run = _get_agent_run_by_id(db, request.run_id, current_user.id)
     if not run:
         raise HTTPException(status_code=404, detail="未找到可恢复的流程")
@@ -7164,6 +7841,10 @@ async def run_agent_flow_resume_stream(
         raise HTTPException(status_code=400, detail="运行记录缺少 novel_id")
     require_novel_owner(db, novel_id, current_user.id)
 
+    event_log = get_event_logs().get(request.run_id)
+    if event_log is not None and (not event_log.finished or last_event_id):
+        return _event_log_response(event_log, parse_last_event_id(last_event_id))
+
     try:
         state = json.loads(run.get("output") or "{}")
     except Exception:
@@ -7173,9 +7854,14 @@ async def run_agent_flow_resume_stream(
         raise HTTPException(status_code=400, detail="流程已完成，无法恢复")
 
     context = _build_agent_context(db, novel_id)
-    context_text = _format_agent_context(context)
+    context_text = _format_agent_context(
+        context,
+        query=state.get("user_message") or "",
+        provider=request.provider,
+        db=db,
+    )
 
-    def event_generator():
+    def event_generator(db: Session):
         stage_completed = state.get("stage") or "start"
         user_message = state.get("user_message") or "Write the next scene."
         max_retries = int(state.get("max_retries") or 1)
@@ -7381,9 +8067,11 @@ async def run_agent_flow_resume_stream(
                     )
                     writer_chunks: List[str] = []
                     for chunk in _run_agent_llm_stream(
-                        "writer", writer_prompt, context_text, provider=provider_name
+                        "writer", writer_prompt, context_text, provider=provider_name,
+                        cancel_token=get_cancel_token(request.run_id),
                     ):
                         if _is_cancelled(request.run_id):
+                            writer_output = "".join(writer_chunks)
                             output_payload = json.dumps(
                                 {
                                     "stage": stage_completed,
@@ -7559,10 +8247,16 @@ async def run_agent_flow_resume_stream(
                         )
                         writer_chunks: List[str] = []
                         for chunk in _run_agent_llm_stream(
-                            "writer", writer_prompt, context_text, provider=provider_name
+                            "writer", writer_prompt, context_text, provider=provider_name,
+                            cancel_token=get_cancel_token(request.run_id),
                         ):
+                            if _is_cancelled(request.run_id):
+                                break
                             writer_chunks.append(chunk)
                             yield _sse_event("chunk", {"stage": "writer", "text": chunk})
+                        if _is_cancelled(request.run_id):
+                            # 重写被取消时保留上一版完整正文，由后续的取消检查记录状态
+                            break
                         writer_output = "".join(writer_chunks)
                         stage_completed = "writer"
                         yield _sse_event("stage_output", {"stage": "writer", "text": writer_output})
@@ -7637,10 +8331,16 @@ async def run_agent_flow_resume_stream(
                         )
                         writer_chunks: List[str] = []
                         for chunk in _run_agent_llm_stream(
-                            "writer", writer_prompt, context_text, provider=provider_name
+                            "writer", writer_prompt, context_text, provider=provider_name,
+                            cancel_token=get_cancel_token(request.run_id),
                         ):
+                            if _is_cancelled(request.run_id):
+                                break
                             writer_chunks.append(chunk)
                             yield _sse_event("chunk", {"stage": "writer", "text": chunk})
+                        if _is_cancelled(request.run_id):
+                            # 重写被取消时保留上一版完整正文，由后续的取消检查记录状态
+                            break
                         writer_output = "".join(writer_chunks)
                         stage_completed = "writer"
                         yield _sse_event("stage_output", {"stage": "writer", "text": writer_output})
@@ -7931,10 +8631,20 @@ async def run_agent_flow_resume_stream(
         finally:
             _clear_cancel(request.run_id)
 
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream; charset=utf-8",
-    )
+    return _logged_stream_response(request.run_id, current_user.id, event_generator)
+
+
+@app.get("/api/agents/runs/{run_id}/events")
+async def stream_agent_run_events(
+    run_id: str,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+):
+    """断线重连：补发 Last-Event-ID 之后的事件，并接上仍在进行的生成"""
+    event_log = get_event_logs().get(run_id)
+    if event_log is None or event_log.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="事件日志不存在或已过期，请通过恢复接口继续流程")
+    return _event_log_response(event_log, parse_last_event_id(last_event_id))
 
 @app.get("/api/agents/history")
 async def list_agent_history(
@@ -8214,30 +8924,15 @@ def _apply_character_updates(db: Session, novel_id: str, updates: List[Dict[str,
 
 
 def _summarize_chapters(db: Session, novel_id: str, overwrite: bool = False) -> int:
-    chapters = (
-        db.query(Chapter)
-        .join(Volume, Chapter.volume_id == Volume.id)
-        .filter(Volume.novel_id == novel_id)
-        .order_by(Chapter.chapter_order)
-        .all()
-    )
-    updated = 0
-    for chapter in chapters:
-        if not chapter.content or not chapter.content.strip():
-            continue
-        if not overwrite and chapter.summary and chapter.summary.strip():
-            continue
-        try:
-            summary = run_async(summarize_chapter_content(chapter.title, chapter.content, 400))
-        except Exception:
-            continue
-        if summary:
-            chapter.summary = summary
-            chapter.updated_at = int(time.time() * 1000)
-            updated += 1
-    if updated:
-        db.commit()
-    return updated
+    """刷新分层摘要（只摘要正文改动过的章节，并汇总卷摘要和全书梗概），返回新生成的章节摘要数"""
+    try:
+        return summarize_novel(db, novel_id, overwrite=overwrite)["chapters"]
+    except SummaryInEventLoopError:
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ 分层摘要失败: novel={novel_id}, error={str(e)}")
+        return 0
 
 
 def _apply_archivist_payload(db: Session, novel_id: str, payload: Dict[str, Any]) -> Dict[str, int]:
@@ -8291,6 +8986,24 @@ async def health_check():
     """健康检查"""
     return {"status": "ok", "message": "API is running"}
 
+@app.get("/api/health/metrics")
+async def health_metrics():
+    """运行指标（上游请求合并、限流额度与排队等待、共享运行状态、用户缓存、事件日志、Agent LLM 网关、向量索引、近重复索引）"""
+    from services.analysis.near_duplicate import get_near_duplicate_registry
+    from services.embedding.embedding_service import get_embedding_single_flight_stats
+    from services.embedding.vector_index import get_vector_index_cache
+
+    return {
+        "embedding_single_flight": get_embedding_single_flight_stats(),
+        "upstream_rate_limits": get_rate_limiter_stats(),
+        "shared_state": get_shared_state().snapshot(),
+        "user_cache": get_user_cache().snapshot(),
+        "event_logs": get_event_logs().snapshot(),
+        "agent_llm_gateway": get_llm_gateway().snapshot(),
+        "vector_index": get_vector_index_cache().snapshot(),
+        "near_duplicate_index": get_near_duplicate_registry().snapshot(),
+    }
+
 @app.get("/")
 async def root():
     """根路径"""
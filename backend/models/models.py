@@ -150,7 +150,7 @@ class Task(Base):
     user_id = Column(String(36), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     task_type = Column(String(50), nullable=False)  # generate_outline, generate_volume_outline, write_chapter, etc.
     task_data = Column(Text, nullable=True)  # JSON 格式的任务参数
-    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed, cancelled
     progress = Column(Integer, nullable=False, default=0)  # 0-100
     progress_message = Column(Text, nullable=True)
     result = Column(Text, nullable=True)  # JSON 格式的任务结果
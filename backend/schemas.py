@@ -331,7 +331,7 @@ class TaskResponse(CamelModel):
     id: str
     novel_id: str
     task_type: str
-    status: str  # pending, running, completed, failed
+    status: str  # pending, running, completed, failed, cancelled
     progress: int  # 0-100
     progress_message: Optional[str] = None
     result: Optional[Union[Dict[str, Any], List[Any]]] = None  # 支持字典或列表
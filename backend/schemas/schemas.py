@@ -309,6 +309,7 @@ class WriteChapterRequestWithNovelId(WriteChapterRequest):
     characters: Optional[List[dict]] = None
     world_settings: Optional[List[dict]] = None
     previous_chapters_context: Optional[str] = None  # 前文上下文，用于避免重复内容
+    draft_mode: Optional[str] = None  # 正文写作模式：single / scenes（场景并行），默认取 CHAPTER_DRAFT_MODE
 
 class GenerateCharactersRequest(BaseModel):
     title: str
@@ -346,7 +347,7 @@ class TaskResponse(BaseModel):
     id: str
     novel_id: str
     task_type: str
-    status: str  # pending, running, completed, failed
+    status: str  # pending, running, completed, failed, cancelled
     progress: int  # 0-100
     progress_message: Optional[str] = None
     result: Optional[Union[Dict[str, Any], List[Any]]] = None  # 支持字典或列表
@@ -4,12 +4,16 @@ from .gemini_service import (
     generate_volume_outline_stream,
     generate_volume_outline,
     generate_chapter_outline,
+    generate_chapter_outline_stream,
     write_chapter_content_stream,
     write_chapter_content,
     generate_characters,
     generate_character_relations,
     generate_world_settings,
     generate_timeline_events,
+    generate_characters_stream,
+    generate_world_settings_stream,
+    generate_timeline_events_stream,
     generate_foreshadowings_from_outline,
     modify_outline_by_dialogue,
     extract_foreshadowings_from_chapter,
@@ -27,12 +31,16 @@ __all__ = [
     'generate_volume_outline_stream',
     'generate_volume_outline',
     'generate_chapter_outline',
+    'generate_chapter_outline_stream',
     'write_chapter_content_stream',
     'write_chapter_content',
     'generate_characters',
     'generate_character_relations',
     'generate_world_settings',
     'generate_timeline_events',
+    'generate_characters_stream',
+    'generate_world_settings_stream',
+    'generate_timeline_events_stream',
     'generate_foreshadowings_from_outline',
     'modify_outline_by_dialogue',
     'extract_foreshadowings_from_chapter',
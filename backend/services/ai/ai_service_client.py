@@ -1,11 +1,34 @@
 """AI 微服务客户端"""
 import json
 import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from typing import Optional, AsyncGenerator
 import httpx
 
+from core.cancellation import CancellationToken, aiter_cancellable, current_token, wait_cancellable
+
 logger = logging.getLogger(__name__)
 
+# session() 期间共享的连接池（同一事件循环内的并发请求复用连接）
+_session_client: ContextVar[Optional[httpx.AsyncClient]] = ContextVar("ai_service_session_client", default=None)
+# bypass_response_cache() 期间的请求带 X-Cache-Bypass，微服务不读取响应缓存
+_cache_bypass: ContextVar[bool] = ContextVar("ai_service_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass_response_cache():
+    """
+    用户主动发起的重新生成/重写：期间的微服务请求跳过响应缓存
+
+    asyncio.run 会复制当前上下文，同步代码中包住 asyncio.run(...) 同样生效。
+    """
+    token = _cache_bypass.set(True)
+    try:
+        yield
+    finally:
+        _cache_bypass.reset(token)
+
 
 class AIServiceClient:
     """AI 微服务客户端"""
@@ -26,28 +49,109 @@ class AIServiceClient:
 
     def _get_headers(self) -> dict:
         """获取请求头"""
-        return {
+        headers = {
             "Content-Type": "application/json",
             "X-Provider": self.provider
         }
+        if _cache_bypass.get():
+            headers["X-Cache-Bypass"] = "true"
+        return headers
+
+    @asynccontextmanager
+    async def session(self, max_connections: int = 8):
+        """
+        在当前事件循环内复用一个连接池
+
+        批量请求（如并发生成章节摘要）放在 async with client.session() 中，
+        期间的 _post_json 请求共用同一个 httpx.AsyncClient，不再每次新建连接。
+        """
+        if _session_client.get() is not None:
+            yield
+            return
+        client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        token = _session_client.set(client)
+        try:
+            yield
+        finally:
+            _session_client.reset(token)
+            await client.aclose()
 
     async def _post_json(self, path: str, payload: dict) -> dict:
-        client = httpx.AsyncClient(timeout=self.timeout)
+        shared = _session_client.get()
+        client = shared or httpx.AsyncClient(timeout=self.timeout)
         try:
-            response = await client.post(
-                f"{self.base_url}{path}",
-                json=payload,
-                headers=self._get_headers()
+            # 后台任务被取消时中断请求，断开连接后微服务随之停止生成
+            response = await wait_cancellable(
+                client.post(
+                    f"{self.base_url}{path}",
+                    json=payload,
+                    headers=self._get_headers()
+                ),
+                current_token()
             )
             response.raise_for_status()
             return response.json()
         finally:
             try:
-                await client.aclose()
+                if shared is None:
+                    await client.aclose()
             except RuntimeError:
                 # Ignore uvloop transport-close errors during cleanup.
                 pass
 
+    async def _stream_items(
+        self,
+        path: str,
+        payload: dict,
+        label: str,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[dict, None]:
+        """
+        请求结构化流式接口，逐个产出 item 事件中的元素
+
+        微服务每生成完一项就发送 data: {"item": ..., "index": n}，最后发送 data: {"done": true, "count": n}。
+        收到错误事件、或连接在完成事件之前断开时抛出异常（已产出的元素由调用方决定是否保留）。
+        """
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                async with client.stream(
+                    "POST",
+                    f"{self.base_url}{path}",
+                    json=payload,
+                    headers=self._get_headers()
+                ) as response:
+                    response.raise_for_status()
+                    done = False
+                    async for line in aiter_cancellable(response.aiter_lines(), cancel_token or current_token()):
+                        if not line.startswith("data:"):
+                            continue
+                        try:
+                            event = json.loads(line[len("data:"):].strip())
+                        except ValueError:
+                            continue
+                        if not isinstance(event, dict):
+                            continue
+                        if event.get("error"):
+                            raise Exception(event["error"])
+                        if "item" in event:
+                            yield event["item"]
+                        elif event.get("done"):
+                            done = True
+                    if not done:
+                        raise Exception("流式响应在完成前中断")
+
+        except httpx.HTTPStatusError as e:
+            error_msg = f"HTTP错误 {e.response.status_code}"
+            logger.error(f"[AI Service] {error_msg}")
+            raise Exception(f"{label}失败: {error_msg}")
+        except httpx.RequestError as e:
+            error_msg = f"请求错误: {str(e)}"
+            logger.error(f"[AI Service] {error_msg}")
+            raise Exception(f"{label}失败: {error_msg}")
+
     async def close(self):
         """关闭客户端"""
         return
@@ -104,7 +208,8 @@ class AIServiceClient:
         volume_title: str,
         volume_summary: str,
         characters: list,
-        volume_index: int
+        volume_index: int,
+        cancel_token: Optional[CancellationToken] = None
     ) -> AsyncGenerator[str, None]:
         """
         流式生成卷详细大纲
@@ -116,6 +221,7 @@ class AIServiceClient:
             volume_summary: 卷简介
             characters: 角色列表
             volume_index: 卷索引
+            cancel_token: 取消令牌（默认取当前作用域的令牌），触发后立即关闭上游连接
 
         Yields:
             SSE 格式数据
@@ -138,7 +244,7 @@ class AIServiceClient:
                     headers=self._get_headers()
                 ) as response:
                     response.raise_for_status()
-                    async for line in response.aiter_lines():
+                    async for line in aiter_cancellable(response.aiter_lines(), cancel_token or current_token()):
                         if line:
                             yield line + "\n"
 
@@ -336,6 +442,46 @@ class AIServiceClient:
             logger.error(f"[AI Service] 未知错误: {str(e)}")
             raise Exception(f"生成章节列表失败: {str(e)}")
 
+    async def generate_chapter_outline_stream(
+        self,
+        novel_title: str,
+        genre: str,
+        full_outline: str,
+        volume_title: str,
+        volume_summary: str,
+        volume_outline: str,
+        characters: list,
+        volume_index: int,
+        chapter_count: Optional[int] = None,
+        previous_volumes_info: Optional[list] = None,
+        future_volumes_info: Optional[list] = None
+    ) -> AsyncGenerator[dict, None]:
+        """
+        流式生成章节列表（参数同 generate_chapter_outline）
+
+        Yields:
+            每生成完一章产出该章 {"title", "summary", "aiPromptHints"}
+        """
+        logger.info(f"[AI Service] 流式生成章节列表: {volume_title}")
+        async for item in self._stream_items(
+            "/api/v1/chapter/generate-outline-stream",
+            {
+                "novel_title": novel_title,
+                "genre": genre,
+                "full_outline": full_outline,
+                "volume_title": volume_title,
+                "volume_summary": volume_summary,
+                "volume_outline": volume_outline,
+                "characters": characters,
+                "volume_index": volume_index,
+                "chapter_count": chapter_count,
+                "previous_volumes_info": previous_volumes_info,
+                "future_volumes_info": future_volumes_info
+            },
+            "生成章节列表"
+        ):
+            yield item
+
     async def write_chapter_content_stream(
         self,
         novel_title: str,
@@ -346,7 +492,8 @@ class AIServiceClient:
         chapter_prompt_hints: str,
         characters: list,
         world_settings: list,
-        previous_chapters_context: Optional[str] = None
+        previous_chapters_context: Optional[str] = None,
+        cancel_token: Optional[CancellationToken] = None
     ) -> AsyncGenerator[str, None]:
         """
         流式生成章节内容
@@ -361,32 +508,46 @@ class AIServiceClient:
             characters: 角色列表
             world_settings: 世界观设定
             previous_chapters_context: 前文上下文
+            cancel_token: 取消令牌（默认取当前作用域的令牌），触发后立即关闭上游连接
 
         Yields:
             SSE 格式数据
         """
+        logger.info(f"[AI Service] 流式生成章节内容: {chapter_title}")
+        async for line in self._stream_chapter_lines(
+            "/api/v1/chapter/write-content-stream",
+            {
+                "novel_title": novel_title,
+                "genre": genre,
+                "synopsis": synopsis,
+                "chapter_title": chapter_title,
+                "chapter_summary": chapter_summary,
+                "chapter_prompt_hints": chapter_prompt_hints,
+                "characters": characters,
+                "world_settings": world_settings,
+                "previous_chapters_context": previous_chapters_context
+            },
+            cancel_token
+        ):
+            yield line
+
+    async def _stream_chapter_lines(
+        self,
+        path: str,
+        payload: dict,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[str, None]:
+        """转发章节正文流的 SSE 行；请求失败时以错误事件结束，不抛出"""
         try:
-            logger.info(f"[AI Service] 流式生成章节内容: {chapter_title}")
-
             async with httpx.AsyncClient(timeout=self.timeout) as client:
                 async with client.stream(
                     "POST",
-                    f"{self.base_url}/api/v1/chapter/write-content-stream",
-                    json={
-                        "novel_title": novel_title,
-                        "genre": genre,
-                        "synopsis": synopsis,
-                        "chapter_title": chapter_title,
-                        "chapter_summary": chapter_summary,
-                        "chapter_prompt_hints": chapter_prompt_hints,
-                        "characters": characters,
-                        "world_settings": world_settings,
-                        "previous_chapters_context": previous_chapters_context
-                    },
+                    f"{self.base_url}{path}",
+                    json=payload,
                     headers=self._get_headers()
                 ) as response:
                     response.raise_for_status()
-                    async for line in response.aiter_lines():
+                    async for line in aiter_cancellable(response.aiter_lines(), cancel_token or current_token()):
                         if line:
                             yield line + "\n"
 
@@ -405,6 +566,85 @@ class AIServiceClient:
             error_data = json.dumps({"error": f"生成章节内容失败: {str(e)}"})
             yield f"data: {error_data}\n\n"
 
+    async def write_chapter_scenes_stream(
+        self,
+        novel_title: str,
+        genre: str,
+        synopsis: str,
+        chapter_title: str,
+        chapter_summary: str,
+        chapter_prompt_hints: str,
+        characters: list,
+        world_settings: list,
+        previous_chapters_context: Optional[str] = None,
+        prompt_cache_key: Optional[str] = None,
+        context_version: Optional[str] = None,
+        max_scenes: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        场景并行写作章节内容（流式，参数同 write_chapter_content_stream）
+
+        事件与整章流式生成兼容（chunk / done / error），另有 plan（场景规划）与 scene（场景开始）事件；
+        每个场景写完后以一个 chunk 事件整段发送。
+        """
+        logger.info(f"[AI Service] 场景并行写作章节内容: {chapter_title}")
+        async for line in self._stream_chapter_lines(
+            "/api/v1/chapter/write-content-scenes-stream",
+            {
+                "novel_title": novel_title,
+                "genre": genre,
+                "synopsis": synopsis,
+                "chapter_title": chapter_title,
+                "chapter_summary": chapter_summary,
+                "chapter_prompt_hints": chapter_prompt_hints,
+                "characters": characters,
+                "world_settings": world_settings,
+                "previous_chapters_context": previous_chapters_context,
+                "prompt_cache_key": prompt_cache_key,
+                "context_version": context_version,
+                "max_scenes": max_scenes
+            },
+            cancel_token
+        ):
+            yield line
+
+    async def write_chapter_scenes(self, on_scene=None, **kwargs) -> str:
+        """
+        场景并行写作章节内容，返回完整正文（参数同 write_chapter_scenes_stream）
+
+        on_scene(index, total, title) 在每个场景的正文收到后回调（用于更新进度）。
+        """
+        parts = []
+        scene = None
+        done = False
+        async for line in self.write_chapter_scenes_stream(**kwargs):
+            if not line.startswith("data:"):
+                continue
+            try:
+                event = json.loads(line[len("data:"):].strip())
+            except ValueError:
+                continue
+            if not isinstance(event, dict):
+                continue
+            if event.get("error"):
+                raise Exception(event["error"])
+            if "scene" in event:
+                scene = event["scene"]
+            elif "chunk" in event:
+                parts.append(event["chunk"])
+                if scene is not None and on_scene:
+                    on_scene(scene.get("index", 0), scene.get("total", 1), scene.get("title", ""))
+                    scene = None
+            elif event.get("done"):
+                done = True
+        if not done:
+            raise Exception("生成章节内容失败: 流式响应在完成前中断")
+        content = "".join(parts)
+        if not content.strip():
+            raise Exception("生成章节内容失败: API 返回空响应")
+        return content
+
     async def write_chapter_content(
         self,
         novel_title: str,
@@ -416,7 +656,9 @@ class AIServiceClient:
         characters: list,
         world_settings: list,
         previous_chapters_context: Optional[str] = None,
-        progress_callback=None
+        progress_callback=None,
+        prompt_cache_key: Optional[str] = None,
+        context_version: Optional[str] = None
     ) -> str:
         """
         生成章节内容（非流式）
@@ -432,6 +674,8 @@ class AIServiceClient:
             world_settings: 世界观设定
             previous_chapters_context: 前文上下文
             progress_callback: 进度回调（保留但不使用）
+            prompt_cache_key: 稳定前缀缓存键（批量写章时传小说ID）
+            context_version: 小说上下文版本（变化时微服务刷新前缀缓存）
 
         Returns:
             章节内容
@@ -450,7 +694,9 @@ class AIServiceClient:
                     "chapter_prompt_hints": chapter_prompt_hints,
                     "characters": characters,
                     "world_settings": world_settings,
-                    "previous_chapters_context": previous_chapters_context
+                    "previous_chapters_context": previous_chapters_context,
+                    "prompt_cache_key": prompt_cache_key,
+                    "context_version": context_version
                 }
             )
             return result.get("content", "")
@@ -558,6 +804,27 @@ class AIServiceClient:
             logger.error(f"[AI Service] 未知错误: {str(e)}")
             raise Exception(f"生成角色列表失败: {str(e)}")
 
+    async def generate_characters_stream(
+        self,
+        title: str,
+        genre: str,
+        synopsis: str,
+        outline: str
+    ) -> AsyncGenerator[dict, None]:
+        """流式生成角色列表（参数同 generate_characters），每生成完一项产出一项"""
+        logger.info(f"[AI Service] 流式生成角色列表: {title}")
+        async for item in self._stream_items(
+            "/api/v1/analysis/generate-characters-stream",
+            {
+                "title": title,
+                "genre": genre,
+                "synopsis": synopsis,
+                "outline": outline
+            },
+            "生成角色列表"
+        ):
+            yield item
+
     async def generate_world_settings(
         self,
         title: str,
@@ -607,6 +874,27 @@ class AIServiceClient:
             logger.error(f"[AI Service] 未知错误: {str(e)}")
             raise Exception(f"生成世界观设定失败: {str(e)}")
 
+    async def generate_world_settings_stream(
+        self,
+        title: str,
+        genre: str,
+        synopsis: str,
+        outline: str
+    ) -> AsyncGenerator[dict, None]:
+        """流式生成世界观设定（参数同 generate_world_settings），每生成完一项产出一项"""
+        logger.info(f"[AI Service] 流式生成世界观设定: {title}")
+        async for item in self._stream_items(
+            "/api/v1/analysis/generate-world-settings-stream",
+            {
+                "title": title,
+                "genre": genre,
+                "synopsis": synopsis,
+                "outline": outline
+            },
+            "生成世界观设定"
+        ):
+            yield item
+
     async def generate_character_relations(
         self,
         title: str,
@@ -706,6 +994,27 @@ class AIServiceClient:
             logger.error(f"[AI Service] 未知错误: {str(e)}")
             raise Exception(f"生成时间线事件失败: {str(e)}")
 
+    async def generate_timeline_events_stream(
+        self,
+        title: str,
+        genre: str,
+        synopsis: str,
+        outline: str
+    ) -> AsyncGenerator[dict, None]:
+        """流式生成时间线事件（参数同 generate_timeline_events），每生成完一项产出一项"""
+        logger.info(f"[AI Service] 流式生成时间线事件: {title}")
+        async for item in self._stream_items(
+            "/api/v1/analysis/generate-timeline-stream",
+            {
+                "title": title,
+                "genre": genre,
+                "synopsis": synopsis,
+                "outline": outline
+            },
+            "生成时间线事件"
+        ):
+            yield item
+
     async def generate_foreshadowings_from_outline(
         self,
         title: str,
@@ -0,0 +1,229 @@
+"""
+多卷章节列表并行生成与跨卷衔接
+
+顺序模式下每卷要等上一卷的章节列表生成后，才能把上一卷结尾的章节作为上下文，卷数多时是一长串串行请求。
+并行模式下所有有卷大纲的卷按各自的卷大纲同时生成（上一卷不在本次生成范围且已有章节时仍带入其结尾章节），
+同时进行的请求数受配置和上游提供商限流器共同约束。生成完成后对相邻两卷的交界做一次轻量的衔接检查，
+只修改后一卷开头几章的摘要和写作提示，不重新生成整卷。
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.cancellation import OperationCancelled
+from core.rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# 衔接检查时带入上一卷结尾 / 下一卷开头的章节数
+STITCH_CHAPTERS = 3
+# 上一卷作为上下文时带入的结尾章节数
+PREVIOUS_TAIL_CHAPTERS = 12
+
+_CHAPTER_PLAN_PATTERN = re.compile(r'\*?\*?[【]?章节规划[】]?[：:\s]*\*?\*?\s*(\d+)\s*章')
+_CHAPTER_PREFIX_PATTERN = re.compile(r'^\s*第\s*[0-9一二三四五六七八九十百千]+\s*章\s*[:：\-—\.\s]*')
+_NUMBER_PREFIX_PATTERN = re.compile(r'^\s*\d+\s*[\.\-：:\s]+')
+
+
+def chapter_count_from_outline(outline: str) -> Optional[int]:
+    """从卷大纲的【章节规划】中提取章节数（支持 **【章节规划】：** 75章、章节规划：10章 等写法）"""
+    match = _CHAPTER_PLAN_PATTERN.search(outline or "")
+    return int(match.group(1)) if match else None
+
+
+def normalize_chapter_title(raw_title: Optional[str], index: int) -> str:
+    """去掉模型写进标题的“第X章”/序号前缀，避免跨卷章号显示错乱"""
+    title = (raw_title or "").strip()
+    if title:
+        title = _CHAPTER_PREFIX_PATTERN.sub('', title).strip()
+        title = _NUMBER_PREFIX_PATTERN.sub('', title).strip()
+    return title or f"第{index + 1}章"
+
+
+@dataclass
+class VolumeChapterJob:
+    """一卷的章节列表生成请求；kwargs 为 generate_chapter_outline 的参数"""
+    volume_id: str
+    volume_index: int
+    title: str
+    kwargs: Dict[str, Any]
+    used_previous_chapters: bool = False
+    existing_chapter_count: int = 0
+
+
+@dataclass
+class VolumeChapterResult:
+    job: VolumeChapterJob
+    chapters: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[Exception] = None
+
+
+def generate_volumes_parallel(
+    jobs: List[VolumeChapterJob],
+    generate: Callable[..., Awaitable[List[Dict[str, Any]]]],
+    max_parallel: int,
+    provider: str,
+    on_result: Optional[Callable[[VolumeChapterResult], None]] = None
+) -> List[VolumeChapterResult]:
+    """
+    并行生成多卷章节列表
+
+    每个请求在工作线程中占用提供商限流器的一个槽位后执行；on_result 在调用线程中按完成顺序回调（用于入库和更新进度）。
+    单卷失败记录在结果中，不影响其他卷；任务被取消时抛出 OperationCancelled。
+    """
+    limiter = get_rate_limiter(provider)
+    workers = max(1, min(max_parallel, len(jobs)))
+
+    def run(job: VolumeChapterJob) -> List[Dict[str, Any]]:
+        with limiter.slot():
+            return asyncio.run(generate(**job.kwargs))
+
+    results: List[VolumeChapterResult] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chapter_outline") as pool:
+        futures = {pool.submit(contextvars.copy_context().run, run, job): job for job in jobs}
+        cancelled: Optional[BaseException] = None
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            exc = future.exception()
+            if isinstance(exc, OperationCancelled):
+                cancelled = cancelled or exc
+                continue
+            if exc is not None:
+                logger.warning(f"⚠️ 第 {job.volume_index + 1} 卷《{job.title}》章节列表生成失败: {exc}")
+                result = VolumeChapterResult(job=job, error=exc if isinstance(exc, Exception) else Exception(str(exc)))
+            else:
+                result = VolumeChapterResult(job=job, chapters=future.result() or [])
+            results.append(result)
+            if on_result and cancelled is None:
+                on_result(result)
+        if cancelled is not None:
+            raise cancelled
+    return results
+
+
+def boundaries_to_stitch(
+    volume_ids: List[str],
+    generated: Dict[str, bool],
+    has_chapters: Dict[str, bool]
+) -> List[Tuple[str, str]]:
+    """
+    需要做衔接检查的相邻卷 (上一卷, 下一卷)
+
+    generated: 本次生成的卷 -> 生成时是否带入了上一卷的结尾章节。两卷都有章节，且上一卷本次重新生成，
+    或下一卷本次生成时没有上一卷结尾章节可参考时，交界处才需要检查。
+    """
+    pairs = []
+    for prev_id, next_id in zip(volume_ids, volume_ids[1:]):
+        if not (has_chapters.get(prev_id) and has_chapters.get(next_id)):
+            continue
+        if prev_id in generated or (next_id in generated and not generated[next_id]):
+            pairs.append((prev_id, next_id))
+    return pairs
+
+
+def build_stitch_prompt(
+    novel_title: str,
+    prev_title: str,
+    prev_tail: List[Dict[str, str]],
+    next_title: str,
+    next_summary: str,
+    next_head: List[Dict[str, str]]
+) -> str:
+    """跨卷衔接检查提示词：只允许修改下一卷开头几章的摘要和写作提示"""
+    tail = "\n".join(f"- {ch['title']}：{(ch.get('summary') or '')[:200]}" for ch in prev_tail)
+    head = "\n".join(
+        f"[{i}] {ch['title']}：{(ch.get('summary') or '')[:200]}"
+        + (f"\n    写作提示：{(ch.get('ai_prompt_hints') or '')[:120]}" if ch.get("ai_prompt_hints") else "")
+        for i, ch in enumerate(next_head)
+    )
+    return f"""你是小说《{novel_title}》的编辑，负责检查相邻两卷章节列表的衔接。两卷的章节列表是分别独立生成的。
+
+【上一卷《{prev_title}》结尾章节】
+{tail}
+
+【下一卷《{next_title}》】
+卷简介：{(next_summary or '')[:300]}
+开头章节（方括号内为序号）：
+{head}
+
+检查下一卷开头是否承接上一卷结尾：人物状态、地点、时间、未了结的冲突是否连贯，是否重复上一卷已经发生的事件。
+衔接自然时返回空列表；否则只修改下一卷开头章节的摘要（可补充写作提示），不要改动章节标题和上一卷。
+只返回 JSON：{{"chapters":[{{"index":序号,"summary":"修改后的摘要","aiPromptHints":"衔接提示（可选）"}}]}}"""
+
+
+def parse_stitch_revisions(text: str, head_count: int) -> List[Dict[str, Any]]:
+    """解析衔接检查结果，只保留序号在开头章节范围内且摘要非空的修改"""
+    payload = None
+    if text:
+        start, end = text.find("{"), text.rfind("}")
+        if start >= 0 and end > start:
+            try:
+                payload = json.loads(text[start:end + 1])
+            except ValueError:
+                payload = None
+    revisions = []
+    seen = set()
+    for item in (payload or {}).get("chapters") or []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("index"))
+        except (TypeError, ValueError):
+            continue
+        summary = str(item.get("summary") or "").strip()
+        if not 0 <= index < head_count or not summary or index in seen:
+            continue
+        seen.add(index)
+        revisions.append({
+            "index": index,
+            "summary": summary,
+            "ai_prompt_hints": str(item.get("aiPromptHints") or item.get("ai_prompt_hints") or "").strip(),
+        })
+    return revisions
+
+
+def stitch_boundaries(
+    boundaries: List[Dict[str, Any]],
+    complete: Callable[[str], str],
+    max_parallel: int
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    并行检查多个卷交界
+
+    boundaries 每项包含 novel_title / prev_title / prev_tail / next_volume_id / next_title / next_summary / next_head；
+    complete 为同步的模型调用（提示词 -> 文本）。返回 {下一卷ID: 修改列表}，检查失败的交界不修改。
+    """
+    if not boundaries:
+        return {}
+
+    def check(boundary: Dict[str, Any]) -> List[Dict[str, Any]]:
+        prompt = build_stitch_prompt(
+            boundary["novel_title"],
+            boundary["prev_title"],
+            boundary["prev_tail"],
+            boundary["next_title"],
+            boundary.get("next_summary", ""),
+            boundary["next_head"],
+        )
+        return parse_stitch_revisions(complete(prompt), len(boundary["next_head"]))
+
+    revisions: Dict[str, List[Dict[str, Any]]] = {}
+    workers = max(1, min(max_parallel, len(boundaries)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chapter_stitch") as pool:
+        futures = {pool.submit(contextvars.copy_context().run, check, b): b for b in boundaries}
+        for future in concurrent.futures.as_completed(futures):
+            boundary = futures[future]
+            exc = future.exception()
+            if isinstance(exc, OperationCancelled):
+                raise exc
+            if exc is not None:
+                logger.warning(f"⚠️ 卷交界衔接检查失败（{boundary['prev_title']} → {boundary['next_title']}）: {exc}")
+                continue
+            if future.result():
+                revisions[boundary["next_volume_id"]] = future.result()
+    return revisions
@@ -1,18 +1,24 @@
 """
 章节写作服务 - 抽象和复用章节生成、保存、向量存储、伏笔提取等逻辑
 """
+import asyncio
 import time
 import logging
 from typing import Optional, Dict, Any, List
 from sqlalchemy.orm import Session
 
 from models import Novel, Volume, Chapter, Character, WorldSetting, Foreshadowing
+from services.ai.ai_service_client import bypass_response_cache
 from services.ai.gemini_service import (
     write_chapter_content as write_chapter_content_impl,
     extract_foreshadowings_from_chapter,
     extract_next_chapter_hook
 )
 from services.embedding.embedding_service import EmbeddingService
+from services.embedding.vector_helper import get_embedding_service
+from services.analysis.content_similarity_checker import ContentSimilarityChecker
+from services.analysis.near_duplicate import record_chapter_content
+from core.config import AI_PROMPT_CACHE_ENABLED, CHAPTER_CHARACTER_TOP_K, CHAPTER_WORLD_SETTING_TOP_K, CHAPTER_DRAFT_MODE
 from core.security import generate_uuid
 
 logger = logging.getLogger(__name__)
@@ -29,7 +35,8 @@ class ChapterWritingContext:
         characters: List[Character],
         world_settings: List[WorldSetting],
         previous_chapter_hook: str = "",
-        forced_previous_chapter_context: str = ""
+        forced_previous_chapter_context: str = "",
+        context_version: Optional[str] = None
     ):
         self.task_db = task_db
         self.novel = novel
@@ -39,12 +46,101 @@ class ChapterWritingContext:
         self.world_settings = world_settings
         self.previous_chapter_hook = previous_chapter_hook
         self.forced_previous_chapter_context = forced_previous_chapter_context
+        self.context_version = context_version
+
+
+def select_relevant_characters_and_settings(
+    task_db: Session,
+    novel_id: str,
+    chapter: Chapter,
+    characters: List[Character],
+    world_settings: List[WorldSetting],
+    previous_chapter_hook: str = "",
+    character_top_k: int = CHAPTER_CHARACTER_TOP_K,
+    world_setting_top_k: int = CHAPTER_WORLD_SETTING_TOP_K,
+    query_embedding: Optional[List[float]] = None
+) -> tuple:
+    """
+    按章节标题、摘要和上一章钩子检索相关角色与世界观设定
+
+    章节大纲（标题/摘要/写作提示）中点名的角色总是保留；其余按向量相似度取 top-k。
+    还没有向量的实体（刚创建或向量生成失败）无法参与排序，总是保留，避免从所有章节中静默消失。
+    数量不超过 top-k 时不做检索；检索失败或没有任何向量时返回原列表。
+    query_embedding 为调用方已生成的查询向量，传入时不再重复生成。
+
+    Returns:
+        (characters, world_settings)
+    """
+    outline_text = "\n".join(
+        v for v in [chapter.title, chapter.summary or "", chapter.ai_prompt_hints or ""] if v
+    )
+    named = [c for c in characters if c.name and c.name in outline_text]
+    need_characters = len(characters) > max(character_top_k, len(named))
+    need_settings = len(world_settings) > world_setting_top_k
+    if not need_characters and not need_settings:
+        return characters, world_settings
+
+    query_text = "\n".join(v for v in [outline_text, previous_chapter_hook] if v)
+    # 对全部有向量的实体排序（而不只取 top-k），才能区分“排名靠后”与“没有向量”
+    ranked = EmbeddingService().find_relevant_characters_and_settings(
+        db=task_db,
+        novel_id=novel_id,
+        query_text=query_text,
+        character_limit=len(characters) if need_characters else 0,
+        world_setting_limit=len(world_settings) if need_settings else 0,
+        query_embedding=query_embedding
+    )
+
+    selected_characters = characters
+    unranked_characters = 0
+    if need_characters and ranked["characters"]:
+        ranked_ids = {item["id"] for item in ranked["characters"]}
+        keep_ids = {c.id for c in named}
+        for item in ranked["characters"]:
+            if len(keep_ids) >= max(character_top_k, len(named)):
+                break
+            keep_ids.add(item["id"])
+        unranked = {c.id for c in characters if c.id not in ranked_ids}
+        unranked_characters = len(unranked - keep_ids)
+        keep_ids |= unranked
+        selected_characters = [c for c in characters if c.id in keep_ids]
+
+    selected_settings = world_settings
+    unranked_settings = 0
+    if need_settings and ranked["world_settings"]:
+        ranked_ids = {item["id"] for item in ranked["world_settings"]}
+        keep_ids = {item["id"] for item in ranked["world_settings"][:world_setting_top_k]}
+        unranked = {w.id for w in world_settings if w.id not in ranked_ids}
+        unranked_settings = len(unranked)
+        keep_ids |= unranked
+        selected_settings = [w for w in world_settings if w.id in keep_ids]
+
+    logger.info(
+        f"✅ 相关实体检索: 角色 {len(selected_characters)}/{len(characters)}（点名 {len(named)}，无向量 {unranked_characters}），"
+        f"世界观 {len(selected_settings)}/{len(world_settings)}（无向量 {unranked_settings}）"
+    )
+    return selected_characters, selected_settings
+
+
+def _chapter_query_embedding(chapter: Chapter, prompt_hints: str) -> Optional[List[float]]:
+    """
+    生成本章的查询向量（标题 + 摘要 + 含上一章钩子的写作提示），实体筛选与上下文装配共用
+
+    失败时返回 None，两处各自回退。
+    """
+    query = "\n".join(v for v in [chapter.title, chapter.summary or "", prompt_hints] if v)
+    try:
+        return get_embedding_service().generate_embedding(query, task_type="RETRIEVAL_QUERY")
+    except Exception as e:
+        logger.warning(f"⚠️ 章节查询向量生成失败（继续）: {str(e)}")
+        return None
 
 
 def write_and_save_chapter(
     context: ChapterWritingContext,
     progress_callback: Optional[callable] = None,
-    next_chapter: Optional[Chapter] = None
+    next_chapter: Optional[Chapter] = None,
+    draft_mode: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     通用的章节生成、保存、向量存储、伏笔提取函数
@@ -53,6 +149,7 @@ def write_and_save_chapter(
         context: 章节写作上下文
         progress_callback: 进度回调函数，接受 (progress: int, message: str)
         next_chapter: 下一章节对象（用于提取钩子）
+        draft_mode: 正文写作模式，single（整章单次生成）或 scenes（场景并行），默认取 CHAPTER_DRAFT_MODE
     
     Returns:
         {
@@ -60,14 +157,21 @@ def write_and_save_chapter(
             "content": str,
             "foreshadowings": List[str],
             "next_chapter_hook": str,
+            "duplicate_report": Dict（段落重复检查结果，检查失败时为 None）,
+            "draft_mode": str（实际使用的写作模式）,
+            "generation_ms": int（正文生成耗时，毫秒）,
             "error": str (如果失败)
         }
     """
+    draft_mode = "scenes" if (draft_mode or CHAPTER_DRAFT_MODE) == "scenes" else "single"
     result = {
         "success": False,
         "content": "",
         "foreshadowings": [],
         "next_chapter_hook": "",
+        "duplicate_report": None,
+        "draft_mode": draft_mode,
+        "generation_ms": None,
         "error": None
     }
     
@@ -84,32 +188,73 @@ def write_and_save_chapter(
         if progress_callback:
             progress_callback(10, f"正在生成章节：{context.chapter.title}")
         
-        # 2. 生成章节内容
-        content = write_chapter_content_impl(
-            novel_title=context.novel.title,
-            genre=context.novel.genre,
-            synopsis=context.novel.synopsis or "",
-            chapter_title=context.chapter.title,
-            chapter_summary=context.chapter.summary or "",
-            chapter_prompt_hints=current_prompt_hints,
-            characters=[{"name": c.name, "personality": c.personality} for c in context.characters],
-            world_settings=[{"title": w.title, "description": w.description} for w in context.world_settings],
-            previous_chapters_context=None,  # 使用向量数据库智能检索
-            novel_id=context.novel.id,
-            current_chapter_id=context.chapter.id,
-            db_session=context.task_db,
-            forced_previous_chapter_context=context.forced_previous_chapter_context
+        # 2. 只带入与本章相关的角色和世界观（启用前缀缓存时保留全部，使前缀跨章节一致）
+        #    查询向量只生成一次，实体筛选与上下文装配共用
+        characters, world_settings = context.characters, context.world_settings
+        query_embedding = None
+        if not AI_PROMPT_CACHE_ENABLED:
+            if characters or world_settings:
+                query_embedding = _chapter_query_embedding(context.chapter, current_prompt_hints)
+            try:
+                characters, world_settings = select_relevant_characters_and_settings(
+                    context.task_db,
+                    context.novel.id,
+                    context.chapter,
+                    context.characters,
+                    context.world_settings,
+                    previous_chapter_hook=context.previous_chapter_hook,
+                    query_embedding=query_embedding
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ 相关实体检索失败，使用全部角色和世界观: {str(e)}")
+        
+        # 3. 生成章节内容（场景并行模式下每个场景完成时更新进度 10% → 50%）
+        def on_scene(index: int, total: int, title: str):
+            if progress_callback:
+                progress_callback(
+                    10 + int(40 * (index + 1) / max(1, total)),
+                    f"正在生成章节：{context.chapter.title}（场景 {index + 1}/{total}：{title}）"
+                )
+
+        # 写章节总是用户发起的（重新）生成，跳过微服务的响应缓存
+        generation_started = time.perf_counter()
+        with bypass_response_cache():
+            content = asyncio.run(write_chapter_content_impl(
+                novel_title=context.novel.title,
+                genre=context.novel.genre,
+                synopsis=context.novel.synopsis or "",
+                chapter_title=context.chapter.title,
+                chapter_summary=context.chapter.summary or "",
+                chapter_prompt_hints=current_prompt_hints,
+                characters=[{"id": c.id, "name": c.name, "personality": c.personality} for c in characters],
+                world_settings=[{"id": w.id, "title": w.title, "description": w.description} for w in world_settings],
+                previous_chapters_context=None,  # 使用向量数据库智能检索
+                novel_id=context.novel.id,
+                current_chapter_id=context.chapter.id,
+                db_session=context.task_db,
+                forced_previous_chapter_context=context.forced_previous_chapter_context,
+                prompt_cache_key=context.novel.id if AI_PROMPT_CACHE_ENABLED else None,
+                context_version=context.context_version,
+                draft_mode=draft_mode,
+                on_scene=on_scene,
+                query_embedding=query_embedding
+            ))
+        result["generation_ms"] = int((time.perf_counter() - generation_started) * 1000)
+        logger.info(
+            f"✅ 章节 {context.chapter.title} 正文生成完成（模式: {draft_mode}，"
+            f"耗时 {result['generation_ms']}ms，{len(content)} 字）"
         )
         
-        # 3. 保存内容到数据库
+        # 4. 保存内容到数据库
         context.chapter.content = content
         context.chapter.updated_at = int(time.time() * 1000)
         context.task_db.commit()
+        record_chapter_content(context.novel.id, context.chapter.id, context.chapter.title, content)
         
         if progress_callback:
             progress_callback(50, "章节内容生成完成，正在存储向量...")
         
-        # 4. 存储向量
+        # 5. 存储向量
         embedding_service = EmbeddingService()
         try:
             embedding_service.store_chapter_embedding(
@@ -122,13 +267,27 @@ def write_and_save_chapter(
         except Exception as e:
             logger.warning(f"⚠️ 章节向量存储失败（继续）: {str(e)}")
         
+        # 段落重复检查（本地 MinHash 索引，发现候选时才用向量确认）
+        duplicate_report = None
+        try:
+            duplicate_report = ContentSimilarityChecker().check_after_generation(
+                db=context.task_db,
+                novel_id=context.novel.id,
+                generated_content=content,
+                current_chapter_id=context.chapter.id
+            )
+            if duplicate_report.get("has_duplicate_content"):
+                logger.warning(f"⚠️ 章节 {context.chapter.title} {duplicate_report.get('warning')}")
+        except Exception as e:
+            logger.warning(f"⚠️ 段落重复检查失败（继续）: {str(e)}")
+        
         # 短暂延迟，确保向量索引建立完成
         time.sleep(0.5)
         
         if progress_callback:
             progress_callback(70, "正在提取伏笔和钩子...")
         
-        # 5. 提取并保存伏笔
+        # 6. 提取并保存伏笔
         extracted_foreshadowings = []
         try:
             existing_foreshadowings = context.task_db.query(Foreshadowing).filter(
@@ -136,13 +295,13 @@ def write_and_save_chapter(
             ).all()
             existing_foreshadowings_list = [{"content": f.content} for f in existing_foreshadowings]
             
-            foreshadowings_data = extract_foreshadowings_from_chapter(
+            foreshadowings_data = asyncio.run(extract_foreshadowings_from_chapter(
                 title=context.novel.title,
                 genre=context.novel.genre,
                 chapter_title=context.chapter.title,
                 chapter_content=content,
                 existing_foreshadowings=existing_foreshadowings_list
-            )
+            ))
             
             if foreshadowings_data:
                 for foreshadowing_data in foreshadowings_data:
@@ -164,20 +323,20 @@ def write_and_save_chapter(
         except Exception as e:
             logger.warning(f"⚠️ 提取伏笔失败（继续）: {str(e)}")
         
-        # 6. 提取并保存下一章钩子
+        # 7. 提取并保存下一章钩子
         next_chapter_hook = ""
         try:
             next_chapter_title = next_chapter.title if next_chapter else None
             next_chapter_summary = next_chapter.summary if next_chapter else None
             
-            next_chapter_hook = extract_next_chapter_hook(
+            next_chapter_hook = asyncio.run(extract_next_chapter_hook(
                 title=context.novel.title,
                 genre=context.novel.genre,
                 chapter_title=context.chapter.title,
                 chapter_content=content,
                 next_chapter_title=next_chapter_title,
                 next_chapter_summary=next_chapter_summary
-            )
+            ))
             
             if next_chapter_hook:
                 # 将钩子保存到章节的ai_prompt_hints字段
@@ -198,7 +357,8 @@ def write_and_save_chapter(
             "success": True,
             "content": content,
             "foreshadowings": extracted_foreshadowings,
-            "next_chapter_hook": next_chapter_hook
+            "next_chapter_hook": next_chapter_hook,
+            "duplicate_report": duplicate_report
         })
         
     except Exception as e:
@@ -301,6 +461,15 @@ def prepare_chapter_writing_context(
             task_db, volume_id, chapter.chapter_order
         )
     
+    # 小说上下文版本：简介、角色、世界观任一变化都会使微服务刷新前缀缓存
+    context_version = ":".join(str(v) for v in [
+        novel.updated_at,
+        len(characters),
+        max((c.updated_at or 0 for c in characters), default=0),
+        len(world_settings),
+        max((w.updated_at or 0 for w in world_settings), default=0),
+    ])
+    
     return ChapterWritingContext(
         task_db=task_db,
         novel=novel,
@@ -309,6 +478,7 @@ def prepare_chapter_writing_context(
         characters=characters,
         world_settings=world_settings,
         previous_chapter_hook=previous_chapter_hook,
-        forced_previous_chapter_context=forced_previous_chapter_context
+        forced_previous_chapter_context=forced_previous_chapter_context,
+        context_version=context_version
     )
 
@@ -0,0 +1,420 @@
+"""
+上下文装配器
+按模型的 token 预算，对候选上下文片段按「时间近度 + 语义相关度」打分，
+贪心装入预算内，并输出预算使用报告。Agent 与章节生成的提示词都经由这里组装。
+"""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core.config import CONTEXT_DEFAULT_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGETS
+
+logger = logging.getLogger(__name__)
+
+_CJK_RE = re.compile("[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+# 片段分值权重：语义相关度为主，时间近度为辅
+SIMILARITY_WEIGHT = 0.65
+RECENCY_WEIGHT = 0.35
+
+# 被截断的片段至少保留的 token 数，低于该值的残片直接丢弃
+MIN_PARTIAL_TOKENS = 48
+
+
+def estimate_tokens(value: str) -> int:
+    """
+    粗略估算文本 token 数（无需加载分词器）
+
+    中日韩字符约 1 字 1 token，其余字符约 4 字符 1 token。
+    """
+    if not value:
+        return 0
+    cjk = len(_CJK_RE.findall(value))
+    other = len(value) - cjk
+    return cjk + (other + 3) // 4
+
+
+def get_context_budget(model: Optional[str] = None) -> int:
+    """获取模型对应的上下文 token 预算（未配置的模型使用默认预算）"""
+    if model:
+        key = model.lower().strip()
+        if key in CONTEXT_TOKEN_BUDGETS:
+            return CONTEXT_TOKEN_BUDGETS[key]
+        # 支持前缀匹配，例如 gemini-2.0-flash-001 命中 gemini-2.0-flash
+        for name, budget in CONTEXT_TOKEN_BUDGETS.items():
+            if key.startswith(name):
+                return budget
+    return CONTEXT_DEFAULT_TOKEN_BUDGET
+
+
+def _char_bigrams(value: str) -> set:
+    cleaned = re.sub(r"\s+", "", (value or "").lower())
+    if len(cleaned) < 2:
+        return {cleaned} if cleaned else set()
+    return {cleaned[i : i + 2] for i in range(len(cleaned) - 1)}
+
+
+def lexical_similarity(query: str, value: str) -> float:
+    """基于字符二元组重合度的相似度（无向量时的兜底打分）"""
+    query_grams = _char_bigrams(query)
+    if not query_grams:
+        return 0.0
+    value_grams = _char_bigrams(value)
+    if not value_grams:
+        return 0.0
+    return len(query_grams & value_grams) / len(query_grams)
+
+
+def _truncate_to_tokens(value: str, max_tokens: int) -> str:
+    """按 token 估算截断文本（保留开头部分）"""
+    if estimate_tokens(value) <= max_tokens:
+        return value
+    low, high = 0, len(value)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(value[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return value[:low] + "..." if low > 0 else ""
+
+
+@dataclass
+class ContextSnippet:
+    """候选上下文片段"""
+    section: str
+    text: str
+    recency: float = 0.0
+    similarity: Optional[float] = None
+    pinned: bool = False
+    key: Optional[str] = None
+    order: int = 0
+    score: float = 0.0
+    truncatable: bool = True
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+@dataclass
+class AssembledContext:
+    """装配结果"""
+    text: str
+    budget: int
+    used_tokens: int
+    sections: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    selected: List[ContextSnippet] = field(default_factory=list)
+
+    def report(self) -> Dict[str, Any]:
+        """预算使用报告"""
+        return {
+            "budget": self.budget,
+            "used_tokens": self.used_tokens,
+            "utilization": round(self.used_tokens / self.budget, 4) if self.budget else 0.0,
+            "sections": self.sections,
+        }
+
+
+class ContextAssembler:
+    """按 token 预算贪心装配上下文"""
+
+    def __init__(
+        self,
+        budget_tokens: int,
+        similarity_fn: Optional[Callable[[str, Sequence[ContextSnippet]], List[Optional[float]]]] = None,
+        section_order: Optional[Sequence[str]] = None,
+        section_titles: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Args:
+            budget_tokens: 本次装配可用的 token 预算
+            similarity_fn: 批量相似度函数 (query, snippets) -> 每个片段的相似度（None 表示未知）
+            section_order: 输出时各分区的顺序
+            section_titles: 分区标题（为空则不输出标题行）
+        """
+        self.budget_tokens = max(0, int(budget_tokens))
+        self.similarity_fn = similarity_fn
+        self.section_order = list(section_order or [])
+        self.section_titles = dict(section_titles or {})
+        self._snippets: List[ContextSnippet] = []
+
+    def add(
+        self,
+        section: str,
+        value: str,
+        recency: float = 0.0,
+        pinned: bool = False,
+        key: Optional[str] = None,
+        similarity: Optional[float] = None,
+        truncatable: bool = True,
+    ) -> None:
+        """添加候选片段（空文本忽略；truncatable=False 的片段要么整段装入要么丢弃）"""
+        value = (value or "").strip()
+        if not value:
+            return
+        if section not in self.section_order:
+            self.section_order.append(section)
+        self._snippets.append(
+            ContextSnippet(
+                section=section,
+                text=value,
+                recency=max(0.0, min(1.0, recency)),
+                similarity=similarity,
+                pinned=pinned,
+                key=key,
+                order=len(self._snippets),
+                truncatable=truncatable,
+            )
+        )
+
+    def add_many(
+        self,
+        section: str,
+        values: Iterable[str],
+        pinned: bool = False,
+        keys: Optional[Sequence[Optional[str]]] = None,
+        newest_last: bool = True,
+    ) -> None:
+        """批量添加同一分区的片段，按位置推算时间近度"""
+        items = [v for v in values]
+        total = len(items)
+        for idx, value in enumerate(items):
+            if total <= 1:
+                recency = 1.0
+            elif newest_last:
+                recency = idx / (total - 1)
+            else:
+                recency = 1 - idx / (total - 1)
+            key = keys[idx] if keys and idx < len(keys) else None
+            self.add(section, value, recency=recency, pinned=pinned, key=key)
+
+    def _score(self, query: str) -> None:
+        pending = [s for s in self._snippets if s.similarity is None]
+        if pending and query and self.similarity_fn:
+            try:
+                scores = self.similarity_fn(query, pending)
+                for snippet, score in zip(pending, scores):
+                    if score is not None:
+                        snippet.similarity = float(score)
+            except Exception as e:
+                logger.warning(f"⚠️  上下文相似度打分失败，回退到文本重合度: {str(e)}")
+        for snippet in self._snippets:
+            if snippet.similarity is None:
+                snippet.similarity = lexical_similarity(query, snippet.text) if query else 0.0
+        # 相似度按本批最大值归一化，避免量纲偏小的文本重合度被时间近度淹没
+        top = max((s.similarity for s in self._snippets), default=0.0)
+        for snippet in self._snippets:
+            similarity = snippet.similarity / top if top > 0 else 0.0
+            snippet.score = SIMILARITY_WEIGHT * similarity + RECENCY_WEIGHT * snippet.recency
+
+    def pack(self, query: str = "") -> AssembledContext:
+        """
+        打分并在预算内贪心装配
+
+        固定片段（pinned）优先装入；其余按分值从高到低装入，
+        放不下的片段会截断到剩余预算（不少于 MIN_PARTIAL_TOKENS）。
+        输出时按分区顺序、分区内按原始顺序排列，保持叙事时间线。
+        """
+        self._score(query)
+        remaining = self.budget_tokens
+        selected: List[ContextSnippet] = []
+        dropped: Dict[str, int] = {}
+
+        pinned = [s for s in self._snippets if s.pinned]
+        ranked = sorted(
+            (s for s in self._snippets if not s.pinned),
+            key=lambda s: (-s.score, s.order),
+        )
+
+        for snippet in pinned + ranked:
+            cost = snippet.tokens
+            if cost <= remaining:
+                selected.append(snippet)
+                remaining -= cost
+                continue
+            if snippet.truncatable and remaining >= MIN_PARTIAL_TOKENS:
+                truncated = _truncate_to_tokens(snippet.text, remaining)
+                if truncated:
+                    snippet.text = truncated
+                    selected.append(snippet)
+                    remaining -= snippet.tokens
+                    continue
+            dropped[snippet.section] = dropped.get(snippet.section, 0) + 1
+
+        sections: Dict[str, Dict[str, int]] = {}
+        lines: List[str] = []
+        for section in self.section_order:
+            items = sorted((s for s in selected if s.section == section), key=lambda s: s.order)
+            candidates = sum(1 for s in self._snippets if s.section == section)
+            if not candidates:
+                continue
+            section_tokens = sum(s.tokens for s in items)
+            sections[section] = {
+                "candidates": candidates,
+                "selected": len(items),
+                "dropped": dropped.get(section, 0),
+                "tokens": section_tokens,
+            }
+            if not items:
+                continue
+            title = self.section_titles.get(section)
+            if title:
+                lines.append(title)
+            lines.extend(s.text for s in items)
+
+        used = self.budget_tokens - remaining
+        result = AssembledContext(
+            text="\n".join(lines),
+            budget=self.budget_tokens,
+            used_tokens=used,
+            sections=sections,
+            selected=selected,
+        )
+        logger.info(
+            f"上下文装配完成: used={used}/{self.budget_tokens} tokens, "
+            f"selected={len(selected)}/{len(self._snippets)}"
+        )
+        return result
+
+
+# ==================== 向量相似度打分 ====================
+
+# section -> (向量表, 外键列, 向量列)
+_EMBEDDING_TABLES = {
+    "chapters": ("chapter_embeddings", "chapter_id", "full_content_embedding"),
+    "characters": ("character_embeddings", "character_id", "full_description_embedding"),
+    "world_settings": ("world_setting_embeddings", "world_setting_id", "full_description_embedding"),
+    "foreshadowings": ("foreshadowing_embeddings", "foreshadowing_id", "content_embedding"),
+}
+
+
+def make_embedding_similarity_fn(
+    db: Session, novel_id: str, query_embedding: Optional[List[float]] = None
+) -> Callable[[str, Sequence[ContextSnippet]], List[Optional[float]]]:
+    """
+    构造基于已存储向量的相似度函数
+
+    查询文本只生成一次向量（调用方已为同一查询生成过向量时通过 query_embedding 传入，不再重复生成）；
+    片段通过 key（实体ID）到对应向量表中取余弦相似度，没有向量的片段返回 None，由装配器回退到文本重合度。
+    查询在保存点内执行，失败时不回滚调用方会话中未提交的修改。
+    """
+
+    def _similarity(query: str, snippets: Sequence[ContextSnippet]) -> List[Optional[float]]:
+        by_section: Dict[str, List[str]] = {}
+        for snippet in snippets:
+            if snippet.key and snippet.section in _EMBEDDING_TABLES:
+                by_section.setdefault(snippet.section, []).append(snippet.key)
+        if not by_section:
+            return [None] * len(snippets)
+
+        from services.embedding.vector_helper import get_embedding_service
+
+        embedding = query_embedding
+        if embedding is None:
+            embedding = get_embedding_service().generate_embedding(query, task_type="RETRIEVAL_QUERY")
+        query_embedding_str = "[" + ",".join(map(str, embedding)) + "]"
+
+        scores: Dict[tuple, float] = {}
+        for section, ids in by_section.items():
+            table, id_column, vector_column = _EMBEDDING_TABLES[section]
+            try:
+                with db.begin_nested():
+                    rows = db.execute(
+                        text(
+                            f"""
+                            SELECT {id_column}, 1 - ({vector_column} <=> CAST(:query_embedding AS vector))
+                            FROM {table}
+                            WHERE novel_id = :novel_id
+                            AND {vector_column} IS NOT NULL
+                            AND {id_column} = ANY(:ids)
+                            """
+                        ),
+                        {"novel_id": novel_id, "query_embedding": query_embedding_str, "ids": ids},
+                    ).fetchall()
+            except Exception as e:
+                logger.warning(f"⚠️  读取 {table} 相似度失败: {str(e)}")
+                continue
+            for row in rows:
+                scores[(section, row[0])] = max(0.0, float(row[1]))
+
+        return [scores.get((s.section, s.key)) for s in snippets]
+
+    return _similarity
+
+
+# ==================== 章节生成上下文 ====================
+
+_PREVIOUS_CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+
+def assemble_chapter_context(
+    chapter_title: str,
+    chapter_summary: str,
+    chapter_prompt_hints: str,
+    characters: List[Dict],
+    world_settings: List[Dict],
+    previous_chapters_context: Optional[str] = None,
+    budget_tokens: Optional[int] = None,
+    similarity_fn: Optional[Callable[[str, Sequence[ContextSnippet]], List[Optional[float]]]] = None,
+) -> Dict[str, Any]:
+    """
+    在预算内为章节生成挑选角色、世界观与前文参考
+
+    标题/摘要/提示中点名的角色必定保留；前文参考的第一段（通常是上一章）必定保留。
+
+    Returns:
+        {"characters", "world_settings", "previous_chapters_context", "report"}
+    """
+    from core.config import CHAPTER_CONTEXT_TOKEN_BUDGET
+
+    query = "\n".join(v for v in [chapter_title, chapter_summary, chapter_prompt_hints] if v)
+    assembler = ContextAssembler(
+        budget_tokens=budget_tokens if budget_tokens is not None else CHAPTER_CONTEXT_TOKEN_BUDGET,
+        similarity_fn=similarity_fn,
+        section_order=["previous", "characters", "world_settings"],
+    )
+
+    character_map: Dict[str, Dict] = {}
+    for idx, c in enumerate(characters or []):
+        key = str(c.get("id") or f"#{idx}")
+        character_map[key] = c
+        name = (c.get("name") or "").strip()
+        assembler.add(
+            "characters",
+            f"{name}：{c.get('personality') or ''}",
+            pinned=bool(name) and name in query,
+            key=key,
+            truncatable=False,
+        )
+
+    setting_map: Dict[str, Dict] = {}
+    for idx, w in enumerate(world_settings or []):
+        key = str(w.get("id") or f"#{idx}")
+        setting_map[key] = w
+        assembler.add("world_settings", f"{w.get('title') or ''}：{w.get('description') or ''}", key=key, truncatable=False)
+
+    blocks = [b for b in (previous_chapters_context or "").split(_PREVIOUS_CONTEXT_SEPARATOR) if b.strip()]
+    for idx, block in enumerate(blocks):
+        assembler.add(
+            "previous",
+            block,
+            recency=1.0 if len(blocks) == 1 else 1 - idx / (len(blocks) - 1),
+            pinned=idx == 0,
+        )
+
+    result = assembler.pack(query)
+    selected_characters = [character_map[s.key] for s in sorted(result.selected, key=lambda s: s.order) if s.section == "characters"]
+    selected_settings = [setting_map[s.key] for s in sorted(result.selected, key=lambda s: s.order) if s.section == "world_settings"]
+    selected_previous = [s.text for s in sorted(result.selected, key=lambda s: s.order) if s.section == "previous"]
+
+    return {
+        "characters": selected_characters,
+        "world_settings": selected_settings,
+        "previous_chapters_context": _PREVIOUS_CONTEXT_SEPARATOR.join(selected_previous) or None,
+        "report": result.report(),
+    }
@@ -0,0 +1,157 @@
+"""
+段落级修订
+Critic 不通过时不再整篇重写：Critic 对带 [P编号] 的草稿给出按段落定位的问题，
+只把被标记的段落（连同前后少量上下文）交给作家重写，再把补丁拼回原稿。
+标记不可用（没有定位、定位越界、被标记的段落过多）时返回 None，由调用方退回整篇重写。
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from services.ai.context_assembler import estimate_tokens
+
+# 被标记段落超过该比例时整篇重写更划算
+MAX_REVISION_RATIO = 0.5
+
+# 补丁前后附带的原文段落数
+CONTEXT_PARAGRAPHS = 1
+
+# 补丁输出 token 预算：原段落 token 数的倍数，上下限
+PATCH_TOKEN_FACTOR = 2
+MIN_PATCH_TOKENS = 256
+MAX_PATCH_TOKENS = 4096
+
+_PARAGRAPH_LABEL_RE = re.compile(r"^\s*\[P\d+\]\s*")
+
+
+@dataclass
+class RevisionSpan:
+    """一段连续的待修订段落（下标含头含尾，从 0 开始）"""
+    start: int
+    end: int
+    issues: List[str] = field(default_factory=list)
+
+    @property
+    def label(self) -> str:
+        if self.start == self.end:
+            return f"P{self.start + 1}"
+        return f"P{self.start + 1}-P{self.end + 1}"
+
+
+def split_paragraphs(text_value: str) -> List[str]:
+    """按行切分段落，去掉空行"""
+    return [line.strip() for line in (text_value or "").splitlines() if line.strip()]
+
+
+def paragraph_separator(text_value: str) -> str:
+    """原稿的段落分隔符（拼回补丁时沿用）"""
+    return "\n\n" if "\n\n" in (text_value or "") else "\n"
+
+
+def number_paragraphs(paragraphs: Sequence[str]) -> str:
+    """给段落加 [P编号] 标记，供 Critic 定位问题"""
+    return "\n\n".join(f"[P{index + 1}] {paragraph}" for index, paragraph in enumerate(paragraphs))
+
+
+def _issue_paragraphs(issue: Dict[str, Any]) -> List[int]:
+    raw = issue.get("paragraphs")
+    if raw is None:
+        raw = issue.get("paragraph")
+    if raw is None:
+        return []
+    if not isinstance(raw, list):
+        raw = [raw]
+    numbers = []
+    for item in raw:
+        try:
+            numbers.append(int(str(item).strip().lstrip("Pp")))
+        except ValueError:
+            continue
+    return numbers
+
+
+def _issue_text(issue: Any) -> str:
+    if isinstance(issue, dict):
+        return str(issue.get("issue") or issue.get("problem") or issue.get("text") or "").strip()
+    return str(issue).strip()
+
+
+def issue_texts(issues: Sequence[Any]) -> List[str]:
+    """把（可能带段落定位的）问题列表转成字符串列表，SSE 与运行记录中的 issues 保持原格式"""
+    texts = []
+    for issue in issues or []:
+        text_value = _issue_text(issue)
+        if isinstance(issue, dict):
+            numbers = _issue_paragraphs(issue)
+            if numbers:
+                text_value = f"[{', '.join(f'P{n}' for n in numbers)}] {text_value}"
+        if text_value:
+            texts.append(text_value)
+    return texts
+
+
+def plan_revision(issues: Sequence[Any], paragraph_count: int) -> Optional[List[RevisionSpan]]:
+    """根据段落定位合并出待修订的连续区间；无法局部修订时返回 None"""
+    if paragraph_count <= 0:
+        return None
+    flagged: Dict[int, List[str]] = {}
+    for issue in issues or []:
+        if not isinstance(issue, dict):
+            return None
+        numbers = _issue_paragraphs(issue)
+        if not numbers or any(n < 1 or n > paragraph_count for n in numbers):
+            return None
+        for number in numbers:
+            flagged.setdefault(number - 1, []).append(_issue_text(issue))
+    if not flagged or len(flagged) > paragraph_count * MAX_REVISION_RATIO:
+        return None
+
+    spans: List[RevisionSpan] = []
+    for index in sorted(flagged):
+        if spans and index <= spans[-1].end + 1:
+            spans[-1].end = index
+        else:
+            spans.append(RevisionSpan(start=index, end=index))
+        for text_value in flagged[index]:
+            if text_value and text_value not in spans[-1].issues:
+                spans[-1].issues.append(text_value)
+    return spans
+
+
+def build_patch_prompt(paragraphs: Sequence[str], span: RevisionSpan) -> str:
+    """作家重写单个区间的提示词：前后文只作参照，只输出替换后的段落"""
+    before = paragraphs[max(0, span.start - CONTEXT_PARAGRAPHS):span.start]
+    target = paragraphs[span.start:span.end + 1]
+    after = paragraphs[span.end + 1:span.end + 1 + CONTEXT_PARAGRAPHS]
+    parts = [f"Revise paragraphs {span.label} of the scene. Keep everything else unchanged."]
+    if before:
+        parts.append("Preceding text (do not output):\n" + "\n".join(before))
+    parts.append(f"Paragraphs to revise ({span.label}):\n" + "\n".join(target))
+    if after:
+        parts.append("Following text (do not output):\n" + "\n".join(after))
+    parts.append("Issues:\n" + "\n".join(f"- {issue}" for issue in span.issues or ["整体打磨"]))
+    parts.append("只输出改写后的这几段正文（可以增减段落），与前后文自然衔接，不要编号、解释或重复上下文。")
+    return "\n\n".join(parts)
+
+
+def patch_token_budget(paragraphs: Sequence[str], span: RevisionSpan) -> int:
+    tokens = estimate_tokens("\n".join(paragraphs[span.start:span.end + 1]))
+    return max(MIN_PATCH_TOKENS, min(MAX_PATCH_TOKENS, tokens * PATCH_TOKEN_FACTOR))
+
+
+def splice_patches(
+    paragraphs: Sequence[str],
+    spans: Sequence[RevisionSpan],
+    patches: Sequence[str],
+    separator: str = "\n\n",
+) -> str:
+    """把补丁拼回原稿；某个补丁为空时保留该区间原文"""
+    result: List[str] = []
+    cursor = 0
+    for span, patch in zip(spans, patches):
+        result.extend(paragraphs[cursor:span.start])
+        replacement = [_PARAGRAPH_LABEL_RE.sub("", line) for line in split_paragraphs(patch)]
+        result.extend(replacement or paragraphs[span.start:span.end + 1])
+        cursor = span.end + 1
+    result.extend(paragraphs[cursor:])
+    return separator.join(result)
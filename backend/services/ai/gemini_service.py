@@ -2,12 +2,60 @@
 import logging
 from typing import Optional, AsyncGenerator
 from services.ai.ai_service_client import AIServiceClient
-from core.config import AI_SERVICE_URL, AI_SERVICE_PROVIDER
+from services.ai.context_assembler import assemble_chapter_context, make_embedding_similarity_fn
+from core.config import AI_SERVICE_URL, AI_SERVICE_PROVIDER, CHAPTER_DRAFT_MODE
 
 # 初始化微服务客户端
 _ai_client = AIServiceClient(base_url=AI_SERVICE_URL, provider=AI_SERVICE_PROVIDER)
 logger = logging.getLogger(__name__)
 
+
+def _pack_chapter_inputs(
+    chapter_title: str,
+    chapter_summary: str,
+    chapter_prompt_hints: str,
+    characters: list,
+    world_settings: list,
+    previous_chapters_context: Optional[str],
+    novel_id: Optional[str] = None,
+    db_session=None,
+    pack_entities: bool = True,
+    query_embedding: Optional[list] = None,
+) -> dict:
+    """
+    按 token 预算挑选章节提示词中的角色、世界观与前文（失败时原样返回）
+
+    pack_entities=False 时角色和世界观原样保留（它们属于可缓存的稳定前缀），只裁剪前文。
+    query_embedding 为调用方已生成的查询向量（标题 + 摘要 + 写作提示），传入时不再重复生成。
+    """
+    try:
+        similarity_fn = (
+            make_embedding_similarity_fn(db_session, novel_id, query_embedding=query_embedding)
+            if novel_id and db_session else None
+        )
+        packed = assemble_chapter_context(
+            chapter_title=chapter_title,
+            chapter_summary=chapter_summary,
+            chapter_prompt_hints=chapter_prompt_hints,
+            characters=characters if pack_entities else [],
+            world_settings=world_settings if pack_entities else [],
+            previous_chapters_context=previous_chapters_context,
+            similarity_fn=similarity_fn,
+        )
+        logger.info(f"✅ 章节上下文预算: {packed['report']}")
+        if not pack_entities:
+            packed["characters"] = characters
+            packed["world_settings"] = world_settings
+        return packed
+    except Exception as e:
+        logger.warning(f"⚠️  章节上下文装配失败，使用原始上下文: {str(e)}")
+        return {
+            "characters": characters,
+            "world_settings": world_settings,
+            "previous_chapters_context": previous_chapters_context,
+        }
+
+
 # ==================== 适配器函数 ====================
 # 保持原有函数签名，调用微服务
 
@@ -96,6 +144,18 @@ async def generate_chapter_outline(
     )
 
 
+def generate_chapter_outline_stream(**kwargs) -> AsyncGenerator[dict, None]:
+    """流式生成章节列表（适配器，参数同 generate_chapter_outline），每生成完一章产出一章"""
+    logger.info(f"[AI Service Adapter] 流式生成章节列表: {kwargs.get('volume_title')}")
+    return _ai_client.generate_chapter_outline_stream(**kwargs)
+
+
+def _resolve_draft_mode(draft_mode: Optional[str]) -> str:
+    """章节正文写作模式：single（整章单次生成）或 scenes（场景并行）"""
+    mode = (draft_mode or CHAPTER_DRAFT_MODE or "single").lower()
+    return "scenes" if mode == "scenes" else "single"
+
+
 async def write_chapter_content_stream(
     novel_title: str,
     genre: str,
@@ -109,9 +169,15 @@ async def write_chapter_content_stream(
     novel_id: Optional[str] = None,
     current_chapter_id: Optional[str] = None,
     db_session=None,
-    forced_previous_chapter_context: Optional[str] = None
+    forced_previous_chapter_context: Optional[str] = None,
+    draft_mode: Optional[str] = None
 ):
-    """流式生成章节内容（适配器，保留向量检索逻辑）"""
+    """
+    流式生成章节内容（适配器，保留向量检索逻辑）
+
+    draft_mode 为 "scenes" 时使用场景并行写作（默认取 CHAPTER_DRAFT_MODE），
+    事件与整章模式兼容，另有 plan / scene 事件。
+    """
     logger.info(f"[AI Service Adapter] 流式生成章节: {chapter_title}")
 
     # ==================== 在主应用中进行向量检索 ====================
@@ -161,17 +227,28 @@ async def write_chapter_content_stream(
             # 如果向量检索失败，使用原始上下文，不影响主流程
             logger.warning(f"⚠️  智能上下文检索失败，使用原始上下文: {str(e)}")
 
+    packed = _pack_chapter_inputs(
+        chapter_title, chapter_summary, chapter_prompt_hints,
+        characters, world_settings, previous_chapters_context,
+        novel_id=novel_id, db_session=db_session,
+    )
+
     # 调用微服务
-    async for chunk in _ai_client.write_chapter_content_stream(
+    stream = (
+        _ai_client.write_chapter_scenes_stream
+        if _resolve_draft_mode(draft_mode) == "scenes"
+        else _ai_client.write_chapter_content_stream
+    )
+    async for chunk in stream(
         novel_title=novel_title,
         genre=genre,
         synopsis=synopsis,
         chapter_title=chapter_title,
         chapter_summary=chapter_summary,
         chapter_prompt_hints=chapter_prompt_hints,
-        characters=characters,
-        world_settings=world_settings,
-        previous_chapters_context=previous_chapters_context
+        characters=packed["characters"],
+        world_settings=packed["world_settings"],
+        previous_chapters_context=packed["previous_chapters_context"]
     ):
         yield chunk
 
@@ -190,9 +267,22 @@ async def write_chapter_content(
     current_chapter_id: Optional[str] = None,
     db_session=None,
     progress_callback=None,
-    forced_previous_chapter_context: Optional[str] = None
+    forced_previous_chapter_context: Optional[str] = None,
+    prompt_cache_key: Optional[str] = None,
+    context_version: Optional[str] = None,
+    draft_mode: Optional[str] = None,
+    on_scene=None,
+    query_embedding: Optional[list] = None
 ) -> str:
-    """生成章节内容（非流式，适配器，保留向量检索逻辑）"""
+    """
+    生成章节内容（非流式，适配器，保留向量检索逻辑）
+
+    传入 prompt_cache_key 时，微服务会把小说级的稳定前缀登记到提供商的上下文缓存，
+    此时角色与世界观不再按章节裁剪，以保证前缀跨章节一致。
+    draft_mode 为 "scenes" 时使用场景并行写作（默认取 CHAPTER_DRAFT_MODE），
+    每个场景完成时回调 on_scene(index, total, title)。
+    query_embedding 为调用方已生成的本章查询向量（标题 + 摘要 + 写作提示），上下文装配时复用。
+    """
     logger.info(f"[AI Service Adapter] 生成章节内容: {chapter_title}")
 
     # ==================== 在主应用中进行向量检索 ====================
@@ -242,7 +332,30 @@ async def write_chapter_content(
             # 如果向量检索失败，使用原始上下文，不影响主流程
             logger.warning(f"⚠️  智能上下文检索失败，使用原始上下文: {str(e)}")
 
+    packed = _pack_chapter_inputs(
+        chapter_title, chapter_summary, chapter_prompt_hints,
+        characters, world_settings, previous_chapters_context,
+        novel_id=novel_id, db_session=db_session,
+        pack_entities=not prompt_cache_key,
+        query_embedding=query_embedding,
+    )
+
     # 调用微服务
+    if _resolve_draft_mode(draft_mode) == "scenes":
+        return await _ai_client.write_chapter_scenes(
+            on_scene=on_scene,
+            novel_title=novel_title,
+            genre=genre,
+            synopsis=synopsis,
+            chapter_title=chapter_title,
+            chapter_summary=chapter_summary,
+            chapter_prompt_hints=chapter_prompt_hints,
+            characters=packed["characters"],
+            world_settings=packed["world_settings"],
+            previous_chapters_context=packed["previous_chapters_context"],
+            prompt_cache_key=prompt_cache_key,
+            context_version=context_version
+        )
     return await _ai_client.write_chapter_content(
         novel_title=novel_title,
         genre=genre,
@@ -250,13 +363,20 @@ async def write_chapter_content(
         chapter_title=chapter_title,
         chapter_summary=chapter_summary,
         chapter_prompt_hints=chapter_prompt_hints,
-        characters=characters,
-        world_settings=world_settings,
-        previous_chapters_context=previous_chapters_context,
-        progress_callback=progress_callback
+        characters=packed["characters"],
+        world_settings=packed["world_settings"],
+        previous_chapters_context=packed["previous_chapters_context"],
+        progress_callback=progress_callback,
+        prompt_cache_key=prompt_cache_key,
+        context_version=context_version
     )
 
 
+def ai_client_session(max_connections: int = 8):
+    """批量调用时复用微服务连接池（async with ai_client_session(): ...）"""
+    return _ai_client.session(max_connections=max_connections)
+
+
 async def summarize_chapter_content(
     chapter_title: str,
     chapter_content: str,
@@ -345,6 +465,21 @@ async def generate_timeline_events(
     )
 
 
+def generate_characters_stream(title: str, genre: str, synopsis: str, outline: str) -> AsyncGenerator[dict, None]:
+    """流式生成角色列表（适配器）"""
+    return _ai_client.generate_characters_stream(title=title, genre=genre, synopsis=synopsis, outline=outline)
+
+
+def generate_world_settings_stream(title: str, genre: str, synopsis: str, outline: str) -> AsyncGenerator[dict, None]:
+    """流式生成世界观设定（适配器）"""
+    return _ai_client.generate_world_settings_stream(title=title, genre=genre, synopsis=synopsis, outline=outline)
+
+
+def generate_timeline_events_stream(title: str, genre: str, synopsis: str, outline: str) -> AsyncGenerator[dict, None]:
+    """流式生成时间线事件（适配器）"""
+    return _ai_client.generate_timeline_events_stream(title=title, genre=genre, synopsis=synopsis, outline=outline)
+
+
 async def generate_foreshadowings_from_outline(
     title: str,
     genre: str,
@@ -0,0 +1,403 @@
+"""
+Agent LLM 网关
+Agent 端点原本每次调用都新建 genai.Client（并改写代理环境变量）或 httpx.Client，模型名写死，
+既没有连接复用也没有重试。这里把所有 Agent 调用收口到一个进程级网关：
+- 网关在独立线程中运行一个事件循环，每个提供商一个共享的 httpx.AsyncClient 连接池（keep-alive 复用连接）；
+  Gemini 直接调用 REST 接口（当前 google-genai SDK 每个请求都新建 HTTP 会话），代理配置在连接池上，不再改写环境变量
+- 同步调用方（流程生成器、推测执行线程）通过 generate / stream 桥接；流式分片经队列交给调用线程，
+  调用方关闭迭代器时取消网关中的读取任务并关闭上游响应
+- 每次尝试都占用 (提供商, 模型, Key) 的限流槽；429/5xx/网络错误按退避重试，流式只在尚未输出分片时重试
+- 每个 Agent 使用的提供商与模型来自 AGENT_MODELS 配置
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from core.rate_limiter import get_rate_limiter, is_throttle_error, retry_after_from_error
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_PROVIDERS = ("gemini", "deepseek")
+
+GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com"
+
+# 退避等待上限（秒）
+MAX_RETRY_DELAY_SECONDS = 30.0
+
+_STREAM_END = object()
+
+
+@dataclass(frozen=True)
+class AgentModel:
+    """Agent 调用的目标提供商与模型"""
+    provider: str
+    model: str
+
+
+def default_model(provider: str) -> str:
+    from core.config import AGENT_GEMINI_MODEL, DEEPSEEK_MODEL
+
+    return AGENT_GEMINI_MODEL if provider == "gemini" else DEEPSEEK_MODEL
+
+
+def resolve_agent_model(
+    agent: str,
+    provider: Optional[str] = None,
+    agent_models: Optional[Dict[str, Tuple[str, str]]] = None,
+    default_provider: Optional[str] = None,
+) -> AgentModel:
+    """确定 Agent 使用的提供商与模型
+
+    请求显式指定的提供商优先；AGENT_MODELS 中该 Agent（或 default）的配置在提供商一致或请求未指定时生效，
+    配置未写模型名时使用提供商的默认模型。不支持的提供商抛出 ValueError。
+    """
+    if agent_models is None or default_provider is None:
+        from core.config import AGENT_MODELS, DEFAULT_AI_PROVIDER
+
+        agent_models = AGENT_MODELS if agent_models is None else agent_models
+        default_provider = DEFAULT_AI_PROVIDER if default_provider is None else default_provider
+
+    configured = agent_models.get((agent or "").lower()) or agent_models.get("default")
+    requested = (provider or "").lower().strip()
+    if requested:
+        name = requested
+        model = configured[1] if configured and configured[0] == requested else ""
+    elif configured:
+        name, model = configured
+    else:
+        name, model = (default_provider or "gemini").lower().strip(), ""
+    if name not in SUPPORTED_PROVIDERS:
+        raise ValueError(f"Unsupported provider: {name}")
+    return AgentModel(provider=name, model=model or default_model(name))
+
+
+def deepseek_endpoint(base_url: str) -> str:
+    base = base_url.rstrip("/")
+    if base.endswith("/v1"):
+        return f"{base}/chat/completions"
+    return f"{base}/v1/chat/completions"
+
+
+def extract_openai_text(data: Dict[str, Any]) -> str:
+    choices = data.get("choices") or []
+    parts: List[str] = []
+    for choice in choices:
+        message = choice.get("message") or {}
+        content = message.get("content") or choice.get("text") or ""
+        parts.append(content)
+    return "".join(parts)
+
+
+def extract_gemini_text(data: Dict[str, Any]) -> str:
+    parts: List[str] = []
+    for candidate in data.get("candidates") or []:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            parts.append(part.get("text") or "")
+    return "".join(parts)
+
+
+async def _sse_payloads(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """逐行读取 SSE 响应中的 JSON 数据（遇到 [DONE] 结束）"""
+    async for line in response.aiter_lines():
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """限流、服务端错误和网络错误可以重试；4xx（除 429）不重试"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if is_throttle_error(error):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if not isinstance(status, int):
+        status = getattr(error, "code", None)
+    return isinstance(status, int) and status >= 500
+
+
+class LLMGateway:
+    """进程级 Agent LLM 网关（连接池 + 异步流式 + 限流与重试）"""
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        timeout_seconds: float = 300.0,
+        max_retries: int = 2,
+        retry_base_seconds: float = 0.5,
+        deepseek_base_url: Optional[str] = None,
+        deepseek_api_key: Optional[str] = None,
+        gemini_api_key: Optional[str] = None,
+        gemini_proxy: Optional[str] = None,
+        gemini_base_url: str = GEMINI_API_BASE_URL,
+    ):
+        self.max_connections = max(1, max_connections)
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max(0, max_retries)
+        self.retry_base_seconds = retry_base_seconds
+        self.deepseek_base_url = deepseek_base_url or ""
+        self.deepseek_api_key = deepseek_api_key
+        self.gemini_api_key = gemini_api_key
+        self.gemini_proxy = (gemini_proxy or "").strip() or None
+        self.gemini_base_url = gemini_base_url.rstrip("/")
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self.stats = {"requests": 0, "streams": 0, "retries": 0, "errors": 0, "cancelled_streams": 0}
+
+    # ==================== 事件循环与连接池 ====================
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name="agent-llm-gateway").start()
+                self._loop = loop
+            return self._loop
+
+    def _client(self, provider: str) -> httpx.AsyncClient:
+        """提供商的共享连接池（只在网关事件循环内调用）"""
+        client = self._clients.get(provider)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=self.timeout_seconds,
+                trust_env=False,
+                proxy=self.gemini_proxy if provider == "gemini" else None,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._clients[provider] = client
+            logger.info(f"✅ Agent LLM 网关已创建 {provider} 连接池 (max_connections={self.max_connections})")
+        return client
+
+    def _api_key(self, provider: str) -> str:
+        key = self.gemini_api_key if provider == "gemini" else self.deepseek_api_key
+        if not key:
+            raise RuntimeError(f"{provider.upper()}_API_KEY not configured")
+        return key
+
+    def _request(self, route: AgentModel, prompt: str, temperature: float, max_tokens: int, stream: bool):
+        """构造上游请求：(URL, JSON 请求体, 请求头)"""
+        if route.provider == "gemini":
+            action = "streamGenerateContent?alt=sse" if stream else "generateContent"
+            payload = {
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens},
+            }
+            headers = {"x-goog-api-key": self.gemini_api_key, "Content-Type": "application/json"}
+            return f"{self.gemini_base_url}/v1beta/models/{route.model}:{action}", payload, headers
+
+        payload = {
+            "model": route.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if stream:
+            payload["stream"] = True
+        headers = {"Authorization": f"Bearer {self.deepseek_api_key}", "Content-Type": "application/json"}
+        return deepseek_endpoint(self.deepseek_base_url), payload, headers
+
+    # ==================== 异步调用（运行在网关事件循环） ====================
+
+    async def _agenerate(self, route: AgentModel, prompt: str, temperature: float, max_tokens: int) -> str:
+        url, payload, headers = self._request(route, prompt, temperature, max_tokens, stream=False)
+        response = await self._client(route.provider).post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        if route.provider == "gemini":
+            return extract_gemini_text(response.json())
+        return extract_openai_text(response.json())
+
+    async def _astream(
+        self, route: AgentModel, prompt: str, temperature: float, max_tokens: int
+    ) -> AsyncIterator[str]:
+        url, payload, headers = self._request(route, prompt, temperature, max_tokens, stream=True)
+        async with self._client(route.provider).stream("POST", url, json=payload, headers=headers) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+            async for data in _sse_payloads(response):
+                if route.provider == "gemini":
+                    text = extract_gemini_text(data)
+                    if text:
+                        yield text
+                    continue
+                for choice in data.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        yield text
+
+    async def _pump_stream(self, items: "queue.Queue", route: AgentModel, prompt: str, temperature: float, max_tokens: int):
+        error = None
+        try:
+            async for text in self._astream(route, prompt, temperature, max_tokens):
+                items.put((text, None))
+        except Exception as e:
+            error = e
+        finally:
+            items.put((_STREAM_END, error))
+
+    # ==================== 同步桥接 ====================
+
+    def _retry_delay(self, attempt: int, error: BaseException) -> float:
+        retry_after = retry_after_from_error(error)
+        if retry_after is not None:
+            return min(MAX_RETRY_DELAY_SECONDS, retry_after)
+        return min(MAX_RETRY_DELAY_SECONDS, self.retry_base_seconds * (2 ** (attempt - 1)))
+
+    def _should_retry(self, attempt: int, error: BaseException, route: AgentModel) -> bool:
+        if attempt >= self.max_retries or not is_retryable_error(error):
+            with self._lock:
+                self.stats["errors"] += 1
+            return False
+        with self._lock:
+            self.stats["retries"] += 1
+        delay = self._retry_delay(attempt + 1, error)
+        logger.warning(
+            f"⚠️ Agent LLM 调用失败，{delay:.1f}s 后重试 ({attempt + 1}/{self.max_retries}) "
+            f"{route.provider}/{route.model}: {str(error)}"
+        )
+        time.sleep(delay)
+        return True
+
+    def generate(self, route: AgentModel, prompt: str, temperature: float = 0.6, max_tokens: int = 4096) -> str:
+        """非流式调用，返回完整文本"""
+        limiter = get_rate_limiter(route.provider, route.model, self._api_key(route.provider))
+        loop = self._ensure_loop()
+        with self._lock:
+            self.stats["requests"] += 1
+        attempt = 0
+        while True:
+            try:
+                with limiter.slot():
+                    future = asyncio.run_coroutine_threadsafe(
+                        self._agenerate(route, prompt, temperature, max_tokens), loop
+                    )
+                    return future.result()
+            except Exception as e:
+                if not self._should_retry(attempt, e, route):
+                    raise
+                attempt += 1
+
+    def stream(self, route: AgentModel, prompt: str, temperature: float = 0.6, max_tokens: int = 4096) -> Iterator[str]:
+        """流式调用，逐个产出文本分片；关闭迭代器时取消上游读取"""
+        limiter = get_rate_limiter(route.provider, route.model, self._api_key(route.provider))
+        loop = self._ensure_loop()
+        with self._lock:
+            self.stats["streams"] += 1
+        attempt = 0
+        while True:
+            started = False
+            try:
+                # 流式调用在整个迭代期间占用并发槽
+                with limiter.slot():
+                    items: "queue.Queue" = queue.Queue()
+                    future = asyncio.run_coroutine_threadsafe(
+                        self._pump_stream(items, route, prompt, temperature, max_tokens), loop
+                    )
+                    ended = False
+                    try:
+                        while True:
+                            text, error = items.get()
+                            if text is _STREAM_END:
+                                ended = True
+                                break
+                            started = True
+                            yield text
+                    finally:
+                        if not ended:
+                            future.cancel()
+                            with self._lock:
+                                self.stats["cancelled_streams"] += 1
+                    if error is not None:
+                        raise error
+                return
+            except Exception as e:
+                if started:
+                    # 已经输出过分片，重试会重复内容
+                    with self._lock:
+                        self.stats["errors"] += 1
+                    raise
+                if not self._should_retry(attempt, e, route):
+                    raise
+                attempt += 1
+
+    # ==================== 运维 ====================
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self.stats)
+        data.update({
+            "max_connections": self.max_connections,
+            "loop_running": bool(self._loop and self._loop.is_running()),
+            "pools": sorted(self._clients),
+        })
+        return data
+
+    async def _shutdown(self) -> None:
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+        await asyncio.get_running_loop().shutdown_asyncgens()
+
+    def close(self) -> None:
+        """取消仍在进行的读取，关闭连接池并停止事件循环"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"⚠️ 关闭 Agent LLM 网关失败: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    """获取进程级 Agent LLM 网关"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                from core.config import (
+                    AGENT_LLM_MAX_CONNECTIONS, AGENT_LLM_MAX_RETRIES, AGENT_LLM_RETRY_BASE_SECONDS,
+                    DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_TIMEOUT_MS, GEMINI_API_BASE_URL, GEMINI_API_KEY,
+                    GEMINI_PROXY,
+                )
+
+                _gateway = LLMGateway(
+                    max_connections=AGENT_LLM_MAX_CONNECTIONS,
+                    timeout_seconds=DEEPSEEK_TIMEOUT_MS / 1000,
+                    max_retries=AGENT_LLM_MAX_RETRIES,
+                    retry_base_seconds=AGENT_LLM_RETRY_BASE_SECONDS,
+                    deepseek_base_url=DEEPSEEK_BASE_URL,
+                    deepseek_api_key=DEEPSEEK_API_KEY,
+                    gemini_api_key=GEMINI_API_KEY,
+                    gemini_proxy=GEMINI_PROXY,
+                    gemini_base_url=GEMINI_API_BASE_URL,
+                )
+    return _gateway
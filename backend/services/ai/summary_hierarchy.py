@@ -0,0 +1,400 @@
+"""
+分层摘要：章节 → 卷 → 全书
+
+章节摘要按正文哈希缓存，只重新摘要正文改动过的章节；卷摘要由章节摘要逐级汇总（每 SUMMARY_ROLLUP_FANOUT 个合并一次），
+全书梗概再由卷摘要汇总。每个汇总节点按输入内容哈希缓存，追加一章只会重算它所在的分组和上层节点。
+一次任务的所有摘要请求在同一个事件循环里以有界并发发出，并复用同一个微服务连接池。
+
+缓存存放在 story_summaries 表：
+    chapter  章节摘要对应的正文哈希（摘要本身写回 chapters.summary）
+    node     汇总节点，content_hash 为输入内容哈希，ref_id 再带上小说ID（不同小说中输入相同的节点各存一份）
+    volume   卷摘要（不覆盖 volumes.summary，那是大纲里的卷简介）
+    novel    全书梗概（不覆盖 novels.synopsis）
+"""
+import asyncio
+import contextlib
+import hashlib
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core.config import (
+    STORY_SO_FAR_RECENT_CHAPTERS,
+    SUMMARY_CONCURRENCY,
+    SUMMARY_MAX_CHARS,
+    SUMMARY_ROLLUP_FANOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# (标题, 正文, 最大字数) -> 摘要
+SummarizeFn = Callable[[str, str, int], Awaitable[str]]
+
+_table_ready = False
+
+
+def ensure_summary_table(db: Session) -> None:
+    """创建摘要缓存表（每个进程只执行一次）"""
+    global _table_ready
+    if _table_ready:
+        return
+    db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS story_summaries (
+                scope VARCHAR(16) NOT NULL,
+                ref_id VARCHAR(64) NOT NULL,
+                novel_id VARCHAR(36) NOT NULL,
+                content_hash VARCHAR(64) NOT NULL,
+                summary TEXT NOT NULL,
+                updated_at BIGINT NOT NULL,
+                PRIMARY KEY (scope, ref_id)
+            )
+            """
+        )
+    )
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_story_summaries_novel ON story_summaries (novel_id)"))
+    db.commit()
+    _table_ready = True
+
+
+def content_hash(*parts: Optional[str]) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _node_ref(novel_id: str, digest: str) -> str:
+    """汇总节点的 ref_id：主键 (scope, ref_id) 不含小说ID，节点键需按小说区分"""
+    return content_hash(novel_id, digest)
+
+
+def _load_cache(db: Session, novel_id: str) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    """读取小说的摘要缓存；汇总节点按输入内容哈希为键"""
+    rows = db.execute(
+        text("SELECT scope, ref_id, content_hash, summary FROM story_summaries WHERE novel_id = :novel_id"),
+        {"novel_id": novel_id}
+    ).fetchall()
+    return {(row[0], row[2] if row[0] == "node" else row[1]): (row[2], row[3]) for row in rows}
+
+
+def _save_rows(db: Session, novel_id: str, rows: List[Tuple[str, str, str, str]]) -> None:
+    if not rows:
+        return
+    now = int(time.time() * 1000)
+    db.execute(
+        text(
+            """
+            INSERT INTO story_summaries (scope, ref_id, novel_id, content_hash, summary, updated_at)
+            VALUES (:scope, :ref_id, :novel_id, :content_hash, :summary, :updated_at)
+            ON CONFLICT (scope, ref_id) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash,
+                summary = EXCLUDED.summary,
+                updated_at = EXCLUDED.updated_at
+            """
+        ),
+        [
+            {
+                "scope": scope,
+                "ref_id": ref_id,
+                "novel_id": novel_id,
+                "content_hash": digest,
+                "summary": summary,
+                "updated_at": now,
+            }
+            for scope, ref_id, digest, summary in rows
+        ]
+    )
+
+
+def record_chapter_summary(db: Session, novel_id: str, chapter_id: str, title: str, content: str, summary: str) -> None:
+    """记录在别处生成的章节摘要对应的正文哈希，之后的摘要任务不再重复摘要这一章（调用方负责提交）"""
+    if not summary:
+        return
+    ensure_summary_table(db)
+    _save_rows(db, novel_id, [("chapter", chapter_id, content_hash(title, content), summary)])
+
+
+class SummaryInEventLoopError(RuntimeError):
+    """在事件循环线程上调用了同步的 summarize_novel（内部需要 asyncio.run）"""
+
+
+class _SummaryJob:
+    """一次摘要任务：共享信号量、缓存和调用计数"""
+
+    def __init__(
+        self,
+        summarize: SummarizeFn,
+        cache: Dict[Tuple[str, str], Tuple[str, str]],
+        concurrency: int,
+        max_chars: int,
+        fanout: int
+    ):
+        self.summarize = summarize
+        self.cache = cache
+        self.concurrency = max(1, concurrency)
+        self.max_chars = max_chars
+        self.fanout = max(2, fanout)
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.calls = 0
+        self.failed = 0
+        self.nodes: Dict[str, str] = {}
+        self.new_nodes: Dict[str, str] = {}
+        self.volumes: Dict[str, Tuple[str, str]] = {}
+        self.novel: Optional[str] = None
+        self.novel_hash = ""
+
+    async def _call(self, title: str, content: str) -> Optional[str]:
+        async with self.semaphore:
+            self.calls += 1
+            try:
+                summary = await self.summarize(title, content, self.max_chars)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"⚠️ 生成摘要失败（{title}）: {str(e)}")
+                return None
+        return (summary or "").strip() or None
+
+    async def _node(self, label: str, items: List[Tuple[str, str]]) -> Optional[str]:
+        joined = "\n".join(f"【{title}】{summary}" for title, summary in items)
+        digest = content_hash("node", str(self.max_chars), joined)
+        cached = self.cache.get(("node", digest))
+        summary = cached[1] if cached else self.nodes.get(digest)
+        if summary is None:
+            summary = await self._call(label, joined)
+            if summary:
+                self.new_nodes[digest] = summary
+        if summary:
+            self.nodes[digest] = summary
+        return summary
+
+    async def rollup(self, label: str, items: List[Tuple[str, str]]) -> Optional[str]:
+        """把 (标题, 摘要) 列表逐级合并成一段摘要；任一节点失败时返回 None"""
+        if not items:
+            return None
+        if len(items) == 1:
+            return items[0][1]
+        level = items
+        while True:
+            groups = [level[i:i + self.fanout] for i in range(0, len(level), self.fanout)]
+            results = await asyncio.gather(*(self._node(label, group) for group in groups))
+            if any(result is None for result in results):
+                return None
+            if len(results) == 1:
+                return results[0]
+            level = [(f"{label}（第{i + 1}部分）", result) for i, result in enumerate(results)]
+
+    async def run(self, chapters: List[Dict[str, Any]], pending: List[Dict[str, Any]], session) -> None:
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with session:
+            summaries = await asyncio.gather(*(self._call(ch["title"], ch["content"]) for ch in pending))
+            for chapter, summary in zip(pending, summaries):
+                if summary:
+                    chapter["new_summary"] = summary
+                    chapter["summary"] = summary
+
+            volumes: Dict[str, Dict[str, Any]] = {}
+            for chapter in chapters:
+                volume = volumes.setdefault(chapter["volume_id"], {"title": chapter["volume_title"], "items": []})
+                if chapter["summary"]:
+                    volume["items"].append((chapter["title"], chapter["summary"]))
+            volume_ids = [vid for vid, volume in volumes.items() if volume["items"]]
+            results = await asyncio.gather(*(self.rollup(volumes[vid]["title"], volumes[vid]["items"]) for vid in volume_ids))
+            for vid, summary in zip(volume_ids, results):
+                items = volumes[vid]["items"]
+                if summary:
+                    self.volumes[vid] = (content_hash(*(s for _, s in items)), summary)
+                elif ("volume", vid) in self.cache:
+                    # 汇总失败时沿用上一次的卷摘要
+                    self.volumes[vid] = self.cache[("volume", vid)]
+
+            novel_items = [(volumes[vid]["title"], self.volumes[vid][1]) for vid in volume_ids if vid in self.volumes]
+            self.novel = await self.rollup("全书", novel_items)
+            self.novel_hash = content_hash(*(s for _, s in novel_items))
+
+
+def _needs_summary(chapter: Dict[str, Any], cached: Optional[Tuple[str, str]], overwrite: bool) -> bool:
+    if cached and cached[0] == chapter["hash"] and chapter["summary"]:
+        return False
+    if overwrite or not chapter["summary"]:
+        return True
+    # 摘要是本任务生成的、正文之后被改过：摘要已过期（手工改过的摘要不覆盖）
+    return bool(cached) and cached[1] == chapter["summary"]
+
+
+def summarize_novel(
+    db: Session,
+    novel_id: str,
+    overwrite: bool = False,
+    summarize_fn: Optional[SummarizeFn] = None,
+    concurrency: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    刷新小说的分层摘要
+
+    Args:
+        db: 数据库会话
+        novel_id: 小说ID
+        overwrite: 是否覆盖已有的章节摘要（正文未改动的章节仍然跳过）
+        summarize_fn: 摘要函数，默认调用 AI 微服务
+        concurrency: 最大并发请求数，默认 SUMMARY_CONCURRENCY
+
+    Returns:
+        {"chapters": 新生成的章节摘要数, "cached": 正文未变跳过的章节数, "failed": 失败请求数,
+         "volumes": 卷摘要数, "novel": 是否有全书梗概, "calls": 摘要请求数, "elapsed_ms": 耗时}
+
+    Raises:
+        SummaryInEventLoopError: 在事件循环线程上调用（异步接口应经 run_in_threadpool 调用）
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise SummaryInEventLoopError("summarize_novel 不能在事件循环线程上调用，请经 run_in_threadpool 调用")
+    started = time.monotonic()
+    ensure_summary_table(db)
+    rows = db.execute(
+        text(
+            """
+            SELECT c.id, c.volume_id, c.title, c.content, c.summary, v.title
+            FROM chapters c
+            JOIN volumes v ON c.volume_id = v.id
+            WHERE v.novel_id = :novel_id
+            ORDER BY v.volume_order, c.chapter_order
+            """
+        ),
+        {"novel_id": novel_id}
+    ).fetchall()
+    chapters = [
+        {
+            "id": row[0],
+            "volume_id": row[1],
+            "title": row[2] or "",
+            "content": row[3],
+            "summary": (row[4] or "").strip(),
+            "volume_title": row[5] or "",
+            "hash": content_hash(row[2], row[3]),
+        }
+        for row in rows
+        if row[3] and row[3].strip()
+    ]
+    cache = _load_cache(db, novel_id)
+    pending = [ch for ch in chapters if _needs_summary(ch, cache.get(("chapter", ch["id"])), overwrite)]
+
+    if summarize_fn is None:
+        from services.ai.gemini_service import ai_client_session, summarize_chapter_content
+        summarize_fn = summarize_chapter_content
+        session = ai_client_session(max_connections=concurrency or SUMMARY_CONCURRENCY)
+    else:
+        session = contextlib.nullcontext()
+    job = _SummaryJob(
+        summarize_fn,
+        cache,
+        concurrency=concurrency or SUMMARY_CONCURRENCY,
+        max_chars=SUMMARY_MAX_CHARS,
+        fanout=SUMMARY_ROLLUP_FANOUT
+    )
+    asyncio.run(job.run(chapters, pending, session))
+
+    updated = [ch for ch in pending if ch.get("new_summary")]
+    now = int(time.time() * 1000)
+    if updated:
+        db.execute(
+            text("UPDATE chapters SET summary = :summary, updated_at = :updated_at WHERE id = :id"),
+            [{"id": ch["id"], "summary": ch["new_summary"], "updated_at": now} for ch in updated]
+        )
+    save = [("chapter", ch["id"], ch["hash"], ch["new_summary"]) for ch in updated]
+    save += [("node", _node_ref(novel_id, digest), digest, summary) for digest, summary in job.new_nodes.items()]
+    save += [
+        ("volume", vid, digest, summary)
+        for vid, (digest, summary) in job.volumes.items()
+        if cache.get(("volume", vid)) != (digest, summary)
+    ]
+    if job.novel and cache.get(("novel", novel_id)) != (job.novel_hash, job.novel):
+        save.append(("novel", novel_id, job.novel_hash, job.novel))
+    _save_rows(db, novel_id, save)
+    if not job.failed:
+        # 清理不再被引用的汇总节点（有失败时保留，下次重试仍可命中）
+        stale = [digest for scope, digest in cache if scope == "node" and digest not in job.nodes]
+        if stale:
+            # 旧版本以输入内容哈希本身为 ref_id，一并清理
+            db.execute(
+                text("DELETE FROM story_summaries WHERE scope = 'node' AND novel_id = :novel_id AND ref_id = ANY(:ref_ids)"),
+                {"novel_id": novel_id, "ref_ids": [_node_ref(novel_id, digest) for digest in stale] + stale}
+            )
+    db.commit()
+
+    report = {
+        "chapters": len(updated),
+        "cached": len(chapters) - len(pending),
+        "failed": job.failed,
+        "volumes": len(job.volumes),
+        "novel": bool(job.novel),
+        "calls": job.calls,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
+    logger.info(
+        f"✅ 分层摘要完成: novel={novel_id}, 章节 {report['chapters']} 新摘要 / {report['cached']} 命中缓存, "
+        f"卷 {report['volumes']}, 请求 {report['calls']} 次（失败 {report['failed']}），耗时 {report['elapsed_ms']}ms"
+    )
+    return report
+
+
+def story_so_far(
+    db: Session,
+    novel_id: str,
+    before_chapter_id: Optional[str] = None,
+    recent_chapters: int = STORY_SO_FAR_RECENT_CHAPTERS
+) -> str:
+    """
+    固定长度的前情提要（只读缓存，不调用 API）
+
+    由全书梗概（或上一卷摘要）、当前卷摘要和最近几章摘要组成，长度不超过 (2 + recent_chapters) × SUMMARY_MAX_CHARS，
+    与小说章节数无关。指定 before_chapter_id 时只使用该章之前的内容，覆盖了之后章节的卷/全书摘要不带入。
+    """
+    ensure_summary_table(db)
+    rows = db.execute(
+        text(
+            """
+            SELECT c.id, c.volume_id, c.title, c.summary,
+                   c.content IS NOT NULL AND length(btrim(c.content)) > 0 AS written
+            FROM chapters c
+            JOIN volumes v ON c.volume_id = v.id
+            WHERE v.novel_id = :novel_id
+            ORDER BY v.volume_order, c.chapter_order
+            """
+        ),
+        {"novel_id": novel_id}
+    ).fetchall()
+    position = next((i for i, row in enumerate(rows) if row[0] == before_chapter_id), len(rows))
+    before = [row for row in rows[:position] if row[4]]
+    after = [row for row in rows[position:] if row[4] and row[0] != before_chapter_id]
+    if not before:
+        return ""
+    cache = _load_cache(db, novel_id)
+    volume_ids = list(dict.fromkeys(row[1] for row in rows))
+    current_volume = rows[position][1] if position < len(rows) else before[-1][1]
+    later_volumes = {row[1] for row in after}
+
+    sections = []
+    novel_summary = cache.get(("novel", novel_id))
+    if novel_summary and not after:
+        sections.append(f"全书梗概：{novel_summary[1]}")
+    else:
+        index = volume_ids.index(current_volume)
+        previous = cache.get(("volume", volume_ids[index - 1])) if index > 0 else None
+        if previous:
+            sections.append(f"上一卷梗概：{previous[1]}")
+    volume_summary = cache.get(("volume", current_volume))
+    if volume_summary and current_volume not in later_volumes:
+        sections.append(f"本卷梗概：{volume_summary[1]}")
+    recent = [row for row in before[-recent_chapters:] if row[3]] if recent_chapters > 0 else []
+    if recent:
+        sections.append("最近章节：\n" + "\n".join(f"- {row[2]}：{row[3][:SUMMARY_MAX_CHARS]}" for row in recent))
+    return "\n".join(sections)
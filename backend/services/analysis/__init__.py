@@ -2,10 +2,20 @@
 from .consistency_checker import ConsistencyChecker
 from .content_similarity_checker import ContentSimilarityChecker
 from .foreshadowing_matcher import ForeshadowingMatcher
+from .near_duplicate import (
+    find_near_duplicates,
+    forget_chapter,
+    invalidate_near_duplicates,
+    record_chapter_content,
+)
 
 __all__ = [
     'ConsistencyChecker',
     'ContentSimilarityChecker',
     'ForeshadowingMatcher',
+    'find_near_duplicates',
+    'forget_chapter',
+    'invalidate_near_duplicates',
+    'record_chapter_content',
 ]
 
@@ -7,10 +7,14 @@ from typing import List, Dict, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from services.embedding.embedding_service import EmbeddingService
+from services.embedding.vector_ops import binary_vector_column, cosine_similarities, stack_vectors
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 角色一致性判定阈值（章节与角色设定向量的余弦相似度）
+CHARACTER_CONSISTENCY_THRESHOLD = 0.7
+
 
 class ConsistencyChecker:
     """一致性检查器"""
@@ -106,7 +110,8 @@ class ConsistencyChecker:
         db: Session,
         novel_id: str,
         chapter_content: str,
-        character_id: str
+        character_id: str,
+        chapter_embedding: Optional[List[float]] = None
     ) -> Dict:
         """
         检查章节内容中角色行为是否与设定一致
@@ -116,70 +121,168 @@ class ConsistencyChecker:
             novel_id: 小说ID
             chapter_content: 章节内容
             character_id: 角色ID
+            chapter_embedding: 已生成的章节向量（同一分析流程中复用，避免重复生成）
         
         Returns:
             一致性检查结果，包含相似度分数和建议
         """
         try:
-            # 1. 获取角色设定向量
-            result = db.execute(
-                text("""
-                    SELECT ce.full_description_embedding, c.name, c.personality, c.background
-                    FROM character_embeddings ce
-                    JOIN characters c ON c.id = ce.character_id
-                    WHERE ce.character_id = :character_id AND ce.novel_id = :novel_id
-                """),
-                {"character_id": character_id, "novel_id": novel_id}
-            ).fetchone()
-            
-            if not result:
+            results = self._score_characters(
+                db=db,
+                novel_id=novel_id,
+                chapter_content=chapter_content,
+                character_ids=[character_id],
+                chapter_embedding=chapter_embedding
+            )
+            if not results:
                 return {
                     "consistent": True,  # 如果没有向量，默认一致
                     "score": 1.0,
                     "message": "角色向量未找到，跳过一致性检查"
                 }
+            return results[0]
             
-            character_embedding_str = result[0]
-            character_name = result[1]
-            
-            # 2. 从章节内容中提取角色相关描述（简化：使用整个内容）
-            # 注意：实际应用中可以提取更精确的角色相关段落
+        except Exception as e:
+            # 出错时返回默认值，不影响主流程
+            logger.error(f"⚠️  角色一致性检查失败: {str(e)}")
+            return {
+                "consistent": True,
+                "score": 1.0,
+                "message": f"一致性检查失败: {str(e)}"
+            }
+    
+    def check_characters_consistency(
+        self,
+        db: Session,
+        novel_id: str,
+        chapter_content: str,
+        character_ids: Optional[List[str]] = None,
+        chapter_embedding: Optional[List[float]] = None
+    ) -> List[Dict]:
+        """
+        批量检查章节内容与多个角色设定的一致性（章节只生成一次向量，全部角色一次查询、一次矩阵运算）
+        
+        Args:
+            db: 数据库会话
+            novel_id: 小说ID
+            chapter_content: 章节内容
+            character_ids: 要检查的角色ID列表（为空时检查小说的全部角色）
+            chapter_embedding: 已生成的章节向量
+        
+        Returns:
+            每个有向量的角色一条检查结果，按评分从低到高排列（最可能不一致的在前）
+        """
+        try:
+            return self._score_characters(
+                db=db,
+                novel_id=novel_id,
+                chapter_content=chapter_content,
+                character_ids=character_ids,
+                chapter_embedding=chapter_embedding
+            )
+        except Exception as e:
+            logger.error(f"⚠️  批量角色一致性检查失败: {str(e)}")
+            return []
+    
+    def check_chapter_consistency(
+        self,
+        db: Session,
+        novel_id: str,
+        chapter_id: str,
+        chapter_content: str,
+        foreshadowing_threshold: float = 0.75
+    ) -> Dict:
+        """
+        一次调用检查章节与全部角色设定的一致性，并匹配章节可能解决的伏笔
+        
+        章节向量只生成一次，由角色检查与伏笔匹配共用。
+        
+        Returns:
+            包含 characters（角色检查结果）、inconsistent_characters（可能不一致的角色名）和 foreshadowings（匹配的伏笔）
+        """
+        from .foreshadowing_matcher import ForeshadowingMatcher
+        
+        chapter_embedding = self.embedding_service.generate_embedding(
+            chapter_content,
+            task_type="RETRIEVAL_DOCUMENT"
+        )
+        characters = self.check_characters_consistency(
+            db=db,
+            novel_id=novel_id,
+            chapter_content=chapter_content,
+            chapter_embedding=chapter_embedding
+        )
+        matcher = ForeshadowingMatcher()
+        matcher.embedding_service = self.embedding_service
+        foreshadowings = matcher.match_foreshadowing_resolutions(
+            db=db,
+            novel_id=novel_id,
+            chapter_id=chapter_id,
+            chapter_content=chapter_content,
+            similarity_threshold=foreshadowing_threshold,
+            chapter_embedding=chapter_embedding
+        )
+        return {
+            "chapter_id": chapter_id,
+            "characters": characters,
+            "inconsistent_characters": [
+                item["character_name"] for item in characters if not item["consistent"]
+            ],
+            "foreshadowings": foreshadowings
+        }
+    
+    def _score_characters(
+        self,
+        db: Session,
+        novel_id: str,
+        chapter_content: str,
+        character_ids: Optional[List[str]],
+        chapter_embedding: Optional[List[float]]
+    ) -> List[Dict]:
+        """一次取回角色设定向量（二进制格式），用一次矩阵-向量乘积计算全部角色的一致性评分"""
+        # 1. 获取角色设定向量
+        sql = f"""
+            SELECT c.id, c.name, {binary_vector_column("ce.full_description_embedding")}
+            FROM character_embeddings ce
+            JOIN characters c ON c.id = ce.character_id
+            WHERE ce.novel_id = :novel_id
+            AND ce.full_description_embedding IS NOT NULL
+        """
+        params = {"novel_id": novel_id}
+        if character_ids is not None:
+            if not character_ids:
+                return []
+            sql += " AND ce.character_id = ANY(:character_ids)"
+            params["character_ids"] = list(character_ids)
+        rows = db.execute(text(sql), params).fetchall()
+        if not rows:
+            return []
+        
+        # 2. 从章节内容中提取角色相关描述（简化：使用整个内容，只生成一次向量）
+        # 注意：实际应用中可以提取更精确的角色相关段落
+        if chapter_embedding is None:
             chapter_embedding = self.embedding_service.generate_embedding(
                 chapter_content,
                 task_type="RETRIEVAL_DOCUMENT"
             )
-            chapter_embedding_str = "[" + ",".join(map(str, chapter_embedding)) + "]"
-            
-            # 3. 计算相似度
-            similarity_result = db.execute(
-                text("""
-                    SELECT 1 - (CAST(:chapter_embedding AS vector) <=> CAST(:character_embedding AS vector)) as similarity
-                """),
-                {
-                    "chapter_embedding": chapter_embedding_str,
-                    "character_embedding": character_embedding_str
-                }
-            ).fetchone()
-            
-            similarity = float(similarity_result[0]) if similarity_result else 0.5
-            
-            # 4. 判断一致性（相似度阈值可调整）
-            threshold = 0.7
+        
+        # 3. 计算相似度
+        matrix, indexes = stack_vectors(row[2] for row in rows)
+        similarities = cosine_similarities(matrix, chapter_embedding)
+        
+        # 4. 判断一致性（相似度阈值可调整）
+        threshold = CHARACTER_CONSISTENCY_THRESHOLD
+        results = []
+        for index, similarity in zip(indexes, similarities.tolist()):
+            character_name = rows[index][1]
             is_consistent = similarity >= threshold
-            
-            return {
+            results.append({
+                "character_id": rows[index][0],
                 "consistent": is_consistent,
                 "score": similarity,
                 "threshold": threshold,
                 "character_name": character_name,
                 "message": f"角色 {character_name} 的一致性评分: {similarity:.2f} ({'一致' if is_consistent else '可能存在不一致'})"
-            }
-            
-        except Exception as e:
-            # 出错时返回默认值，不影响主流程
-            logger.error(f"⚠️  角色一致性检查失败: {str(e)}")
-            return {
-                "consistent": True,
-                "score": 1.0,
-                "message": f"一致性检查失败: {str(e)}"
-            }
+            })
+        results.sort(key=lambda item: item["score"])
+        return results
@@ -1,15 +1,21 @@
 """
 内容相似度检查服务
-在生成章节内容前检查是否与已有内容重复
+在生成章节内容前检查是否与已有内容重复，生成后检查段落级重复
 """
 import logging
 from typing import Dict, List, Optional
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from services.embedding.embedding_service import EmbeddingService
+from services.embedding.vector_ops import cosine_similarities, stack_vectors
+from .near_duplicate import find_near_duplicates, split_paragraphs
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 估计的 Jaccard 相似度达到该值视为逐字复用，不再做向量确认
+VERBATIM_SIMILARITY = 0.9
+
 
 class ContentSimilarityChecker:
     """内容相似度检查器"""
@@ -122,43 +128,76 @@ class ContentSimilarityChecker:
         novel_id: str,
         generated_content: str,
         current_chapter_id: Optional[str] = None,
-        similarity_threshold: float = 0.85
+        similarity_threshold: float = 0.85,
+        lexical_threshold: Optional[float] = None,
+        confirm_with_embeddings: bool = True,
+        max_confirmations: int = 3
     ) -> Dict:
         """
-        在生成章节内容后检查相似度（更严格）
+        在生成章节内容后检查重复（更严格）
+        
+        第一阶段用本地 MinHash 索引找出与其他章节近重复的段落，不调用任何 API；
+        只有找到候选且不是逐字复用时，才用向量相似度做第二阶段确认。
         
         Args:
             db: 数据库会话
             novel_id: 小说ID
             generated_content: 生成的章节内容
             current_chapter_id: 当前章节ID（用于排除）
-            similarity_threshold: 相似度阈值（更严格，默认0.85）
+            similarity_threshold: 向量确认的相似度阈值（更严格，默认0.85）
+            lexical_threshold: 段落近重复阈值（估计的 Jaccard 相似度，默认取 NEAR_DUPLICATE_THRESHOLD）
+            confirm_with_embeddings: 是否对非逐字复用的候选做向量确认
+            max_confirmations: 最多确认的候选段落数（每个候选 2 次向量请求）
         
         Returns:
             检查结果
         """
         try:
-            similar_chapters = self.embedding_service.find_similar_chapters(
+            duplicates = find_near_duplicates(
                 db=db,
                 novel_id=novel_id,
-                query_text=generated_content[:1000],  # 使用前1000字作为查询
-                exclude_chapter_ids=[current_chapter_id] if current_chapter_id else None,
-                limit=5,
-                similarity_threshold=similarity_threshold
+                content=generated_content,
+                exclude_chapter_id=current_chapter_id,
+                threshold=lexical_threshold
             )
+            if not duplicates:
+                return {
+                    "has_duplicate_content": False,
+                    "similar_chapters": [],
+                    "duplicate_paragraphs": [],
+                    "recommendation": "内容独特，可以使用"
+                }
             
-            if similar_chapters:
+            self._confirm_duplicates(
+                db, generated_content, duplicates, similarity_threshold,
+                max_confirmations if confirm_with_embeddings else 0
+            )
+            confirmed = [d for d in duplicates if d["confirmed"]]
+            if not confirmed:
                 return {
-                    "has_duplicate_content": True,
-                    "similar_chapters": similar_chapters,
-                    "warning": f"生成的内容与 {len(similar_chapters)} 个章节高度相似，可能存在重复",
-                    "recommendation": "建议重新生成或手动修改内容"
+                    "has_duplicate_content": False,
+                    "similar_chapters": [],
+                    "duplicate_paragraphs": duplicates,
+                    "recommendation": "发现措辞相近的段落，但语义差异较大，可以使用"
                 }
             
+            similar_chapters: Dict[str, Dict] = {}
+            for duplicate in confirmed:
+                chapter = similar_chapters.setdefault(duplicate["chapter_id"], {
+                    "chapter_id": duplicate["chapter_id"],
+                    "chapter_title": duplicate["chapter_title"],
+                    "duplicate_paragraphs": 0,
+                    "similarity": 0.0
+                })
+                chapter["duplicate_paragraphs"] += 1
+                chapter["similarity"] = max(chapter["similarity"], duplicate["similarity"])
+            
             return {
-                "has_duplicate_content": False,
-                "similar_chapters": [],
-                "recommendation": "内容独特，可以使用"
+                "has_duplicate_content": True,
+                "similar_chapters": list(similar_chapters.values()),
+                "duplicate_paragraphs": duplicates,
+                "warning": f"生成的内容有 {len(confirmed)} 个段落与 {len(similar_chapters)} 个章节重复或高度相似",
+                "recommendation": "建议重新生成或手动修改内容"
             }
             
         except Exception as e:
@@ -167,4 +206,48 @@ class ContentSimilarityChecker:
                 "error": str(e),
                 "recommendation": "检查失败，建议人工审查"
             }
-
+    
+    def _confirm_duplicates(
+        self,
+        db: Session,
+        generated_content: str,
+        duplicates: List[Dict],
+        similarity_threshold: float,
+        max_confirmations: int
+    ) -> None:
+        """逐字复用直接确认；其余候选取两段原文生成向量比较，超出确认数量的标记为未确认（None）"""
+        pending = []
+        for duplicate in duplicates:
+            if duplicate["similarity"] >= VERBATIM_SIMILARITY:
+                duplicate["confirmed"] = True
+                duplicate["confirmed_by"] = "lexical"
+            elif len(pending) < max_confirmations:
+                pending.append(duplicate)
+            else:
+                duplicate["confirmed"] = None
+        if not pending:
+            return
+        
+        rows = db.execute(
+            text("SELECT id, content FROM chapters WHERE id = ANY(:chapter_ids)"),
+            {"chapter_ids": list({d["chapter_id"] for d in pending})}
+        ).fetchall()
+        chapter_paragraphs = {row[0]: split_paragraphs(row[1]) for row in rows}
+        generated_paragraphs = split_paragraphs(generated_content)
+        for duplicate in pending:
+            matched = chapter_paragraphs.get(duplicate["chapter_id"], [])
+            if duplicate["matched_paragraph_index"] >= len(matched):
+                duplicate["confirmed"] = False
+                continue
+            vectors = [
+                self.embedding_service.generate_embedding(paragraph, task_type="RETRIEVAL_DOCUMENT")
+                for paragraph in (
+                    generated_paragraphs[duplicate["paragraph_index"]],
+                    matched[duplicate["matched_paragraph_index"]]
+                )
+            ]
+            matrix, _ = stack_vectors(vectors[:1])
+            semantic_similarity = float(cosine_similarities(matrix, vectors[1])[0])
+            duplicate["semantic_similarity"] = semantic_similarity
+            duplicate["confirmed"] = semantic_similarity >= similarity_threshold
+            duplicate["confirmed_by"] = "embedding"
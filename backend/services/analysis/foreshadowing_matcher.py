@@ -2,10 +2,16 @@
 伏笔匹配服务
 使用向量相似度自动匹配章节内容与伏笔，识别哪些章节可能解决了伏笔
 """
+import logging
+import time as time_module
 from typing import List, Dict, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from services.embedding.embedding_service import EmbeddingService
+from services.embedding.vector_ops import binary_vector_column, cosine_similarities, stack_vectors
+
+# 配置日志
+logger = logging.getLogger(__name__)
 
 
 class ForeshadowingMatcher:
@@ -20,7 +26,8 @@ class ForeshadowingMatcher:
         novel_id: str,
         chapter_id: str,
         chapter_content: str,
-        similarity_threshold: float = 0.75
+        similarity_threshold: float = 0.75,
+        chapter_embedding: Optional[List[float]] = None
     ) -> List[Dict]:
         """
         匹配章节内容可能解决的伏笔
@@ -31,17 +38,18 @@ class ForeshadowingMatcher:
             chapter_id: 章节ID
             chapter_content: 章节内容
             similarity_threshold: 相似度阈值（0-1之间）
+            chapter_embedding: 已生成的章节向量（同一分析流程中复用，避免重复生成）
         
         Returns:
             匹配的伏笔列表，每个元素包含：foreshadowing_id, similarity, content, is_resolved
         """
         try:
-            # 1. 获取所有未解决的伏笔
+            # 1. 一次取回所有未解决伏笔的向量（二进制格式）
             unresolved_foreshadowings = db.execute(
-                text("""
-                    SELECT f.id, f.content, f.is_resolved, fe.content_embedding
+                text(f"""
+                    SELECT f.id, f.content, f.is_resolved, {binary_vector_column("fe.content_embedding")}
                     FROM foreshadowings f
-                    LEFT JOIN foreshadowing_embeddings fe ON fe.foreshadowing_id = f.id
+                    JOIN foreshadowing_embeddings fe ON fe.foreshadowing_id = f.id
                     WHERE f.novel_id = :novel_id
                     AND (f.is_resolved IS NULL OR f.is_resolved = 'false')
                     AND fe.content_embedding IS NOT NULL
@@ -52,41 +60,25 @@ class ForeshadowingMatcher:
             if not unresolved_foreshadowings:
                 return []
             
-            # 2. 生成章节内容的向量
-            chapter_embedding = self.embedding_service.generate_embedding(
-                chapter_content,
-                task_type="RETRIEVAL_DOCUMENT"
-            )
-            chapter_embedding_str = "[" + ",".join(map(str, chapter_embedding)) + "]"
+            # 2. 生成章节内容的向量（调用方已生成时直接复用）
+            if chapter_embedding is None:
+                chapter_embedding = self.embedding_service.generate_embedding(
+                    chapter_content,
+                    task_type="RETRIEVAL_DOCUMENT"
+                )
+            
+            # 3. 一次矩阵-向量乘积计算全部伏笔与章节内容的相似度
+            matrix, indexes = stack_vectors(row[3] for row in unresolved_foreshadowings)
+            similarities = cosine_similarities(matrix, chapter_embedding)
             
-            # 3. 计算每个伏笔与章节内容的相似度
             matches = []
-            for foreshadowing in unresolved_foreshadowings:
-                foreshadowing_id = foreshadowing[0]
-                foreshadowing_content = foreshadowing[1]
-                foreshadowing_embedding_str = str(foreshadowing[3]) if foreshadowing[3] else None
-                
-                if not foreshadowing_embedding_str:
-                    continue
-                
-                # 计算相似度
-                similarity_result = db.execute(
-                    text("""
-                        SELECT 1 - (CAST(:chapter_embedding AS vector) <=> CAST(:foreshadowing_embedding AS vector)) as similarity
-                    """),
-                    {
-                        "chapter_embedding": chapter_embedding_str,
-                        "foreshadowing_embedding": foreshadowing_embedding_str
-                    }
-                ).fetchone()
-                
-                similarity = float(similarity_result[0]) if similarity_result else 0.0
-                
+            for index, similarity in zip(indexes, similarities.tolist()):
                 # 如果相似度超过阈值，认为是匹配的
                 if similarity >= similarity_threshold:
+                    foreshadowing = unresolved_foreshadowings[index]
                     matches.append({
-                        "foreshadowing_id": foreshadowing_id,
-                        "foreshadowing_content": foreshadowing_content,
+                        "foreshadowing_id": foreshadowing[0],
+                        "foreshadowing_content": foreshadowing[1],
                         "similarity": similarity,
                         "chapter_id": chapter_id,
                         "is_match": True
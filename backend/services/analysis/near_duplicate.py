@@ -0,0 +1,319 @@
+"""
+段落近重复检测（MinHash + LSH）
+
+长篇批量生成时模型常会原样或几乎原样复用前文段落，向量检索既要一次 API 调用，又容易漏掉这类逐字复用。
+这里为每部小说在进程内维护一个基于字符 shingle 的 MinHash LSH 索引：
+- 段落去掉空白和标点后取 SHINGLE_SIZE 字的 shingle，计算 NUM_PERM 维 MinHash 签名
+- 签名按 LSH_BANDS 个分带建桶，只有同桶的段落才比较签名（估计 Jaccard 相似度），检查一章只需微秒到毫秒级，不调用任何 API
+- 章节保存时原地更新本进程索引，并通过共享存储通知其他 worker 丢弃该小说的索引（下次使用时从数据库重建）
+"""
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core.shared_state import get_shared_state
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "novawrite_near_duplicate_invalidate"
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+# 去掉空白和标点后少于该字数的段落不参与检测（对白短句重复很常见）
+MIN_PARAGRAPH_CHARS = 40
+
+_PRIME = (1 << 32) - 5
+_MASK32 = np.uint64(0xFFFFFFFF)
+_SHINGLE_BASE = np.uint64(1000003)
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_NOISE = re.compile(r"[\W_]+", re.UNICODE)
+
+# 本进程标识：收到自己发出的失效广播时忽略（本进程的索引已原地更新）
+_ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def split_paragraphs(content: str) -> List[str]:
+    """按换行切分段落（保留原文，去掉首尾空白）"""
+    return [p.strip() for p in (content or "").splitlines() if p.strip()]
+
+
+def minhash_signature(paragraph: str) -> Optional[np.ndarray]:
+    """段落的 MinHash 签名；归一化后过短的段落返回 None"""
+    normalized = _NOISE.sub("", paragraph)
+    if len(normalized) < MIN_PARAGRAPH_CHARS:
+        return None
+    # 每个 shingle 的多项式哈希按窗口偏移向量化累加（重复的 shingle 不影响最小值，无需去重）
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    count = codes.shape[0] - SHINGLE_SIZE + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        hashes = (hashes * _SHINGLE_BASE + codes[offset:offset + count]) & _MASK32
+    return ((hashes[:, None] * _PERM_A + _PERM_B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """两个签名相同位置取值相等的比例，即 Jaccard 相似度的估计"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def _band_keys(signature: np.ndarray) -> List[Tuple[int, bytes]]:
+    return [(band, row.tobytes()) for band, row in enumerate(signature.reshape(LSH_BANDS, LSH_ROWS))]
+
+
+class _Paragraph:
+    __slots__ = ("chapter_id", "index", "signature", "preview")
+
+    def __init__(self, chapter_id: str, index: int, signature: np.ndarray, preview: str):
+        self.chapter_id = chapter_id
+        self.index = index
+        self.signature = signature
+        self.preview = preview
+
+
+class NovelDuplicateIndex:
+    """一部小说全部章节段落的 MinHash LSH 索引（线程安全）"""
+
+    def __init__(self, novel_id: str):
+        self.novel_id = novel_id
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._paragraphs: Dict[int, _Paragraph] = {}
+        self._chapters: Dict[str, List[int]] = {}
+        self._titles: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[int]] = {}
+
+    @property
+    def paragraph_count(self) -> int:
+        return len(self._paragraphs)
+
+    def update_chapter(self, chapter_id: str, title: str, content: str) -> None:
+        """替换章节的全部段落（签名在锁外计算）"""
+        entries = []
+        for index, paragraph in enumerate(split_paragraphs(content)):
+            signature = minhash_signature(paragraph)
+            if signature is not None:
+                entries.append((index, signature, paragraph[:80]))
+        with self._lock:
+            self._remove_locked(chapter_id)
+            self._titles[chapter_id] = title or ""
+            ids = []
+            for index, signature, preview in entries:
+                paragraph_id = self._next_id
+                self._next_id += 1
+                self._paragraphs[paragraph_id] = _Paragraph(chapter_id, index, signature, preview)
+                for key in _band_keys(signature):
+                    self._buckets.setdefault(key, set()).add(paragraph_id)
+                ids.append(paragraph_id)
+            self._chapters[chapter_id] = ids
+
+    def remove_chapter(self, chapter_id: str) -> None:
+        with self._lock:
+            self._remove_locked(chapter_id)
+
+    def _remove_locked(self, chapter_id: str) -> None:
+        self._titles.pop(chapter_id, None)
+        for paragraph_id in self._chapters.pop(chapter_id, []):
+            paragraph = self._paragraphs.pop(paragraph_id)
+            for key in _band_keys(paragraph.signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(paragraph_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def find_duplicates(
+        self,
+        content: str,
+        exclude_chapter_id: Optional[str] = None,
+        threshold: float = 0.6,
+        limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        """
+        查找与 content 中段落近重复的其他章节段落
+
+        Returns:
+            按相似度降序的匹配列表，每项包含 paragraph_index, paragraph_preview, chapter_id,
+            chapter_title, matched_paragraph_index, matched_paragraph_preview, similarity
+        """
+        matches = []
+        for index, paragraph in enumerate(split_paragraphs(content)):
+            signature = minhash_signature(paragraph)
+            if signature is None:
+                continue
+            with self._lock:
+                candidates: Set[int] = set()
+                for key in _band_keys(signature):
+                    candidates.update(self._buckets.get(key, ()))
+                for paragraph_id in candidates:
+                    other = self._paragraphs[paragraph_id]
+                    if other.chapter_id == exclude_chapter_id:
+                        continue
+                    similarity = estimate_similarity(signature, other.signature)
+                    if similarity >= threshold:
+                        matches.append({
+                            "paragraph_index": index,
+                            "paragraph_preview": paragraph[:80],
+                            "chapter_id": other.chapter_id,
+                            "chapter_title": self._titles.get(other.chapter_id, ""),
+                            "matched_paragraph_index": other.index,
+                            "matched_paragraph_preview": other.preview,
+                            "similarity": similarity
+                        })
+        matches.sort(key=lambda m: (-m["similarity"], m["paragraph_index"]))
+        return matches[:limit]
+
+
+def build_novel_index(db: Session, novel_id: str) -> NovelDuplicateIndex:
+    """从数据库读取小说全部章节正文构建索引"""
+    rows = db.execute(
+        text("""
+            SELECT c.id, c.title, c.content
+            FROM chapters c
+            JOIN volumes v ON v.id = c.volume_id
+            WHERE v.novel_id = :novel_id
+            AND c.content IS NOT NULL AND c.content != ''
+        """),
+        {"novel_id": novel_id}
+    ).fetchall()
+    index = NovelDuplicateIndex(novel_id)
+    for chapter_id, title, content in rows:
+        index.update_chapter(chapter_id, title, content)
+    return index
+
+
+class NearDuplicateRegistry:
+    """按小说 ID 的索引 LRU（最多 max_novels 部小说）"""
+
+    def __init__(self, max_novels: int):
+        self.max_novels = max_novels
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[str, NovelDuplicateIndex]" = OrderedDict()
+        # 构建期间章节有变化时代数加一，构建结果只用于本次检测不写入缓存
+        self._generations: Dict[str, int] = {}
+        self.stats = {"hits": 0, "builds": 0, "updates": 0, "invalidations": 0}
+
+    def get(self, db: Session, novel_id: str) -> NovelDuplicateIndex:
+        with self._lock:
+            index = self._indexes.get(novel_id)
+            if index is not None:
+                self._indexes.move_to_end(novel_id)
+                self.stats["hits"] += 1
+                return index
+            generation = self._generations.get(novel_id, 0)
+        index = build_novel_index(db, novel_id)
+        with self._lock:
+            self.stats["builds"] += 1
+            if self.max_novels > 0 and self._generations.get(novel_id, 0) == generation:
+                self._indexes[novel_id] = index
+                while len(self._indexes) > self.max_novels:
+                    self._indexes.popitem(last=False)
+        return index
+
+    def update_chapter(self, novel_id: str, chapter_id: str, title: str, content: str) -> None:
+        """章节保存后更新已载入的索引（未载入的小说下次使用时从数据库构建）"""
+        with self._lock:
+            self._generations[novel_id] = self._generations.get(novel_id, 0) + 1
+            index = self._indexes.get(novel_id)
+            self.stats["updates"] += 1
+        if index is not None:
+            if content and content.strip():
+                index.update_chapter(chapter_id, title, content)
+            else:
+                index.remove_chapter(chapter_id)
+
+    def remove_chapter(self, novel_id: str, chapter_id: str) -> None:
+        self.update_chapter(novel_id, chapter_id, "", "")
+
+    def evict(self, novel_id: str) -> None:
+        with self._lock:
+            self._generations[novel_id] = self._generations.get(novel_id, 0) + 1
+            if self._indexes.pop(novel_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def _on_broadcast(self, payload: str) -> None:
+        origin, _, novel_id = payload.partition(":")
+        if origin != _ORIGIN and novel_id:
+            self.evict(novel_id)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "novels": len(self._indexes),
+                "paragraphs": sum(index.paragraph_count for index in self._indexes.values()),
+                "max_novels": self.max_novels,
+                **self.stats,
+            }
+
+
+_registry: Optional[NearDuplicateRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_near_duplicate_registry() -> NearDuplicateRegistry:
+    """获取进程级近重复索引（首次使用时订阅失效广播）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from core.config import NEAR_DUPLICATE_MAX_NOVELS
+
+                registry = NearDuplicateRegistry(NEAR_DUPLICATE_MAX_NOVELS)
+                get_shared_state().subscribe(INVALIDATE_CHANNEL, registry._on_broadcast)
+                _registry = registry
+    return _registry
+
+
+def _broadcast(novel_id: str) -> None:
+    try:
+        get_shared_state().publish(INVALIDATE_CHANNEL, f"{_ORIGIN}:{novel_id}")
+    except Exception as e:
+        # 广播失败时其他 worker 的索引保持旧内容，直到被 LRU 淘汰
+        logger.warning(f"⚠️ 近重复索引失效广播失败: {str(e)}")
+
+
+def record_chapter_content(novel_id: str, chapter_id: str, title: str, content: str) -> None:
+    """章节正文保存后调用：更新本进程索引并通知其他 worker"""
+    try:
+        get_near_duplicate_registry().update_chapter(novel_id, chapter_id, title, content)
+    except Exception as e:
+        logger.warning(f"⚠️ 更新近重复索引失败: {str(e)}")
+    _broadcast(novel_id)
+
+
+def forget_chapter(novel_id: str, chapter_id: str) -> None:
+    """章节删除后调用"""
+    record_chapter_content(novel_id, chapter_id, "", "")
+
+
+def invalidate_near_duplicates(novel_id: str) -> None:
+    """批量修改章节（导入、同步、删除卷）后调用：丢弃该小说的索引，下次使用时重建"""
+    get_near_duplicate_registry().evict(novel_id)
+    _broadcast(novel_id)
+
+
+def find_near_duplicates(
+    db: Session,
+    novel_id: str,
+    content: str,
+    exclude_chapter_id: Optional[str] = None,
+    threshold: Optional[float] = None,
+    limit: int = 20
+) -> List[Dict[str, Any]]:
+    """检测 content 与小说其他章节的近重复段落（不调用任何 API）"""
+    if threshold is None:
+        from core.config import NEAR_DUPLICATE_THRESHOLD
+        threshold = NEAR_DUPLICATE_THRESHOLD
+    index = get_near_duplicate_registry().get(db, novel_id)
+    return index.find_duplicates(content, exclude_chapter_id=exclude_chapter_id, threshold=threshold, limit=limit)
@@ -18,7 +18,7 @@ class BatchEmbeddingProcessor:
     def __init__(
         self,
         max_workers: int = 3,
-        delay_between_calls: float = 0.5,
+        delay_between_calls: float = 0.0,
         batch_size: int = 10,
         max_retries: int = 3
     ):
@@ -27,7 +27,7 @@ class BatchEmbeddingProcessor:
         
         Args:
             max_workers: 最大并发工作线程数
-            delay_between_calls: API调用间隔（秒）
+            delay_between_calls: API调用间隔（秒），默认 0：速率由共享的上游限流器控制
             batch_size: 每批处理的任务数量
             max_retries: 最大重试次数
         """
@@ -257,7 +257,7 @@ def batch_generate_embeddings(
     texts: List[str],
     embedding_service,
     max_workers: int = 3,
-    delay: float = 0.5,
+    delay: float = 0.0,
     progress_callback: Optional[Callable] = None
 ) -> List[Dict]:
     """
@@ -267,7 +267,7 @@ def batch_generate_embeddings(
         texts: 文本列表
         embedding_service: EmbeddingService实例
         max_workers: 最大并发数
-        delay: API调用间隔
+        delay: API调用间隔（默认 0，由上游限流器控制速率）
         progress_callback: 进度回调
     
     Returns:
@@ -6,6 +6,7 @@ from .vector_helper import (
     store_world_setting_embedding,
     get_embedding_service
 )
+from .vector_index import invalidate_novel_vectors
 
 __all__ = [
     'EmbeddingService',
@@ -13,5 +14,6 @@ __all__ = [
     'store_character_embedding',
     'store_world_setting_embedding',
     'get_embedding_service',
+    'invalidate_novel_vectors',
 ]
 
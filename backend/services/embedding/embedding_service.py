@@ -6,12 +6,16 @@ import os
 import uuid
 import time
 import re
+import hashlib
 import logging
 from typing import List, Optional, Dict
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from google import genai
 from core.config import GEMINI_API_KEY, GEMINI_PROXY
+from core.single_flight import SingleFlight
+from core.rate_limiter import get_rate_limiter, is_throttle_error
+from .vector_index import get_vector_index_cache, invalidate_novel_vectors
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -32,6 +36,15 @@ if GEMINI_PROXY:
 
 client = genai.Client(api_key=GEMINI_API_KEY)
 
+# 进程内共享的向量请求单飞合并器
+_embedding_flight = SingleFlight("embedding")
+
+
+def get_embedding_single_flight_stats() -> Dict[str, int]:
+    """向量请求合并统计"""
+    return _embedding_flight.snapshot()
+
+
 class EmbeddingService:
     """向量嵌入服务类"""
     
@@ -57,6 +70,12 @@ class EmbeddingService:
         if not text or not text.strip():
             raise ValueError("文本不能为空")
         
+        # 并发的相同请求（同模型、同任务类型、同文本）只调用一次 API
+        flight_key = (self.model, task_type, hashlib.sha256(text.encode("utf-8")).hexdigest())
+        return _embedding_flight.do(flight_key, lambda: self._request_embedding(text, task_type))
+    
+    def _request_embedding(self, text: str, task_type: str) -> List[float]:
+        """调用 Embedding API 生成向量（带重试机制）"""
         last_error = None
         for attempt in range(MAX_RETRIES):
             try:
@@ -65,11 +84,12 @@ class EmbeddingService:
                 # 使用 Google Gemini Embedding API
                 # 注意：API 使用 contents 参数（复数），接受列表
                 from google.genai import types
-                result = client.models.embed_content(
-                    model=self.model,
-                    contents=[text],
-                    config=types.EmbedContentConfig(task_type=task_type)
-                )
+                with get_rate_limiter("gemini", self.model, GEMINI_API_KEY).slot():
+                    result = client.models.embed_content(
+                        model=self.model,
+                        contents=[text],
+                        config=types.EmbedContentConfig(task_type=task_type)
+                    )
                 
                 # 提取向量
                 # EmbedContentResponse 包含 embeddings 属性（列表）
@@ -114,7 +134,9 @@ class EmbeddingService:
                 
                 # 如果不是最后一次尝试，等待后重试
                 if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY * (attempt + 1))  # 指数退避
+                    # 429/503 由限流器按 Retry-After 暂停整个桶，下次取令牌时自然等待
+                    if not is_throttle_error(e):
+                        time.sleep(RETRY_DELAY * (attempt + 1))  # 指数退避
                 else:
                     logger.error(f"❌ 向量生成失败，已重试 {MAX_RETRIES} 次: {str(e)}")
                     raise Exception(f"生成向量失败（已重试 {MAX_RETRIES} 次）: {str(e)}")
@@ -264,6 +286,7 @@ class EmbeddingService:
                     params,
                 )
             db.commit()
+            invalidate_novel_vectors(novel_id)
             
             elapsed_time = time.time() - start_time
             logger.info(f"✅ 章节向量存储成功: chapter_id={chapter_id}, chunks={len(paragraph_embeddings)}, time={elapsed_time:.2f}s")
@@ -300,6 +323,13 @@ class EmbeddingService:
         try:
             # 生成查询向量
             query_embedding = self.generate_embedding(query_text, task_type="RETRIEVAL_QUERY")
+            
+            # 优先使用进程内向量索引
+            indexed = self._search_chapters_in_index(
+                db, novel_id, query_embedding, exclude_chapter_ids, limit, similarity_threshold
+            )
+            if indexed is not None:
+                return indexed
             query_embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
             
             # 构建SQL查询
@@ -382,6 +412,14 @@ class EmbeddingService:
             
             # 生成查询向量
             query_embedding = self.generate_embedding(query_text, task_type="RETRIEVAL_QUERY")
+            
+            # 优先使用进程内向量索引
+            indexed = self._search_paragraphs_in_index(
+                db, novel_id, query_embedding, exclude_chapter_ids, limit, similarity_threshold
+            )
+            if indexed is not None:
+                logger.debug(f"找到 {len(indexed)} 个相似段落（内存索引）")
+                return indexed
             query_embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
             
             # 构建SQL查询
@@ -456,3 +494,163 @@ class EmbeddingService:
         except Exception as e:
             logger.error(f"查找相似段落失败: {str(e)}")
             return []
+
+    def _load_vector_index(self, db: Session, novel_id: str):
+        """取小说的进程内向量索引；缓存关闭或载入失败时返回 None（调用方走 pgvector 检索）"""
+        try:
+            return get_vector_index_cache().get_or_load(db, novel_id)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"⚠️  载入向量索引失败，改用数据库检索: {str(e)}")
+            return None
+    
+    def _search_chapters_in_index(
+        self,
+        db: Session,
+        novel_id: str,
+        query_embedding: List[float],
+        exclude_chapter_ids: Optional[List[str]],
+        limit: int,
+        similarity_threshold: float
+    ) -> Optional[List[Dict]]:
+        """在内存索引中检索相似章节，只为命中的章节查询标题、摘要和内容预览"""
+        index = self._load_vector_index(db, novel_id)
+        if index is None:
+            return None
+        hits = index.search_chapters(query_embedding, limit, similarity_threshold, exclude_chapter_ids)
+        if not hits:
+            return []
+        rows = db.execute(
+            text("""
+                SELECT id, title, summary, LEFT(content, 500)
+                FROM chapters
+                WHERE id = ANY(:chapter_ids)
+            """),
+            {"chapter_ids": [chapter_id for chapter_id, _, _ in hits]}
+        ).fetchall()
+        chapters = {row[0]: row for row in rows}
+        # 已删除的章节在索引失效前可能仍被命中，这里按查询结果过滤
+        return [
+            {
+                "chapter_id": chapter_id,
+                "chunk_count": chunk_count,
+                "similarity": similarity,
+                "chapter_title": chapters[chapter_id][1],
+                "chapter_summary": chapters[chapter_id][2],
+                "chapter_content_preview": chapters[chapter_id][3]
+            }
+            for chapter_id, chunk_count, similarity in hits
+            if chapter_id in chapters
+        ]
+    
+    def _search_paragraphs_in_index(
+        self,
+        db: Session,
+        novel_id: str,
+        query_embedding: List[float],
+        exclude_chapter_ids: Optional[List[str]],
+        limit: int,
+        similarity_threshold: float
+    ) -> Optional[List[Dict]]:
+        """在内存索引中检索相似段落，命中章节的正文一次查询取回后切分出段落文本"""
+        index = self._load_vector_index(db, novel_id)
+        if index is None:
+            return None
+        hits = index.search_paragraphs(query_embedding, limit, similarity_threshold, exclude_chapter_ids)
+        if not hits:
+            return []
+        rows = db.execute(
+            text("SELECT id, title, content FROM chapters WHERE id = ANY(:chapter_ids)"),
+            {"chapter_ids": list({chapter_id for chapter_id, _, _ in hits})}
+        ).fetchall()
+        chapters = {row[0]: row for row in rows}
+        chunks_by_chapter: Dict[str, List[str]] = {}
+        results = []
+        for chapter_id, paragraph_index, similarity in hits:
+            if chapter_id not in chapters:
+                continue
+            if chapter_id not in chunks_by_chapter:
+                content = chapters[chapter_id][2]
+                chunks_by_chapter[chapter_id] = self._split_into_chunks(content, chunk_size=500) if content else []
+            chunks = chunks_by_chapter[chapter_id]
+            results.append({
+                "chapter_id": chapter_id,
+                "chapter_title": chapters[chapter_id][1],
+                "paragraph_index": paragraph_index,
+                "similarity": similarity,
+                "paragraph_text": chunks[paragraph_index] if paragraph_index < len(chunks) else ""
+            })
+        return results
+    
+    def _rank_entities_by_embedding(
+        self,
+        db: Session,
+        table: str,
+        id_column: str,
+        vector_column: str,
+        novel_id: str,
+        query_embedding: List[float],
+        limit: int
+    ) -> List[Dict]:
+        """按余弦相似度对某个实体向量表排序，返回 [{id, similarity}]"""
+        query_embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
+        sql = f"""
+            SELECT
+                {id_column},
+                1 - ({vector_column} <=> CAST(:query_embedding AS vector)) as similarity
+            FROM {table}
+            WHERE novel_id = :novel_id
+            AND {vector_column} IS NOT NULL
+            ORDER BY {vector_column} <=> CAST(:query_embedding AS vector)
+            LIMIT :limit
+        """
+        rows = db.execute(
+            text(sql),
+            {"novel_id": novel_id, "query_embedding": query_embedding_str, "limit": limit}
+        ).fetchall()
+        return [{"id": row[0], "similarity": float(row[1])} for row in rows]
+
+    def find_relevant_characters_and_settings(
+        self,
+        db: Session,
+        novel_id: str,
+        query_text: str,
+        character_limit: int = 12,
+        world_setting_limit: int = 8,
+        query_embedding: Optional[List[float]] = None
+    ) -> Dict[str, List[Dict]]:
+        """
+        检索与查询文本最相关的角色和世界观设定（共用一次查询向量）
+
+        Args:
+            db: 数据库会话
+            novel_id: 小说ID
+            query_text: 查询文本（通常是章节标题 + 摘要 + 钩子）
+            character_limit: 角色返回数量
+            world_setting_limit: 世界观设定返回数量
+            query_embedding: 已生成的查询向量（传入时不再为 query_text 生成）
+
+        Returns:
+            {"characters": [{id, similarity}], "world_settings": [{id, similarity}]}
+
+        查询在保存点内执行，失败时只回滚保存点，不影响调用方会话中未提交的修改。
+        """
+        result = {"characters": [], "world_settings": []}
+        try:
+            if query_embedding is None:
+                query_embedding = self.generate_embedding(query_text, task_type="RETRIEVAL_QUERY")
+            with db.begin_nested():
+                if character_limit > 0:
+                    result["characters"] = self._rank_entities_by_embedding(
+                        db, "character_embeddings", "character_id", "full_description_embedding",
+                        novel_id, query_embedding, character_limit
+                    )
+                if world_setting_limit > 0:
+                    result["world_settings"] = self._rank_entities_by_embedding(
+                        db, "world_setting_embeddings", "world_setting_id", "full_description_embedding",
+                        novel_id, query_embedding, world_setting_limit
+                    )
+        except Exception as e:
+            logger.error(f"检索相关角色/世界观失败: {str(e)}")
+            result = {"characters": [], "world_settings": []}
+        return result
@@ -0,0 +1,316 @@
+"""
+小说向量内存索引
+
+一部小说最多几千个章节/段落向量，但 `find_similar_chapters` / `find_similar_paragraphs` 每次检索都要一次
+pgvector 往返加多表关联；批量写作时同一部小说会被反复检索几十次。这里按小说把向量一次载入进程内
+连续的 float32 矩阵（行向量预先归一化），top-k 检索只需一次矩阵-向量乘积：
+- 按内存预算（VECTOR_INDEX_CACHE_MB）做 LRU 淘汰，单部小说超过预算时只用于本次检索不缓存
+- 章节向量写入后立即失效本进程索引，并通过共享存储广播给其他 worker；VECTOR_INDEX_TTL_SECONDS 兜底
+- 载入期间发生失效时，载入结果只用于本次检索，不写入缓存（避免缓存写入前的旧向量）
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core.shared_state import get_shared_state
+from core.single_flight import SingleFlight
+from .vector_ops import decode_vector
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "novawrite_vector_index_invalidate"
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """行向量归一化（零向量保持为零，相似度记为 0）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def _top_k(scores: np.ndarray, limit: int, threshold: float, excluded: Optional[np.ndarray] = None) -> np.ndarray:
+    """返回相似度不低于阈值、未被排除的前 limit 个下标（按相似度降序）"""
+    candidates = scores >= threshold
+    if excluded is not None:
+        candidates &= ~excluded
+    indexes = np.flatnonzero(candidates)
+    if limit <= 0 or indexes.size == 0:
+        return indexes[:0]
+    if indexes.size > limit:
+        indexes = indexes[np.argpartition(-scores[indexes], limit - 1)[:limit]]
+    return indexes[np.argsort(-scores[indexes], kind="stable")]
+
+
+class NovelVectorIndex:
+    """一部小说的章节向量矩阵与段落向量矩阵"""
+
+    def __init__(
+        self,
+        novel_id: str,
+        chapter_ids: List[str],
+        chapter_matrix: np.ndarray,
+        chunk_counts: List[int],
+        paragraph_matrix: np.ndarray,
+        paragraph_chapters: np.ndarray,
+        paragraph_indexes: np.ndarray,
+    ):
+        self.novel_id = novel_id
+        self.chapter_ids = chapter_ids
+        self.chapter_matrix = chapter_matrix
+        self.chunk_counts = chunk_counts
+        self.paragraph_matrix = paragraph_matrix
+        self.paragraph_chapters = paragraph_chapters
+        self.paragraph_indexes = paragraph_indexes
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def build(cls, novel_id: str, rows: Sequence[Tuple[Any, Any, Any, Any]]) -> "NovelVectorIndex":
+        """由 (chapter_id, chunk_count, 章节向量, 段落向量列表) 行构建索引；维度以第一个向量为准，不一致的跳过"""
+        chapter_ids: List[str] = []
+        chunk_counts: List[int] = []
+        chapter_vectors: List[np.ndarray] = []
+        paragraph_vectors: List[np.ndarray] = []
+        paragraph_chapters: List[int] = []
+        paragraph_indexes: List[int] = []
+        dim = None
+        for chapter_id, chunk_count, full_embedding, paragraph_embeddings in rows:
+            full_vector = decode_vector(full_embedding)
+            if full_vector is None:
+                continue
+            dim = dim or full_vector.shape[0]
+            if full_vector.shape[0] != dim:
+                continue
+            position = len(chapter_ids)
+            chapter_ids.append(chapter_id)
+            chunk_counts.append(chunk_count)
+            chapter_vectors.append(full_vector)
+            for paragraph_index, value in enumerate(paragraph_embeddings or []):
+                vector = decode_vector(value)
+                if vector is not None and vector.shape[0] == dim:
+                    paragraph_vectors.append(vector)
+                    paragraph_chapters.append(position)
+                    paragraph_indexes.append(paragraph_index)
+
+        def _matrix(vectors: List[np.ndarray]) -> np.ndarray:
+            if not vectors:
+                return np.empty((0, dim or 0), dtype=np.float32)
+            return _normalize(np.vstack(vectors).astype(np.float32, copy=False))
+
+        return cls(
+            novel_id=novel_id,
+            chapter_ids=chapter_ids,
+            chapter_matrix=_matrix(chapter_vectors),
+            chunk_counts=chunk_counts,
+            paragraph_matrix=_matrix(paragraph_vectors),
+            paragraph_chapters=np.asarray(paragraph_chapters, dtype=np.int32),
+            paragraph_indexes=np.asarray(paragraph_indexes, dtype=np.int32),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.chapter_matrix.nbytes + self.paragraph_matrix.nbytes
+            + self.paragraph_chapters.nbytes + self.paragraph_indexes.nbytes
+        )
+
+    def _query(self, query_embedding: Sequence[float]) -> Optional[np.ndarray]:
+        query = decode_vector(query_embedding)
+        if query is None or query.shape[0] != self.chapter_matrix.shape[1]:
+            return None
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def _excluded(self, exclude_chapter_ids: Optional[List[str]]) -> Optional[np.ndarray]:
+        if not exclude_chapter_ids:
+            return None
+        excluded = set(exclude_chapter_ids)
+        return np.fromiter((cid in excluded for cid in self.chapter_ids), dtype=bool, count=len(self.chapter_ids))
+
+    def search_chapters(
+        self,
+        query_embedding: Sequence[float],
+        limit: int,
+        similarity_threshold: float,
+        exclude_chapter_ids: Optional[List[str]] = None,
+    ) -> List[Tuple[str, int, float]]:
+        """章节级 top-k，返回 (chapter_id, chunk_count, similarity)"""
+        query = self._query(query_embedding)
+        if query is None or not self.chapter_ids:
+            return []
+        scores = self.chapter_matrix @ query
+        hits = _top_k(scores, limit, similarity_threshold, self._excluded(exclude_chapter_ids))
+        return [(self.chapter_ids[i], self.chunk_counts[i], float(scores[i])) for i in hits]
+
+    def search_paragraphs(
+        self,
+        query_embedding: Sequence[float],
+        limit: int,
+        similarity_threshold: float,
+        exclude_chapter_ids: Optional[List[str]] = None,
+    ) -> List[Tuple[str, int, float]]:
+        """段落级 top-k，返回 (chapter_id, paragraph_index, similarity)"""
+        query = self._query(query_embedding)
+        if query is None or self.paragraph_matrix.shape[0] == 0:
+            return []
+        scores = self.paragraph_matrix @ query
+        excluded = self._excluded(exclude_chapter_ids)
+        hits = _top_k(
+            scores, limit, similarity_threshold,
+            excluded[self.paragraph_chapters] if excluded is not None else None,
+        )
+        return [
+            (self.chapter_ids[self.paragraph_chapters[i]], int(self.paragraph_indexes[i]), float(scores[i]))
+            for i in hits
+        ]
+
+
+def load_novel_index(db: Session, novel_id: str) -> NovelVectorIndex:
+    """一次查询以二进制形式取回小说全部章节向量与段落向量"""
+    rows = db.execute(
+        text("""
+            SELECT
+                ce.chapter_id,
+                ce.chunk_count,
+                vector_send(ce.full_content_embedding) AS full_content_embedding,
+                ARRAY(
+                    SELECT vector_send(t.paragraph_emb)
+                    FROM unnest(ce.paragraph_embeddings) WITH ORDINALITY AS t(paragraph_emb, paragraph_idx)
+                    ORDER BY t.paragraph_idx
+                ) AS paragraph_embeddings
+            FROM chapter_embeddings ce
+            JOIN chapters c ON c.id = ce.chapter_id
+            JOIN volumes v ON v.id = c.volume_id
+            WHERE v.novel_id = :novel_id
+            AND ce.full_content_embedding IS NOT NULL
+        """),
+        {"novel_id": novel_id}
+    ).fetchall()
+    return NovelVectorIndex.build(novel_id, rows)
+
+
+class VectorIndexCache:
+    """按小说 ID 的 LRU 缓存，总内存不超过 max_bytes，条目超过 ttl 秒后重新载入"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, NovelVectorIndex]" = OrderedDict()
+        self._bytes = 0
+        # 每部小说的失效代数：载入开始后代数变化说明期间有写入，结果不写入缓存
+        self._generations: Dict[str, int] = {}
+        self._loads = SingleFlight("vector_index")
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "invalidations": 0, "oversized": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get_or_load(self, db: Session, novel_id: str) -> Optional[NovelVectorIndex]:
+        """返回小说的向量索引；缓存关闭时返回 None（调用方走 pgvector 检索）"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            index = self._entries.get(novel_id)
+            if index is not None:
+                if self.ttl > 0 and index.loaded_at + self.ttl <= now:
+                    self._remove(novel_id)
+                else:
+                    self._entries.move_to_end(novel_id)
+                    self.stats["hits"] += 1
+                    return index
+            self.stats["misses"] += 1
+        return self._loads.do(novel_id, lambda: self._load(db, novel_id))
+
+    def _load(self, db: Session, novel_id: str) -> NovelVectorIndex:
+        with self._lock:
+            generation = self._generations.get(novel_id, 0)
+        started = time.perf_counter()
+        index = load_novel_index(db, novel_id)
+        logger.debug(
+            f"载入小说向量索引: novel_id={novel_id}, chapters={len(index.chapter_ids)}, "
+            f"paragraphs={index.paragraph_matrix.shape[0]}, bytes={index.nbytes}, "
+            f"time={(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        with self._lock:
+            self.stats["loads"] += 1
+            if index.nbytes > self.max_bytes:
+                self.stats["oversized"] += 1
+                return index
+            if self._generations.get(novel_id, 0) != generation:
+                return index
+            self._remove(novel_id)
+            self._entries[novel_id] = index
+            self._bytes += index.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                evicted_id = next(iter(self._entries))
+                self._remove(evicted_id)
+                self.stats["evictions"] += 1
+        return index
+
+    def _remove(self, novel_id: str) -> bool:
+        index = self._entries.pop(novel_id, None)
+        if index is None:
+            return False
+        self._bytes -= index.nbytes
+        return True
+
+    def evict(self, novel_id: str) -> None:
+        with self._lock:
+            self._generations[novel_id] = self._generations.get(novel_id, 0) + 1
+            if self._remove(novel_id):
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "novels": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                **self.stats,
+            }
+
+
+_cache: Optional[VectorIndexCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_vector_index_cache() -> VectorIndexCache:
+    """获取进程级向量索引缓存（首次使用时订阅失效广播）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from core.config import VECTOR_INDEX_CACHE_MB, VECTOR_INDEX_TTL_SECONDS
+
+                cache = VectorIndexCache(int(VECTOR_INDEX_CACHE_MB * 1024 * 1024), VECTOR_INDEX_TTL_SECONDS)
+                if cache.enabled:
+                    get_shared_state().subscribe(INVALIDATE_CHANNEL, cache.evict)
+                _cache = cache
+    return _cache
+
+
+def invalidate_novel_vectors(novel_id: str) -> None:
+    """小说的章节向量写入或删除后调用：清除本进程索引并通知其他 worker"""
+    cache = get_vector_index_cache()
+    if not cache.enabled:
+        return
+    cache.evict(novel_id)
+    try:
+        get_shared_state().publish(INVALIDATE_CHANNEL, novel_id)
+    except Exception as e:
+        # 广播失败时其他 worker 的索引最多保留一个 TTL
+        logger.warning(f"⚠️ 向量索引失效广播失败: {str(e)}")
@@ -0,0 +1,75 @@
+"""
+进程内向量运算
+从 pgvector 以二进制形式（vector_send）一次取回候选向量，在进程内用一次矩阵-向量乘积计算全部余弦相似度，
+避免逐个候选发起 `SELECT 1 - (CAST(...) <=> CAST(...))` 往返和向量文本的解析
+"""
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+VectorLike = Union[bytes, bytearray, memoryview, str, Sequence[float], np.ndarray]
+
+
+def binary_vector_column(column: str, alias: Optional[str] = None) -> str:
+    """SELECT 列表中以二进制取回 vector 列的表达式"""
+    return f"vector_send({column}) AS {alias or column.rsplit('.', 1)[-1]}"
+
+
+def decode_vector(value: Optional[VectorLike]) -> Optional[np.ndarray]:
+    """把数据库返回的向量解码为 float32 数组
+
+    支持 vector_send 的二进制格式（2 字节维度 + 2 字节保留 + 大端 float32）、
+    pgvector 文本格式 "[0.1,0.2,...]" 以及已经是列表或数组的值；空值返回 None。
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        buffer = bytes(value)
+        if len(buffer) < 4:
+            return None
+        dim = int.from_bytes(buffer[:2], "big")
+        if len(buffer) != 4 + dim * 4:
+            raise ValueError(f"向量二进制长度与维度不符: dim={dim}, bytes={len(buffer)}")
+        return np.frombuffer(buffer, dtype=">f4", offset=4).astype(np.float32)
+    if isinstance(value, str):
+        body = value.strip().strip("[]")
+        if not body:
+            return None
+        return np.array(body.split(","), dtype=np.float32)
+    vector = np.asarray(value, dtype=np.float32)
+    return vector if vector.size else None
+
+
+def stack_vectors(values: Iterable[Optional[VectorLike]]) -> Tuple[np.ndarray, List[int]]:
+    """解码并堆叠成矩阵，返回矩阵与各行对应的原始下标（跳过空值与维度不一致的向量）"""
+    vectors: List[np.ndarray] = []
+    indexes: List[int] = []
+    dim = None
+    for index, value in enumerate(values):
+        vector = decode_vector(value)
+        if vector is None:
+            continue
+        if dim is None:
+            dim = vector.shape[0]
+        elif vector.shape[0] != dim:
+            continue
+        vectors.append(vector)
+        indexes.append(index)
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32), []
+    return np.vstack(vectors), indexes
+
+
+def cosine_similarities(matrix: np.ndarray, query: VectorLike) -> np.ndarray:
+    """一次矩阵-向量乘积计算每一行与查询向量的余弦相似度（与 pgvector 的 1 - (a <=> b) 一致）
+
+    零向量的相似度记为 0。
+    """
+    if matrix.size == 0:
+        return np.empty(0, dtype=np.float32)
+    query_vector = decode_vector(query)
+    if query_vector is None or query_vector.shape[0] != matrix.shape[1]:
+        raise ValueError("查询向量为空或维度与候选向量不一致")
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+    dots = matrix @ query_vector
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
@@ -5,11 +5,21 @@ from .task_service import (
     ProgressCallback,
     TaskExecutor
 )
+from .dag_scheduler import (
+    DagProgress,
+    Stage,
+    StageResult,
+    run_stages
+)
 
 __all__ = [
     'create_task',
     'get_task_executor',
     'ProgressCallback',
     'TaskExecutor',
+    'DagProgress',
+    'Stage',
+    'StageResult',
+    'run_stages',
 ]
 
@@ -0,0 +1,177 @@
+"""
+多阶段任务的依赖图调度
+
+把任务描述为若干阶段和它们之间的依赖：依赖全部完成的阶段即可开始，互不依赖的阶段在线程池中并行（最多 max_workers 个）。
+已完成的阶段（断点）直接跳过；任一阶段失败后不再启动新阶段，等已在运行的阶段结束后抛出第一个异常。
+阶段在调用方的上下文副本中执行，取消令牌等上下文变量在阶段内同样可见。
+"""
+import concurrent.futures
+import contextvars
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from core.cancellation import raise_if_cancelled
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """任务阶段：run 接收该阶段的进度回调（update(progress, message)），weight 为该阶段在总进度中的占比"""
+    name: str
+    run: Callable[[Any], Any]
+    deps: Tuple[str, ...] = ()
+    weight: float = 1.0
+    label: str = ""
+
+
+@dataclass
+class StageResult:
+    name: str
+    value: Any = None
+    elapsed_ms: int = 0
+    skipped: bool = False
+
+
+def order_stages(stages: Sequence[Stage]) -> List[Stage]:
+    """按依赖拓扑排序；依赖不存在或存在环时抛出 ValueError"""
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("阶段名称重复")
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"阶段 {stage.name} 依赖不存在的阶段: {missing}")
+    ordered: List[Stage] = []
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if all(dep in done for dep in stage.deps)]
+        if not ready:
+            raise ValueError(f"阶段依赖存在环: {[stage.name for stage in remaining]}")
+        for stage in ready:
+            ordered.append(stage)
+            done.add(stage.name)
+        remaining = [stage for stage in remaining if stage.name not in done]
+    return ordered
+
+
+class DagProgress:
+    """按阶段权重把各阶段 0-100 的进度汇总成任务总进度（映射到 [start, end]，只增不减）"""
+
+    def __init__(
+        self,
+        stages: Sequence[Stage],
+        report: Callable[[int, str], None],
+        start: int = 0,
+        end: int = 100,
+        completed: Iterable[str] = ()
+    ):
+        self.report = report
+        self.start = start
+        self.span = max(0, end - start)
+        self.weights = {stage.name: max(0.0, stage.weight) for stage in stages}
+        self.total_weight = sum(self.weights.values()) or 1.0
+        self.progress = {stage.name: (100 if stage.name in set(completed) else 0) for stage in stages}
+        self.reported = start
+        self._lock = threading.Lock()
+
+    def overall(self) -> int:
+        done = sum(self.weights[name] * progress for name, progress in self.progress.items()) / 100
+        return self.start + int(self.span * done / self.total_weight)
+
+    def update(self, name: str, progress: int, message: str) -> None:
+        with self._lock:
+            self.progress[name] = max(self.progress[name], max(0, min(100, int(progress))))
+            overall = max(self.reported, self.overall())
+            self.reported = overall
+        self.report(overall, message)
+
+    def tracker(self, name: str) -> "_StageTracker":
+        return _StageTracker(self, name)
+
+
+class _StageTracker:
+    """单个阶段的进度回调，接口与 ProgressCallback 相同"""
+
+    def __init__(self, progress: DagProgress, name: str):
+        self._progress = progress
+        self._name = name
+
+    def update(self, progress: int, message: str) -> None:
+        self._progress.update(self._name, progress, message)
+
+
+def run_stages(
+    stages: Sequence[Stage],
+    max_workers: int = 4,
+    completed: Iterable[str] = (),
+    progress: Optional[DagProgress] = None,
+    on_stage_done: Optional[Callable[[StageResult], None]] = None
+) -> Dict[str, StageResult]:
+    """
+    按依赖图执行阶段
+
+    Args:
+        stages: 阶段列表
+        max_workers: 最多同时执行的阶段数
+        completed: 已完成（从断点恢复）的阶段名称，直接跳过
+        progress: 总进度汇总器
+        on_stage_done: 每个阶段完成后在调度线程中回调（用于保存断点），按完成顺序调用
+
+    Returns:
+        {阶段名称: StageResult}
+    """
+    ordered = order_stages(stages)
+    results: Dict[str, StageResult] = {
+        name: StageResult(name=name, skipped=True) for name in completed if any(s.name == name for s in ordered)
+    }
+    pending = [stage for stage in ordered if stage.name not in results]
+    running: Dict[concurrent.futures.Future, Tuple[Stage, float]] = {}
+    error: Optional[BaseException] = None
+
+    def _start(stage: Stage, pool: concurrent.futures.ThreadPoolExecutor) -> None:
+        tracker = progress.tracker(stage.name) if progress else None
+        context = contextvars.copy_context()
+        logger.info(f"阶段开始: {stage.label or stage.name}")
+        running[pool.submit(context.run, stage.run, tracker)] = (stage, time.monotonic())
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="stage_") as pool:
+        while pending or running:
+            if error is None:
+                try:
+                    raise_if_cancelled()
+                except BaseException as e:
+                    error = e
+            if error is None:
+                ready = [stage for stage in pending if all(dep in results for dep in stage.deps)]
+                for stage in ready[:max(0, max_workers - len(running))]:
+                    pending.remove(stage)
+                    _start(stage, pool)
+            if not running:
+                if error is None and pending:
+                    raise ValueError(f"阶段无法开始: {[stage.name for stage in pending]}")
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                stage, started = running.pop(future)
+                elapsed_ms = int((time.monotonic() - started) * 1000)
+                exc = future.exception()
+                if exc is not None:
+                    logger.error(f"阶段失败: {stage.label or stage.name}（{elapsed_ms}ms）: {exc}")
+                    error = error or exc
+                    continue
+                result = StageResult(name=stage.name, value=future.result(), elapsed_ms=elapsed_ms)
+                results[stage.name] = result
+                if progress:
+                    progress.update(stage.name, 100, f"{stage.label or stage.name}完成")
+                logger.info(f"✅ 阶段完成: {stage.label or stage.name}（{elapsed_ms}ms）")
+                if on_stage_done:
+                    on_stage_done(result)
+
+    if error is not None:
+        raise error
+    return results
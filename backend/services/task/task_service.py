@@ -5,6 +5,8 @@ from typing import Optional, Dict, Any, Callable
 from sqlalchemy.orm import Session
 from models import Task
 from core.database import SessionLocal
+from core.cancellation import OperationCancelled, cancel_scope, get_cancel_token
+from core.run_control import broadcast_cancel, clear_run, is_cancelled
 
 # 全局任务执行器
 _task_executor = None
@@ -54,13 +56,35 @@ class TaskExecutor:
     
     def submit_task(self, task_id: str, task_func: Callable):
         """提交任务到后台执行"""
+        get_cancel_token(task_id)
         future = self.executor.submit(self._execute_task, task_id, task_func)
         return future
     
-    def submit(self, task_func: Callable):
-        """直接提交任务函数到后台执行（用于已经在内部处理状态的任务）"""
-        future = self.executor.submit(task_func)
-        return future
+    def submit(self, task_func: Callable, task_id: Optional[str] = None):
+        """直接提交任务函数到后台执行（用于已经在内部处理状态的任务）
+
+        传入 task_id 时任务可被取消：函数在该任务的取消作用域内执行，
+        取消后 AI 请求立即中断，任务标记为 cancelled。
+        """
+        if task_id is None:
+            return self.executor.submit(task_func)
+        get_cancel_token(task_id)
+        return self.executor.submit(self._run_cancellable, task_id, task_func)
+    
+    def _run_cancellable(self, task_id: str, task_func: Callable):
+        """在取消作用域内执行任务函数"""
+        token = get_cancel_token(task_id)
+        try:
+            with cancel_scope(token):
+                # 排队期间可能已在其他 worker 上被取消
+                if is_cancelled(task_id):
+                    token.cancel()
+                token.raise_if_cancelled()
+                return task_func()
+        except OperationCancelled:
+            mark_task_cancelled(task_id)
+        finally:
+            clear_run(task_id)
     
     def _execute_task(self, task_id: str, task_func: Callable):
         """执行任务并更新状态"""
@@ -79,7 +103,12 @@ class TaskExecutor:
             
             # 执行任务函数（函数内部会创建和使用进度回调）
             try:
-                result = task_func()
+                token = get_cancel_token(task_id)
+                with cancel_scope(token):
+                    if is_cancelled(task_id):
+                        token.cancel()
+                    token.raise_if_cancelled()
+                    result = task_func()
                 
                 # 更新任务为完成状态
                 task = db.query(Task).filter(Task.id == task_id).first()
@@ -91,6 +120,8 @@ class TaskExecutor:
                     task.progress_message = "任务完成"
                     db.commit()
                 
+            except OperationCancelled:
+                mark_task_cancelled(task_id)
             except Exception as e:
                 # 更新任务为失败状态
                 task = db.query(Task).filter(Task.id == task_id).first()
@@ -104,9 +135,36 @@ class TaskExecutor:
         except Exception as e:
             print(f"任务执行错误: {e}")
         finally:
+            clear_run(task_id)
             db.close()
 
 
+def request_task_cancel(task_id: str) -> bool:
+    """请求取消后台任务（广播到所有 worker）；返回 False 表示该任务不在本进程的执行器中"""
+    return broadcast_cancel(task_id)
+
+
+def mark_task_cancelled(task_id: str, result: Optional[Dict[str, Any]] = None):
+    """把任务标记为已取消，保留已完成的进度（已生成的章节等已逐条入库）"""
+    db = SessionLocal()
+    try:
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task or task.status in ("completed", "failed", "cancelled"):
+            return
+        now = int(time.time() * 1000)
+        task.status = "cancelled"
+        task.completed_at = now
+        task.updated_at = now
+        task.progress_message = f"任务已取消（{task.progress_message}）" if task.progress_message else "任务已取消"
+        if result is not None:
+            task.result = json.dumps(result)
+        db.commit()
+    except Exception as e:
+        print(f"标记任务取消失败: {e}")
+    finally:
+        db.close()
+
+
 def create_task(
     db: Session,
     novel_id: str,
@@ -0,0 +1,132 @@
+"""
+多 Agent 流程推测执行测试
+用固定耗时的假 Agent 驱动 /api/agents/flow/stream：验证 Archivist 与 Critic 并行、Critic 要求重写时
+丢弃推测结果、status 事件带阶段耗时，并对比顺序执行与推测执行的端到端耗时
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import main  # noqa: E402
+
+AGENT_SECONDS = {"director": 0.05, "critic": 0.3, "archivist": 0.3}
+
+
+class FakeAgents:
+    """假 Agent：按固定耗时返回，Critic 按预设分数序列打分"""
+
+    def __init__(self, critic_scores):
+        self.critic_scores = list(critic_scores)
+        self.lock = threading.Lock()
+        self.calls = []
+        self.drafts = 0
+
+    def run(self, agent, message, context_text, provider=None):
+        time.sleep(AGENT_SECONDS[agent])
+        with self.lock:
+            self.calls.append((agent, message))
+            if agent == "critic":
+                return {"text": json.dumps({"score": self.critic_scores.pop(0), "issues": ["节奏拖沓"]})}
+        if agent == "archivist":
+            return {"text": json.dumps({"source": message})}
+        return {"text": f"{agent} 输出"}
+
+    def stream(self, agent, message, context_text, provider=None, cancel_token=None):
+        self.drafts += 1
+        for part in (f"草稿{self.drafts}", "。"):
+            time.sleep(0.02)
+            yield part
+
+
+def run_flow(agents, speculative):
+    patches = {
+        "require_novel_owner": mock.DEFAULT,
+        "_build_agent_context": mock.DEFAULT,
+        "_format_agent_context": mock.MagicMock(return_value=""),
+        "_persist_agent_run": mock.DEFAULT,
+        "_save_flow_status_message": mock.DEFAULT,
+        "_save_flow_messages_preserve_system": mock.DEFAULT,
+        "_save_flow_output_to_chapter": mock.MagicMock(return_value=None),
+        "_apply_archivist_payload": mock.DEFAULT,
+        "_run_agent_llm": agents.run,
+        "_run_agent_llm_stream": agents.stream,
+    }
+    request = main.AgentFlowRequest(novel_id="n1", summarize_chapters=False, speculative=speculative)
+    user = SimpleNamespace(id="u1")
+
+    async def collect():
+        response = await main.run_agent_flow_stream(request, current_user=user, db=None)
+        return [chunk async for chunk in response.body_iterator]
+
+    with mock.patch.multiple(main, **patches):
+        started = time.monotonic()
+        raw = asyncio.run(collect())
+        elapsed = time.monotonic() - started
+
+    events = []
+    for block in raw:
+        fields = dict(line.split(": ", 1) for line in block.strip().split("\n") if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events, elapsed
+
+
+class TestSpeculativeFlow(unittest.TestCase):
+    """测试推测执行"""
+
+    def test_archivist_overlaps_critic(self):
+        """测试 Critic 通过时直接采用并行运行的 Archivist 结果"""
+        agents = FakeAgents([90])
+        events, elapsed = run_flow(agents, speculative=True)
+        done = events[-1][1]
+        self.assertEqual(events[-1][0], "done")
+        self.assertEqual(json.loads(done["archivist"])["source"], done["writer"])
+        self.assertEqual([c[0] for c in agents.calls].count("archivist"), 1)
+        self.assertTrue(done["speculative"])
+        for stage in ("director", "writer", "critic", "archivist", "total"):
+            self.assertIn(stage, done["timings"])
+        archivist_done = [d for e, d in events if e == "status" and d["stage"] == "archivist" and d["status"] == "done"]
+        self.assertEqual(len(archivist_done), 1)
+        self.assertLess(archivist_done[0]["waited_ms"], archivist_done[0]["elapsed_ms"])
+        print(f"   ✅ Archivist 与 Critic 并行测试通过（{elapsed:.2f}s）")
+
+    def test_rewrite_discards_speculation(self):
+        """测试 Critic 要求重写时丢弃推测结果，最终档案来自重写后的草稿"""
+        agents = FakeAgents([40, 90])
+        events, _ = run_flow(agents, speculative=True)
+        done = events[-1][1]
+        self.assertEqual(done["writer"], "草稿2。")
+        self.assertEqual(json.loads(done["archivist"])["source"], "草稿2。")
+        discarded = [d for e, d in events if e == "status" and d.get("status") == "discarded"]
+        self.assertEqual(len(discarded), 1)
+        print("   ✅ 重写丢弃推测结果测试通过")
+
+    def test_retries_exhausted_keeps_speculation(self):
+        """测试重试次数用尽时推测结果对应最终草稿，不再重复运行 Archivist"""
+        agents = FakeAgents([40, 40])
+        events, _ = run_flow(agents, speculative=True)
+        done = events[-1][1]
+        self.assertEqual(json.loads(done["archivist"])["source"], "草稿2。")
+        self.assertEqual([c[0] for c in agents.calls].count("archivist"), 2)
+        print("   ✅ 重试用尽保留推测结果测试通过")
+
+    def test_latency_drop(self):
+        """测试推测执行缩短端到端耗时（约一个 Archivist 的时间）"""
+        _, sequential = run_flow(FakeAgents([90]), speculative=False)
+        _, speculative = run_flow(FakeAgents([90]), speculative=True)
+        print(f"   顺序执行 {sequential:.2f}s | 推测执行 {speculative:.2f}s")
+        self.assertLess(speculative, sequential - 0.2)
+        print("   ✅ 端到端耗时测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
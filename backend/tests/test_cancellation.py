@@ -0,0 +1,133 @@
+"""
+取消令牌单元测试
+验证取消后流式读取在有界时间内返回、上游被关闭、异步请求被中断
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core.cancellation import (  # noqa: E402
+    CancellationToken, OperationCancelled, aiter_cancellable, cancel_scope, get_cancel_token,
+    iterate_cancellable, raise_if_cancelled, release_cancel_token, request_cancel, wait_cancellable
+)
+
+
+class TestCancellation(unittest.TestCase):
+    """测试取消令牌"""
+
+    def test_sync_stream_stops_within_bound(self):
+        """测试取消后同步流立即返回，上游在下一个分片到达时关闭"""
+        token = CancellationToken("stream")
+        closed = threading.Event()
+        produced = []
+
+        def upstream():
+            try:
+                for i in range(100):
+                    produced.append(i)
+                    yield f"片段{i}"
+                    time.sleep(0.3)
+            finally:
+                closed.set()
+
+        received = []
+        threading.Timer(0.1, token.cancel).start()
+        started = time.monotonic()
+        with self.assertRaises(OperationCancelled):
+            for chunk in iterate_cancellable(upstream(), token):
+                received.append(chunk)
+        self.assertLess(time.monotonic() - started, 0.25)
+        self.assertEqual(received, ["片段0"])
+        self.assertTrue(closed.wait(1.0))
+        self.assertLessEqual(len(produced), 3)
+        print("   ✅ 同步流取消测试通过")
+
+    def test_sync_stream_without_token(self):
+        """测试未传令牌时按原样迭代，异常透传"""
+        def upstream():
+            yield "a"
+            raise ValueError("上游错误")
+
+        received = []
+        with self.assertRaises(ValueError):
+            for chunk in iterate_cancellable(upstream(), CancellationToken("e")):
+                received.append(chunk)
+        self.assertEqual(received, ["a"])
+        self.assertEqual(list(iterate_cancellable(iter([1, 2]), None)), [1, 2])
+        print("   ✅ 异常透传测试通过")
+
+    def test_async_request_interrupted(self):
+        """测试异步请求在令牌触发后被取消"""
+        token = CancellationToken("request")
+        finished = []
+
+        async def slow_request():
+            try:
+                await asyncio.sleep(5)
+            finally:
+                finished.append(True)
+
+        async def run():
+            threading.Timer(0.05, token.cancel).start()
+            started = time.monotonic()
+            with self.assertRaises(OperationCancelled):
+                await wait_cancellable(slow_request(), token)
+            return time.monotonic() - started
+
+        elapsed = asyncio.run(run())
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(finished, [True])
+        print("   ✅ 异步请求取消测试通过")
+
+    def test_async_stream_uses_scope_token(self):
+        """测试异步流默认使用作用域内的令牌（asyncio.run 复制上下文）"""
+        token = CancellationToken("scope")
+
+        async def upstream():
+            for i in range(100):
+                yield i
+                await asyncio.sleep(0.05)
+
+        async def consume():
+            from core.cancellation import current_token
+            received = []
+            try:
+                async for item in aiter_cancellable(upstream(), current_token()):
+                    received.append(item)
+                    if item == 2:
+                        token.cancel()
+            except OperationCancelled:
+                return received
+            return None
+
+        with cancel_scope(token):
+            received = asyncio.run(consume())
+        self.assertEqual(received, [0, 1, 2])
+        print("   ✅ 作用域令牌测试通过")
+
+    def test_registry(self):
+        """测试按 ID 登记、取消与检查点"""
+        self.assertFalse(request_cancel("missing"))
+        token = get_cancel_token("task-1")
+        self.assertIs(get_cancel_token("task-1"), token)
+        callbacks = []
+        token.on_cancel(lambda: callbacks.append(1))
+        self.assertTrue(request_cancel("task-1"))
+        self.assertEqual(callbacks, [1])
+        with cancel_scope(token):
+            with self.assertRaises(OperationCancelled):
+                raise_if_cancelled()
+        raise_if_cancelled()
+        release_cancel_token("task-1")
+        self.assertFalse(request_cancel("task-1"))
+        print("   ✅ 令牌登记测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,265 @@
+"""
+多卷章节列表并行生成测试
+验证并行生成不超过并发上限、单卷失败不影响其他卷、取消时抛出、卷交界检查范围与结果解析、
+章节规划与标题清洗，并对比按卷顺序生成与并行生成的耗时
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core.cancellation import CancellationToken, OperationCancelled, cancel_scope  # noqa: E402
+from core.rate_limiter import AdaptiveRateLimiter  # noqa: E402
+from services.ai.chapter_outline_batch import (  # noqa: E402
+    VolumeChapterJob,
+    boundaries_to_stitch,
+    chapter_count_from_outline,
+    generate_volumes_parallel,
+    normalize_chapter_title,
+    parse_stitch_revisions,
+    stitch_boundaries,
+)
+
+
+class FakeChapterGenerator:
+    """模拟 generate_chapter_outline：记录调用与并发峰值，latency 模拟每卷请求耗时"""
+
+    def __init__(self, latency=0.0, fail_titles=(), token=None):
+        self.latency = latency
+        self.fail_titles = set(fail_titles)
+        self.token = token
+        self.titles = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    async def __call__(self, volume_title, chapter_count=None, **kwargs):
+        with self.lock:
+            self.titles.append(volume_title)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.token is not None:
+                self.token.cancel()
+                raise OperationCancelled("cancelled")
+            if volume_title in self.fail_titles:
+                raise RuntimeError("upstream error")
+            return [
+                {"title": f"第{i + 1}章 {volume_title}-{i + 1}", "summary": f"{volume_title}第{i + 1}章"}
+                for i in range(chapter_count or 3)
+            ]
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def fast_limiter(provider, model="", api_key=None):
+    return AdaptiveRateLimiter(key=f"{provider}:{model}", rate=1000, burst=1000, max_concurrency=16)
+
+
+def patch_limiter(limiter_factory=fast_limiter):
+    return mock.patch("services.ai.chapter_outline_batch.get_rate_limiter", side_effect=limiter_factory)
+
+
+def make_jobs(volume_count, chapter_count=3):
+    return [
+        VolumeChapterJob(
+            volume_id=f"v{i}",
+            volume_index=i,
+            title=f"第{i + 1}卷",
+            kwargs={"volume_title": f"第{i + 1}卷", "chapter_count": chapter_count},
+        )
+        for i in range(volume_count)
+    ]
+
+
+class TestParallelGeneration(unittest.TestCase):
+    """测试并行生成"""
+
+    def setUp(self):
+        patcher = patch_limiter()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bounded_parallelism(self):
+        """测试所有卷都生成，并发不超过上限，回调在调用线程按完成顺序执行"""
+        generator = FakeChapterGenerator(latency=0.02)
+        callback_threads = []
+        results = generate_volumes_parallel(
+            make_jobs(6), generator, max_parallel=3, provider="test-parallel",
+            on_result=lambda result: callback_threads.append(threading.get_ident())
+        )
+        self.assertEqual(sorted(r.job.volume_id for r in results), [f"v{i}" for i in range(6)])
+        self.assertTrue(all(len(r.chapters) == 3 and r.error is None for r in results))
+        self.assertEqual(generator.peak, 3)
+        self.assertEqual(set(callback_threads), {threading.get_ident()})
+        print("   ✅ 并发上限测试通过")
+
+    def test_provider_limiter_caps_parallelism(self):
+        """测试提供商限流器的并发上限低于配置的并行数时，以限流器为准"""
+        limiter = AdaptiveRateLimiter(key="tight", rate=1000, burst=1000, max_concurrency=2)
+        generator = FakeChapterGenerator(latency=0.02)
+        with patch_limiter(lambda provider, model="", api_key=None: limiter):
+            generate_volumes_parallel(make_jobs(6), generator, max_parallel=4, provider="tight")
+        self.assertEqual(generator.peak, 2)
+        self.assertEqual(limiter.stats["acquired"], 6)
+        print("   ✅ 限流器并发约束测试通过")
+
+    def test_failure_is_isolated(self):
+        """测试单卷失败记录在结果中，其他卷正常返回"""
+        generator = FakeChapterGenerator(fail_titles={"第2卷"})
+        results = {r.job.volume_id: r for r in generate_volumes_parallel(make_jobs(3), generator, 3, "test-failure")}
+        self.assertIsInstance(results["v1"].error, RuntimeError)
+        self.assertEqual(results["v1"].chapters, [])
+        self.assertEqual(len(results["v0"].chapters), 3)
+        self.assertEqual(len(results["v2"].chapters), 3)
+        print("   ✅ 单卷失败隔离测试通过")
+
+    def test_cancel_raises(self):
+        """测试任务取消时抛出 OperationCancelled，不再回调入库"""
+        token = CancellationToken()
+        saved = []
+        with cancel_scope(token):
+            with self.assertRaises(OperationCancelled):
+                generate_volumes_parallel(
+                    make_jobs(2), FakeChapterGenerator(token=token), 1, "test-cancel", on_result=saved.append
+                )
+        self.assertEqual(saved, [])
+        print("   ✅ 取消测试通过")
+
+
+class TestHelpers(unittest.TestCase):
+    """测试章节规划提取与标题清洗"""
+
+    def test_chapter_count_from_outline(self):
+        """测试多种章节规划写法"""
+        self.assertEqual(chapter_count_from_outline("**【章节规划】：** 75章\n..."), 75)
+        self.assertEqual(chapter_count_from_outline("章节规划：10 章"), 10)
+        self.assertIsNone(chapter_count_from_outline("本卷讲述主角出山"))
+        self.assertIsNone(chapter_count_from_outline(None))
+        print("   ✅ 章节规划提取测试通过")
+
+    def test_normalize_chapter_title(self):
+        """测试去掉“第X章”与序号前缀，空标题回退为章号"""
+        self.assertEqual(normalize_chapter_title("第十二章：风起", 0), "风起")
+        self.assertEqual(normalize_chapter_title("3. 夜袭", 0), "夜袭")
+        self.assertEqual(normalize_chapter_title("  ", 4), "第5章")
+        self.assertEqual(normalize_chapter_title("第3章", 2), "第3章")
+        print("   ✅ 标题清洗测试通过")
+
+
+class TestStitching(unittest.TestCase):
+    """测试卷交界衔接检查"""
+
+    def test_boundaries_to_stitch(self):
+        """测试只检查重新生成且没有参考上一卷结尾的交界"""
+        ids = ["v0", "v1", "v2", "v3"]
+        has_chapters = {"v0": True, "v1": True, "v2": True, "v3": True}
+        # v0 未重新生成、v1 生成时参考了 v0 结尾：v0-v1 不需要检查；v1 重新生成，v1-v2 需要检查
+        self.assertEqual(
+            boundaries_to_stitch(ids, {"v1": True, "v2": False}, has_chapters),
+            [("v1", "v2"), ("v2", "v3")],
+        )
+        self.assertEqual(boundaries_to_stitch(ids, {"v0": False}, dict(has_chapters, v1=False)), [])
+        self.assertEqual(boundaries_to_stitch(ids, {"v3": False}, has_chapters), [("v2", "v3")])
+        print("   ✅ 交界范围测试通过")
+
+    def test_parse_stitch_revisions(self):
+        """测试只保留范围内、摘要非空、不重复的修改，非法输出视为无修改"""
+        text = "说明文字\n" + json.dumps({"chapters": [
+            {"index": 0, "summary": "承接上一卷的追杀", "aiPromptHints": "开篇交代伤势"},
+            {"index": 0, "summary": "重复"},
+            {"index": "1", "summary": ""},
+            {"index": 5, "summary": "越界"},
+            {"index": 2, "summary": "修改第三章"},
+        ]}, ensure_ascii=False)
+        revisions = parse_stitch_revisions(text, head_count=3)
+        self.assertEqual([r["index"] for r in revisions], [0, 2])
+        self.assertEqual(revisions[0]["ai_prompt_hints"], "开篇交代伤势")
+        self.assertEqual(parse_stitch_revisions("不是 JSON", 3), [])
+        self.assertEqual(parse_stitch_revisions('{"chapters": []}', 3), [])
+        print("   ✅ 衔接结果解析测试通过")
+
+    def test_stitch_boundaries(self):
+        """测试多个交界并行检查，单个交界失败不影响其他交界"""
+        def boundary(next_id, prev_title):
+            return {
+                "novel_title": "测试小说",
+                "prev_title": prev_title,
+                "prev_tail": [{"title": "决战", "summary": "主角重伤"}],
+                "next_volume_id": next_id,
+                "next_title": next_id,
+                "next_summary": "",
+                "next_head": [{"title": "新城", "summary": "主角抵达新城", "ai_prompt_hints": ""}],
+            }
+
+        prompts = []
+
+        def complete(prompt):
+            prompts.append(prompt)
+            if "坏卷" in prompt:
+                raise RuntimeError("timeout")
+            if "好卷" in prompt:
+                return '{"chapters": [{"index": 0, "summary": "主角带伤抵达新城"}]}'
+            return '{"chapters": []}'
+
+        revisions = stitch_boundaries(
+            [boundary("v1", "好卷"), boundary("v2", "坏卷"), boundary("v3", "顺卷")], complete, max_parallel=3
+        )
+        self.assertEqual(len(prompts), 3)
+        self.assertIn("主角重伤", prompts[0])
+        self.assertEqual(revisions, {"v1": [{"index": 0, "summary": "主角带伤抵达新城", "ai_prompt_hints": ""}]})
+        self.assertEqual(stitch_boundaries([], complete, 3), {})
+        print("   ✅ 交界并行检查测试通过")
+
+
+def sequential_generate(jobs, generator):
+    """改造前：按卷顺序逐个 asyncio.run 生成"""
+    return [asyncio.run(generator(**job.kwargs)) for job in jobs]
+
+
+def run_benchmark(volume_count, latency, max_parallel=4):
+    started = time.perf_counter()
+    sequential_generate(make_jobs(volume_count), FakeChapterGenerator(latency=latency))
+    sequential_s = time.perf_counter() - started
+
+    with patch_limiter():
+        started = time.perf_counter()
+        generate_volumes_parallel(make_jobs(volume_count), FakeChapterGenerator(latency=latency), max_parallel, "bench")
+        parallel_s = time.perf_counter() - started
+    return sequential_s, parallel_s
+
+
+class TestBatchBenchmark(unittest.TestCase):
+    """对比按卷顺序与并行生成"""
+
+    def test_parallel_is_faster(self):
+        """测试 8 卷（每卷请求模拟 50ms）、并发 4：并行约为顺序的 1/4"""
+        sequential_s, parallel_s = run_benchmark(8, 0.05)
+        print(f"   顺序 {sequential_s * 1000:.0f}ms | 并行 {parallel_s * 1000:.0f}ms")
+        self.assertLess(parallel_s * 2.5, sequential_s)
+        print("   ✅ 章节列表并行基准测试通过")
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("全部章节列表生成（每卷请求模拟 0.5s，并发 4，不含衔接检查）")
+    print("=" * 60)
+    for volume_count in (4, 8, 12):
+        sequential_s, parallel_s = run_benchmark(volume_count, 0.5)
+        print(f"{volume_count:>3} 卷: 顺序 {sequential_s:>5.2f}s | 并行 {parallel_s:>5.2f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,130 @@
+"""
+章节写作服务单元测试
+验证相关角色/世界观的检索与筛选逻辑（向量检索使用 Mock）
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from services.ai import chapter_writing_service  # noqa: E402
+
+
+def _character(idx, name=None):
+    return SimpleNamespace(id=f"c{idx}", name=name or f"路人{idx}", personality="")
+
+
+def _setting(idx):
+    return SimpleNamespace(id=f"w{idx}", title=f"设定{idx}", description="")
+
+
+class TestSelectRelevantEntities(unittest.TestCase):
+    """测试 select_relevant_characters_and_settings"""
+
+    def setUp(self):
+        self.chapter = SimpleNamespace(title="夜袭", summary="林风潜入敌营", ai_prompt_hints="")
+        self.characters = [_character(i) for i in range(80)] + [_character(80, "林风")]
+        self.settings = [_setting(i) for i in range(30)]
+
+    @patch.object(chapter_writing_service, "EmbeddingService")
+    def test_top_k_with_named_characters(self, mock_service_cls):
+        """测试只保留 top-k 且点名角色必定保留"""
+        mock_service_cls.return_value.find_relevant_characters_and_settings.return_value = {
+            "characters": [{"id": f"c{i}", "similarity": 0.9 - i / 100} for i in range(81)],
+            "world_settings": [{"id": f"w{i}", "similarity": 0.8 - i / 100} for i in range(30)],
+        }
+        characters, settings = chapter_writing_service.select_relevant_characters_and_settings(
+            None, "novel", self.chapter, self.characters, self.settings,
+            character_top_k=5, world_setting_top_k=3,
+        )
+        ids = {c.id for c in characters}
+        self.assertIn("c80", ids)
+        self.assertEqual(len(characters), 5)
+        self.assertEqual([w.id for w in settings], ["w0", "w1", "w2"])
+        print(f"   ✅ 相关实体筛选测试通过: 角色 {len(characters)}，世界观 {len(settings)}")
+
+    @patch.object(chapter_writing_service, "EmbeddingService")
+    def test_entities_without_embedding_kept(self, mock_service_cls):
+        """测试还没有向量的角色/世界观（刚创建或向量生成失败）总是保留"""
+        mock_service_cls.return_value.find_relevant_characters_and_settings.return_value = {
+            "characters": [{"id": f"c{i}", "similarity": 0.9 - i / 100} for i in range(81) if i != 42],
+            "world_settings": [{"id": f"w{i}", "similarity": 0.8 - i / 100} for i in range(29)],
+        }
+        characters, settings = chapter_writing_service.select_relevant_characters_and_settings(
+            None, "novel", self.chapter, self.characters, self.settings,
+            character_top_k=5, world_setting_top_k=3,
+        )
+        self.assertIn("c42", {c.id for c in characters})
+        self.assertEqual(len(characters), 6)
+        self.assertEqual([w.id for w in settings], ["w0", "w1", "w2", "w29"])
+        print("   ✅ 无向量实体保留测试通过")
+
+    @patch.object(chapter_writing_service, "EmbeddingService")
+    def test_query_embedding_reused(self, mock_service_cls):
+        """测试传入的查询向量直接用于检索（不再为同一查询重复生成向量）"""
+        find = mock_service_cls.return_value.find_relevant_characters_and_settings
+        find.return_value = {"characters": [], "world_settings": []}
+        chapter_writing_service.select_relevant_characters_and_settings(
+            None, "novel", self.chapter, self.characters, self.settings,
+            character_top_k=5, world_setting_top_k=3, query_embedding=[0.1, 0.2],
+        )
+        self.assertEqual(find.call_args.kwargs["query_embedding"], [0.1, 0.2])
+        print("   ✅ 查询向量复用测试通过")
+
+    @patch.object(chapter_writing_service, "EmbeddingService")
+    def test_small_novel_skips_retrieval(self, mock_service_cls):
+        """测试实体数量不超过 top-k 时不做检索"""
+        characters, settings = chapter_writing_service.select_relevant_characters_and_settings(
+            None, "novel", self.chapter, self.characters[:3], self.settings[:2],
+            character_top_k=5, world_setting_top_k=3,
+        )
+        mock_service_cls.assert_not_called()
+        self.assertEqual(len(characters), 3)
+        self.assertEqual(len(settings), 2)
+        print("   ✅ 小规模小说跳过检索测试通过")
+
+    @patch.object(chapter_writing_service, "EmbeddingService")
+    def test_no_embeddings_falls_back(self, mock_service_cls):
+        """测试没有向量时返回原列表"""
+        mock_service_cls.return_value.find_relevant_characters_and_settings.return_value = {
+            "characters": [],
+            "world_settings": [],
+        }
+        characters, settings = chapter_writing_service.select_relevant_characters_and_settings(
+            None, "novel", self.chapter, self.characters, self.settings,
+            character_top_k=5, world_setting_top_k=3,
+        )
+        self.assertEqual(len(characters), len(self.characters))
+        self.assertEqual(len(settings), len(self.settings))
+        print("   ✅ 无向量回退测试通过")
+
+
+class TestEntityRankingSession(unittest.TestCase):
+    """测试向量检索失败时不回滚调用方的会话"""
+
+    def test_failure_uses_savepoint(self):
+        """测试检索在保存点内执行，失败时不调用 rollback（调用方未提交的修改保留）"""
+        from unittest.mock import MagicMock
+        from services.embedding.embedding_service import EmbeddingService
+
+        db = MagicMock()
+        db.execute.side_effect = RuntimeError("relation does not exist")
+        db.begin_nested.return_value.__exit__.return_value = False
+        service = EmbeddingService.__new__(EmbeddingService)
+        with patch.object(EmbeddingService, "generate_embedding") as generate:
+            result = service.find_relevant_characters_and_settings(
+                db, "novel", "夜袭", character_limit=5, world_setting_limit=3, query_embedding=[0.1, 0.2]
+            )
+        generate.assert_not_called()
+        db.begin_nested.assert_called_once()
+        db.rollback.assert_not_called()
+        self.assertEqual(result, {"characters": [], "world_settings": []})
+        print("   ✅ 保存点测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,113 @@
+"""
+上下文装配器单元测试
+验证 token 预算内的贪心装配、固定片段与预算报告
+"""
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from services.ai.context_assembler import (  # noqa: E402
+    ContextAssembler,
+    ContextSnippet,
+    assemble_chapter_context,
+    estimate_tokens,
+    get_context_budget,
+    make_embedding_similarity_fn,
+)
+
+
+class TestContextAssembler(unittest.TestCase):
+    """测试 ContextAssembler"""
+
+    def test_estimate_tokens(self):
+        """测试 token 估算"""
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("林风拔剑"), 4)
+        self.assertEqual(estimate_tokens("abcdefgh"), 2)
+        print("   ✅ token 估算测试通过")
+
+    def test_pack_respects_budget(self):
+        """测试装配结果不超过预算"""
+        assembler = ContextAssembler(budget_tokens=100, section_titles={"world": "世界观:"})
+        for idx in range(20):
+            assembler.add("world", f"设定{idx}：" + "灵气" * 10, recency=idx / 19)
+        result = assembler.pack("灵气")
+        self.assertLessEqual(result.used_tokens, 100)
+        self.assertLess(result.sections["world"]["selected"], 20)
+        self.assertEqual(
+            result.sections["world"]["selected"] + result.sections["world"]["dropped"], 20
+        )
+        self.assertTrue(result.text.startswith("世界观:"))
+        print(f"   ✅ 预算测试通过: {result.report()}")
+
+    def test_relevance_beats_recency(self):
+        """测试相关片段优先于无关的新片段"""
+        assembler = ContextAssembler(budget_tokens=30)
+        assembler.add("world", "青云宗的护山大阵由三位长老共同维持", recency=0.0)
+        assembler.add("world", "东海渔村每年举办一次祭海节日庆典", recency=1.0)
+        result = assembler.pack("护山大阵被破，青云宗危在旦夕")
+        self.assertIn("护山大阵", result.text)
+        self.assertNotIn("祭海", result.text)
+        print("   ✅ 相关度排序测试通过")
+
+    def test_pinned_always_included(self):
+        """测试固定片段总是装入"""
+        assembler = ContextAssembler(budget_tokens=20)
+        assembler.add("novel", "标题: 星河", pinned=True)
+        assembler.add("other", "无关内容" * 20)
+        result = assembler.pack("毫不相干")
+        self.assertIn("标题: 星河", result.text)
+        print("   ✅ 固定片段测试通过")
+
+    def test_chapter_context_keeps_named_characters(self):
+        """测试章节装配保留摘要中点名的角色"""
+        characters = [{"name": f"路人{idx}", "personality": "沉默寡言" * 20} for idx in range(50)]
+        characters.append({"name": "林风", "personality": "冷静果断"})
+        packed = assemble_chapter_context(
+            chapter_title="夜袭",
+            chapter_summary="林风潜入敌营",
+            chapter_prompt_hints="",
+            characters=characters,
+            world_settings=[],
+            previous_chapters_context="上一章内容",
+            budget_tokens=200,
+        )
+        names = [c["name"] for c in packed["characters"]]
+        self.assertIn("林风", names)
+        self.assertLess(len(names), len(characters))
+        self.assertEqual(packed["previous_chapters_context"], "上一章内容")
+        self.assertLessEqual(packed["report"]["used_tokens"], 200)
+        print(f"   ✅ 章节装配测试通过: 保留 {len(names)} 个角色")
+
+    def test_model_budget_lookup(self):
+        """测试按模型获取预算"""
+        self.assertGreater(get_context_budget("gemini-2.0-flash"), 0)
+        self.assertEqual(get_context_budget("gemini-2.0-flash-001"), get_context_budget("gemini-2.0-flash"))
+        self.assertGreater(get_context_budget("unknown-model"), 0)
+        print("   ✅ 模型预算测试通过")
+
+
+class TestEmbeddingSimilarity(unittest.TestCase):
+    """测试基于已存储向量的相似度函数"""
+
+    def test_reuses_query_embedding_and_keeps_session(self):
+        """测试复用传入的查询向量；读取失败时只回滚保存点，不回滚调用方会话"""
+        db = MagicMock()
+        db.execute.side_effect = RuntimeError("relation does not exist")
+        db.begin_nested.return_value.__exit__.return_value = False
+        snippets = [ContextSnippet(section="characters", text="林风", key="c1")]
+        with patch("services.embedding.vector_helper.get_embedding_service") as get_service:
+            similarity = make_embedding_similarity_fn(db, "novel", query_embedding=[0.1, 0.2])
+            self.assertEqual(similarity("夜袭", snippets), [None])
+        get_service.assert_not_called()
+        db.begin_nested.assert_called_once()
+        db.rollback.assert_not_called()
+        print("   ✅ 查询向量复用与保存点测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
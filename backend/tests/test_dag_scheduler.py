@@ -0,0 +1,235 @@
+"""
+任务阶段依赖图调度测试
+验证依赖顺序、互不依赖的阶段并行、并行数上限、断点跳过、失败后不再启动后续阶段、取消令牌在阶段内可见、
+按权重汇总的总进度只增不减，并对比完整大纲流水线顺序执行与依赖图执行的耗时
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core.cancellation import CancellationToken, OperationCancelled, cancel_scope, current_token  # noqa: E402
+from core.shared_state import MemoryStateStore  # noqa: E402
+from services.task.dag_scheduler import DagProgress, Stage, order_stages, run_stages  # noqa: E402
+
+
+class Recorder:
+    """记录阶段开始/结束顺序与并发峰值"""
+
+    def __init__(self):
+        self.events = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def stage(self, name, seconds=0.02, deps=(), weight=1.0, fail=False):
+        def run(progress):
+            with self.lock:
+                self.events.append(("start", name))
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            try:
+                if progress:
+                    progress.update(50, f"{name} 进行中")
+                time.sleep(seconds)
+                if fail:
+                    raise RuntimeError(f"{name} failed")
+                return name.upper()
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.events.append(("end", name))
+
+        return Stage(name=name, run=run, deps=tuple(deps), weight=weight)
+
+    def index(self, kind, name):
+        return self.events.index((kind, name))
+
+
+def outline_pipeline(recorder, seconds=0.02):
+    """与完整大纲任务相同的依赖结构"""
+    return [
+        recorder.stage("outline", seconds, weight=3),
+        recorder.stage("characters", seconds, deps=("outline",), weight=2),
+        recorder.stage("world_settings", seconds, deps=("outline",), weight=2),
+        recorder.stage("timeline", seconds, deps=("outline",)),
+        recorder.stage("foreshadowings", seconds, deps=("outline",)),
+    ]
+
+
+class TestDagScheduler(unittest.TestCase):
+    """测试依赖图调度"""
+
+    def test_dependencies_and_parallelism(self):
+        """测试依赖阶段完成后才开始，互不依赖的阶段并行且不超过上限"""
+        recorder = Recorder()
+        results = run_stages(outline_pipeline(recorder), max_workers=2)
+        for name in ("characters", "world_settings", "timeline", "foreshadowings"):
+            self.assertGreater(recorder.index("start", name), recorder.index("end", "outline"))
+            self.assertEqual(results[name].value, name.upper())
+        self.assertEqual(recorder.peak, 2)
+        self.assertGreaterEqual(results["outline"].elapsed_ms, 15)
+        print("   ✅ 依赖顺序与并行上限测试通过")
+
+    def test_checkpoint_skips_completed(self):
+        """测试已完成的阶段直接跳过，完成回调按完成顺序记录断点"""
+        recorder = Recorder()
+        done = []
+        results = run_stages(
+            outline_pipeline(recorder),
+            completed=["outline", "characters"],
+            on_stage_done=lambda result: done.append(result.name),
+        )
+        self.assertNotIn(("start", "outline"), recorder.events)
+        self.assertNotIn(("start", "characters"), recorder.events)
+        self.assertTrue(results["outline"].skipped)
+        self.assertEqual(sorted(done), ["foreshadowings", "timeline", "world_settings"])
+        print("   ✅ 断点跳过测试通过")
+
+    def test_failure_stops_new_stages(self):
+        """测试阶段失败后已在运行的阶段跑完，依赖它的阶段不再启动，抛出原异常"""
+        recorder = Recorder()
+        stages = [
+            recorder.stage("a", 0.01, fail=True),
+            recorder.stage("b", 0.05),
+            recorder.stage("c", 0.01, deps=("a",)),
+        ]
+        done = []
+        with self.assertRaises(RuntimeError):
+            run_stages(stages, max_workers=2, on_stage_done=lambda result: done.append(result.name))
+        self.assertIn(("end", "b"), recorder.events)
+        self.assertNotIn(("start", "c"), recorder.events)
+        self.assertEqual(done, ["b"])
+        print("   ✅ 失败处理测试通过")
+
+    def test_invalid_graphs(self):
+        """测试依赖不存在与依赖环"""
+        noop = lambda progress: None  # noqa: E731
+        with self.assertRaises(ValueError):
+            order_stages([Stage("a", noop, deps=("missing",))])
+        with self.assertRaises(ValueError):
+            order_stages([Stage("a", noop, deps=("b",)), Stage("b", noop, deps=("a",))])
+        print("   ✅ 非法依赖图测试通过")
+
+    def test_cancel_token_propagates(self):
+        """测试阶段线程内可见调用方的取消令牌，取消后不再启动新阶段"""
+        token = CancellationToken()
+        seen = []
+
+        def first(progress):
+            seen.append(current_token())
+            token.cancel()
+
+        with cancel_scope(token):
+            with self.assertRaises(OperationCancelled):
+                run_stages([Stage("a", first), Stage("b", lambda p: seen.append("b"), deps=("a",))])
+        self.assertEqual(seen, [token])
+        print("   ✅ 取消令牌传递测试通过")
+
+    def test_progress_aggregation(self):
+        """测试按权重汇总的总进度映射到区间内且只增不减"""
+        reports = []
+        stages = outline_pipeline(Recorder(), seconds=0.005)
+        progress = DagProgress(stages, lambda value, message: reports.append(value), start=5, end=95, completed=["outline"])
+        self.assertEqual(progress.overall(), 5 + int(90 * 3 / 9))
+        run_stages(stages, completed=["outline"], progress=progress)
+        self.assertEqual(reports, sorted(reports))
+        self.assertEqual(reports[-1], 95)
+        print("   ✅ 进度汇总测试通过")
+
+
+class TestResumeTask(unittest.TestCase):
+    """测试断点续跑接口"""
+
+    def test_resume_after_cancelling_orphaned_task(self):
+        """测试取消不在本进程中运行的任务后续跑：遗留的取消标记被清除，续跑的阶段真正执行"""
+        import main
+        from services.task import task_service
+        from services.task.task_service import TaskExecutor
+
+        task = SimpleNamespace(
+            id="task-1", status="running", task_type="generate_complete_outline", novel_id="novel-1",
+            error_message=None, completed_at=None, progress_message="", updated_at=0
+        )
+        db = mock.MagicMock()
+        db.query.return_value.filter.return_value.first.return_value = task
+        user = SimpleNamespace(id="user-1")
+        cancelled = []
+
+        def mark_cancelled(task_id, result=None):
+            cancelled.append(task_id)
+            task.status = "cancelled"
+
+        ran = []
+        executor = TaskExecutor()
+        with mock.patch("core.run_control.get_shared_state", return_value=MemoryStateStore()), \
+                mock.patch.object(main, "mark_task_cancelled", mark_cancelled), \
+                mock.patch.object(task_service, "mark_task_cancelled", mark_cancelled), \
+                mock.patch.object(main, "get_task_executor", return_value=executor), \
+                mock.patch.object(main, "_execute_complete_outline_task", lambda task_id, novel_id: ran.append(task_id)):
+            asyncio.run(main.cancel_task("task-1", current_user=user, db=db))
+            self.assertEqual(task.status, "cancelled")
+            asyncio.run(main.resume_task("task-1", current_user=user, db=db))
+            executor.executor.shutdown(wait=True)
+        self.assertEqual(ran, ["task-1"])
+        self.assertEqual(cancelled, ["task-1"])
+        print("   ✅ 取消后续跑测试通过")
+
+
+def run_benchmark(seconds):
+    sequential = Recorder()
+    started = time.perf_counter()
+    run_stages(outline_pipeline(sequential, seconds), max_workers=1)
+    sequential_s = time.perf_counter() - started
+
+    parallel = Recorder()
+    started = time.perf_counter()
+    run_stages(outline_pipeline(parallel, seconds), max_workers=4)
+    parallel_s = time.perf_counter() - started
+
+    resumed = Recorder()
+    started = time.perf_counter()
+    run_stages(outline_pipeline(resumed, seconds), max_workers=4, completed=["outline", "characters"])
+    resumed_s = time.perf_counter() - started
+    return sequential_s, parallel_s, resumed_s
+
+
+class TestPipelineBenchmark(unittest.TestCase):
+    """对比顺序执行与依赖图执行"""
+
+    def test_dag_overlaps_independent_stages(self):
+        """测试 5 个阶段（每个 50ms）：依赖图执行约为 2 个阶段的耗时"""
+        sequential_s, parallel_s, resumed_s = run_benchmark(0.05)
+        print(
+            f"   顺序执行 {sequential_s * 1000:.0f}ms | 依赖图 {parallel_s * 1000:.0f}ms | "
+            f"从断点（已完成大纲+角色）继续 {resumed_s * 1000:.0f}ms"
+        )
+        self.assertLess(parallel_s * 2, sequential_s)
+        self.assertLess(resumed_s, parallel_s)
+        print("   ✅ 流水线基准测试通过")
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("完整大纲流水线（大纲 → 角色 / 世界观 / 时间线 / 伏笔）")
+    print("=" * 60)
+    for seconds in (0.05, 0.2, 0.5):
+        sequential_s, parallel_s, resumed_s = run_benchmark(seconds)
+        print(
+            f"每阶段 {seconds * 1000:>4.0f}ms: 顺序 {sequential_s:.2f}s | 依赖图 {parallel_s:.2f}s | "
+            f"断点续跑 {resumed_s:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,169 @@
+"""
+段落级修订测试
+验证段落定位解析、区间合并、补丁拼接，并用假 Agent 对比整篇重写与段落修订的重试输出 token 与耗时
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from services.ai.context_assembler import estimate_tokens  # noqa: E402
+from services.ai.draft_revision import (  # noqa: E402
+    RevisionSpan, build_patch_prompt, issue_texts, number_paragraphs, plan_revision, splice_patches, split_paragraphs
+)
+
+PARAGRAPHS = [f"第{i}段，" + "雨夜里的长街寂静无声。" * 20 for i in range(1, 21)]
+DRAFT = "\n\n".join(PARAGRAPHS)
+
+
+class TestDraftRevision(unittest.TestCase):
+    """测试段落级修订的纯函数部分"""
+
+    def test_plan_merges_adjacent_paragraphs(self):
+        """测试相邻段落合并为一个区间，问题文本按区间归并"""
+        issues = [
+            {"paragraphs": [3], "issue": "问题:动机不清"},
+            {"paragraphs": ["P4", 8], "issue": "问题:节奏拖沓"},
+        ]
+        spans = plan_revision(issues, 20)
+        self.assertEqual([(s.start, s.end) for s in spans], [(2, 3), (7, 7)])
+        self.assertEqual(spans[0].label, "P3-P4")
+        self.assertEqual(spans[0].issues, ["问题:动机不清", "问题:节奏拖沓"])
+        self.assertEqual(issue_texts(issues), ["[P3] 问题:动机不清", "[P4, P8] 问题:节奏拖沓"])
+        print("   ✅ 区间合并测试通过")
+
+    def test_plan_falls_back_to_rewrite(self):
+        """测试没有定位、定位越界或标记过多时退回整篇重写"""
+        self.assertIsNone(plan_revision(["问题:整体平淡"], 20))
+        self.assertIsNone(plan_revision([{"issue": "问题:整体平淡"}], 20))
+        self.assertIsNone(plan_revision([{"paragraphs": [21], "issue": "越界"}], 20))
+        self.assertIsNone(plan_revision([{"paragraphs": list(range(1, 12)), "issue": "大面积问题"}], 20))
+        self.assertIsNone(plan_revision([], 20))
+        print("   ✅ 退回整篇重写测试通过")
+
+    def test_patch_prompt_and_splice(self):
+        """测试补丁提示词只含前后各一段上下文，拼接保留未修改段落与分隔符"""
+        paragraphs = ["甲", "乙", "丙", "丁", "戊"]
+        span = RevisionSpan(start=2, end=2, issues=["问题:太短"])
+        prompt = build_patch_prompt(paragraphs, span)
+        self.assertIn("乙", prompt)
+        self.assertIn("丁", prompt)
+        self.assertNotIn("甲", prompt)
+        self.assertNotIn("戊", prompt)
+        revised = splice_patches(paragraphs, [span], ["[P3] 丙一\n\n丙二"], separator="\n")
+        self.assertEqual(revised, "甲\n乙\n丙一\n丙二\n丁\n戊")
+        self.assertEqual(splice_patches(paragraphs, [span], [""]), "甲\n\n乙\n\n丙\n\n丁\n\n戊")
+        self.assertEqual(split_paragraphs(number_paragraphs(["a", "b"])), ["[P1] a", "[P2] b"])
+        print("   ✅ 补丁拼接测试通过")
+
+
+class FakeAgents:
+    """假 Agent：输出耗时与 token 数成正比；Critic 第一次标出两段，第二次通过"""
+
+    SECONDS_PER_TOKEN = 0.0001
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.critic_rounds = 0
+        self.writer_tokens = []
+
+    def _emit(self, text_value):
+        time.sleep(estimate_tokens(text_value) * self.SECONDS_PER_TOKEN)
+        with self.lock:
+            self.writer_tokens.append(estimate_tokens(text_value))
+        return text_value
+
+    def run(self, agent, message, context_text, provider=None, max_tokens=4096):
+        if agent == "critic":
+            with self.lock:
+                self.critic_rounds += 1
+                first = self.critic_rounds == 1
+            if first:
+                issues = [{"paragraphs": [5], "issue": "问题:对白生硬"}, {"paragraphs": [12], "issue": "问题:转折突兀"}]
+                return {"text": json.dumps({"score": 40, "issues": issues}, ensure_ascii=False)}
+            return {"text": json.dumps({"score": 90, "issues": []})}
+        if agent == "writer":
+            return {"text": self._emit("改写后的段落。" * 30)}
+        return {"text": f"{agent} 输出"}
+
+    def stream(self, agent, message, context_text, provider=None, cancel_token=None):
+        yield self._emit(DRAFT)
+
+
+def run_flow(revision_mode):
+    import main
+
+    agents = FakeAgents()
+    patches = {
+        "require_novel_owner": mock.DEFAULT,
+        "_build_agent_context": mock.DEFAULT,
+        "_format_agent_context": mock.MagicMock(return_value=""),
+        "_persist_agent_run": mock.DEFAULT,
+        "_save_flow_status_message": mock.DEFAULT,
+        "_save_flow_messages_preserve_system": mock.DEFAULT,
+        "_save_flow_output_to_chapter": mock.MagicMock(return_value=None),
+        "_apply_archivist_payload": mock.DEFAULT,
+        "_run_agent_llm": agents.run,
+        "_run_agent_llm_stream": agents.stream,
+    }
+    request = main.AgentFlowRequest(novel_id="n1", summarize_chapters=False, revision_mode=revision_mode)
+
+    async def collect():
+        response = await main.run_agent_flow_stream(request, current_user=SimpleNamespace(id="u1"), db=None)
+        return [chunk async for chunk in response.body_iterator]
+
+    with mock.patch.multiple(main, **patches):
+        raw = asyncio.run(collect())
+    events = []
+    for block in raw:
+        fields = dict(line.split(": ", 1) for line in block.strip().split("\n") if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return agents, events
+
+
+class TestParagraphRevisionFlow(unittest.TestCase):
+    """测试流程中的段落级修订"""
+
+    def test_paragraph_revision_cuts_retry_cost(self):
+        """测试只重写被标记的段落，其余段落原样保留，重试输出 token 大幅下降"""
+        rewrite_agents, rewrite_events = run_flow("rewrite")
+        paragraph_agents, paragraph_events = run_flow("paragraph")
+
+        retry = [d for e, d in paragraph_events if e == "status" and d.get("status") == "retry"][0]
+        self.assertEqual(retry["mode"], "paragraph")
+        self.assertEqual(retry["paragraphs"], ["P5", "P12"])
+        self.assertEqual(retry["issues"], ["[P5] 问题:对白生硬", "[P12] 问题:转折突兀"])
+
+        final = split_paragraphs(paragraph_events[-1][1]["writer"])
+        self.assertEqual(len(final), 20)
+        self.assertEqual(final[3], PARAGRAPHS[3])
+        self.assertNotEqual(final[4], PARAGRAPHS[4])
+        self.assertNotEqual(final[11], PARAGRAPHS[11])
+
+        rewrite_retry_tokens = sum(rewrite_agents.writer_tokens[1:])
+        paragraph_retry_tokens = sum(paragraph_agents.writer_tokens[1:])
+        timings = {
+            mode: [d["elapsed_ms"] for e, d in events if e == "status" and d.get("stage") == "writer"
+                   and d.get("status") == "done"][1]
+            for mode, events in (("rewrite", rewrite_events), ("paragraph", paragraph_events))
+        }
+        print(
+            f"   重试输出 token: 整篇重写 {rewrite_retry_tokens} | 段落修订 {paragraph_retry_tokens}；"
+            f"重试耗时: {timings['rewrite']}ms | {timings['paragraph']}ms"
+        )
+        self.assertLess(paragraph_retry_tokens * 5, rewrite_retry_tokens)
+        self.assertLess(timings["paragraph"], timings["rewrite"])
+        print("   ✅ 段落级修订流程测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
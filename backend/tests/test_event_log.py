@@ -0,0 +1,189 @@
+"""
+SSE 事件日志测试
+验证事件编号、Last-Event-ID 补发后接上仍在进行的生成、内存溢出后从溢出存储补发、
+客户端断开不影响生成、结束后的保留与清理，以及生成者租约与线程上限
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core.event_log import (  # noqa: E402
+    EventLogRegistry,
+    ProducerLimitReached,
+    RunAlreadyActive,
+    RunEventLog,
+    parse_last_event_id,
+    start_logged_stream,
+)
+from core.shared_state import MemoryStateStore  # noqa: E402
+
+
+class MemorySpill:
+    """与 PostgresEventSpill 接口一致的内存实现"""
+
+    def __init__(self):
+        self.rows = {}
+        self.deleted = []
+
+    def write(self, run_id, events):
+        for seq, payload in events:
+            self.rows[(run_id, seq)] = payload
+
+    def read(self, run_id, after_seq, until_seq):
+        return sorted(
+            (seq, payload) for (rid, seq), payload in self.rows.items()
+            if rid == run_id and after_seq < seq <= until_seq
+        )
+
+    def delete(self, run_id):
+        self.deleted.append(run_id)
+        self.rows = {k: v for k, v in self.rows.items() if k[0] != run_id}
+
+
+def event(i):
+    return f"event: chunk\ndata: {{\"i\": {i}}}\n\n"
+
+
+def seqs(payloads):
+    return [int(p.split("\n", 1)[0][len("id: "):]) for p in payloads if p.startswith("id: ")]
+
+
+class TestEventLog(unittest.TestCase):
+    """测试可续传事件日志"""
+
+    def test_replay_then_follow(self):
+        """测试重连补发 Last-Event-ID 之后的事件，再接上仍在写入的事件"""
+        log = RunEventLog("run-1", "u1", max_events=100)
+        for i in range(5):
+            log.append(event(i))
+
+        def producer():
+            for i in range(5, 10):
+                time.sleep(0.02)
+                log.append(event(i))
+            log.finish()
+
+        threading.Thread(target=producer).start()
+        received = list(log.iter_events(after_seq=3, heartbeat=0.5))
+        self.assertEqual(seqs(received), list(range(4, 11)))
+        self.assertTrue(received[0].startswith("id: 4\nevent: chunk\n"))
+        print("   ✅ 补发并跟随测试通过")
+
+    def test_spill_replay(self):
+        """测试内存窗口外的旧事件从溢出存储补发，且无重复、无遗漏"""
+        spill = MemorySpill()
+        log = RunEventLog("run-2", "u1", max_events=8, spill=spill)
+        for i in range(50):
+            log.append(event(i))
+        log.finish()
+        self.assertGreater(log.spilled, 0)
+        self.assertLessEqual(log.snapshot()["in_memory"], 8)
+        self.assertEqual(seqs(log.iter_events(after_seq=0)), list(range(1, 51)))
+        self.assertEqual(seqs(log.iter_events(after_seq=45)), list(range(46, 51)))
+        print("   ✅ 溢出补发测试通过")
+
+    def test_gap_without_spill(self):
+        """测试未配置溢出存储时对丢失的事件发出 gap 通知"""
+        log = RunEventLog("run-3", "u1", max_events=4)
+        for i in range(10):
+            log.append(event(i))
+        log.finish()
+        received = list(log.iter_events(after_seq=0))
+        self.assertTrue(received[0].startswith("event: gap\n"))
+        self.assertEqual(seqs(received)[-1], 10)
+        print("   ✅ 缺口通知测试通过")
+
+    def test_disconnect_does_not_stop_generation(self):
+        """测试订阅者中途断开后生成继续，重连补齐全部事件"""
+        registry = EventLogRegistry(max_events=100, retention=60)
+        produced = []
+
+        def produce():
+            for i in range(20):
+                time.sleep(0.005)
+                produced.append(i)
+                yield event(i)
+
+        log = start_logged_stream("run-4", "u1", produce, registry=registry)
+        first = log.iter_events(after_seq=0, heartbeat=0.5)
+        received = [next(first) for _ in range(3)]
+        first.close()
+        last_id = seqs(received)[-1]
+
+        resumed = list(registry.get("run-4").iter_events(after_seq=last_id, heartbeat=0.5))
+        self.assertEqual(len(produced), 20)
+        self.assertEqual(seqs(received + resumed), list(range(1, 21)))
+        print("   ✅ 断线后继续生成测试通过")
+
+    def test_resume_numbering_and_retention(self):
+        """测试同一运行再次生成时编号接续，结束超过保留时间后日志与溢出行被清理"""
+        spill = MemorySpill()
+        registry = EventLogRegistry(max_events=2, retention=0.05, spill=spill)
+        first = registry.open("run-5", "u1")
+        for i in range(6):
+            first.append(event(i))
+        first.finish()
+        second = registry.open("run-5", "u1")
+        self.assertEqual(second.append(event(6)), 7)
+        second.finish()
+        time.sleep(0.06)
+        self.assertIsNone(registry.get("run-5"))
+        self.assertEqual(spill.deleted, ["run-5"])
+        self.assertEqual(parse_last_event_id(" 12 "), 12)
+        self.assertEqual(parse_last_event_id("abc"), 0)
+        self.assertEqual(parse_last_event_id(None), 0)
+        print("   ✅ 编号接续与保留清理测试通过")
+
+
+def gated_produce(gate):
+    def produce():
+        yield event(0)
+        gate.wait(5)
+        yield event(1)
+    return produce
+
+
+class TestProducers(unittest.TestCase):
+    """测试生成者租约与生成线程上限"""
+
+    def test_lease_blocks_second_producer_on_other_worker(self):
+        """测试运行在一个 worker 上生成时，另一个 worker 不会再启动生成；结束后可以恢复"""
+        store = MemoryStateStore()
+        worker_a = EventLogRegistry(max_events=100, retention=60, lease_store=store)
+        worker_b = EventLogRegistry(max_events=100, retention=60, lease_store=store)
+        gate = threading.Event()
+
+        log = start_logged_stream("run-6", "u1", gated_produce(gate), registry=worker_a)
+        with self.assertRaises(RunAlreadyActive):
+            start_logged_stream("run-6", "u1", gated_produce(gate), registry=worker_b)
+        self.assertIsNone(worker_b.get("run-6"))
+
+        gate.set()
+        self.assertEqual(seqs(log.iter_events(after_seq=0, heartbeat=0.5)), [1, 2])
+        resumed = start_logged_stream("run-6", "u1", gated_produce(gate), registry=worker_b)
+        self.assertEqual(seqs(resumed.iter_events(after_seq=0, heartbeat=0.5)), [1, 2])
+        print("   ✅ 生成者租约测试通过")
+
+    def test_producer_limit(self):
+        """测试同时运行的生成线程达到上限时拒绝新的生成，结束后释放名额"""
+        registry = EventLogRegistry(max_events=100, retention=60, max_producers=1)
+        gate = threading.Event()
+
+        log = start_logged_stream("run-7", "u1", gated_produce(gate), registry=registry)
+        with self.assertRaises(ProducerLimitReached):
+            start_logged_stream("run-8", "u1", gated_produce(gate), registry=registry)
+        self.assertEqual(registry.snapshot()["producers"], 1)
+
+        gate.set()
+        list(log.iter_events(after_seq=0, heartbeat=0.5))
+        start_logged_stream("run-8", "u1", gated_produce(gate), registry=registry)
+        print("   ✅ 生成线程上限测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
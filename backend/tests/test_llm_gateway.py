@@ -0,0 +1,231 @@
+"""
+Agent LLM 网关测试
+用本地 HTTP 服务模拟 DeepSeek 与 Gemini 接口：验证连接复用、按 Agent 配置选择模型、
+429/5xx 重试、流式输出与提前关闭，并对比每次新建客户端与共享连接池的连接数与延迟
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import httpx  # noqa: E402
+
+from core.rate_limiter import AdaptiveRateLimiter  # noqa: E402
+from services.ai.llm_gateway import AgentModel, LLMGateway, resolve_agent_model  # noqa: E402
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    """模拟 DeepSeek（OpenAI 兼容）与 Gemini REST 接口，记录连接数与请求"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeLLM/1.0"
+    # 头部与正文分两次写出，keep-alive 连接上需关闭 Nagle，否则与延迟确认叠加出 40ms 停顿
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        """body 为列表时逐段写出（段间停顿 chunk_delay 秒），模拟流式输出"""
+        pieces = [p.encode("utf-8") for p in (body if isinstance(body, list) else [body])]
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(sum(len(p) for p in pieces)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(self.server.chunk_delay)
+            self.wfile.write(piece)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+        with self.server.lock:
+            self.server.requests.append((self.path, payload))
+            failure = self.server.failures.pop(0) if self.server.failures else None
+        if failure:
+            self._send(failure, json.dumps({"error": "unavailable"}), headers={"Retry-After": "0"})
+            return
+        time.sleep(self.server.latency)
+        parts = ["第一段", "第二段", "第三段"]
+        if self.path.startswith("/v1/chat/completions"):
+            if payload.get("stream"):
+                events = [json.dumps({"choices": [{"delta": {"content": p}}]}) for p in parts] + ["[DONE]"]
+                self._send(200, [f"data: {e}\n\n" for e in events], "text/event-stream")
+            else:
+                self._send(200, json.dumps({"choices": [{"message": {"content": f"deepseek:{payload['model']}"}}]}))
+            return
+        model = self.path.split("/models/", 1)[1].split(":", 1)[0]
+        if ":streamGenerateContent" in self.path:
+            events = [json.dumps({"candidates": [{"content": {"parts": [{"text": p}]}}]}) for p in parts]
+            self._send(200, [f"data: {e}\r\n\r\n" for e in events], "text/event-stream")
+        else:
+            self._send(200, json.dumps({"candidates": [{"content": {"parts": [{"text": f"gemini:{model}"}]}}]}))
+
+
+def start_upstream(latency=0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstream)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = []
+    server.failures = []
+    server.latency = latency
+    server.chunk_delay = 0.0
+    # 客户端提前关闭流式响应时服务端写入会断开，不打印异常
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_gateway(server, **kwargs):
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    return LLMGateway(
+        deepseek_base_url=base_url,
+        deepseek_api_key="ds-key",
+        gemini_api_key="gm-key",
+        gemini_base_url=base_url,
+        retry_base_seconds=0.01,
+        **kwargs,
+    )
+
+
+def fast_limiter(provider, model="", api_key=None):
+    return AdaptiveRateLimiter(key=f"{provider}:{model}", rate=1000, burst=1000, max_concurrency=16)
+
+
+DEEPSEEK = AgentModel("deepseek", "deepseek-chat")
+GEMINI = AgentModel("gemini", "gemini-2.0-flash")
+
+
+class TestLLMGateway(unittest.TestCase):
+    """测试 Agent LLM 网关"""
+
+    def setUp(self):
+        patcher = mock.patch("services.ai.llm_gateway.get_rate_limiter", side_effect=fast_limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = start_upstream()
+        self.addCleanup(self.server.shutdown)
+        self.gateway = make_gateway(self.server)
+        self.addCleanup(self.gateway.close)
+
+    def test_connection_reuse(self):
+        """测试连续调用复用同一条连接"""
+        for _ in range(10):
+            self.assertEqual(self.gateway.generate(DEEPSEEK, "你好"), "deepseek:deepseek-chat")
+            self.assertEqual(self.gateway.generate(GEMINI, "你好"), "gemini:gemini-2.0-flash")
+        self.assertLessEqual(self.server.connections, 2)
+        print(f"   ✅ 连接复用测试通过（20 次调用 {self.server.connections} 条连接）")
+
+    def test_per_agent_models(self):
+        """测试按 Agent 配置选择提供商与模型，请求显式指定的提供商优先"""
+        models = {"writer": ("deepseek", "deepseek-chat"), "critic": ("gemini", ""), "default": ("gemini", "gemini-pro")}
+        self.assertEqual(resolve_agent_model("writer", None, models, "gemini"), DEEPSEEK)
+        self.assertEqual(resolve_agent_model("critic", None, models, "deepseek").provider, "gemini")
+        self.assertEqual(resolve_agent_model("director", None, models, "deepseek"), AgentModel("gemini", "gemini-pro"))
+        self.assertEqual(resolve_agent_model("writer", "deepseek", models, "gemini").model, "deepseek-chat")
+        self.assertEqual(resolve_agent_model("writer", "gemini", {}, "gemini").provider, "gemini")
+        with self.assertRaises(ValueError):
+            resolve_agent_model("writer", "openai", models, "gemini")
+        self.gateway.generate(AgentModel("gemini", "gemini-1.5-pro"), "你好")
+        self.assertIn("/models/gemini-1.5-pro:generateContent", self.server.requests[-1][0])
+        print("   ✅ 按 Agent 选择模型测试通过")
+
+    def test_retry_on_unavailable(self):
+        """测试 503/429 按退避重试，4xx 不重试"""
+        self.server.failures = [503, 429]
+        self.assertEqual(self.gateway.generate(DEEPSEEK, "你好"), "deepseek:deepseek-chat")
+        self.assertEqual(self.gateway.snapshot()["retries"], 2)
+
+        self.server.failures = [400]
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.gateway.generate(DEEPSEEK, "你好")
+        self.assertEqual(self.gateway.snapshot()["retries"], 2)
+
+        self.server.failures = [503]
+        self.assertEqual(list(self.gateway.stream(GEMINI, "你好")), ["第一段", "第二段", "第三段"])
+        print("   ✅ 重试测试通过")
+
+    def test_stream_and_early_close(self):
+        """测试两种提供商的流式输出，提前关闭后取消读取且连接池仍可继续使用"""
+        self.assertEqual(list(self.gateway.stream(DEEPSEEK, "你好")), ["第一段", "第二段", "第三段"])
+        self.assertEqual(list(self.gateway.stream(GEMINI, "你好")), ["第一段", "第二段", "第三段"])
+        self.assertTrue(self.server.requests[-2][1]["stream"])
+
+        self.server.chunk_delay = 0.5
+        started = time.monotonic()
+        iterator = self.gateway.stream(DEEPSEEK, "你好")
+        self.assertEqual(next(iterator), "第一段")
+        iterator.close()
+        self.assertEqual(self.gateway.snapshot()["cancelled_streams"], 1)
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.server.chunk_delay = 0.0
+        self.assertEqual(self.gateway.generate(DEEPSEEK, "你好"), "deepseek:deepseek-chat")
+        print("   ✅ 流式与提前关闭测试通过")
+
+
+def run_old_style(base_url, calls):
+    """改造前的调用方式：每次调用新建并关闭 httpx.Client"""
+    for _ in range(calls):
+        with httpx.Client(timeout=30, trust_env=False) as client:
+            response = client.post(
+                f"{base_url}/v1/chat/completions",
+                json={"model": "deepseek-chat", "messages": [{"role": "user", "content": "你好"}]},
+            )
+            response.raise_for_status()
+
+
+class TestGatewayBenchmark(unittest.TestCase):
+    """对比每次新建客户端与共享连接池"""
+
+    def test_pool_cuts_connections_and_latency(self):
+        """测试共享连接池减少新建连接，并发调用下连接数不超过并发度"""
+        calls = 40
+        with mock.patch("services.ai.llm_gateway.get_rate_limiter", side_effect=fast_limiter):
+            old_server = start_upstream()
+            started = time.perf_counter()
+            run_old_style(f"http://127.0.0.1:{old_server.server_address[1]}", calls)
+            old_ms = (time.perf_counter() - started) * 1000 / calls
+            old_server.shutdown()
+
+            server = start_upstream()
+            gateway = make_gateway(server)
+            started = time.perf_counter()
+            for _ in range(calls):
+                gateway.generate(DEEPSEEK, "你好")
+            pooled_ms = (time.perf_counter() - started) * 1000 / calls
+
+            threads = [threading.Thread(target=lambda: list(gateway.stream(DEEPSEEK, "你好"))) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            gateway.close()
+            server.shutdown()
+
+        print(
+            f"   每次新建客户端: {old_server.connections} 条连接, {old_ms:.2f}ms/次 | "
+            f"共享连接池: {server.connections} 条连接（含 8 路并发流式）, {pooled_ms:.2f}ms/次"
+        )
+        self.assertEqual(old_server.connections, calls)
+        self.assertLessEqual(server.connections, 9)
+        self.assertLess(pooled_ms, old_ms)
+        print("   ✅ 连接池基准测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+"""
+段落近重复检测测试
+验证 MinHash 相似度估计、LSH 索引的更新与删除、跨 worker 失效、生成后检查只在有候选时才调用向量确认，
+并测量每章检测耗时（对比原先每次检查都要一次向量请求和一次向量查询）
+"""
+import os
+import random
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from services.analysis import near_duplicate  # noqa: E402
+from services.analysis.content_similarity_checker import ContentSimilarityChecker  # noqa: E402
+from services.analysis.near_duplicate import (  # noqa: E402
+    NearDuplicateRegistry,
+    NovelDuplicateIndex,
+    estimate_similarity,
+    minhash_signature,
+)
+
+CHARS = [chr(0x4E00 + i) for i in range(3000)]
+
+
+def paragraph(rng, length=120):
+    return "".join(rng.choice(CHARS) for _ in range(length)) + "。"
+
+
+def chapter(rng, paragraphs=30):
+    return "\n".join(paragraph(rng) for _ in range(paragraphs))
+
+
+def edit(text, rng, changes):
+    """随机替换 changes 个字"""
+    chars = list(text)
+    for position in rng.sample(range(len(chars) - 1), changes):
+        chars[position] = rng.choice(CHARS)
+    return "".join(chars)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDB:
+    def __init__(self, chapters):
+        self.chapters = chapters
+        self.queries = 0
+
+    def execute(self, statement, params=None):
+        self.queries += 1
+        sql = str(statement)
+        if "JOIN volumes" in sql:
+            return FakeResult([(cid, title, content) for cid, (title, content) in self.chapters.items()])
+        return FakeResult([(cid, self.chapters[cid][1]) for cid in params["chapter_ids"] if cid in self.chapters])
+
+
+class TestMinHash(unittest.TestCase):
+    """测试签名与相似度估计"""
+
+    def test_similarity_estimates(self):
+        """测试逐字复用、标点空白差异、少量改写与无关段落的相似度"""
+        rng = random.Random(1)
+        original = paragraph(rng)
+        signature = minhash_signature(original)
+        self.assertEqual(estimate_similarity(signature, minhash_signature(original)), 1.0)
+        reformatted = "  " + original.replace("。", "！") + "……"
+        self.assertEqual(estimate_similarity(signature, minhash_signature(reformatted)), 1.0)
+        self.assertGreaterEqual(estimate_similarity(signature, minhash_signature(edit(original, rng, 3))), 0.6)
+        self.assertLess(estimate_similarity(signature, minhash_signature(paragraph(rng))), 0.2)
+        self.assertIsNone(minhash_signature("他点了点头。"))
+        print("   ✅ MinHash 相似度测试通过")
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    """测试小说段落索引"""
+
+    def test_find_update_and_remove(self):
+        """测试跨章节检出复用段落，排除本章，章节更新与删除后结果随之变化"""
+        rng = random.Random(2)
+        index = NovelDuplicateIndex("n1")
+        first = chapter(rng, 10)
+        index.update_chapter("c1", "第一章", first)
+        index.update_chapter("c2", "第二章", chapter(rng, 10))
+        reused = first.splitlines()[4]
+        generated = "\n".join([paragraph(rng), edit(reused, rng, 2), paragraph(rng)])
+
+        matches = index.find_duplicates(generated, exclude_chapter_id="c3")
+        self.assertEqual(len(matches), 1)
+        self.assertEqual((matches[0]["chapter_id"], matches[0]["matched_paragraph_index"]), ("c1", 4))
+        self.assertEqual(matches[0]["paragraph_index"], 1)
+        self.assertEqual(matches[0]["chapter_title"], "第一章")
+        self.assertEqual(index.find_duplicates(generated, exclude_chapter_id="c1"), [])
+
+        index.update_chapter("c1", "第一章", chapter(rng, 10))
+        self.assertEqual(index.find_duplicates(generated), [])
+        index.update_chapter("c1", "第一章", first)
+        index.remove_chapter("c1")
+        self.assertEqual(index.find_duplicates(generated), [])
+        self.assertEqual(index.paragraph_count, 10)
+        print("   ✅ 段落索引测试通过")
+
+    def test_registry_updates_and_broadcast(self):
+        """测试索引从数据库构建后原地更新，其他 worker 的失效广播丢弃索引，自己的广播忽略"""
+        rng = random.Random(3)
+        chapters = {"c1": ("第一章", chapter(rng, 5))}
+        db = FakeDB(chapters)
+        registry = NearDuplicateRegistry(max_novels=2)
+        reused = chapters["c1"][1].splitlines()[0]
+        self.assertEqual(len(registry.get(db, "n1").find_duplicates(reused)), 1)
+
+        registry.update_chapter("n1", "c2", "第二章", reused)
+        self.assertEqual(len(registry.get(db, "n1").find_duplicates(reused)), 2)
+        self.assertEqual(db.queries, 1)
+
+        registry._on_broadcast(f"{near_duplicate._ORIGIN}:n1")
+        registry.get(db, "n1")
+        self.assertEqual(db.queries, 1)
+        registry._on_broadcast("other-worker:n1")
+        registry.get(db, "n1")
+        self.assertEqual(db.queries, 2)
+        print("   ✅ 索引注册表测试通过")
+
+
+class CountingEmbeddings:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def generate_embedding(self, text, task_type="RETRIEVAL_DOCUMENT"):
+        self.calls += 1
+        return self.vectors[(self.calls - 1) % len(self.vectors)]
+
+
+class TestAfterGeneration(unittest.TestCase):
+    """测试生成后检查：词法候选在前，向量只做确认"""
+
+    def setUp(self):
+        rng = random.Random(4)
+        self.rng = rng
+        self.previous = chapter(rng, 10)
+        self.db = FakeDB({"c1": ("第一章", self.previous)})
+        registry = NearDuplicateRegistry(max_novels=10)
+        patcher = mock.patch.object(near_duplicate, "_registry", registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check(self, content, vectors):
+        checker = ContentSimilarityChecker.__new__(ContentSimilarityChecker)
+        checker.embedding_service = CountingEmbeddings(vectors)
+        return checker.check_after_generation(self.db, "n1", content, current_chapter_id="c2"), checker.embedding_service.calls
+
+    def test_unique_content_makes_no_api_call(self):
+        """测试没有词法候选时不调用向量接口"""
+        report, calls = self.check(chapter(self.rng, 10), [[1.0, 0.0]])
+        self.assertFalse(report["has_duplicate_content"])
+        self.assertEqual(calls, 0)
+        print("   ✅ 无候选不调用 API 测试通过")
+
+    def test_verbatim_confirmed_without_embeddings(self):
+        """测试逐字复用直接确认"""
+        reused = self.previous.splitlines()[2]
+        report, calls = self.check("\n".join([paragraph(self.rng), reused]), [[1.0, 0.0]])
+        self.assertTrue(report["has_duplicate_content"])
+        self.assertEqual(calls, 0)
+        self.assertEqual(report["similar_chapters"][0]["chapter_id"], "c1")
+        self.assertEqual(report["duplicate_paragraphs"][0]["confirmed_by"], "lexical")
+        print("   ✅ 逐字复用确认测试通过")
+
+    def test_near_duplicate_confirmed_by_embeddings(self):
+        """测试改写过的候选用向量确认：语义接近才算重复"""
+        reused = edit(self.previous.splitlines()[2], self.rng, 4)
+        report, calls = self.check(reused, [[1.0, 0.0], [0.99, 0.1]])
+        self.assertEqual(calls, 2)
+        self.assertTrue(report["has_duplicate_content"])
+        self.assertLess(report["duplicate_paragraphs"][0]["similarity"], 0.9)
+
+        report, calls = self.check(reused, [[1.0, 0.0], [0.0, 1.0]])
+        self.assertFalse(report["has_duplicate_content"])
+        self.assertFalse(report["duplicate_paragraphs"][0]["confirmed"])
+        print("   ✅ 向量二次确认测试通过")
+
+
+class TestNearDuplicateBenchmark(unittest.TestCase):
+    """每章检测耗时"""
+
+    def test_chapter_check_latency(self):
+        """测试 200 章 × 30 段的小说中检测一章（30 段）的耗时"""
+        build_ms, check_ms, per_paragraph_us, matches = run_benchmark(200)
+        print(
+            f"   构建索引 {build_ms:.0f}ms（6000 段），检测一章 {check_ms:.2f}ms，"
+            f"每段 {per_paragraph_us:.0f}µs，检出 {matches} 处复用"
+        )
+        self.assertEqual(matches, 2)
+        self.assertLess(check_ms, 100)
+        print("   ✅ 近重复检测基准测试通过")
+
+
+def run_benchmark(chapters, repeats=20):
+    rng = random.Random(5)
+    contents = [chapter(rng, 30) for _ in range(chapters)]
+    index = NovelDuplicateIndex("bench")
+    started = time.perf_counter()
+    for i, content in enumerate(contents):
+        index.update_chapter(f"c{i}", f"第{i + 1}章", content)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    generated = chapter(rng, 28).splitlines() + [contents[17].splitlines()[3], edit(contents[min(90, chapters - 1)].splitlines()[8], rng, 2)]
+    generated = "\n".join(generated)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        matches = index.find_duplicates(generated, exclude_chapter_id="new")
+    check_ms = (time.perf_counter() - started) * 1000 / repeats
+    return build_ms, check_ms, check_ms * 1000 / 30, len(matches)
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("段落近重复检测基准（每章 30 段，每段约 120 字）")
+    print("=" * 60)
+    for chapters in (50, 200, 1000):
+        build_ms, check_ms, per_paragraph_us, matches = run_benchmark(chapters)
+        print(
+            f"{chapters:>5} 章: 构建索引 {build_ms:>7.0f}ms, 检测一章 {check_ms:.2f}ms"
+            f"（每段 {per_paragraph_us:.0f}µs），检出 {matches} 处复用"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
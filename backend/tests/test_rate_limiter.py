@@ -0,0 +1,105 @@
+"""
+上游自适应限流单元测试
+验证令牌桶、AIMD 并发上限、429 识别与 Retry-After 解析
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core.rate_limiter import (  # noqa: E402
+    AdaptiveRateLimiter,
+    MemoryBucketStore,
+    RateLimitTimeout,
+    is_throttle_error,
+    retry_after_from_error,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = FakeResponse(status_code, headers)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """测试 AdaptiveRateLimiter"""
+
+    def test_throttle_detection(self):
+        """测试 429/503 识别与 Retry-After 解析"""
+        self.assertTrue(is_throttle_error(FakeHTTPError(429)))
+        self.assertTrue(is_throttle_error(Exception("429 RESOURCE_EXHAUSTED")))
+        self.assertFalse(is_throttle_error(FakeHTTPError(400)))
+        self.assertEqual(retry_after_from_error(FakeHTTPError(429, {"Retry-After": "3"})), 3.0)
+        self.assertEqual(retry_after_from_error(Exception("Please retry in 9.5s")), 9.5)
+        print("   ✅ 限流错误识别测试通过")
+
+    def test_concurrency_cap(self):
+        """测试并发不超过上限"""
+        limiter = AdaptiveRateLimiter("gemini:m:-", rate=1000, burst=1000, max_concurrency=2)
+        active = [0]
+        peak = [0]
+        lock = threading.Lock()
+
+        def worker():
+            with limiter.slot():
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.05)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = limiter.snapshot()
+        self.assertLessEqual(peak[0], 2)
+        self.assertEqual(stats["acquired"], 6)
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertGreater(stats["queue_wait_ms_max"], 0)
+        print("   ✅ 并发上限测试通过")
+
+    def test_throttle_halves_limit_and_pauses(self):
+        """测试 429 时并发上限减半并按 Retry-After 暂停"""
+        store = MemoryBucketStore()
+        limiter = AdaptiveRateLimiter("gemini:m:-", rate=100, burst=10, max_concurrency=8, store=store)
+        with self.assertRaises(FakeHTTPError):
+            with limiter.slot():
+                raise FakeHTTPError(429, {"Retry-After": "30"})
+        self.assertEqual(limiter.concurrency_limit, 4)
+        self.assertGreater(store.take("gemini:m:-", 100, 10), 20)
+
+        limiter.max_wait_seconds = 0.1
+        with self.assertRaises(RateLimitTimeout):
+            limiter.acquire()
+        self.assertEqual(limiter.in_flight, 0)
+        print("   ✅ 限流减半与暂停测试通过")
+
+    def test_success_increases_limit(self):
+        """测试成功后并发上限加性恢复"""
+        limiter = AdaptiveRateLimiter("gemini:m:-", rate=1000, burst=1000, max_concurrency=4)
+        limiter.concurrency_limit = 2.0
+        for _ in range(4):
+            with limiter.slot():
+                pass
+        self.assertGreater(limiter.concurrency_limit, 3.0)
+        self.assertLessEqual(limiter.concurrency_limit, 4.0)
+        print("   ✅ 加性恢复测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+接口限速单元测试与微基准
+验证按 IP / 账号 / 用户计数、Retry-After、空闲键清理，并对比旧的时间戳列表实现在并发下的开销
+
+单独运行基准: python tests/test_request_limiter.py
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from fastapi import HTTPException  # noqa: E402
+
+from core.request_limiter import RequestRateLimiter, client_ip  # noqa: E402
+from core.shared_state import MemoryStateStore  # noqa: E402
+
+
+class ListWindowLimiter:
+    """旧实现：每个 IP 一个时间戳列表，每次调用在全局锁内重建列表"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def check(self, key):
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.get(key, [])
+            bucket = [ts for ts in bucket if now - ts < self.window]
+            if len(bucket) >= self.limit:
+                return 1.0
+            bucket.append(now)
+            self.buckets[key] = bucket
+            return 0.0
+
+
+def run_contention(check, threads=8, calls=5000, keys=50):
+    """多线程反复命中少量热点键（模拟撞库突发），返回每秒判定次数"""
+    barrier = threading.Barrier(threads)
+
+    def worker(offset):
+        barrier.wait()
+        for i in range(calls):
+            check(f"ip:{(i + offset) % keys}")
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return threads * calls / (time.perf_counter() - started)
+
+
+class TestRequestRateLimiter(unittest.TestCase):
+    """测试接口限速"""
+
+    def test_enforce_sets_retry_after(self):
+        """测试超限时返回 429 与 Retry-After"""
+        limiter = RequestRateLimiter("rate_auth", limit=2, window=60, store=MemoryStateStore())
+        limiter.enforce("ip:1.1.1.1", "请求过于频繁")
+        limiter.enforce("ip:1.1.1.1", "请求过于频繁")
+        with self.assertRaises(HTTPException) as ctx:
+            limiter.enforce("ip:1.1.1.1", "请求过于频繁")
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertEqual(ctx.exception.headers["Retry-After"], "30")
+        # 不同的键互不影响（按用户 / 账号计数）
+        limiter.enforce("user:u1", "请求过于频繁")
+        limiter.enforce("account:alice", "请求过于频繁")
+        print("   ✅ 429 与 Retry-After 测试通过")
+
+    def test_idle_keys_evicted(self):
+        """测试空闲键在清理时移除，内存不随历史 IP 数增长"""
+        store = MemoryStateStore()
+        limiter = RequestRateLimiter("rate_auth", limit=20, window=60, store=store)
+        for i in range(1000):
+            limiter.check(f"ip:10.0.{i // 256}.{i % 256}")
+        self.assertEqual(store.snapshot()["entries"], 1000)
+        with mock.patch("core.shared_state.time.time", return_value=time.time() + 61):
+            store._next_sweep = 0
+            limiter.check("ip:127.0.0.1")
+        self.assertEqual(store.snapshot()["entries"], 1)
+        print("   ✅ 空闲键清理测试通过")
+
+    def test_client_ip(self):
+        """测试取客户端 IP"""
+        self.assertEqual(client_ip(SimpleNamespace(client=SimpleNamespace(host="8.8.8.8"))), "8.8.8.8")
+        self.assertEqual(client_ip(SimpleNamespace(client=None)), "unknown")
+        print("   ✅ 客户端 IP 测试通过")
+
+    def test_contention_benchmark(self):
+        """微基准：热点键并发判定，GCRA 不应慢于旧的时间戳列表实现"""
+        limit, window = 20, 60
+        old = ListWindowLimiter(limit, window)
+        new = RequestRateLimiter("bench", limit, window, store=MemoryStateStore())
+        old_rate = run_contention(old.check, calls=2000)
+        new_rate = run_contention(new.check, calls=2000)
+        print(f"   ℹ️ 时间戳列表: {old_rate:,.0f} 次/秒, GCRA: {new_rate:,.0f} 次/秒")
+        self.assertGreater(new_rate, old_rate * 0.5)
+        print("   ✅ 并发微基准完成")
+
+
+def main():
+    limit, window = 20, 60
+    print("热点键并发判定（50 个 IP，每线程 20000 次）")
+    for threads in (1, 8, 32):
+        old = ListWindowLimiter(limit, window)
+        new = RequestRateLimiter("bench", limit, window, store=MemoryStateStore())
+        old_rate = run_contention(old.check, threads=threads, calls=20000)
+        new_rate = run_contention(new.check, threads=threads, calls=20000)
+        print(f"  线程 {threads:>2}: 时间戳列表 {old_rate:>12,.0f} 次/秒 | GCRA {new_rate:>12,.0f} 次/秒")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,220 @@
+"""
+场景并行写作客户端测试
+验证客户端拼接各场景正文并按顺序回调场景进度、错误事件与未完成即断开时抛出异常、
+适配器按写作模式选择微服务接口，以及 write_and_save_chapter 上报场景进度与生成耗时
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+# 导入 services 时会按 GEMINI_PROXY 设置 HTTP(S)_PROXY，本地模拟服务不走代理
+os.environ.setdefault("NO_PROXY", "127.0.0.1,localhost")
+
+from services.ai import gemini_service  # noqa: E402
+from services.ai.ai_service_client import AIServiceClient  # noqa: E402
+
+SCENES = [("出发", "第一段正文。"), ("潜入", "\n\n第二段正文。"), ("撤离", "\n\n第三段正文。")]
+CHAPTER_KWARGS = dict(
+    novel_title="n", genre="g", synopsis="s", chapter_title="夜袭", chapter_summary="潜入敌营",
+    chapter_prompt_hints="", characters=[], world_settings=[]
+)
+
+
+def sse(event):
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def scene_events(done=True):
+    events = [sse({"plan": [{"title": title} for title, _ in SCENES]})]
+    for index, (title, text) in enumerate(SCENES):
+        events.append(sse({"scene": {"index": index, "total": len(SCENES), "title": title}}))
+        events.append(sse({"chunk": text}))
+    if done:
+        events.append(sse({"done": True, "mode": "scenes", "scenes": len(SCENES), "plan_ms": 10, "elapsed_ms": 50}))
+    return events
+
+
+class FakeAIService(BaseHTTPRequestHandler):
+    """模拟微服务的章节正文流式接口：server.events 为依次写出的 SSE 事件"""
+
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+        self.server.requests.append((self.path, payload))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for event in self.server.events:
+            self.wfile.write(event.encode("utf-8"))
+            self.wfile.flush()
+
+
+def start_service(events):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAIService)
+    server.daemon_threads = True
+    server.events = events
+    server.requests = []
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_client(server):
+    return AIServiceClient(f"http://127.0.0.1:{server.server_address[1]}", timeout=10)
+
+
+class TestSceneDraftingClient(unittest.TestCase):
+    """测试客户端消费场景并行写作流"""
+
+    def test_joins_scenes_and_reports_progress(self):
+        """测试拼接各场景正文，场景进度按顺序回调，请求带上场景数上限"""
+        server = start_service(scene_events())
+        self.addCleanup(server.shutdown)
+        progress = []
+        content = asyncio.run(make_client(server).write_chapter_scenes(
+            on_scene=lambda index, total, title: progress.append((index, total, title)),
+            max_scenes=3, **CHAPTER_KWARGS
+        ))
+        self.assertEqual(content, "第一段正文。\n\n第二段正文。\n\n第三段正文。")
+        self.assertEqual(progress, [(0, 3, "出发"), (1, 3, "潜入"), (2, 3, "撤离")])
+        path, payload = server.requests[0]
+        self.assertEqual(path, "/api/v1/chapter/write-content-scenes-stream")
+        self.assertEqual(payload["max_scenes"], 3)
+        print("   ✅ 场景拼接与进度回调测试通过")
+
+    def test_error_event_raises(self):
+        """测试错误事件抛出异常"""
+        server = start_service(scene_events(done=False)[:3] + [sse({"error": "生成章节内容失败: 503 UNAVAILABLE"})])
+        self.addCleanup(server.shutdown)
+        with self.assertRaisesRegex(Exception, "503 UNAVAILABLE"):
+            asyncio.run(make_client(server).write_chapter_scenes(**CHAPTER_KWARGS))
+        print("   ✅ 错误事件测试通过")
+
+    def test_missing_done_raises(self):
+        """测试连接在完成事件之前断开时抛出异常，避免保存只写了一部分场景的章节"""
+        server = start_service(scene_events(done=False))
+        self.addCleanup(server.shutdown)
+        with self.assertRaisesRegex(Exception, "完成前中断"):
+            asyncio.run(make_client(server).write_chapter_scenes(**CHAPTER_KWARGS))
+        print("   ✅ 中断检测测试通过")
+
+
+class TestDraftModeSelection(unittest.TestCase):
+    """测试适配器按写作模式选择接口"""
+
+    def run_stream(self, server, draft_mode):
+        async def run():
+            return [line async for line in gemini_service.write_chapter_content_stream(**CHAPTER_KWARGS, draft_mode=draft_mode)]
+
+        with mock.patch.object(gemini_service, "_ai_client", make_client(server)):
+            return asyncio.run(run())
+
+    def test_stream_endpoint_by_mode(self):
+        """测试 scenes 走场景并行接口，single 与未指定（默认 single）走整章接口"""
+        server = start_service(scene_events())
+        self.addCleanup(server.shutdown)
+        with mock.patch.object(gemini_service, "CHAPTER_DRAFT_MODE", "single"):
+            for draft_mode in ("scenes", "single", None):
+                self.run_stream(server, draft_mode)
+        self.assertEqual([path for path, _ in server.requests], [
+            "/api/v1/chapter/write-content-scenes-stream",
+            "/api/v1/chapter/write-content-stream",
+            "/api/v1/chapter/write-content-stream",
+        ])
+        print("   ✅ 写作模式选择测试通过")
+
+    def test_default_mode_from_config(self):
+        """测试未指定时使用 CHAPTER_DRAFT_MODE"""
+        server = start_service(scene_events())
+        self.addCleanup(server.shutdown)
+        with mock.patch.object(gemini_service, "CHAPTER_DRAFT_MODE", "scenes"):
+            self.run_stream(server, None)
+        self.assertEqual(server.requests[0][0], "/api/v1/chapter/write-content-scenes-stream")
+        print("   ✅ 默认写作模式测试通过")
+
+
+class TestWriteAndSaveChapter(unittest.TestCase):
+    """测试 write_and_save_chapter 的场景并行模式（数据库、向量与提取步骤用替身）"""
+
+    def test_scene_progress_and_generation_time(self):
+        """测试场景完成时上报进度，结果带写作模式与生成耗时，异步提取步骤被正确等待"""
+        from services.ai import chapter_writing_service as service
+
+        calls = {}
+
+        async def fake_write(**kwargs):
+            calls["write"] = kwargs
+            for index, (title, _) in enumerate(SCENES):
+                kwargs["on_scene"](index, len(SCENES), title)
+            return "".join(text for _, text in SCENES)
+
+        async def fake_foreshadowings(**kwargs):
+            return [{"content": "敌营的暗门"}]
+
+        async def fake_hook(**kwargs):
+            return "撤离时发现追兵"
+
+        chapter = SimpleNamespace(id="c1", title="夜袭", summary="潜入敌营", ai_prompt_hints="", content="", updated_at=0)
+        context = SimpleNamespace(
+            task_db=mock.MagicMock(), novel=SimpleNamespace(id="n1", title="n", genre="g", synopsis="s"),
+            volume=None, chapter=chapter, characters=[], world_settings=[],
+            previous_chapter_hook="", forced_previous_chapter_context="", context_version=None
+        )
+        progress = []
+        with mock.patch.object(service, "write_chapter_content_impl", fake_write), \
+                mock.patch.object(service, "extract_foreshadowings_from_chapter", fake_foreshadowings), \
+                mock.patch.object(service, "extract_next_chapter_hook", fake_hook), \
+                mock.patch.object(service, "select_relevant_characters_and_settings", lambda *a, **k: ([], [])), \
+                mock.patch.object(service, "EmbeddingService"), \
+                mock.patch.object(service, "ContentSimilarityChecker"), \
+                mock.patch.object(service, "record_chapter_content"), \
+                mock.patch.object(service, "Foreshadowing"), \
+                mock.patch.object(service.time, "sleep"):
+            result = service.write_and_save_chapter(
+                context, progress_callback=lambda p, msg: progress.append((p, msg)), draft_mode="scenes"
+            )
+        self.assertTrue(result["success"], result["error"])
+        self.assertEqual(calls["write"]["draft_mode"], "scenes")
+        self.assertEqual(result["draft_mode"], "scenes")
+        self.assertIsInstance(result["generation_ms"], int)
+        self.assertEqual(chapter.content, "第一段正文。\n\n第二段正文。\n\n第三段正文。")
+        self.assertEqual(result["foreshadowings"], ["敌营的暗门"])
+        self.assertEqual(result["next_chapter_hook"], "撤离时发现追兵")
+        scene_progress = [p for p, msg in progress if "场景" in msg]
+        self.assertEqual(scene_progress, [23, 36, 50])
+        print("   ✅ 章节写作服务场景模式测试通过")
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("场景并行写作客户端")
+    print("=" * 60)
+    server = start_service(scene_events())
+    try:
+        started = time.perf_counter()
+        content = asyncio.run(make_client(server).write_chapter_scenes(
+            on_scene=lambda index, total, title: print(f"场景 {index + 1}/{total}：{title}"), **CHAPTER_KWARGS
+        ))
+        print(f"{len(content)} 字 | {(time.perf_counter() - started) * 1000:.0f}ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,106 @@
+"""
+共享运行状态单元测试
+验证 TTL 过期、一次性读取、GCRA 限速与跨 worker 取消信号（内存实现）
+"""
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core import run_control  # noqa: E402
+from core.cancellation import find_cancel_token  # noqa: E402
+from core.shared_state import MemoryStateStore  # noqa: E402
+
+
+class TestMemoryStateStore(unittest.TestCase):
+    """测试内存存储"""
+
+    def test_ttl_expiry(self):
+        """测试过期数据读取不到，并在清理时移除"""
+        store = MemoryStateStore()
+        store.set("captcha", "a", "1234", ttl=0.05)
+        store.set("captcha", "b", "5678", ttl=60)
+        self.assertEqual(store.get("captcha", "a"), "1234")
+        time.sleep(0.06)
+        self.assertIsNone(store.get("captcha", "a"))
+        with mock.patch("core.shared_state.time.time", return_value=time.time() + 120):
+            store._next_sweep = 0
+            store.set("captcha", "c", "0000", ttl=300)
+        self.assertEqual(store.snapshot()["entries"], 1)
+        print("   ✅ TTL 过期测试通过")
+
+    def test_claim_lease(self):
+        """测试租约只能由一个持有者取得，持有者可续期，释放或过期后其他持有者可取得"""
+        store = MemoryStateStore()
+        self.assertTrue(store.claim("run_producer", "r1", "a", ttl=0.05))
+        self.assertFalse(store.claim("run_producer", "r1", "b", ttl=60))
+        self.assertTrue(store.claim("run_producer", "r1", "a", ttl=0.05))
+        store.release("run_producer", "r1", "b")
+        self.assertEqual(store.get("run_producer", "r1"), "a")
+        time.sleep(0.06)
+        self.assertTrue(store.claim("run_producer", "r1", "b", ttl=60))
+        store.release("run_producer", "r1", "b")
+        self.assertIsNone(store.get("run_producer", "r1"))
+        print("   ✅ 租约测试通过")
+
+    def test_pop_once(self):
+        """测试一次性读取（验证码只能用一次）"""
+        store = MemoryStateStore()
+        store.set("captcha", "id", "1234", ttl=60)
+        self.assertEqual(store.pop("captcha", "id"), "1234")
+        self.assertIsNone(store.pop("captcha", "id"))
+        print("   ✅ 一次性读取测试通过")
+
+    def test_throttle(self):
+        """测试 GCRA 限速：突发 limit 次后按速率放行"""
+        store = MemoryStateStore()
+        results = [store.throttle("rate_auth", "ip:1.2.3.4", limit=3, window=0.3) for _ in range(4)]
+        self.assertEqual(results[:3], [0.0, 0.0, 0.0])
+        self.assertGreater(results[3], 0)
+        self.assertLessEqual(results[3], 0.1 + 1e-6)
+        self.assertEqual(store.throttle("rate_auth", "ip:5.6.7.8", limit=3, window=0.3), 0.0)
+        time.sleep(0.11)
+        self.assertEqual(store.throttle("rate_auth", "ip:1.2.3.4", limit=3, window=0.3), 0.0)
+        print("   ✅ GCRA 限速测试通过")
+
+
+class TestRunControl(unittest.TestCase):
+    """测试取消信号"""
+
+    def setUp(self):
+        self.store = MemoryStateStore()
+        patcher = mock.patch("core.run_control.get_shared_state", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store.subscribe(run_control.CANCEL_CHANNEL, run_control._on_cancel_signal)
+
+    def test_broadcast_cancels_local_run(self):
+        """测试广播取消触发本进程令牌，结束后清理"""
+        run_control.register_run_owner("run-1", "user-1")
+        self.assertEqual(run_control.get_run_owner("run-1"), "user-1")
+        self.assertFalse(run_control.is_cancelled("run-1"))
+        self.assertTrue(run_control.broadcast_cancel("run-1"))
+        self.assertTrue(find_cancel_token("run-1").cancelled)
+        self.assertTrue(run_control.is_cancelled("run-1"))
+        run_control.clear_run("run-1")
+        self.assertIsNone(find_cancel_token("run-1"))
+        self.assertIsNone(run_control.get_run_owner("run-1"))
+        print("   ✅ 广播取消测试通过")
+
+    def test_missed_broadcast_falls_back_to_flag(self):
+        """测试错过广播时（其他 worker 写入的标记）回查共享存储"""
+        run_control.register_run_owner("run-2", "user-1")
+        self.store.set("cancel", "run-2", "1", ttl=60)
+        run_control._last_recheck.pop("run-2", None)
+        self.assertTrue(run_control.is_cancelled("run-2"))
+        self.assertTrue(find_cancel_token("run-2").cancelled)
+        run_control.clear_run("run-2")
+        print("   ✅ 取消标记回查测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+单飞合并单元测试
+验证并发相同请求只执行一次、异常共享与统计
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core.single_flight import SingleFlight  # noqa: E402
+
+
+class TestSingleFlight(unittest.TestCase):
+    """测试 SingleFlight"""
+
+    def _run_concurrently(self, flight, key, fn, count=5):
+        results = []
+        errors = []
+        barrier = threading.Barrier(count)
+
+        def worker():
+            barrier.wait()
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, errors
+
+    def test_concurrent_calls_coalesced(self):
+        """测试并发相同调用只执行一次"""
+        flight = SingleFlight("test")
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            return [0.1, 0.2]
+
+        results, errors = self._run_concurrently(flight, "k", fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[0.1, 0.2]] * 5)
+        self.assertEqual(errors, [])
+        stats = flight.snapshot()
+        self.assertEqual(stats["executed"], 1)
+        self.assertEqual(stats["coalesced"], 4)
+        self.assertEqual(stats["in_flight"], 0)
+        print("   ✅ 并发合并测试通过")
+
+    def test_error_shared(self):
+        """测试异常传给所有等待者"""
+        flight = SingleFlight("test")
+
+        def fn():
+            time.sleep(0.1)
+            raise RuntimeError("429")
+
+        results, errors = self._run_concurrently(flight, "k", fn, count=3)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flight.snapshot()["errors"], 1)
+        print("   ✅ 异常共享测试通过")
+
+    def test_sequential_calls_not_cached(self):
+        """测试完成后的调用重新执行（只合并进行中的请求，不做缓存）"""
+        flight = SingleFlight("test")
+        calls = []
+        flight.do("k", lambda: calls.append(1))
+        flight.do("k", lambda: calls.append(1))
+        self.assertEqual(len(calls), 2)
+        print("   ✅ 顺序调用测试通过")
+
+
+if __name__ == "__main__":
+    unittest.main()
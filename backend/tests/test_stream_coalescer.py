@@ -0,0 +1,144 @@
+"""
+SSE 分片合并测试
+验证时间窗口与字符上限合并、上游停顿时按窗口冲刷、结束与出错时冲刷已缓冲内容，
+并对比逐片发送与合并发送的事件数、事件速率和每个 token 的 CPU 开销
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from core.event_log import RunEventLog  # noqa: E402
+from core.stream_coalescer import coalesce_chunks  # noqa: E402
+
+
+def fast_tokens(count, burst=5, pause=0.001):
+    """模拟快速模型：每 burst 个 token 停顿 pause 秒"""
+    for i in range(count):
+        if i % burst == 0:
+            time.sleep(pause)
+        yield "字词"
+
+
+class TestStreamCoalescer(unittest.TestCase):
+    """测试分片合并"""
+
+    def test_merges_within_window(self):
+        """测试窗口内的分片合并，内容与顺序不变"""
+        chunks = list(coalesce_chunks(fast_tokens(200), window_seconds=0.04, max_chars=10000))
+        self.assertEqual("".join(chunks), "字词" * 200)
+        self.assertLess(len(chunks), 40)
+        print(f"   ✅ 窗口合并测试通过（200 个分片合并为 {len(chunks)} 个）")
+
+    def test_max_chars_flush(self):
+        """测试缓冲达到字符上限时不等窗口结束立即输出"""
+        def paced():
+            for _ in range(10):
+                time.sleep(0.01)
+                yield "abcd"
+
+        chunks = list(coalesce_chunks(paced(), window_seconds=10, max_chars=8))
+        self.assertEqual(chunks, ["abcdabcd"] * 5)
+        print("   ✅ 字符上限冲刷测试通过")
+
+    def test_window_flush_while_upstream_stalls(self):
+        """测试上游停顿时按窗口输出已缓冲内容，不等下一个分片"""
+        def stalled():
+            yield "前半"
+            time.sleep(0.5)
+            yield "后半"
+
+        started = time.monotonic()
+        iterator = coalesce_chunks(stalled(), window_seconds=0.03, max_chars=10000)
+        self.assertEqual(next(iterator), "前半")
+        self.assertLess(time.monotonic() - started, 0.3)
+        self.assertEqual(list(iterator), ["后半"])
+        print("   ✅ 停顿时按窗口冲刷测试通过")
+
+    def test_flush_on_end_error_and_checkpoint(self):
+        """测试出错前先输出已缓冲内容，空分片先冲刷再原样传递，窗口为 0 时透传"""
+        def failing():
+            yield "a"
+            yield "b"
+            raise RuntimeError("upstream failed")
+
+        received = []
+        with self.assertRaises(RuntimeError):
+            for chunk in coalesce_chunks(failing(), window_seconds=10, max_chars=10000):
+                received.append(chunk)
+        self.assertEqual(received, ["ab"])
+        self.assertEqual(list(coalesce_chunks(iter(["a", "b", "", "c"]), 10, 10000)), ["ab", "", "c"])
+        self.assertEqual(list(coalesce_chunks(iter(["a", "b"]), 0, 10000)), ["a", "b"])
+        print("   ✅ 结束与出错冲刷测试通过")
+
+    def test_consumer_close_stops_upstream(self):
+        """测试调用方提前关闭后上游迭代器被关闭"""
+        closed = []
+
+        def upstream():
+            try:
+                while True:
+                    time.sleep(0.005)
+                    yield "x"
+            finally:
+                closed.append(True)
+
+        iterator = coalesce_chunks(upstream(), window_seconds=0.02, max_chars=10000)
+        next(iterator)
+        iterator.close()
+        time.sleep(0.05)
+        self.assertEqual(closed, [True])
+        print("   ✅ 提前关闭测试通过")
+
+
+def run_stream(window_seconds, tokens=3000):
+    """把模拟上游经 SSE 编码写入事件日志，返回事件数、耗时与 CPU 时间"""
+    from main import _sse_event
+
+    log = RunEventLog("bench", "u1", max_events=tokens + 10)
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    for chunk in coalesce_chunks(fast_tokens(tokens), window_seconds, max_chars=512, name="bench"):
+        log.append(_sse_event("chunk", {"stage": "writer", "content": chunk}))
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    return log.last_seq, wall, cpu
+
+
+class TestCoalescingBenchmark(unittest.TestCase):
+    """对比逐片发送与按窗口合并"""
+
+    def test_fewer_events_and_less_cpu_per_token(self):
+        """测试合并后事件数与每 token 的 CPU 开销下降"""
+        tokens = 3000
+        results = {}
+        for label, window in (("逐片发送", 0), ("40ms 合并", 0.04)):
+            events, wall, cpu = run_stream(window, tokens)
+            results[label] = (events, cpu)
+            print(
+                f"   {label}: {events} 个事件, {events / wall:.0f} 事件/秒, "
+                f"CPU {cpu * 1e6 / tokens:.1f}µs/token"
+            )
+        self.assertEqual(results["逐片发送"][0], tokens)
+        self.assertLess(results["40ms 合并"][0] * 10, results["逐片发送"][0])
+        self.assertLess(results["40ms 合并"][1], results["逐片发送"][1])
+        print("   ✅ 合并基准测试通过")
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("SSE 分片合并基准")
+    print("=" * 60)
+    for window_ms in (0, 10, 30, 50):
+        events, wall, cpu = run_stream(window_ms / 1000)
+        print(f"窗口 {window_ms:>2}ms: {events:>5} 个事件, {events / wall:>6.0f} 事件/秒, CPU {cpu * 1e6 / 3000:.1f}µs/token")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,204 @@
+"""
+结构化生成流式接口测试
+验证客户端逐项产出元素、错误事件与未完成即断开时抛出异常、逐项回调在流式/非流式模式下结果一致，
+并对比等待完整列表与流式接收时首项到达的耗时
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+# 导入 services 时会按 GEMINI_PROXY 设置 HTTP(S)_PROXY，本地模拟服务不走代理
+os.environ.setdefault("NO_PROXY", "127.0.0.1,localhost")
+
+from services.ai.ai_service_client import AIServiceClient, bypass_response_cache  # noqa: E402
+
+
+def item_events(items):
+    return [f"data: {json.dumps({'item': item, 'index': i}, ensure_ascii=False)}\n\n" for i, item in enumerate(items)]
+
+
+def done_event(count):
+    return f"data: {json.dumps({'done': True, 'count': count, 'skipped': 0})}\n\n"
+
+
+class FakeAIService(BaseHTTPRequestHandler):
+    """模拟微服务的结构化流式接口：server.events 为依次写出的 SSE 事件，事件间停顿 item_delay 秒"""
+
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+        self.server.requests.append((self.path, payload))
+        self.server.headers.append(dict(self.headers))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for event in self.server.events:
+            time.sleep(self.server.item_delay)
+            self.wfile.write(event.encode("utf-8"))
+            self.wfile.flush()
+
+
+def start_service(events, item_delay=0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAIService)
+    server.daemon_threads = True
+    server.events = events
+    server.item_delay = item_delay
+    server.requests = []
+    server.headers = []
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_client(server):
+    return AIServiceClient(f"http://127.0.0.1:{server.server_address[1]}", timeout=10)
+
+
+def collect(stream):
+    async def run():
+        return [item async for item in stream]
+    return asyncio.run(run())
+
+
+class TestStructuredStreamClient(unittest.TestCase):
+    """测试客户端解析结构化流"""
+
+    def test_items_in_order(self):
+        """测试按顺序产出元素，请求发往对应的流式接口"""
+        characters = [{"name": f"角色{i}", "role": "配角"} for i in range(3)]
+        server = start_service(item_events(characters) + [done_event(3)])
+        self.addCleanup(server.shutdown)
+        items = collect(make_client(server).generate_characters_stream(title="t", genre="g", synopsis="s", outline="o"))
+        self.assertEqual(items, characters)
+        self.assertEqual(server.requests[0][0], "/api/v1/analysis/generate-characters-stream")
+        print("   ✅ 逐项产出测试通过")
+
+    def test_error_event_raises(self):
+        """测试错误事件抛出异常，之前的元素已经产出"""
+        server = start_service(item_events([{"name": "一"}]) + ['data: {"error": "生成角色列表失败: 超时"}\n\n'])
+        self.addCleanup(server.shutdown)
+        received = []
+
+        async def run():
+            async for item in make_client(server).generate_characters_stream(title="t", genre="g", synopsis="s", outline="o"):
+                received.append(item)
+
+        with self.assertRaisesRegex(Exception, "超时"):
+            asyncio.run(run())
+        self.assertEqual(received, [{"name": "一"}])
+        print("   ✅ 错误事件测试通过")
+
+    def test_missing_done_raises(self):
+        """测试连接在完成事件之前断开时抛出异常，避免把截断的结果当作完整结果"""
+        server = start_service(item_events([{"title": "一"}, {"title": "二"}]))
+        self.addCleanup(server.shutdown)
+        with self.assertRaisesRegex(Exception, "完成前中断"):
+            collect(make_client(server).generate_timeline_events_stream(title="t", genre="g", synopsis="s", outline="o"))
+        print("   ✅ 中断检测测试通过")
+
+
+    def test_cache_bypass_header(self):
+        """测试 bypass_response_cache() 期间的请求带 X-Cache-Bypass，其余请求不带"""
+        server = start_service(item_events([{"name": "一"}]) + [done_event(1)])
+        self.addCleanup(server.shutdown)
+        client = make_client(server)
+        collect(client.generate_characters_stream(title="t", genre="g", synopsis="s", outline="o"))
+        with bypass_response_cache():
+            collect(client.generate_characters_stream(title="t", genre="g", synopsis="s", outline="o"))
+        self.assertNotIn("X-Cache-Bypass", server.headers[0])
+        self.assertEqual(server.headers[1].get("X-Cache-Bypass"), "true")
+        print("   ✅ 跳过响应缓存请求头测试通过")
+
+
+class TestConsumeStructuredItems(unittest.TestCase):
+    """测试逐项回调"""
+
+    def test_stream_and_list_modes_match(self):
+        """测试流式与非流式模式回调的元素和序号一致"""
+        from main import consume_structured_items
+
+        data = [{"title": "一"}, {"title": "二"}, {"title": "三"}]
+
+        async def stream_fn(**kwargs):
+            for item in data:
+                yield item
+
+        async def list_fn(**kwargs):
+            return data
+
+        results = {}
+        for streaming in (True, False):
+            received = []
+            with mock.patch("main.STRUCTURED_STREAMING", streaming):
+                count = consume_structured_items(stream_fn, list_fn, {}, lambda item, index: received.append((index, item)))
+            results[streaming] = (count, received)
+        self.assertEqual(results[True], results[False])
+        self.assertEqual(results[True][0], 3)
+        print("   ✅ 流式/非流式一致性测试通过")
+
+
+def first_and_total(stream):
+    async def run():
+        started = time.perf_counter()
+        first = None
+        count = 0
+        async for _ in stream:
+            count += 1
+            if first is None:
+                first = time.perf_counter() - started
+        return first, time.perf_counter() - started, count
+    return asyncio.run(run())
+
+
+def run_benchmark(chapter_count, item_delay):
+    chapters = [{"title": f"第{i + 1}章", "summary": "摘要" * 40} for i in range(chapter_count)]
+    server = start_service(item_events(chapters) + [done_event(chapter_count)], item_delay=item_delay)
+    try:
+        first, total, count = first_and_total(make_client(server).generate_chapter_outline_stream(
+            novel_title="n", genre="g", full_outline="", volume_title="v", volume_summary="",
+            volume_outline="", characters=[], volume_index=0
+        ))
+    finally:
+        server.shutdown()
+    # 非流式接口要等所有章节生成完才返回，首章到达时间即完整耗时
+    return first, total, count
+
+
+class TestStreamingBenchmark(unittest.TestCase):
+    """对比首项到达时间"""
+
+    def test_first_item_arrives_early(self):
+        """测试 30 章（每章模拟 30ms）：首章到达时间远早于完整列表"""
+        first, total, count = run_benchmark(30, 0.03)
+        print(f"   首章 {first * 1000:.0f}ms | 全部 {count} 章 {total * 1000:.0f}ms")
+        self.assertEqual(count, 30)
+        self.assertLess(first * 3, total)
+        print("   ✅ 首项到达基准测试通过")
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("章节列表流式接收（非流式接口的首章到达时间等于全部耗时）")
+    print("=" * 60)
+    for chapter_count, item_delay in ((20, 0.05), (50, 0.05), (50, 0.2)):
+        first, total, _ = run_benchmark(chapter_count, item_delay)
+        print(f"{chapter_count:>3} 章 / 每章 {item_delay * 1000:.0f}ms: 首章 {first:.2f}s | 全部 {total:.2f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
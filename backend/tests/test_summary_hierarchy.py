@@ -0,0 +1,310 @@
+"""
+分层摘要测试
+验证章节摘要按正文哈希缓存、卷摘要和全书梗概逐级汇总、改动一章只重算受影响的节点、并发不超过上限、
+前情提要长度固定，并对比逐章串行摘要与有界并发摘要的耗时
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from services.ai import summary_hierarchy  # noqa: E402
+from services.ai.summary_hierarchy import SummaryInEventLoopError, story_so_far, summarize_novel  # noqa: E402
+
+
+class FakeResult:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDB:
+    """按 SQL 内容模拟 chapters / volumes / story_summaries 三张表"""
+
+    def __init__(self, volumes):
+        # volumes: [(volume_id, title, [(chapter_id, title, content, summary), ...]), ...]
+        self.volumes = [(vid, title) for vid, title, _ in volumes]
+        self.chapters = {
+            cid: {"volume_id": vid, "title": title, "content": content, "summary": summary}
+            for vid, _, chapters in volumes
+            for cid, title, content, summary in chapters
+        }
+        self.order = [cid for _, _, chapters in volumes for cid, *_ in chapters]
+        self.summaries = {}
+
+    def _chapter_rows(self):
+        titles = dict(self.volumes)
+        return [(cid, self.chapters[cid], titles[self.chapters[cid]["volume_id"]]) for cid in self.order]
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        if "CREATE" in sql:
+            return FakeResult()
+        if "AS written" in sql:
+            return FakeResult([
+                (cid, ch["volume_id"], ch["title"], ch["summary"], bool(ch["content"] and ch["content"].strip()))
+                for cid, ch, _ in self._chapter_rows()
+            ])
+        if "FROM chapters c" in sql:
+            return FakeResult([
+                (cid, ch["volume_id"], ch["title"], ch["content"], ch["summary"], volume_title)
+                for cid, ch, volume_title in self._chapter_rows()
+            ])
+        if sql.strip().startswith("SELECT") and "story_summaries" in sql:
+            return FakeResult([
+                (scope, ref_id, row["content_hash"], row["summary"])
+                for (scope, ref_id), row in self.summaries.items()
+                if row["novel_id"] == params["novel_id"]
+            ])
+        if "INSERT INTO story_summaries" in sql:
+            # ON CONFLICT (scope, ref_id) 只更新哈希、摘要和时间，novel_id 保持不变
+            for row in params:
+                existing = self.summaries.get((row["scope"], row["ref_id"]))
+                if existing:
+                    existing.update(content_hash=row["content_hash"], summary=row["summary"], updated_at=row["updated_at"])
+                else:
+                    self.summaries[(row["scope"], row["ref_id"])] = dict(row)
+            return FakeResult()
+        if "UPDATE chapters" in sql:
+            for row in params:
+                self.chapters[row["id"]]["summary"] = row["summary"]
+            return FakeResult()
+        if "DELETE FROM story_summaries" in sql:
+            for ref_id in params["ref_ids"]:
+                row = self.summaries.get(("node", ref_id))
+                if row and row["novel_id"] == params["novel_id"]:
+                    del self.summaries[("node", ref_id)]
+            return FakeResult()
+        raise AssertionError(f"unexpected query: {sql}")
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeSummarizer:
+    """模拟 AI 微服务摘要：记录调用、并发峰值，latency 模拟每次请求耗时"""
+
+    def __init__(self, latency=0.0, fail_titles=()):
+        self.latency = latency
+        self.fail_titles = set(fail_titles)
+        self.titles = []
+        self.active = 0
+        self.peak = 0
+
+    async def __call__(self, title, content, max_len):
+        self.titles.append(title)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            if title in self.fail_titles:
+                raise RuntimeError("upstream error")
+            return f"《{title}》摘要{hashlib.md5(content.encode()).hexdigest()[:8]}"[:max_len]
+        finally:
+            self.active -= 1
+
+
+def make_novel(volume_count=2, chapters_per_volume=20, id_prefix=""):
+    return FakeDB([
+        (
+            f"{id_prefix}v{v}",
+            f"第{v + 1}卷",
+            [
+                (f"{id_prefix}v{v}c{c}", f"第{v + 1}卷第{c + 1}章", f"第{v + 1}卷第{c + 1}章正文" * 50, "")
+                for c in range(chapters_per_volume)
+            ],
+        )
+        for v in range(volume_count)
+    ])
+
+
+class TestSummaryHierarchy(unittest.TestCase):
+    """测试分层摘要的缓存与汇总"""
+
+    def test_first_run_then_cached(self):
+        """测试首次全部摘要并逐级汇总，第二次不发任何请求"""
+        db = make_novel()
+        summarizer = FakeSummarizer(latency=0.001)
+        report = summarize_novel(db, "n1", summarize_fn=summarizer, concurrency=4)
+        # 每卷 20 章：3 个分组 + 1 个卷节点；全书 2 卷：1 个节点
+        self.assertEqual(report["chapters"], 40)
+        self.assertEqual(report["calls"], 40 + 2 * 4 + 1)
+        self.assertEqual((report["volumes"], report["novel"]), (2, True))
+        self.assertLessEqual(summarizer.peak, 4)
+        self.assertGreater(summarizer.peak, 1)
+        self.assertTrue(all(ch["summary"] for ch in db.chapters.values()))
+        self.assertIn(("novel", "n1"), db.summaries)
+
+        again = FakeSummarizer()
+        report = summarize_novel(db, "n1", summarize_fn=again)
+        self.assertEqual(again.titles, [])
+        self.assertEqual((report["chapters"], report["cached"], report["calls"]), (0, 40, 0))
+        print("   ✅ 首次汇总与缓存命中测试通过")
+
+    def test_edit_recomputes_affected_nodes_only(self):
+        """测试改动一章只重算该章、所在分组、卷和全书节点，旧节点被清理"""
+        db = make_novel()
+        summarize_novel(db, "n1", summarize_fn=FakeSummarizer())
+        nodes_before = sum(scope == "node" for scope, _ in db.summaries)
+        db.chapters["v1c3"]["content"] += "新增一段情节"
+
+        summarizer = FakeSummarizer()
+        report = summarize_novel(db, "n1", summarize_fn=summarizer)
+        self.assertEqual(report["chapters"], 1)
+        self.assertEqual(summarizer.titles[0], "第2卷第4章")
+        self.assertEqual(summarizer.titles[1:], ["第2卷", "第2卷", "全书"])
+        self.assertEqual(sum(scope == "node" for scope, _ in db.summaries), nodes_before)
+        print("   ✅ 增量重算测试通过")
+
+    def test_identical_nodes_in_two_novels(self):
+        """测试两部小说出现输入相同的汇总节点时各存一份，互不覆盖、互不清理"""
+        first, second = make_novel(1, 6), make_novel(1, 6, id_prefix="b-")
+        second.summaries = first.summaries
+        summarize_novel(first, "n1", summarize_fn=FakeSummarizer())
+        summarize_novel(second, "n2", summarize_fn=FakeSummarizer())
+        nodes = [row["novel_id"] for (scope, _), row in first.summaries.items() if scope == "node"]
+        self.assertEqual(sorted(set(nodes)), ["n1", "n2"])
+        self.assertEqual(nodes.count("n1"), nodes.count("n2"))
+
+        first.chapters["v0c0"]["content"] += "新增一段情节"
+        summarize_novel(first, "n1", summarize_fn=FakeSummarizer())
+        again = FakeSummarizer()
+        report = summarize_novel(second, "n2", summarize_fn=again)
+        self.assertEqual((again.titles, report["calls"]), ([], 0))
+        print("   ✅ 跨小说汇总节点隔离测试通过")
+
+    def test_flow_summaries_from_running_loop(self):
+        """测试在事件循环中（异步 Agent 流程接口）经线程池调用 _summarize_chapters 能正常摘要"""
+        import functools
+        from unittest import mock
+        from fastapi.concurrency import run_in_threadpool
+        import main
+
+        db = make_novel(1, 4)
+
+        async def flow():
+            return await run_in_threadpool(main._summarize_chapters, db, "n1")
+
+        with mock.patch.object(main, "summarize_novel", functools.partial(summarize_novel, summarize_fn=FakeSummarizer())):
+            # 直接在事件循环线程上调用时明确报错，而不是静默跳过摘要
+            async def direct():
+                return main._summarize_chapters(db, "n1")
+            with self.assertRaises(SummaryInEventLoopError):
+                asyncio.run(direct())
+            self.assertEqual(asyncio.run(flow()), 4)
+        self.assertTrue(all(ch["summary"] for ch in db.chapters.values()))
+        print("   ✅ 事件循环内摘要测试通过")
+
+    def test_manual_summaries_and_failures(self):
+        """测试手工摘要不被覆盖、空章节跳过、单章失败不影响其他章节"""
+        db = make_novel(volume_count=1, chapters_per_volume=4)
+        db.chapters["v0c0"]["summary"] = "作者手写的摘要"
+        db.chapters["v0c3"]["content"] = "  "
+        summarizer = FakeSummarizer(fail_titles={"第1卷第2章"})
+        report = summarize_novel(db, "n1", summarize_fn=summarizer)
+        self.assertEqual(db.chapters["v0c0"]["summary"], "作者手写的摘要")
+        self.assertNotIn("第1卷第4章", summarizer.titles)
+        self.assertEqual((report["chapters"], report["failed"]), (1, 1))
+        self.assertEqual(db.chapters["v0c1"]["summary"], "")
+
+        report = summarize_novel(db, "n1", summarize_fn=FakeSummarizer())
+        self.assertEqual(report["chapters"], 1)
+        report = summarize_novel(db, "n1", overwrite=True, summarize_fn=FakeSummarizer())
+        self.assertEqual(report["chapters"], 1)
+        self.assertNotEqual(db.chapters["v0c0"]["summary"], "作者手写的摘要")
+        print("   ✅ 手工摘要与失败处理测试通过")
+
+    def test_story_so_far_is_bounded(self):
+        """测试前情提要长度固定，指定章节时不带入覆盖后文的梗概"""
+        short, long = make_novel(2, 5), make_novel(6, 50)
+        for db in (short, long):
+            summarize_novel(db, "n1", summarize_fn=FakeSummarizer())
+        recap = story_so_far(long, "n1", recent_chapters=3)
+        self.assertTrue(recap.startswith("全书梗概："))
+        self.assertIn("本卷梗概：", recap)
+        self.assertIn("第6卷第50章", recap)
+        self.assertEqual(recap.count("\n- "), 3)
+        self.assertLess(len(recap), 5 * summary_hierarchy.SUMMARY_MAX_CHARS)
+        self.assertEqual(len(recap.splitlines()), len(story_so_far(short, "n1", recent_chapters=3).splitlines()))
+
+        middle = story_so_far(long, "n1", before_chapter_id="v3c10")
+        self.assertNotIn("全书梗概", middle)
+        self.assertNotIn("本卷梗概", middle)
+        self.assertTrue(middle.startswith("上一卷梗概："))
+        self.assertIn("第4卷第10章", middle)
+        self.assertNotIn("第4卷第11章", middle)
+        self.assertEqual(story_so_far(long, "n1", before_chapter_id="v0c0"), "")
+        print("   ✅ 前情提要测试通过")
+
+
+def legacy_summarize(db, summarizer):
+    """改造前：逐章 asyncio.run 串行摘要，没有缓存，也没有卷/全书汇总"""
+    updated = 0
+    for cid in db.order:
+        chapter = db.chapters[cid]
+        chapter["summary"] = asyncio.run(summarizer(chapter["title"], chapter["content"], 400))
+        updated += 1
+    return updated
+
+
+def run_benchmark(volume_count, chapters_per_volume, latency, concurrency=8):
+    db = make_novel(volume_count, chapters_per_volume)
+    started = time.perf_counter()
+    legacy_summarize(db, FakeSummarizer(latency=latency))
+    legacy_s = time.perf_counter() - started
+
+    db = make_novel(volume_count, chapters_per_volume)
+    summarizer = FakeSummarizer(latency=latency)
+    started = time.perf_counter()
+    report = summarize_novel(db, "n1", summarize_fn=summarizer, concurrency=concurrency)
+    concurrent_s = time.perf_counter() - started
+
+    db.chapters[db.order[-1]]["content"] += "续写"
+    started = time.perf_counter()
+    incremental = summarize_novel(db, "n1", summarize_fn=FakeSummarizer(latency=latency), concurrency=concurrency)
+    incremental_s = time.perf_counter() - started
+    return legacy_s, concurrent_s, report, incremental_s, incremental
+
+
+class TestSummaryBenchmark(unittest.TestCase):
+    """对比逐章串行与有界并发"""
+
+    def test_concurrent_is_faster(self):
+        """测试 60 章（每次请求模拟 20ms）：并发摘要含汇总仍明显快于串行，改动一章只需几次请求"""
+        legacy_s, concurrent_s, report, incremental_s, incremental = run_benchmark(3, 20, latency=0.02)
+        print(
+            f"   串行 {legacy_s * 1000:.0f}ms（仅章节） | 并发 {concurrent_s * 1000:.0f}ms"
+            f"（{report['calls']} 次请求，含卷/全书汇总） | 改动一章 {incremental_s * 1000:.0f}ms（{incremental['calls']} 次请求）"
+        )
+        self.assertLess(concurrent_s * 3, legacy_s)
+        self.assertEqual(incremental["calls"], 4)
+        print("   ✅ 分层摘要基准测试通过")
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("小说摘要基准（每次摘要请求模拟 50ms，并发 8）")
+    print("=" * 60)
+    for volume_count, chapters_per_volume in ((2, 25), (4, 50), (6, 50)):
+        legacy_s, concurrent_s, report, incremental_s, incremental = run_benchmark(volume_count, chapters_per_volume, 0.05)
+        print(
+            f"{volume_count * chapters_per_volume:>4} 章: 串行 {legacy_s:>6.2f}s | 并发 {concurrent_s:>5.2f}s"
+            f"（{report['calls']} 次请求） | 改动一章 {incremental_s:.2f}s（{incremental['calls']} 次请求）"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,171 @@
+"""
+已认证用户缓存单元测试与微基准
+验证缓存命中不查库、TTL 与条目上限、修改密码/锁定后失效，并对比开启缓存前后任务轮询路径的查库次数与耗时
+
+单独运行基准: python tests/test_user_cache.py
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from fastapi import HTTPException  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from core import security  # noqa: E402
+from core.security import create_access_token, get_current_user, handle_login_failure, token_claims  # noqa: E402
+from core.user_cache import UserCache, invalidate_user  # noqa: E402
+from models import Task, User  # noqa: E402
+
+
+def make_database(path=None):
+    """sqlite 数据库（只建 users / tasks 表），返回 (Session, 查询计数器)"""
+    engine = create_engine(f"sqlite:///{path}" if path else "sqlite://")
+    User.__table__.create(engine)
+    Task.__table__.create(engine)
+    queries = {"count": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*args):
+        queries["count"] += 1
+
+    return sessionmaker(bind=engine), queries
+
+
+def add_user(Session, user_id="u1"):
+    with Session() as db:
+        db.add(User(
+            id=user_id, username=f"name-{user_id}", email=f"{user_id}@example.com",
+            password_hash="hash-1", created_at=1, password_fail_count=0, captcha_fail_count=0
+        ))
+        db.commit()
+        return create_access_token(data=token_claims(db.get(User, user_id)))
+
+
+class TestUserCache(unittest.TestCase):
+    """测试已认证用户缓存"""
+
+    def setUp(self):
+        self.Session, self.queries = make_database()
+        self.cache = UserCache(max_entries=100, ttl=30)
+        for target in ("core.security.get_user_cache", "core.user_cache.get_user_cache"):
+            patcher = mock.patch(target, return_value=self.cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.token = add_user(self.Session)
+
+    def authenticate(self, token=None):
+        with self.Session() as db:
+            return get_current_user(token or self.token, db)
+
+    def test_hit_skips_database(self):
+        """测试第二次认证命中缓存，不查库，返回的快照脱离会话仍可读"""
+        first = self.authenticate()
+        before = self.queries["count"]
+        second = self.authenticate()
+        self.assertEqual(self.queries["count"], before)
+        self.assertIs(first, second)
+        self.assertEqual(second.username, "name-u1")
+        self.assertEqual(self.cache.stats["hits"], 1)
+        print("   ✅ 缓存命中测试通过")
+
+    def test_ttl_and_bound(self):
+        """测试条目过期后回库，超过上限时淘汰最久未用的用户"""
+        self.cache.ttl = 0.05
+        self.authenticate()
+        time.sleep(0.06)
+        before = self.queries["count"]
+        self.authenticate()
+        self.assertGreater(self.queries["count"], before)
+
+        self.cache.ttl = 30
+        self.cache.max_entries = 2
+        tokens = {uid: add_user(self.Session, uid) for uid in ("u2", "u3")}
+        self.authenticate()
+        self.authenticate(tokens["u2"])
+        self.authenticate()
+        self.authenticate(tokens["u3"])
+        self.assertEqual(self.cache.snapshot()["entries"], 2)
+        self.assertIsNone(self.cache.get("u2", None))
+        self.assertIsNotNone(self.cache.get("u1", None))
+        print("   ✅ TTL 与条目上限测试通过")
+
+    def test_password_change_revokes_token(self):
+        """测试修改密码并失效缓存后旧令牌被拒绝，新令牌可用"""
+        self.authenticate()
+        with self.Session() as db:
+            user = db.get(User, "u1")
+            user.password_hash = "hash-2"
+            db.commit()
+            invalidate_user(user.id)
+            new_token = create_access_token(data=token_claims(user))
+        with self.assertRaises(HTTPException) as ctx:
+            self.authenticate()
+        self.assertEqual(ctx.exception.status_code, 401)
+        self.assertEqual(self.authenticate(new_token).password_hash, "hash-2")
+        print("   ✅ 修改密码失效测试通过")
+
+    def test_lockout_invalidates(self):
+        """测试账户锁定后缓存条目被清除，下一次认证读到最新状态"""
+        self.assertIsNone(self.authenticate().locked_until)
+        with self.Session() as db:
+            user = db.get(User, "u1")
+            for _ in range(5):
+                handle_login_failure(db, user)
+        self.assertEqual(self.cache.stats["invalidations"], 1)
+        self.assertIsNotNone(self.authenticate().locked_until)
+        print("   ✅ 锁定失效测试通过")
+
+    def test_legacy_token_without_version(self):
+        """测试升级前签发的令牌（不带版本）仍可认证"""
+        legacy = create_access_token(data={"sub": "u1"})
+        self.assertEqual(self.authenticate(legacy).id, "u1")
+        self.assertEqual(self.authenticate(legacy).id, "u1")
+        self.assertEqual(self.cache.stats["hits"], 1)
+        print("   ✅ 旧令牌兼容测试通过")
+
+
+def poll_task(Session, token, task_id):
+    """模拟 GET /api/tasks/{id}：认证 + 按用户读取任务"""
+    with Session() as db:
+        user = get_current_user(token, db)
+        return db.query(Task).filter(Task.id == task_id, Task.user_id == user.id).first()
+
+
+def main():
+    requests = 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        Session, queries = make_database(os.path.join(tmp, "bench.db"))
+        token = add_user(Session)
+        with Session() as db:
+            db.add(Task(id="t1", user_id="u1", novel_id="n1", task_type="write_chapter", status="running", progress=0,
+                        created_at=1, updated_at=1))
+            db.commit()
+
+        print(f"任务轮询路径（sqlite 文件库，{requests} 次请求）")
+        for label, ttl in (("每次查用户", 0), ("用户缓存", 30)):
+            cache = UserCache(max_entries=1000, ttl=ttl)
+            with mock.patch.object(security, "get_user_cache", return_value=cache):
+                poll_task(Session, token, "t1")
+                queries["count"] = 0
+                started = time.perf_counter()
+                for _ in range(requests):
+                    poll_task(Session, token, "t1")
+                elapsed = time.perf_counter() - started
+            print(
+                f"  {label}: 每请求查库 {queries['count'] / requests:.1f} 次 | "
+                f"{elapsed / requests * 1e6:,.0f} 微秒/请求 | {requests / elapsed:,.0f} 请求/秒"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,338 @@
+"""
+小说向量内存索引测试
+验证章节/段落 top-k 与精确余弦排序一致、排除章节与阈值过滤、按内存预算 LRU 淘汰、TTL 与写入失效，
+以及 EmbeddingService 命中索引时只为结果查询章节信息；
+基准：100 / 1,000 / 10,000 个段落向量的索引检索耗时，数据库可用时（python tests/test_vector_index.py）与 pgvector 检索对比
+"""
+import os
+import struct
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import numpy as np  # noqa: E402
+
+from services.embedding import vector_index  # noqa: E402
+from services.embedding.embedding_service import EmbeddingService  # noqa: E402
+from services.embedding.vector_index import NovelVectorIndex, VectorIndexCache  # noqa: E402
+
+DIM = 768
+
+
+def vector_send(vector):
+    return struct.pack(">HH", len(vector), 0) + np.asarray(vector, dtype=">f4").tobytes()
+
+
+def make_rows(chapters, paragraphs_per_chapter, seed=3, dim=DIM):
+    """生成 (chapter_id, chunk_count, 章节向量, 段落向量列表) 行（vector_send 二进制格式）"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for c in range(chapters):
+        paragraphs = rng.standard_normal((paragraphs_per_chapter, dim)).astype(np.float32)
+        rows.append((
+            f"ch{c}",
+            paragraphs_per_chapter,
+            vector_send(paragraphs.mean(axis=0)),
+            [vector_send(p) for p in paragraphs],
+        ))
+    return rows
+
+
+def exact_top_k(vectors, labels, query, limit, threshold):
+    """逐个计算余弦相似度后排序（与 pgvector ORDER BY a <=> b 的结果一致）"""
+    scored = []
+    for label, vector in zip(labels, vectors):
+        similarity = float(np.dot(vector, query) / (np.linalg.norm(vector) * np.linalg.norm(query)))
+        if similarity >= threshold:
+            scored.append((label, similarity))
+    scored.sort(key=lambda item: -item[1])
+    return scored[:limit]
+
+
+def decode(binary):
+    return np.frombuffer(binary, dtype=">f4", offset=4).astype(np.float32)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDB:
+    """载入查询返回向量行，章节查询按 ID 返回标题、摘要与正文；记录查询次数"""
+
+    def __init__(self, rows, load_delay=0.0):
+        self.rows = rows
+        self.load_delay = load_delay
+        self.queries = []
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        self.queries.append(sql)
+        if "FROM chapter_embeddings" in sql:
+            time.sleep(self.load_delay)
+            return FakeResult(self.rows)
+        if "FROM chapters" in sql:
+            ids = params["chapter_ids"]
+            if "summary" in sql:
+                return FakeResult([(cid, f"标题{cid}", f"摘要{cid}", "正文预览") for cid in ids])
+            return FakeResult([(cid, f"标题{cid}", "第一段内容。" * 400) for cid in ids])
+        raise AssertionError(f"unexpected query: {sql}")
+
+    def rollback(self):
+        pass
+
+
+class TestNovelVectorIndex(unittest.TestCase):
+    """测试索引检索"""
+
+    def setUp(self):
+        self.rows = make_rows(chapters=20, paragraphs_per_chapter=5, dim=32)
+        self.index = NovelVectorIndex.build("n1", self.rows)
+        self.query = np.random.default_rng(9).standard_normal(32).tolist()
+
+    def test_chapter_top_k_matches_exact(self):
+        """测试章节 top-k 与精确余弦排序一致，排除章节后不再出现"""
+        expected = exact_top_k([decode(r[2]) for r in self.rows], [r[0] for r in self.rows], self.query, 5, -1.0)
+        hits = self.index.search_chapters(self.query, 5, -1.0)
+        self.assertEqual([h[0] for h in hits], [e[0] for e in expected])
+        np.testing.assert_allclose([h[2] for h in hits], [e[1] for e in expected], atol=1e-5)
+
+        excluded = [expected[0][0], expected[1][0]]
+        hits = self.index.search_chapters(self.query, 5, -1.0, exclude_chapter_ids=excluded)
+        self.assertFalse(set(excluded) & {h[0] for h in hits})
+        self.assertEqual(self.index.search_chapters(self.query, 5, 0.99), [])
+        print("   ✅ 章节 top-k 测试通过")
+
+    def test_paragraph_top_k_matches_exact(self):
+        """测试段落 top-k 返回正确的章节与段落序号"""
+        vectors, labels = [], []
+        for chapter_id, _, _, paragraphs in self.rows:
+            for index, binary in enumerate(paragraphs):
+                vectors.append(decode(binary))
+                labels.append((chapter_id, index))
+        expected = exact_top_k(vectors, labels, self.query, 8, 0.1)
+        hits = self.index.search_paragraphs(self.query, 8, 0.1)
+        self.assertEqual([(h[0], h[1]) for h in hits], [e[0] for e in expected])
+
+        hits = self.index.search_paragraphs(self.query, 8, -1.0, exclude_chapter_ids=["ch0", "ch1"])
+        self.assertEqual(len(hits), 8)
+        self.assertFalse({"ch0", "ch1"} & {h[0] for h in hits})
+        print("   ✅ 段落 top-k 测试通过")
+
+
+class TestVectorIndexCache(unittest.TestCase):
+    """测试缓存的淘汰、过期与失效"""
+
+    def index_bytes(self, rows):
+        return NovelVectorIndex.build("x", rows).nbytes
+
+    def test_lru_eviction_by_memory_budget(self):
+        """测试超过内存预算时淘汰最久未用的小说，超过预算的单部小说不缓存"""
+        rows = make_rows(4, 5, dim=32)
+        size = self.index_bytes(rows)
+        cache = VectorIndexCache(max_bytes=size * 2, ttl=0)
+        db = FakeDB(rows)
+        cache.get_or_load(db, "a")
+        cache.get_or_load(db, "b")
+        cache.get_or_load(db, "a")
+        cache.get_or_load(db, "c")
+        self.assertEqual(cache.snapshot()["evictions"], 1)
+        loads = len(db.queries)
+        cache.get_or_load(db, "a")
+        self.assertEqual(len(db.queries), loads)
+        cache.get_or_load(db, "b")
+        self.assertEqual(len(db.queries), loads + 1)
+
+        small = VectorIndexCache(max_bytes=size - 1, ttl=0)
+        self.assertIsNotNone(small.get_or_load(db, "a"))
+        self.assertEqual(small.snapshot()["novels"], 0)
+        self.assertIsNone(VectorIndexCache(max_bytes=0, ttl=0).get_or_load(db, "a"))
+        print("   ✅ 内存预算 LRU 测试通过")
+
+    def test_ttl_and_invalidation(self):
+        """测试过期后重新载入，失效后重新载入，载入期间失效的结果不写入缓存"""
+        rows = make_rows(2, 2, dim=8)
+        cache = VectorIndexCache(max_bytes=1 << 20, ttl=0.05)
+        db = FakeDB(rows)
+        cache.get_or_load(db, "n1")
+        cache.get_or_load(db, "n1")
+        self.assertEqual(cache.snapshot()["loads"], 1)
+        time.sleep(0.06)
+        cache.get_or_load(db, "n1")
+        self.assertEqual(cache.snapshot()["loads"], 2)
+        cache.evict("n1")
+        cache.get_or_load(db, "n1")
+        self.assertEqual(cache.snapshot()["loads"], 3)
+
+        slow = FakeDB(rows, load_delay=0.1)
+        cache = VectorIndexCache(max_bytes=1 << 20, ttl=0)
+        loader = threading.Thread(target=cache.get_or_load, args=(slow, "n1"))
+        loader.start()
+        time.sleep(0.03)
+        cache.evict("n1")
+        loader.join()
+        self.assertEqual(cache.snapshot()["novels"], 0)
+        print("   ✅ 过期与失效测试通过")
+
+    def test_write_path_invalidates(self):
+        """测试章节向量写入后索引失效"""
+        cache = VectorIndexCache(max_bytes=1 << 20, ttl=0)
+        cache.get_or_load(FakeDB(make_rows(2, 2, dim=8)), "n1")
+        with mock.patch.object(vector_index, "_cache", cache):
+            service = EmbeddingService()
+            with mock.patch.object(service, "generate_embedding", return_value=[0.1] * 8):
+                db = mock.MagicMock()
+                db.execute.return_value.fetchone.return_value = None
+                service.store_chapter_embedding(db, "ch0", "n1", "第一段。第二段。")
+        self.assertEqual(cache.snapshot()["novels"], 0)
+        self.assertEqual(cache.snapshot()["invalidations"], 1)
+        print("   ✅ 写入失效测试通过")
+
+
+class TestEmbeddingServiceWithIndex(unittest.TestCase):
+    """测试 EmbeddingService 使用内存索引检索"""
+
+    def test_similar_chapters_and_paragraphs(self):
+        """测试命中索引后只查询结果章节的信息，段落文本按序号切分"""
+        rows = make_rows(30, 4)
+        cache = VectorIndexCache(max_bytes=1 << 28, ttl=0)
+        query = decode(rows[7][3][2]).tolist()
+        service = EmbeddingService()
+        db = FakeDB(rows)
+        with mock.patch.object(vector_index, "_cache", cache), \
+                mock.patch.object(service, "generate_embedding", return_value=query):
+            chapters = service.find_similar_chapters(db, "n1", "查询", limit=3, similarity_threshold=0.0)
+            paragraphs = service.find_similar_paragraphs(db, "n1", "查询", limit=3, similarity_threshold=0.5)
+            service.find_similar_chapters(db, "n1", "查询", exclude_chapter_ids=["ch7"], limit=3, similarity_threshold=0.0)
+        self.assertEqual(chapters[0]["chapter_id"], "ch7")
+        self.assertEqual(chapters[0]["chapter_title"], "标题ch7")
+        self.assertEqual(chapters[0]["chunk_count"], 4)
+        self.assertEqual((paragraphs[0]["chapter_id"], paragraphs[0]["paragraph_index"]), ("ch7", 2))
+        self.assertAlmostEqual(paragraphs[0]["similarity"], 1.0, places=5)
+        self.assertTrue(paragraphs[0]["paragraph_text"])
+        # 一次载入 + 每次检索一次章节信息查询
+        self.assertEqual(sum("FROM chapter_embeddings" in q for q in db.queries), 1)
+        self.assertEqual(len(db.queries), 4)
+        print("   ✅ EmbeddingService 索引检索测试通过")
+
+
+SIZES = ((100, 10, 10), (1000, 50, 20), (10000, 500, 20))
+
+
+def time_index_search(chapters, per_chapter, repeats=50):
+    rows = make_rows(chapters, per_chapter)
+    started = time.perf_counter()
+    index = NovelVectorIndex.build("bench", rows)
+    build_ms = (time.perf_counter() - started) * 1000
+    query = np.random.default_rng(1).standard_normal(DIM).tolist()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        index.search_paragraphs(query, 10, 0.0)
+        index.search_chapters(query, 5, 0.0)
+    search_ms = (time.perf_counter() - started) * 1000 / repeats
+    return build_ms, search_ms
+
+
+class TestIndexBenchmark(unittest.TestCase):
+    """内存索引检索耗时"""
+
+    def test_search_latency(self):
+        """测试 10,000 个段落向量时一次章节 + 段落检索仍在毫秒级"""
+        for chunks, chapters, per_chapter in SIZES:
+            build_ms, search_ms = time_index_search(chapters, per_chapter)
+            print(f"   {chunks:>5} 个段落向量: 载入构建 {build_ms:.1f}ms, 每次检索 {search_ms:.2f}ms")
+        self.assertLess(search_ms, 50)
+        print("   ✅ 索引检索基准测试通过")
+
+
+def seed_temp_tables(db, rows):
+    """在会话临时表中写入基准数据（临时表优先于同名正式表，不影响已有数据）"""
+    from sqlalchemy import text
+
+    db.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    db.execute(text("CREATE TEMP TABLE volumes (id text PRIMARY KEY, novel_id text)"))
+    db.execute(text("CREATE TEMP TABLE chapters (id text PRIMARY KEY, volume_id text, title text, summary text, content text)"))
+    db.execute(text(
+        "CREATE TEMP TABLE chapter_embeddings (chapter_id text, novel_id text, full_content_embedding vector, "
+        "paragraph_embeddings vector[], chunk_count int)"
+    ))
+    db.execute(text("INSERT INTO volumes VALUES ('bench-v', 'bench')"))
+    literal = lambda v: "[" + ",".join(map(str, decode(v).tolist())) + "]"  # noqa: E731
+    for chapter_id, chunk_count, full, paragraphs in rows:
+        db.execute(
+            text("INSERT INTO chapters VALUES (:id, 'bench-v', :id, '', :content)"),
+            {"id": chapter_id, "content": "段落内容。" * 200},
+        )
+        db.execute(
+            text(
+                "INSERT INTO chapter_embeddings VALUES (:id, 'bench', CAST(:full AS vector), "
+                "CAST(:paragraphs AS vector[]), :chunk_count)"
+            ),
+            {
+                "id": chapter_id,
+                "full": literal(full),
+                "paragraphs": "{" + ",".join(f'"{literal(p)}"' for p in paragraphs) + "}",
+                "chunk_count": chunk_count,
+            },
+        )
+
+
+def main():
+    """与 pgvector 检索对比（需要 DATABASE_URL 指向安装了 pgvector 的 PostgreSQL）"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from core.config import DATABASE_URL
+
+    print("\n" + "=" * 60)
+    print("小说向量检索基准：pgvector vs 进程内索引（每轮 20 次章节 + 段落检索）")
+    print("=" * 60)
+    try:
+        engine = create_engine(DATABASE_URL)
+        engine.connect().close()
+    except Exception as e:
+        print(f"数据库不可用，仅测试进程内索引: {str(e).splitlines()[0]}")
+        for chunks, chapters, per_chapter in SIZES:
+            build_ms, search_ms = time_index_search(chapters, per_chapter)
+            print(f"{chunks:>5} 个段落向量: 载入构建 {build_ms:.1f}ms, 每次检索 {search_ms:.2f}ms")
+        return
+
+    query = np.random.default_rng(1).standard_normal(DIM).tolist()
+    rounds = 20
+    for chunks, chapters, per_chapter in SIZES:
+        db = sessionmaker(bind=engine)()
+        try:
+            seed_temp_tables(db, make_rows(chapters, per_chapter))
+            service = EmbeddingService()
+            timings = {}
+            for label, max_bytes in (("pgvector", 0), ("内存索引", 1 << 30)):
+                cache = VectorIndexCache(max_bytes=max_bytes, ttl=0)
+                with mock.patch.object(vector_index, "_cache", cache), \
+                        mock.patch.object(service, "generate_embedding", return_value=query):
+                    started = time.perf_counter()
+                    for _ in range(rounds):
+                        service.find_similar_chapters(db, "bench", "查询", limit=5, similarity_threshold=0.0)
+                        service.find_similar_paragraphs(db, "bench", "查询", limit=10, similarity_threshold=0.0)
+                    timings[label] = (time.perf_counter() - started) * 1000 / rounds
+            print(
+                f"{chunks:>5} 个段落向量: pgvector {timings['pgvector']:.1f}ms/轮 | "
+                f"内存索引 {timings['内存索引']:.1f}ms/轮（含首次载入）"
+            )
+        finally:
+            db.rollback()
+            db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -0,0 +1,272 @@
+"""
+进程内向量打分测试
+验证 vector_send 二进制解码、批量余弦相似度与 pgvector 结果一致，伏笔匹配与角色一致性检查只发起一次查询、
+章节只生成一次向量，并对比逐个候选 SQL 计算相似度与一次矩阵-向量乘积的查询数和耗时
+"""
+import math
+import os
+import struct
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import numpy as np  # noqa: E402
+
+from services.analysis.consistency_checker import ConsistencyChecker  # noqa: E402
+from services.analysis.foreshadowing_matcher import ForeshadowingMatcher  # noqa: E402
+from services.embedding.vector_ops import cosine_similarities, decode_vector, stack_vectors  # noqa: E402
+
+DIM = 768
+
+
+def vector_send(vector):
+    """按 pgvector 的 vector_send 格式编码"""
+    return struct.pack(">HH", len(vector), 0) + np.asarray(vector, dtype=">f4").tobytes()
+
+
+def vector_text(vector):
+    return "[" + ",".join(map(str, vector)) + "]"
+
+
+def pg_cosine(a, b):
+    """pgvector 的 1 - (a <=> b)"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeDB:
+    """按 SQL 内容返回候选行，记录查询次数；latency 模拟每次数据库往返的耗时"""
+
+    def __init__(self, foreshadowings=(), characters=(), latency=0.0):
+        self.foreshadowings = list(foreshadowings)
+        self.characters = list(characters)
+        self.latency = latency
+        self.queries = []
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        self.queries.append(sql)
+        if self.latency:
+            time.sleep(self.latency)
+        binary = "vector_send(" in sql
+        if "FROM foreshadowings" in sql:
+            return FakeResult([
+                (fid, content, "false", vector_send(vec) if binary else vector_text(vec))
+                for fid, content, vec in self.foreshadowings
+            ])
+        if "FROM character_embeddings" in sql:
+            wanted = set(params.get("character_ids") or [cid for cid, _, _ in self.characters])
+            return FakeResult([
+                (cid, name, vector_send(vec)) for cid, name, vec in self.characters if cid in wanted
+            ])
+        if "<=>" in sql:
+            a = decode_vector(params["chapter_embedding"])
+            b = decode_vector(params["foreshadowing_embedding"])
+            return FakeResult([(pg_cosine(a.tolist(), b.tolist()),)])
+        raise AssertionError(f"unexpected query: {sql}")
+
+
+class CountingEmbeddingService:
+    def __init__(self, vector):
+        self.vector = vector
+        self.calls = 0
+
+    def generate_embedding(self, text, task_type="RETRIEVAL_DOCUMENT"):
+        self.calls += 1
+        return self.vector
+
+
+def random_unit(rng, dim=DIM):
+    vector = rng.standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def near(rng, base, noise):
+    vector = np.asarray(base) + rng.standard_normal(len(base)) * noise
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def make_novel(foreshadowing_count=200, character_count=30, seed=7):
+    """章节向量与前几个伏笔、前一半角色相近，其余随机"""
+    rng = np.random.default_rng(seed)
+    chapter = random_unit(rng)
+    foreshadowings = [
+        (f"f{i}", f"伏笔{i}", near(rng, chapter, 0.02) if i < 3 else random_unit(rng))
+        for i in range(foreshadowing_count)
+    ]
+    characters = [
+        (f"c{i}", f"角色{i}", near(rng, chapter, 0.02) if i < character_count // 2 else random_unit(rng))
+        for i in range(character_count)
+    ]
+    return chapter, foreshadowings, characters
+
+
+def make_matcher(service):
+    matcher = ForeshadowingMatcher.__new__(ForeshadowingMatcher)
+    matcher.embedding_service = service
+    return matcher
+
+
+def make_checker(service):
+    checker = ConsistencyChecker.__new__(ConsistencyChecker)
+    checker.embedding_service = service
+    return checker
+
+
+class TestVectorOps(unittest.TestCase):
+    """测试向量解码与批量相似度"""
+
+    def test_decode_formats(self):
+        """测试二进制、文本、列表三种格式解码一致"""
+        vector = [0.5, -1.25, 3.0]
+        for value in (vector_send(vector), memoryview(vector_send(vector)), "[0.5,-1.25,3]", vector):
+            np.testing.assert_allclose(decode_vector(value), vector)
+        self.assertIsNone(decode_vector(None))
+        with self.assertRaises(ValueError):
+            decode_vector(vector_send(vector)[:-4])
+        print("   ✅ 向量解码测试通过")
+
+    def test_matches_pgvector_cosine(self):
+        """测试批量余弦相似度与 pgvector 逐个计算结果一致，零向量与空值跳过或记为 0"""
+        rng = np.random.default_rng(1)
+        rows = [random_unit(rng, 16) for _ in range(5)] + [[0.0] * 16]
+        query = random_unit(rng, 16)
+        matrix, indexes = stack_vectors([vector_send(r) for r in rows[:3]] + [None] + [vector_send(r) for r in rows[3:]])
+        self.assertEqual(indexes, [0, 1, 2, 4, 5, 6])
+        scores = cosine_similarities(matrix, query)
+        np.testing.assert_allclose(scores, [pg_cosine(r, query) for r in rows], atol=1e-5)
+        self.assertEqual(len(cosine_similarities(np.empty((0, 0), dtype=np.float32), query)), 0)
+        print("   ✅ 批量余弦相似度测试通过")
+
+
+class TestBatchAnalysis(unittest.TestCase):
+    """测试伏笔匹配与角色一致性检查的批量打分"""
+
+    def test_foreshadowing_single_query(self):
+        """测试伏笔匹配只发起一次查询，结果按相似度排序"""
+        chapter, foreshadowings, _ = make_novel()
+        db = FakeDB(foreshadowings=foreshadowings)
+        matches = make_matcher(CountingEmbeddingService(chapter)).match_foreshadowing_resolutions(
+            db, "n1", "ch1", "章节内容", similarity_threshold=0.75
+        )
+        self.assertEqual(len(db.queries), 1)
+        self.assertEqual({m["foreshadowing_id"] for m in matches}, {"f0", "f1", "f2"})
+        self.assertEqual([m["similarity"] for m in matches], sorted((m["similarity"] for m in matches), reverse=True))
+        print(f"   ✅ 伏笔批量匹配测试通过（{len(foreshadowings)} 个伏笔 1 次查询）")
+
+    def test_characters_share_one_embedding(self):
+        """测试批量角色检查只生成一次章节向量，单个角色检查结果格式不变"""
+        chapter, _, characters = make_novel(character_count=10)
+        service = CountingEmbeddingService(chapter)
+        checker = make_checker(service)
+        db = FakeDB(characters=characters)
+        results = checker.check_characters_consistency(db, "n1", "章节内容")
+        self.assertEqual(service.calls, 1)
+        self.assertEqual(len(db.queries), 1)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(sum(not r["consistent"] for r in results), 5)
+        self.assertFalse(results[0]["consistent"])
+
+        single = checker.check_character_consistency(db, "n1", "章节内容", "c0")
+        self.assertTrue(single["consistent"])
+        self.assertEqual(single["character_name"], "角色0")
+        self.assertEqual(single["threshold"], 0.7)
+        missing = checker.check_character_consistency(db, "n1", "章节内容", "nobody")
+        self.assertEqual(missing["score"], 1.0)
+        print("   ✅ 批量角色一致性测试通过")
+
+    def test_chapter_check_embeds_once(self):
+        """测试章节级批量检查：一次生成章节向量，角色与伏笔各一次查询"""
+        chapter, foreshadowings, characters = make_novel(character_count=6)
+        service = CountingEmbeddingService(chapter)
+        db = FakeDB(foreshadowings=foreshadowings, characters=characters)
+        result = make_checker(service).check_chapter_consistency(db, "n1", "ch1", "章节内容")
+        self.assertEqual(service.calls, 1)
+        self.assertEqual(len(db.queries), 2)
+        self.assertEqual(len(result["characters"]), 6)
+        self.assertEqual(sorted(result["inconsistent_characters"]), ["角色3", "角色4", "角色5"])
+        self.assertEqual(len(result["foreshadowings"]), 3)
+        print("   ✅ 章节批量检查测试通过")
+
+
+def legacy_match(db, chapter_embedding, novel_id, threshold=0.75):
+    """改造前的伏笔匹配：以文本取回向量，每个伏笔一次 SQL 计算相似度"""
+    rows = db.execute("SELECT f.id, f.content, f.is_resolved, fe.content_embedding FROM foreshadowings f", {"novel_id": novel_id}).fetchall()
+    chapter_str = vector_text(chapter_embedding)
+    matches = []
+    for row in rows:
+        similarity = db.execute(
+            "SELECT 1 - (CAST(:chapter_embedding AS vector) <=> CAST(:foreshadowing_embedding AS vector))",
+            {"chapter_embedding": chapter_str, "foreshadowing_embedding": str(row[3])},
+        ).fetchone()[0]
+        if similarity >= threshold:
+            matches.append(row[0])
+    return matches
+
+
+def run_benchmark(count, latency):
+    chapter, foreshadowings, _ = make_novel(foreshadowing_count=count)
+
+    db = FakeDB(foreshadowings=foreshadowings, latency=latency)
+    started = time.perf_counter()
+    legacy = legacy_match(db, chapter, "n1")
+    legacy_ms = (time.perf_counter() - started) * 1000
+    legacy_queries = len(db.queries)
+
+    db = FakeDB(foreshadowings=foreshadowings, latency=latency)
+    matcher = make_matcher(CountingEmbeddingService(chapter))
+    started = time.perf_counter()
+    batch = matcher.match_foreshadowing_resolutions(db, "n1", "ch1", "章节内容")
+    batch_ms = (time.perf_counter() - started) * 1000
+    return legacy, legacy_queries, legacy_ms, batch, len(db.queries), batch_ms
+
+
+class TestScoringBenchmark(unittest.TestCase):
+    """对比逐个候选 SQL 计算与批量矩阵运算"""
+
+    def test_batch_cuts_queries_and_latency(self):
+        """测试批量打分结果一致，查询数从 N+1 降为 1，耗时下降"""
+        legacy, legacy_queries, legacy_ms, batch, batch_queries, batch_ms = run_benchmark(200, latency=0.0002)
+        print(
+            f"   逐个 SQL 计算: {legacy_queries} 次查询, {legacy_ms:.1f}ms | "
+            f"批量矩阵运算: {batch_queries} 次查询, {batch_ms:.1f}ms"
+        )
+        self.assertEqual(sorted(legacy), sorted(m["foreshadowing_id"] for m in batch))
+        self.assertEqual(legacy_queries, 201)
+        self.assertEqual(batch_queries, 1)
+        self.assertLess(batch_ms * 5, legacy_ms)
+        print("   ✅ 批量打分基准测试通过")
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("伏笔匹配打分基准（每次数据库往返模拟 0.2ms）")
+    print("=" * 60)
+    for count in (50, 200, 1000):
+        _, legacy_queries, legacy_ms, _, batch_queries, batch_ms = run_benchmark(count, latency=0.0002)
+        print(
+            f"{count:>5} 个伏笔: 逐个 SQL {legacy_queries:>5} 次查询 {legacy_ms:>8.1f}ms | "
+            f"批量 {batch_queries} 次查询 {batch_ms:>6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unittest":
+        unittest.main(argv=sys.argv[:1])
+    else:
+        main()
@@ -1,24 +1,90 @@
 """Dependency injection helpers for API routers."""
 
 import logging
-from fastapi import Header, HTTPException
-from typing import Optional
+from fastapi import Header, HTTPException, Response
+from typing import List, Optional
 
 from app.config import settings
 from app.core.providers import get_provider, AIServiceProvider
+from app.core.rate_limiter import enable_rate_limit
+from app.core.response_cache import enable_response_cache
+from app.core.routing import RoutedProvider
+from app.core.single_flight import enable_single_flight
 
 logger = logging.getLogger(__name__)
 
 
+def _cache_bypassed(x_cache_bypass: Optional[str], cache_control: Optional[str]) -> bool:
+    """Whether the request asked to skip the response cache."""
+    if x_cache_bypass and x_cache_bypass.lower().strip() in {"1", "true", "yes"}:
+        return True
+    return bool(cache_control) and "no-cache" in cache_control.lower()
+
+
 async def get_ai_provider(
+    response: Response,
     x_provider: Optional[str] = Header(
         default=None,
         description="AI provider name (gemini, deepseek, claude, openai). If omitted, the backend DEFAULT_AI_PROVIDER is used."
-    )
+    ),
+    x_cache_bypass: Optional[str] = Header(
+        default=None,
+        description="Set to true to skip the response cache for this request."
+    ),
+    cache_control: Optional[str] = Header(default=None)
 ) -> AIServiceProvider:
-    """Resolve an AI service provider instance using the X-Provider header or the configured default."""
+    """Resolve an AI service provider instance using the X-Provider header or the configured default.
+
+    With ROUTING_ENABLED the requested provider comes first and the other configured
+    providers (ROUTING_PROVIDERS) serve as failover / hedge targets.
+    """
     provider_name = (x_provider or settings.DEFAULT_AI_PROVIDER).lower().strip()
+    use_cache = settings.RESPONSE_CACHE_ENABLED and not _cache_bypassed(x_cache_bypass, cache_control)
+
+    def build(name: str) -> AIServiceProvider:
+        return _build_provider(name, use_cache)
+
+    if not settings.ROUTING_ENABLED:
+        return build(provider_name)
+
+    # Validate the requested provider eagerly so configuration errors still surface as 4xx/5xx here
+    primary = build(provider_name)
+    return RoutedProvider(
+        _routing_candidates(provider_name),
+        build,
+        response=response,
+        providers={provider_name: primary}
+    )
+
+
+def _routing_candidates(requested: str) -> List[str]:
+    """The requested provider followed by other configured providers that have API keys."""
+    candidates = [requested]
+    for name in settings.ROUTING_PROVIDERS.split(","):
+        name = name.lower().strip()
+        if name and name not in candidates and _has_api_key(name):
+            candidates.append(name)
+    return candidates
+
+
+def _has_api_key(provider_name: str) -> bool:
+    return bool(getattr(settings, f"{provider_name.upper()}_API_KEY", None))
+
+
+def _build_provider(provider_name: str, use_cache: bool) -> AIServiceProvider:
+    """Create a provider and wrap its client: rate limit (innermost), single-flight, response cache."""
+    provider = _create_provider(provider_name)
+    if settings.RATE_LIMIT_ENABLED:
+        enable_rate_limit(provider, provider_name)
+    if settings.SINGLE_FLIGHT_ENABLED:
+        enable_single_flight(provider, provider_name)
+    if use_cache:
+        enable_response_cache(provider, provider_name)
+    return provider
+
 
+def _create_provider(provider_name: str) -> AIServiceProvider:
+    """Instantiate the named provider from settings."""
     try:
         if provider_name == "gemini":
             if not settings.GEMINI_API_KEY:
@@ -32,7 +98,11 @@ async def get_ai_provider(
                 api_key=settings.GEMINI_API_KEY,
                 proxy=settings.GEMINI_PROXY,
                 model=settings.GEMINI_MODEL,
-                timeout_ms=settings.GEMINI_TIMEOUT_MS
+                timeout_ms=settings.GEMINI_TIMEOUT_MS,
+                chapter_shard_size=settings.CHAPTER_OUTLINE_SHARD_SIZE,
+                chapter_shard_retries=settings.CHAPTER_OUTLINE_SHARD_RETRIES,
+                scene_max_scenes=settings.SCENE_DRAFT_MAX_SCENES,
+                scene_smoothing=settings.SCENE_DRAFT_SMOOTHING
             )
 
         if provider_name == "deepseek":
@@ -48,7 +118,11 @@ async def get_ai_provider(
                 proxy=settings.DEEPSEEK_PROXY,
                 base_url=settings.DEEPSEEK_BASE_URL,
                 model=settings.DEEPSEEK_MODEL,
-                timeout_ms=settings.DEEPSEEK_TIMEOUT_MS
+                timeout_ms=settings.DEEPSEEK_TIMEOUT_MS,
+                chapter_shard_size=settings.CHAPTER_OUTLINE_SHARD_SIZE,
+                chapter_shard_retries=settings.CHAPTER_OUTLINE_SHARD_RETRIES,
+                scene_max_scenes=settings.SCENE_DRAFT_MAX_SCENES,
+                scene_smoothing=settings.SCENE_DRAFT_SMOOTHING
             )
 
         if provider_name == "claude":
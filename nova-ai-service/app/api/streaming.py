@@ -0,0 +1,36 @@
+"""结构化流式响应"""
+
+import json
+import logging
+from typing import AsyncGenerator
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"  # 禁用 Nginx 缓冲
+}
+
+
+def structured_stream_response(stream: AsyncGenerator[str, None], label: str) -> StreamingResponse:
+    """把提供商的结构化流（item / scene / done / error 事件）包装为 SSE 响应
+
+    元素、场景事件本身就是完整的一项，不经过分片合并；出错时补发错误事件，客户端断开时关闭提供商流以终止上游生成。
+    """
+    async def stream_generator():
+        count = 0
+        try:
+            async for event in stream:
+                count += 1
+                yield event
+            logger.info(f"{label}流式生成完成 - 事件数: {count}")
+        except Exception as e:
+            logger.error(f"流式{label}失败: {str(e)}", exc_info=True)
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(stream_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -4,6 +4,7 @@ import logging
 from fastapi import APIRouter, Depends, HTTPException
 
 from app.api.dependencies import get_ai_provider
+from app.api.streaming import structured_stream_response
 from app.core.providers.base import AIServiceProvider
 from app.schemas.requests import (
     GenerateCharactersRequest,
@@ -82,6 +83,30 @@ async def generate_characters(
         )
 
 
+@router.post(
+    "/generate-characters-stream",
+    summary="流式生成角色列表",
+    description="生成角色列表，每项生成完即输出（返回 SSE 流，事件格式同 /chapter/generate-outline-stream）",
+    responses={
+        400: {"model": ErrorResponse, "description": "请求参数错误"},
+        500: {"model": ErrorResponse, "description": "服务器内部错误"},
+    },
+)
+async def generate_characters_stream(
+    request: GenerateCharactersRequest,
+    provider: AIServiceProvider = Depends(get_ai_provider),
+):
+    """流式生成角色列表"""
+    logger.info(f"开始流式生成角色列表 - 标题: {request.title}")
+    stream = provider.generate_characters_stream(
+        title=request.title,
+        genre=request.genre,
+        synopsis=request.synopsis,
+        outline=request.outline,
+    )
+    return structured_stream_response(stream, "角色列表")
+
+
 @router.post(
     "/generate-world-settings",
     response_model=WorldSettingsResponse,
@@ -128,6 +153,30 @@ async def generate_world_settings(
         )
 
 
+@router.post(
+    "/generate-world-settings-stream",
+    summary="流式生成世界观设定",
+    description="生成世界观设定，每项生成完即输出（返回 SSE 流，事件格式同 /chapter/generate-outline-stream）",
+    responses={
+        400: {"model": ErrorResponse, "description": "请求参数错误"},
+        500: {"model": ErrorResponse, "description": "服务器内部错误"},
+    },
+)
+async def generate_world_settings_stream(
+    request: GenerateWorldSettingsRequest,
+    provider: AIServiceProvider = Depends(get_ai_provider),
+):
+    """流式生成世界观设定"""
+    logger.info(f"开始流式生成世界观设定 - 标题: {request.title}")
+    stream = provider.generate_world_settings_stream(
+        title=request.title,
+        genre=request.genre,
+        synopsis=request.synopsis,
+        outline=request.outline,
+    )
+    return structured_stream_response(stream, "世界观设定")
+
+
 @router.post(
     "/generate-character-relations",
     response_model=CharacterRelationsResponse,
@@ -211,6 +260,30 @@ async def generate_timeline_events(
         )
 
 
+@router.post(
+    "/generate-timeline-stream",
+    summary="流式生成时间线事件",
+    description="生成时间线事件，每项生成完即输出（返回 SSE 流，事件格式同 /chapter/generate-outline-stream）",
+    responses={
+        400: {"model": ErrorResponse, "description": "请求参数错误"},
+        500: {"model": ErrorResponse, "description": "服务器内部错误"},
+    },
+)
+async def generate_timeline_events_stream(
+    request: GenerateTimelineEventsRequest,
+    provider: AIServiceProvider = Depends(get_ai_provider),
+):
+    """流式生成时间线事件"""
+    logger.info(f"开始流式生成时间线事件 - 标题: {request.title}")
+    stream = provider.generate_timeline_events_stream(
+        title=request.title,
+        genre=request.genre,
+        synopsis=request.synopsis,
+        outline=request.outline,
+    )
+    return structured_stream_response(stream, "时间线事件")
+
+
 @router.post(
     "/generate-foreshadowings",
     response_model=ForeshadowingsResponse,
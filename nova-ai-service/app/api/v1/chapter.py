@@ -5,11 +5,16 @@ from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 
 from app.api.dependencies import get_ai_provider
+from app.api.streaming import structured_stream_response
+from app.config import settings
+from app.core.prompt_cache import get_prompt_cache
 from app.core.providers.base import AIServiceProvider
+from app.core.stream_coalescer import coalesce_sse_events
 from app.schemas.requests import (
     GenerateChapterOutlineRequest,
     WriteChapterContentRequest,
     WriteChapterContentStreamRequest,
+    WriteChapterScenesRequest,
     SummarizeChapterRequest
 )
 from app.schemas.responses import (
@@ -25,6 +30,25 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/chapter", tags=["章节生成"])
 
 
+async def _acquire_prefix_cache(provider: AIServiceProvider, request):
+    """为章节请求获取稳定前缀的缓存句柄（未提供缓存键或未启用时返回 None）"""
+    if not settings.PROMPT_CACHE_ENABLED or not request.prompt_cache_key:
+        return None
+    prefix = provider.build_chapter_prompt_prefix(
+        novel_title=request.novel_title,
+        genre=request.genre,
+        synopsis=request.synopsis,
+        characters=request.characters,
+        world_settings=request.world_settings
+    )
+    return await get_prompt_cache().acquire(
+        provider,
+        key=request.prompt_cache_key,
+        prefix=prefix,
+        context_version=request.context_version
+    )
+
+
 @router.post(
     "/generate-outline",
     response_model=ChapterOutlineResponse,
@@ -90,6 +114,54 @@ async def generate_chapter_outline(
         )
 
 
+@router.post(
+    "/generate-outline-stream",
+    summary="流式生成章节列表",
+    description="根据卷大纲生成章节列表，每章生成完即输出（返回 SSE 流）",
+    responses={
+        200: {
+            "description": "成功返回流式响应",
+            "content": {
+                "text/event-stream": {
+                    "example": 'data: {"item": {"title": "...", "summary": "...", "aiPromptHints": "..."}, "index": 0}\n\n'
+                               'data: {"done": true, "count": 1, "skipped": 0}\n\n'
+                }
+            }
+        },
+        400: {"model": ErrorResponse, "description": "请求参数错误"},
+        500: {"model": ErrorResponse, "description": "服务器内部错误"}
+    }
+)
+async def generate_chapter_outline_stream(
+    request: GenerateChapterOutlineRequest,
+    provider: AIServiceProvider = Depends(get_ai_provider)
+):
+    """流式生成章节列表
+
+    Args:
+        request: 包含小说标题、完整大纲、卷信息等的请求
+        provider: AI 提供商实例（依赖注入）
+
+    Returns:
+        StreamingResponse: SSE 格式的流式响应，每章一个 item 事件
+    """
+    logger.info(f"开始流式生成章节列表 - 小说: {request.novel_title}, 卷: {request.volume_title}")
+    stream = provider.generate_chapter_outline_stream(
+        novel_title=request.novel_title,
+        genre=request.genre,
+        full_outline=request.full_outline,
+        volume_title=request.volume_title,
+        volume_summary=request.volume_summary,
+        volume_outline=request.volume_outline,
+        characters=request.characters,
+        volume_index=request.volume_index,
+        chapter_count=request.chapter_count,
+        previous_volumes_info=request.previous_volumes_info,
+        future_volumes_info=request.future_volumes_info
+    )
+    return structured_stream_response(stream, "章节列表")
+
+
 @router.post(
     "/write-content",
     response_model=ChapterContentResponse,
@@ -119,6 +191,7 @@ async def write_chapter_content(
     try:
         logger.info(f"开始生成章节内容 - 小说: {request.novel_title}, 章节: {request.chapter_title}")
 
+        cache_handle = await _acquire_prefix_cache(provider, request)
         content = await provider.write_chapter_content(
             novel_title=request.novel_title,
             genre=request.genre,
@@ -128,7 +201,8 @@ async def write_chapter_content(
             chapter_prompt_hints=request.chapter_prompt_hints,
             characters=request.characters,
             world_settings=request.world_settings,
-            previous_chapters_context=request.previous_chapters_context
+            previous_chapters_context=request.previous_chapters_context,
+            cache_handle=cache_handle
         )
 
         logger.info(f"章节内容生成成功 - 章节: {request.chapter_title}, 字数: {len(content)}")
@@ -178,21 +252,25 @@ async def write_chapter_content_stream(
     """
     try:
         logger.info(f"开始流式生成章节内容 - 小说: {request.novel_title}, 章节: {request.chapter_title}")
+        cache_handle = await _acquire_prefix_cache(provider, request)
 
         async def stream_generator():
             """流式生成器"""
+            stream = provider.write_chapter_content_stream(
+                novel_title=request.novel_title,
+                genre=request.genre,
+                synopsis=request.synopsis,
+                chapter_title=request.chapter_title,
+                chapter_summary=request.chapter_summary,
+                chapter_prompt_hints=request.chapter_prompt_hints,
+                characters=request.characters,
+                world_settings=request.world_settings,
+                previous_chapters_context=request.previous_chapters_context,
+                cache_handle=cache_handle
+            )
+            events = coalesce_sse_events(stream)
             try:
-                async for chunk in provider.write_chapter_content_stream(
-                    novel_title=request.novel_title,
-                    genre=request.genre,
-                    synopsis=request.synopsis,
-                    chapter_title=request.chapter_title,
-                    chapter_summary=request.chapter_summary,
-                    chapter_prompt_hints=request.chapter_prompt_hints,
-                    characters=request.characters,
-                    world_settings=request.world_settings,
-                    previous_chapters_context=request.previous_chapters_context
-                ):
+                async for chunk in events:
                     yield chunk
 
                 logger.info(f"章节内容流式生成完成 - 章节: {request.chapter_title}")
@@ -203,6 +281,10 @@ async def write_chapter_content_stream(
                 import json
                 error_data = json.dumps({"error": str(e)})
                 yield f"data: {error_data}\n\n"
+            finally:
+                # 客户端断开时 Starlette 会取消响应，这里显式关闭提供商流以终止上游生成
+                await events.aclose()
+                await stream.aclose()
 
         return StreamingResponse(
             stream_generator(),
@@ -222,6 +304,46 @@ async def write_chapter_content_stream(
         )
 
 
+@router.post(
+    "/write-content-scenes-stream",
+    summary="场景并行写作章节内容",
+    description="先规划场景，再并发写作各场景并润色交界，按场景顺序输出（返回 SSE 流）",
+    responses={
+        200: {
+            "description": "成功返回流式响应",
+            "content": {
+                "text/event-stream": {
+                    "example": 'data: {"plan": [...]}\n\ndata: {"scene": {"index": 0, "total": 3, "title": "..."}}\n\n'
+                               'data: {"chunk": "场景正文..."}\n\ndata: {"done": true, "mode": "scenes", "elapsed_ms": 41000}\n\n'
+                }
+            }
+        },
+        500: {"model": ErrorResponse, "description": "服务器内部错误"}
+    }
+)
+async def write_chapter_scenes_stream(
+    request: WriteChapterScenesRequest,
+    provider: AIServiceProvider = Depends(get_ai_provider)
+):
+    """场景并行写作章节内容（规划失败时退回整章流式生成，事件格式相同）"""
+    logger.info(f"开始场景并行写作 - 小说: {request.novel_title}, 章节: {request.chapter_title}")
+    cache_handle = await _acquire_prefix_cache(provider, request)
+    stream = provider.write_chapter_scenes_stream(
+        novel_title=request.novel_title,
+        genre=request.genre,
+        synopsis=request.synopsis,
+        chapter_title=request.chapter_title,
+        chapter_summary=request.chapter_summary,
+        chapter_prompt_hints=request.chapter_prompt_hints,
+        characters=request.characters,
+        world_settings=request.world_settings,
+        previous_chapters_context=request.previous_chapters_context,
+        cache_handle=cache_handle,
+        max_scenes=request.max_scenes
+    )
+    return structured_stream_response(stream, "场景并行章节")
+
+
 @router.post(
     "/summarize",
     response_model=ChapterSummaryResponse,
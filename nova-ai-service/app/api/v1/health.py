@@ -3,6 +3,12 @@
 import logging
 from fastapi import APIRouter
 
+from app.config import settings
+from app.core.prompt_cache import get_prompt_cache
+from app.core.rate_limiter import get_rate_limiter_stats
+from app.core.response_cache import get_response_cache
+from app.core.routing import get_provider_router
+from app.core.single_flight import get_single_flight
 from app.schemas.responses import HealthResponse
 
 logger = logging.getLogger(__name__)
@@ -29,3 +35,49 @@ async def health_check():
         service="nova-ai-service",
         version="1.0.0"
     )
+
+
+@router.get(
+    "/health/cache",
+    summary="缓存统计",
+    description="查看响应缓存、提示词前缀缓存与请求合并的命中情况"
+)
+async def cache_stats():
+    """缓存统计端点
+
+    Returns:
+        dict: 响应缓存（启用时）、前缀缓存与单飞合并的计数
+    """
+    return {
+        "response_cache": get_response_cache().snapshot() if settings.RESPONSE_CACHE_ENABLED else None,
+        "prompt_cache": get_prompt_cache().snapshot(),
+        "single_flight": get_single_flight().snapshot(),
+    }
+
+
+@router.get(
+    "/health/rate-limits",
+    summary="上游限流指标",
+    description="查看每个 (提供商, 模型, Key) 的当前限额、并发与排队等待时间"
+)
+async def rate_limit_stats():
+    """上游限流指标端点
+
+    Returns:
+        dict: 各限流器的并发上限、当前速率、限流次数与排队等待
+    """
+    return {"limiters": get_rate_limiter_stats()}
+
+
+@router.get(
+    "/health/routing",
+    summary="提供商路由指标",
+    description="查看各提供商的健康度、熔断状态、延迟分位数以及故障转移/对冲计数"
+)
+async def routing_stats():
+    """提供商路由指标端点
+
+    Returns:
+        dict: 路由计数、延迟预算与各提供商健康快照
+    """
+    return get_provider_router().snapshot()
@@ -6,6 +6,7 @@ from fastapi.responses import StreamingResponse
 
 from app.api.dependencies import get_ai_provider
 from app.core.providers.base import AIServiceProvider
+from app.core.stream_coalescer import coalesce_sse_events
 from app.schemas.requests import (
     GenerateFullOutlineRequest,
     GenerateVolumeOutlineRequest,
@@ -162,15 +163,17 @@ async def generate_volume_outline_stream(
 
         async def stream_generator():
             """流式生成器"""
+            stream = provider.generate_volume_outline_stream(
+                novel_title=request.novel_title,
+                full_outline=request.full_outline,
+                volume_title=request.volume_title,
+                volume_summary=request.volume_summary,
+                characters=request.characters,
+                volume_index=request.volume_index
+            )
+            events = coalesce_sse_events(stream)
             try:
-                async for chunk in provider.generate_volume_outline_stream(
-                    novel_title=request.novel_title,
-                    full_outline=request.full_outline,
-                    volume_title=request.volume_title,
-                    volume_summary=request.volume_summary,
-                    characters=request.characters,
-                    volume_index=request.volume_index
-                ):
+                async for chunk in events:
                     yield chunk
 
                 logger.info(f"卷大纲流式生成完成 - 卷: {request.volume_title}")
@@ -181,6 +184,10 @@ async def generate_volume_outline_stream(
                 import json
                 error_data = json.dumps({"error": str(e)})
                 yield f"data: {error_data}\n\n"
+            finally:
+                # 客户端断开时 Starlette 会取消响应，这里显式关闭提供商流以终止上游生成
+                await events.aclose()
+                await stream.aclose()
 
         return StreamingResponse(
             stream_generator(),
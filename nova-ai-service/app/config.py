@@ -34,6 +34,65 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_MODEL: Optional[str] = "gpt-4"
 
+    # Prompt prefix caching (provider-side context cache)
+    PROMPT_CACHE_ENABLED: bool = True
+    PROMPT_CACHE_TTL_SECONDS: int = 3600
+    PROMPT_CACHE_MAX_ENTRIES: int = 256
+
+    # Response cache (opt-in): identical deterministic prompts (temperature 0, summaries, extraction) are answered from cache
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_TTL_SECONDS: int = 86400
+    RESPONSE_CACHE_MEMORY_MAX_ENTRIES: int = 512
+    RESPONSE_CACHE_DB_PATH: str = "data/response_cache.sqlite3"
+    RESPONSE_CACHE_DB_MAX_MB: int = 256
+
+    # Coalesce concurrent identical upstream requests (single-flight)
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    # Adaptive upstream rate limiting per (provider, model, API key)
+    # "name:requests_per_second:burst:max_concurrency", name is provider or provider/model
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMITS: str = "default:2:5:4,gemini:2:5:4,deepseek:2:5:4"
+    # Shared SQLite token buckets for multiple workers (empty keeps buckets in process memory).
+    # The file is local, so it only coordinates workers on one host; with several hosts each
+    # host enforces RATE_LIMITS on its own, so divide the limits by the number of hosts.
+    RATE_LIMIT_DB_PATH: str = ""
+    RATE_LIMIT_MAX_WAIT_SECONDS: float = 120
+
+    # Provider routing: latency budgets, health scoring, circuit breakers, failover and hedging
+    ROUTING_ENABLED: bool = True
+    # Failover order after the requested provider (only providers with an API key are used)
+    ROUTING_PROVIDERS: str = "gemini,deepseek"
+    # Per-operation latency budget in seconds ("operation:seconds"); streams budget the first chunk.
+    # Exceeding it starts the next provider without cancelling the slow attempt (first success wins);
+    # the last candidate has no budget and is bounded only by the provider timeout (GEMINI_TIMEOUT_MS etc.)
+    ROUTING_LATENCY_BUDGETS: str = (
+        "extract_next_chapter_hook:30,summarize_chapter_content:45,"
+        "write_chapter_content_stream:60,generate_volume_outline_stream:60,"
+        "write_chapter_content:240,default:180"
+    )
+    ROUTING_BREAKER_FAILURES: int = 5
+    ROUTING_BREAKER_OPEN_SECONDS: float = 30
+    # Hedged requests: send a delayed duplicate to the next provider, first success wins
+    ROUTING_HEDGE_ENABLED: bool = False
+    ROUTING_HEDGE_OPERATIONS: str = "extract_next_chapter_hook,summarize_chapter_content"
+    # Hedge delay used until the primary has latency samples (then its p95 is used)
+    ROUTING_HEDGE_DELAY_MS: int = 3000
+
+    # Chapter-list sharding: volumes with more chapters than the shard size are generated
+    # as concurrent shards (chapters 1-10, 11-20, ...) and merged (0 disables)
+    CHAPTER_OUTLINE_SHARD_SIZE: int = 10
+    # Retries for a failed or short shard before the whole request fails
+    CHAPTER_OUTLINE_SHARD_RETRIES: int = 2
+
+    # Scene-parallel chapter drafting (opt-in per request): plan scenes, draft them concurrently, smooth joins
+    SCENE_DRAFT_MAX_SCENES: int = 4
+    SCENE_DRAFT_SMOOTHING: bool = True
+
+    # Stream coalescing: merge chunk events within a time window (0 sends every chunk)
+    STREAM_COALESCE_WINDOW_MS: int = 40
+    STREAM_COALESCE_MAX_BYTES: int = 4096
+
     # Logging
     LOG_LEVEL: str = "INFO"
     LOG_FORMAT: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -0,0 +1,115 @@
+"""章节列表分片生成
+
+一卷 40~50 章的章节列表一次生成时，耗时随输出长度线性增长，且模型输出的 JSON 只要有一处损坏就整卷作废。
+章节数超过分片大小时按连续区间拆成若干分片（如 1-10、11-20 章）并发生成：
+- 每个分片都拿到完整的卷大纲，外加简短的边界提示：全卷章节数、本分片对应的情节进度区间、
+  前后分片各自负责的区间，以及开篇/收束/承接等约束，避免分片之间重复或跳过情节
+- 各分片独立解析（宽容解析，坏元素跳过），失败或章节数不足的分片单独重试，不影响其他分片
+- 按分片顺序合并，去掉模型写进标题的章节编号，由系统统一编号
+整卷耗时接近单个分片的耗时（并发数仍受上游限流器约束）。
+"""
+
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+from app.core.json_stream import IncrementalArrayParser
+
+_CHAPTER_PREFIX_PATTERN = re.compile(r'^\s*第\s*[0-9一二三四五六七八九十百千]+\s*章\s*[:：\-—\.\s]*')
+_NUMBER_PREFIX_PATTERN = re.compile(r'^\s*\d+\s*[\.\-：:、\s]+')
+
+
+@dataclass(frozen=True)
+class ChapterShard:
+    """一个分片：全卷第 start~end 章（从 1 开始，含两端）"""
+    index: int
+    start: int
+    end: int
+    total: int
+
+    @property
+    def count(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def label(self) -> str:
+        return f"第 {self.start}-{self.end} 章"
+
+    def progress(self) -> str:
+        """本分片对应的卷大纲情节进度区间（按章节位置折算）"""
+        low = round((self.start - 1) * 100 / self.total)
+        high = round(self.end * 100 / self.total)
+        return f"{low}%-{high}%"
+
+
+def plan_shards(chapter_count: Any, shard_size: int) -> List[ChapterShard]:
+    """
+    按分片大小拆分章节区间，各分片章节数尽量均匀（23 章、分片 10 → 8/8/7）
+
+    章节数未知、分片大小 <= 0 或章节数不超过分片大小时返回空列表（不分片）。
+    """
+    if not chapter_count or shard_size <= 0 or chapter_count <= shard_size:
+        return []
+    shard_count = math.ceil(chapter_count / shard_size)
+    base, extra = divmod(chapter_count, shard_count)
+    shards = []
+    start = 1
+    for index in range(shard_count):
+        count = base + (1 if index < extra else 0)
+        shards.append(ChapterShard(index=index, start=start, end=start + count - 1, total=chapter_count))
+        start += count
+    return shards
+
+
+def build_shard_instruction(shard: ChapterShard, shards: List[ChapterShard]) -> str:
+    """分片的生成要求与边界提示（替换整卷提示词中的章节数要求）"""
+    lines = [
+        f"本卷共 {shard.total} 章，分为 {len(shards)} 段并行生成。你只负责{shard.label}（共 {shard.count} 章），"
+        f"必须恰好返回 {shard.count} 个章节。",
+        "",
+        "【分段边界】",
+        f"- 本段对应卷详细大纲中约 {shard.progress()} 的情节进度，只写这一段的情节",
+    ]
+    if shard.index > 0:
+        previous = shards[shard.index - 1]
+        lines.append(f"- 前一段（{previous.label}）已覆盖约 {previous.progress()} 的情节，不要重复")
+        lines.append(
+            f"- 第 {shard.start} 章紧接第 {shard.start - 1} 章继续推进，不要重新开篇或重新介绍背景"
+            f"（“第1章必须承接上一卷”的要求只针对全卷第 1 章）"
+        )
+    else:
+        lines.append("- 第 1 章为本卷开篇")
+    if shard.index < len(shards) - 1:
+        following = shards[shard.index + 1]
+        lines.append(f"- 后一段（{following.label}）负责约 {following.progress()} 的情节，不要提前写")
+        lines.append(f"- 第 {shard.end} 章不要收束本卷主线，为后续章节留出推进空间")
+    else:
+        lines.append(f"- 第 {shard.end} 章为本卷收束，闭合本卷主要冲突")
+    lines.append("- 主线情节不足时可补充本段范围内的支线章节，使章节数达到要求")
+    return "\n".join(lines)
+
+
+def parse_shard_chapters(text: str) -> List[Dict[str, Any]]:
+    """宽容解析分片结果：取顶层数组（或 chapters 键下的数组）中的对象，无法解析的元素跳过"""
+    parser = IncrementalArrayParser("chapters")
+    items = parser.feed(text or "") + parser.close()
+    return [item for item in items if isinstance(item, dict) and (item.get("title") or item.get("summary"))]
+
+
+def normalize_chapter_title(raw_title: Any, number: int) -> str:
+    """去掉模型写进标题的“第X章”/序号前缀（分片内的编号与全卷编号不一致），空标题回退为章号"""
+    title = str(raw_title or "").strip()
+    if title:
+        title = _CHAPTER_PREFIX_PATTERN.sub('', title).strip()
+        title = _NUMBER_PREFIX_PATTERN.sub('', title).strip()
+    return title or f"第{number}章"
+
+
+def merge_shards(results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """按分片顺序合并并统一编号"""
+    chapters = []
+    for items in results:
+        for item in items:
+            chapters.append({**item, "title": normalize_chapter_title(item.get("title"), len(chapters) + 1)})
+    return chapters
@@ -0,0 +1,165 @@
+"""结构化输出的增量 JSON 解析
+
+章节列表、角色、世界观、时间线等结构化生成原本要等模型输出完整个 JSON 才能 json.loads，
+50 章的章节列表会在一分钟内毫无反馈，然后一次性全部出现。这里边接收流式分片边扫描：
+- 定位要输出的数组（顶层数组，或顶层对象中指定键的数组；前面的说明文字、```json 围栏会被跳过）
+- 逐字符跟踪字符串、转义与嵌套深度，数组元素一闭合就解码输出，不等后面的逗号或整个数组结束
+- 解码宽容：允许字符串内的控制字符和多余的尾逗号；仍无法解码的元素跳过并计数，不影响后续元素
+- 已输出的内容从缓冲区丢弃，总扫描量与输出长度成正比
+
+提供商把每个元素包装成 `data: {"item": ..., "index": n}` 事件，最后发送 `data: {"done": true, "count": n}`。
+"""
+
+import json
+import logging
+import re
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_WHITESPACE = " \t\r\n"
+
+
+def _decode(text: str) -> Any:
+    """宽容地解码单个数组元素，失败抛出 ValueError"""
+    try:
+        return json.loads(text, strict=False)
+    except ValueError:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", text), strict=False)
+
+
+class IncrementalArrayParser:
+    """从流式文本中逐个解析出 JSON 数组的元素"""
+
+    def __init__(self, key: Optional[str] = None):
+        """
+        Args:
+            key: 数组所在的顶层键（如 "chapters"）；None 表示取第一个数组。
+                 指定了键但模型直接返回了数组时同样可以解析。
+        """
+        self.key = key
+        self._key_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key)) if key else None
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start: Optional[int] = None
+        self.finished = False
+        self.count = 0
+        self.skipped = 0
+
+    def _seek(self) -> bool:
+        """定位数组起点；找到后 _pos 指向 '[' 之后"""
+        if self._key_pattern is not None:
+            match = self._key_pattern.search(self._buffer)
+            if match:
+                self._pos = match.end()
+                return True
+            first = re.search(r"[\[{]", self._buffer)
+            if first is None or first.group() != "[":
+                return False
+            self._pos = first.end()
+            return True
+        index = self._buffer.find("[")
+        if index < 0:
+            return False
+        self._pos = index + 1
+        return True
+
+    def _emit(self, text: str, items: List[Any]) -> None:
+        text = text.strip()
+        if not text:
+            return
+        try:
+            items.append(_decode(text))
+            self.count += 1
+        except ValueError:
+            self.skipped += 1
+            logger.warning(f"⚠️  跳过无法解析的数组元素: {text[:80]}")
+
+    def feed(self, text: str) -> List[Any]:
+        """追加一段流式文本，返回本次新闭合的元素"""
+        items: List[Any] = []
+        if self.finished or not text:
+            return items
+        self._buffer += text
+        if not self._started:
+            if not self._seek():
+                return items
+            self._started = True
+            self._depth = 1
+
+        buffer = self._buffer
+        pos = self._pos
+        end = len(buffer)
+        while pos < end:
+            char = buffer[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._item_start is None:
+                    self._item_start = pos
+            elif char in "{[":
+                if self._depth == 1 and self._item_start is None:
+                    self._item_start = pos
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._item_start is not None:
+                    # 对象/数组元素闭合即输出
+                    self._emit(buffer[self._item_start:pos + 1], items)
+                    self._item_start = None
+                elif self._depth == 0:
+                    if self._item_start is not None:
+                        self._emit(buffer[self._item_start:pos], items)
+                        self._item_start = None
+                    self.finished = True
+                    pos += 1
+                    break
+            elif self._depth == 1:
+                if char == ",":
+                    if self._item_start is not None:
+                        self._emit(buffer[self._item_start:pos], items)
+                        self._item_start = None
+                elif char not in _WHITESPACE and self._item_start is None:
+                    self._item_start = pos
+            pos += 1
+
+        # 丢弃已处理的内容，只保留未闭合的元素
+        keep = self._item_start if self._item_start is not None else pos
+        self._buffer = buffer[keep:]
+        self._pos = pos - keep
+        if self._item_start is not None:
+            self._item_start = 0
+        return items
+
+    def close(self) -> List[Any]:
+        """输入结束：输出仍未以逗号结束的标量元素；被截断的对象计为跳过"""
+        items: List[Any] = []
+        if self._started and not self.finished and self._item_start is not None:
+            if self._depth == 1 and not self._in_string:
+                self._emit(self._buffer[self._item_start:], items)
+            else:
+                self.skipped += 1
+                logger.warning("⚠️  输出被截断，最后一个数组元素不完整")
+        self.finished = True
+        return items
+
+
+def item_event(item: Any, index: int) -> str:
+    """单个元素的 SSE 事件"""
+    return f"data: {json.dumps({'item': item, 'index': index}, ensure_ascii=False)}\n\n"
+
+
+def done_event(count: int, skipped: int = 0) -> str:
+    """结构化流的完成事件"""
+    return f"data: {json.dumps({'done': True, 'count': count, 'skipped': skipped})}\n\n"
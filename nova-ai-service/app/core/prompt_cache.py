@@ -0,0 +1,185 @@
+"""提示词前缀缓存
+
+批量写章节时，每章提示词的前半部分（小说标题、简介、角色、世界观、创作要求）完全相同，
+只有章节相关的尾部不同。这里把稳定前缀登记到提供商的上下文缓存（如 Gemini cached content），
+并按 (提供商, 模型, 缓存键) 复用；上下文版本或前缀内容变化时自动刷新。
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 前缀缓存创建失败后，同一版本在这段时间内不再重试（避免每章都撞同一个失败）
+CREATE_RETRY_SECONDS = 300
+
+
+@dataclass
+class PromptCacheHandle:
+    """前缀缓存句柄，传给提供商的生成方法
+
+    Attributes:
+        key: 调用方给出的缓存键（通常是小说 ID）
+        version: 上下文版本 + 前缀摘要
+        provider_ref: 提供商侧缓存引用（如 Gemini 的 cachedContents/xxx）
+        expires_at: 过期时间戳（秒）
+        failed_at: 最近一次创建失败的时间戳（秒），退避期过后才重试
+        delete_remote: 创建该缓存的提供商的删除方法；路由或故障转移后当前调用方可能是另一个提供商
+    """
+    key: str
+    version: str
+    provider_ref: Optional[str] = None
+    expires_at: float = 0.0
+    hits: int = 0
+    failed_at: float = 0.0
+    delete_remote: Optional[Callable[[str], Awaitable[Any]]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def usable(self) -> bool:
+        """提供商侧缓存存在且未临近过期"""
+        return bool(self.provider_ref) and self.expires_at - time.time() > 30
+
+
+def prefix_version(prefix: str, context_version: Optional[str] = None) -> str:
+    """由上下文版本和前缀内容计算缓存版本（前缀有任何变化都会得到新版本）"""
+    digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+    return f"{context_version}:{digest}" if context_version else digest
+
+
+class PromptPrefixCache:
+    """进程内的前缀缓存登记表
+
+    提供商实例按请求创建，缓存句柄需要跨请求复用，因此登记表是进程级单例。
+    """
+
+    def __init__(self, ttl_seconds: int = 3600, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str], PromptCacheHandle]" = OrderedDict()
+        # 每个缓存键一把锁，只在有协程持有或等待时存在（弱引用），登记表不随历史键无限增长
+        self._locks: "weakref.WeakValueDictionary[Tuple[str, str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.stats = {"hits": 0, "creates": 0, "refreshes": 0, "failures": 0}
+
+    @staticmethod
+    def _entry_key(provider, key: str) -> Tuple[str, str, str]:
+        # 路由代理（RoutedProvider）按其首选提供商登记，提供商内部失效时才能对上同一个键
+        provider = getattr(provider, "primary", provider)
+        return (type(provider).__name__, str(getattr(provider, "model", "")), key)
+
+    async def acquire(
+        self,
+        provider,
+        key: str,
+        prefix: str,
+        context_version: Optional[str] = None
+    ) -> Optional[PromptCacheHandle]:
+        """获取可用的前缀缓存句柄，必要时在提供商侧创建或刷新
+
+        Args:
+            provider: AIServiceProvider 实例
+            key: 缓存键
+            prefix: 稳定前缀文本
+            context_version: 调用方的上下文版本（可选）
+
+        Returns:
+            可用句柄；提供商不支持或创建失败时返回 None（调用方应发送完整提示词）
+        """
+        if not key or not prefix:
+            return None
+
+        entry_key = self._entry_key(provider, key)
+        version = prefix_version(prefix, context_version)
+        lock = self._locks.get(entry_key)
+        if lock is None:
+            lock = self._locks[entry_key] = asyncio.Lock()
+
+        async with lock:
+            handle = self._entries.get(entry_key)
+            if handle and handle.version == version and handle.usable:
+                handle.hits += 1
+                self.stats["hits"] += 1
+                self._entries.move_to_end(entry_key)
+                return handle
+
+            if (
+                handle and handle.version == version and not handle.provider_ref
+                and time.time() - handle.failed_at < CREATE_RETRY_SECONDS
+            ):
+                # 同一版本刚创建失败（提供商不支持、前缀过短或临时错误），退避期内不重复尝试
+                return None
+
+            if handle and handle.provider_ref:
+                self.stats["refreshes"] += 1
+                await self._delete_remote(handle)
+
+            provider_ref = None
+            try:
+                provider_ref = await provider.create_prefix_cache(prefix, self.ttl_seconds)
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.warning(f"⚠️  创建前缀缓存失败（使用完整提示词）: {str(e)}")
+
+            now = time.time()
+            handle = PromptCacheHandle(
+                key=key,
+                version=version,
+                provider_ref=provider_ref,
+                expires_at=now + self.ttl_seconds,
+                failed_at=0.0 if provider_ref else now,
+                delete_remote=getattr(provider, "delete_prefix_cache", None),
+            )
+            self._entries[entry_key] = handle
+            self._entries.move_to_end(entry_key)
+            await self._evict()
+
+            if not provider_ref:
+                return None
+            self.stats["creates"] += 1
+            logger.info(f"✅ 前缀缓存已创建: key={key}, version={version}, ref={provider_ref}")
+            return handle
+
+    def invalidate(self, provider, key: str) -> None:
+        """丢弃某个缓存键的句柄（例如提供商侧缓存已失效）"""
+        self._entries.pop(self._entry_key(provider, key), None)
+
+    async def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            _, old = self._entries.popitem(last=False)
+            if old.provider_ref:
+                await self._delete_remote(old)
+
+    @staticmethod
+    async def _delete_remote(handle: PromptCacheHandle) -> None:
+        """通过创建该缓存的提供商删除提供商侧缓存"""
+        if handle.delete_remote is None:
+            return
+        try:
+            await handle.delete_remote(handle.provider_ref)
+        except Exception as e:
+            logger.debug(f"删除前缀缓存失败（忽略）: {str(e)}")
+
+    def snapshot(self) -> Dict[str, int]:
+        """缓存统计"""
+        return {**self.stats, "entries": len(self._entries)}
+
+
+_prompt_cache: Optional[PromptPrefixCache] = None
+
+
+def get_prompt_cache() -> PromptPrefixCache:
+    """获取进程级前缀缓存登记表（单例）"""
+    global _prompt_cache
+    if _prompt_cache is None:
+        _prompt_cache = PromptPrefixCache(
+            ttl_seconds=settings.PROMPT_CACHE_TTL_SECONDS,
+            max_entries=settings.PROMPT_CACHE_MAX_ENTRIES,
+        )
+    return _prompt_cache
@@ -1,9 +1,22 @@
 """AI 服务提供商抽象基类"""
 
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, Optional, List, Dict, Any, Callable
+from typing import AsyncGenerator, Awaitable, Optional, List, Dict, Any, Callable, TYPE_CHECKING
 from enum import Enum
 
+from app.core.json_stream import done_event, item_event
+
+if TYPE_CHECKING:
+    from app.core.prompt_cache import PromptCacheHandle
+
+
+async def _items_as_events(result: Awaitable[List[Dict]]) -> AsyncGenerator[str, None]:
+    """把非流式的列表结果转换为结构化流事件"""
+    items = await result
+    for index, item in enumerate(items):
+        yield item_event(item, index)
+    yield done_event(len(items))
+
 
 class StreamMode(str, Enum):
     """流式响应模式"""
@@ -17,6 +30,9 @@ class AIServiceProvider(ABC):
     所有 AI 提供商（Gemini、Claude、OpenAI等）都必须实现这个接口
     """
 
+    # 客户端是否为同步阻塞调用（路由层会把这类提供商的调用放到工作线程执行，避免阻塞事件循环）
+    blocking_client: bool = False
+
     def __init__(self, api_key: str, proxy: Optional[str] = None, **kwargs):
         """初始化 AI 服务提供商
 
@@ -153,6 +169,14 @@ class AIServiceProvider(ABC):
         """
         pass
 
+    async def generate_chapter_outline_stream(self, **kwargs) -> AsyncGenerator[str, None]:
+        """流式生成章节列表，每章一个 `data: {"item": ..., "index": n}` 事件，最后为完成事件
+
+        参数同 generate_chapter_outline。默认实现等待完整结果后逐项输出；支持流式的提供商应覆盖此方法。
+        """
+        async for event in _items_as_events(self.generate_chapter_outline(**kwargs)):
+            yield event
+
     @abstractmethod
     async def modify_outline_by_dialogue(
         self,
@@ -188,7 +212,8 @@ class AIServiceProvider(ABC):
         chapter_prompt_hints: str,
         characters: List[Dict],
         world_settings: List[Dict],
-        previous_chapters_context: Optional[str] = None
+        previous_chapters_context: Optional[str] = None,
+        cache_handle: Optional["PromptCacheHandle"] = None
     ) -> AsyncGenerator[str, None]:
         """流式生成章节内容
 
@@ -202,6 +227,7 @@ class AIServiceProvider(ABC):
             characters: 角色列表
             world_settings: 世界观设定列表
             previous_chapters_context: 前面章节的上下文（可选）
+            cache_handle: 稳定前缀的缓存句柄（可选，见 build_chapter_prompt_prefix）
 
         Yields:
             SSE 格式的字符串: "data: {json}\\n\\n"
@@ -219,7 +245,8 @@ class AIServiceProvider(ABC):
         chapter_prompt_hints: str,
         characters: List[Dict],
         world_settings: List[Dict],
-        previous_chapters_context: Optional[str] = None
+        previous_chapters_context: Optional[str] = None,
+        cache_handle: Optional["PromptCacheHandle"] = None
     ) -> str:
         """生成章节内容（非流式）
 
@@ -231,6 +258,51 @@ class AIServiceProvider(ABC):
         """
         pass
 
+    async def write_chapter_scenes_stream(
+        self,
+        max_scenes: Optional[int] = None,
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """场景并行写作（流式，参数同 write_chapter_content_stream）
+
+        默认退回整章生成；支持的提供商先规划场景，再并发写作各场景，按顺序输出
+        data: {"scene": {...}} 与该场景的 data: {"chunk": "..."}。
+        """
+        async for event in self.write_chapter_content_stream(**kwargs):
+            yield event
+
+    # ==================== 提示词前缀缓存 ====================
+
+    def build_chapter_prompt_prefix(
+        self,
+        novel_title: str,
+        genre: str,
+        synopsis: str,
+        characters: List[Dict],
+        world_settings: List[Dict]
+    ) -> str:
+        """构建章节提示词中跨章节不变的前缀
+
+        返回空字符串表示该提供商不做前缀拆分。
+        """
+        return ""
+
+    async def create_prefix_cache(self, prefix: str, ttl_seconds: int) -> Optional[str]:
+        """在提供商侧登记稳定前缀
+
+        Args:
+            prefix: 前缀文本
+            ttl_seconds: 缓存有效期（秒）
+
+        Returns:
+            提供商侧缓存引用；不支持上下文缓存时返回 None
+        """
+        return None
+
+    async def delete_prefix_cache(self, provider_ref: str) -> None:
+        """删除提供商侧的前缀缓存"""
+        return None
+
     @abstractmethod
     async def summarize_chapter_content(
         self,
@@ -321,6 +393,21 @@ class AIServiceProvider(ABC):
         """
         pass
 
+    async def generate_characters_stream(self, **kwargs) -> AsyncGenerator[str, None]:
+        """流式生成角色列表（事件格式同 generate_chapter_outline_stream，参数同 generate_characters）"""
+        async for event in _items_as_events(self.generate_characters(**kwargs)):
+            yield event
+
+    async def generate_world_settings_stream(self, **kwargs) -> AsyncGenerator[str, None]:
+        """流式生成世界观设定（事件格式同 generate_chapter_outline_stream，参数同 generate_world_settings）"""
+        async for event in _items_as_events(self.generate_world_settings(**kwargs)):
+            yield event
+
+    async def generate_timeline_events_stream(self, **kwargs) -> AsyncGenerator[str, None]:
+        """流式生成时间线事件（事件格式同 generate_chapter_outline_stream，参数同 generate_timeline_events）"""
+        async for event in _items_as_events(self.generate_timeline_events(**kwargs)):
+            yield event
+
     @abstractmethod
     async def generate_character_relations(
         self,
@@ -155,6 +155,9 @@ class DeepSeekClient:
 class DeepSeekProvider(GeminiProvider):
     """Provider that reuses the Gemini plan but routes requests to DeepSeek."""
 
+    # DeepSeekClient is async (httpx.AsyncClient), so calls can stay on the event loop
+    blocking_client = False
+
     def __init__(
         self,
         api_key: str,
@@ -176,3 +179,10 @@ class DeepSeekProvider(GeminiProvider):
             timeout=self.timeout_ms / 1000
         )
         logger.info(f"DeepSeek client initialized (model={self.model}, base_url={self.base_url})")
+
+    async def create_prefix_cache(self, prefix: str, ttl_seconds: int) -> Optional[str]:
+        """DeepSeek caches repeated prompt prefixes on its side automatically; nothing to register."""
+        return None
+
+    async def delete_prefix_cache(self, provider_ref: str) -> None:
+        return None
@@ -1,15 +1,60 @@
 """Gemini AI 服务提供商实现"""
 
+import asyncio
+import inspect
 import os
 import json
 import logging
-from typing import Optional, AsyncGenerator, List, Dict, Any, Callable
+import time
+from typing import Optional, AsyncGenerator, List, Dict, Any, Callable, Tuple
 from google import genai
 
+from app.config import settings
+from app.core.chapter_shards import (
+    ChapterShard,
+    build_shard_instruction,
+    merge_shards,
+    normalize_chapter_title,
+    parse_shard_chapters,
+    plan_shards,
+)
+from app.core.json_stream import IncrementalArrayParser, done_event, item_event
 from app.core.providers.base import AIServiceProvider
+from app.core.prompt_cache import PromptCacheHandle, get_prompt_cache
+from app.core.response_cache import cacheable_response
+from app.core.scene_drafting import (
+    build_beat_plan_prompt,
+    build_scene_instruction,
+    build_transition_prompt,
+    clean_scene_text,
+    join_scene,
+    parse_beat_plan,
+    parse_transition,
+)
 
 logger = logging.getLogger(__name__)
 
+# 章节提示词的创作要求与结尾指令（前缀缓存与完整提示词共用）
+CHAPTER_REQUIREMENTS = """【创作要求】
+1. 字数要求：5000-8000字（正文内容，充实饱满）
+2. 情节要求：
+   - 必须完整推进本章情节，有明确的开端、发展、高潮、结尾
+   - 核心事件必须与前文不同，避免重复情节
+   - 确保本章有独特的戏剧冲突和情感张力
+3. 叙事要求：
+   - 采用高文学品质的沉浸式描述
+   - 对话要生动自然，符合角色性格
+   - 细节描写丰富（环境、心理、动作、神态）
+   - 叙事节奏张弛有度，避免平铺直叙
+4. 原创性要求：
+   - 场景设置必须新颖独特
+   - 角色互动方式要有变化
+   - 避免使用套路化的表达和桥段"""
+
+CHAPTER_CLOSING = """⚠️ 最重要：认真阅读【前文内容参考】，确保本章内容完全原创，不与前文重复！
+
+现在请开始创作，仅输出章节正文内容（不要输出标题）："""
+
 
 class GeminiProvider(AIServiceProvider):
     """Gemini AI 服务提供商
@@ -17,12 +62,24 @@ class GeminiProvider(AIServiceProvider):
     基于 Google Gemini API 实现的 AI 服务提供商
     """
 
+    # google-genai 的 client.models 为同步调用
+    blocking_client = True
+    # 章节列表分片、场景并行写作（构造参数可覆盖）
+    chapter_shard_size = 0
+    chapter_shard_retries = 2
+    scene_max_scenes = 4
+    scene_smoothing = True
+
     def __init__(
         self,
         api_key: str,
         proxy: Optional[str] = None,
         model: str = "gemini-3-pro-preview",
         timeout_ms: int = 300000,
+        chapter_shard_size: int = 0,
+        chapter_shard_retries: int = 2,
+        scene_max_scenes: int = 4,
+        scene_smoothing: bool = True,
         **kwargs
     ):
         """初始化 Gemini 提供商
@@ -32,10 +89,18 @@ class GeminiProvider(AIServiceProvider):
             proxy: 代理地址（可选，支持 HTTP/HTTPS/SOCKS5）
             model: 模型名称
             timeout_ms: 超时时间（毫秒）
+            chapter_shard_size: 章节列表分片大小（章节数超过时分片并发生成，0 表示不分片）
+            chapter_shard_retries: 单个分片失败后的重试次数
+            scene_max_scenes: 场景并行写作时每章最多拆分的场景数
+            scene_smoothing: 场景并行写作后是否润色场景交界
             **kwargs: 其他参数
         """
         self.model = model
         self.timeout_ms = timeout_ms
+        self.chapter_shard_size = chapter_shard_size
+        self.chapter_shard_retries = chapter_shard_retries
+        self.scene_max_scenes = scene_max_scenes
+        self.scene_smoothing = scene_smoothing
         self.client = None
         super().__init__(api_key, proxy, **kwargs)
 
@@ -262,6 +327,79 @@ class GeminiProvider(AIServiceProvider):
         except Exception as e:
             self._handle_geo_restriction_error(e, "生成大纲")
 
+    @staticmethod
+    def _close_stream(stream) -> None:
+        close = getattr(stream, "close", None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            logger.warning(f"⚠️  关闭上游流失败: {str(e)}")
+
+    @staticmethod
+    async def _iter_stream_text(stream) -> AsyncGenerator[str, None]:
+        """逐个取出上游流式分片的文本（Gemini 为同步迭代器，DeepSeek 为异步迭代器）"""
+        if hasattr(stream, "__aiter__"):
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+        else:
+            for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+
+    @staticmethod
+    def _stream_error_message(error: Exception) -> str:
+        """结构化流错误事件中的提示（地区限制给出可操作的说明）"""
+        error_msg = str(error)
+        if "location is not supported" in error_msg or "FAILED_PRECONDITION" in error_msg:
+            error_msg = "抱歉，服务器所在地区暂不支持 Gemini API 服务。请联系管理员检查服务器配置，或考虑使用代理服务器。"
+        return error_msg
+
+    async def _stream_json_items(
+        self,
+        prompt: str,
+        operation: str,
+        key: Optional[str] = None,
+        temperature: float = 0.7
+    ) -> AsyncGenerator[str, None]:
+        """流式生成 JSON 数组，每个元素闭合后立即以 SSE 事件输出（只输出对象元素）"""
+        stream = None
+        parser = IncrementalArrayParser(key)
+        try:
+            stream = self.client.models.generate_content_stream(
+                model=self.model,
+                contents=prompt,
+                config={
+                    "response_mime_type": "application/json",
+                    "temperature": temperature,
+                }
+            )
+            index = 0
+            async for text in self._iter_stream_text(stream):
+                for item in parser.feed(text):
+                    if isinstance(item, dict):
+                        yield item_event(item, index)
+                        index += 1
+            for item in parser.close():
+                if isinstance(item, dict):
+                    yield item_event(item, index)
+                    index += 1
+            if index == 0:
+                raise Exception("返回的数据格式不正确")
+            if parser.skipped:
+                logger.warning(f"⚠️  {operation}：跳过 {parser.skipped} 个无法解析的元素")
+            yield done_event(index, parser.skipped)
+
+        except Exception as e:
+            error_msg = self._stream_error_message(e)
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+            raise Exception(f"{operation}失败: {error_msg}")
+        finally:
+            # 调用方提前离开时立即关闭上游流，停止继续生成
+            self._close_stream(stream)
+
     async def generate_volume_outline_stream(
         self,
         novel_title: str,
@@ -272,6 +410,7 @@ class GeminiProvider(AIServiceProvider):
         volume_index: int
     ) -> AsyncGenerator[str, None]:
         """生成卷详细大纲（流式）"""
+        stream = None
         try:
             characters_text = "、".join([f"{c.get('name', '')}（{c.get('role', '')}）" for c in characters[:5]]) if characters else "暂无"
 
@@ -339,6 +478,9 @@ class GeminiProvider(AIServiceProvider):
             error_data = json.dumps({"error": error_msg})
             yield f"data: {error_data}\n\n"
             raise Exception(f"生成卷大纲失败: {error_msg}")
+        finally:
+            # 调用方提前离开（客户端断开、取消）时立即关闭上游流，停止继续生成
+            self._close_stream(stream)
 
     async def generate_volume_outline(
         self,
@@ -413,11 +555,10 @@ class GeminiProvider(AIServiceProvider):
         except Exception as e:
             self._handle_geo_restriction_error(e, "生成卷大纲")
 
-    async def generate_chapter_outline(
+    def _build_chapter_outline_prompt(
         self,
         novel_title: str,
         genre: str,
-        full_outline: str,
         volume_title: str,
         volume_summary: str,
         volume_outline: str,
@@ -425,25 +566,27 @@ class GeminiProvider(AIServiceProvider):
         volume_index: int,
         chapter_count: Optional[int] = None,
         previous_volumes_info: Optional[List[Dict]] = None,
-        future_volumes_info: Optional[List[Dict]] = None
-    ) -> List[Dict]:
-        """生成章节列表"""
-        try:
-            characters_text = "、".join([f"{c.get('name', '')}（{c.get('role', '')}）" for c in characters[:5]]) if characters else "暂无"
-
-            # 提取字数规划和章节规划
-            word_count_info = ""
-            if volume_outline:
-                import re
-                word_match = re.search(r'【字数规划】：\s*(\d+)[-~]?(\d+)?\s*万字', volume_outline)
-                if word_match:
-                    min_w = word_match.group(1)
-                    max_w = word_match.group(2) if word_match.group(2) else min_w
-                    word_count_info = f"\n字数规划：{min_w}-{max_w}万字" if max_w != min_w else f"\n字数规划：{min_w}万字"
-
-            chapter_count_instruction = ""
-            if chapter_count:
-                chapter_count_instruction = f"""请为本卷生成 {chapter_count} 个章节。
+        future_volumes_info: Optional[List[Dict]] = None,
+        shard_instruction: Optional[str] = None
+    ) -> str:
+        """章节列表提示词（流式与非流式共用；shard_instruction 为分片生成时替换章节数要求的分段说明）"""
+        characters_text = "、".join([f"{c.get('name', '')}（{c.get('role', '')}）" for c in characters[:5]]) if characters else "暂无"
+
+        # 提取字数规划和章节规划
+        word_count_info = ""
+        if volume_outline:
+            import re
+            word_match = re.search(r'【字数规划】：\s*(\d+)[-~]?(\d+)?\s*万字', volume_outline)
+            if word_match:
+                min_w = word_match.group(1)
+                max_w = word_match.group(2) if word_match.group(2) else min_w
+                word_count_info = f"\n字数规划：{min_w}-{max_w}万字" if max_w != min_w else f"\n字数规划：{min_w}万字"
+
+        chapter_count_instruction = ""
+        if shard_instruction:
+            chapter_count_instruction = shard_instruction
+        elif chapter_count:
+            chapter_count_instruction = f"""请为本卷生成 {chapter_count} 个章节。
 
 【章节生成策略】
 1. 首先基于卷大纲中的主线剧情生成章节（优先覆盖卷大纲中的所有主要情节点）
@@ -454,8 +597,8 @@ class GeminiProvider(AIServiceProvider):
    - 必须在当前卷的时间线和故事范围内
    - 应该丰富故事的层次感，不要显得突兀
 4. 最终生成的章节总数必须达到 {chapter_count} 个"""
-            else:
-                chapter_count_instruction = """请仔细分析本卷的详细大纲，根据以下原则确定合适的章节数量并生成章节列表：
+        else:
+            chapter_count_instruction = """请仔细分析本卷的详细大纲，根据以下原则确定合适的章节数量并生成章节列表：
 章节数量应该：
 1. 优先参考卷大纲中标注的【章节规划】（如果存在）
 2. 根据卷大纲的内容复杂度和字数规划合理分配
@@ -466,50 +609,50 @@ class GeminiProvider(AIServiceProvider):
 7. 如果基于主线剧情确定的章节数偏少，可以适当增加支线剧情章节（角色互动、日常描写、世界观展示等）来丰富内容
 8. 章节数量应在合理范围内（建议6-30章）"""
 
-            volume_desc = f"卷描述：{volume_summary[:200]}" if volume_summary else ""
-            volume_outline_text = f"卷详细大纲：{volume_outline[:2500]}" if volume_outline else ""
-
-            # 构建前面卷的参考信息（用于确保连贯性）
-            previous_volumes_section = ""
-            if volume_index > 0 and previous_volumes_info:
-                previous_volumes_section = "\n【前面卷的参考信息】（用于确保情节连贯，不要重复这些内容）\n"
-                for prev_vol_info in previous_volumes_info:
-                    prev_vol_title = prev_vol_info.get("title", "")
-                    prev_vol_summary = prev_vol_info.get("summary", "")
-                    prev_chapters = prev_vol_info.get("chapters", [])
-
-                    previous_volumes_section += f"\n{prev_vol_title}：\n"
-                    if prev_vol_summary:
-                        previous_volumes_section += f"  卷描述：{prev_vol_summary[:200]}\n"
-                    if prev_chapters:
-                        previous_volumes_section += "  已发生章节（标题 - 摘要，避免重复）：\n"
-                        for ch in prev_chapters[:12]:
-                            ch_title = ch.get("title", "")
-                            ch_summary = (ch.get("summary", "") or "")[:120]
-                            if ch_title and ch_summary:
-                                previous_volumes_section += f"   - {ch_title}：{ch_summary}\n"
-                            elif ch_title:
-                                previous_volumes_section += f"   - {ch_title}\n"
-
-                previous_volumes_section += "\n重要：你必须承接这些已发生事件，但不要重复同类冲突/同一事件的再讲一遍。\n"
-
-            # 构建后续卷的"禁止提前"信息（用于避免串到后面卷）
-            future_volumes_section = ""
-            if future_volumes_info:
-                future_volumes_section = "\n【后续卷规划（禁止提前使用）】\n"
-                for next_vol in future_volumes_info[:3]:
-                    next_title = next_vol.get("title", "")
-                    next_summary = (next_vol.get("summary", "") or "")[:240]
-                    next_outline = (next_vol.get("outline", "") or "")[:500]
-                    if next_title:
-                        future_volumes_section += f"\n{next_title}：\n"
-                        if next_summary:
-                            future_volumes_section += f"  规划简介：{next_summary}\n"
-                        if next_outline:
-                            future_volumes_section += f"  规划要点（摘要）：{next_outline}\n"
-                future_volumes_section += "\n重要：以上内容仅用于\"避雷\"。本卷不得出现这些卷的主要事件、关键反转或结局信息。\n"
-
-            prompt = f"""基于以下信息，为第 {volume_index + 1} 卷《{volume_title}》生成章节列表：
+        volume_desc = f"卷描述：{volume_summary[:200]}" if volume_summary else ""
+        volume_outline_text = f"卷详细大纲：{volume_outline[:2500]}" if volume_outline else ""
+
+        # 构建前面卷的参考信息（用于确保连贯性）
+        previous_volumes_section = ""
+        if volume_index > 0 and previous_volumes_info:
+            previous_volumes_section = "\n【前面卷的参考信息】（用于确保情节连贯，不要重复这些内容）\n"
+            for prev_vol_info in previous_volumes_info:
+                prev_vol_title = prev_vol_info.get("title", "")
+                prev_vol_summary = prev_vol_info.get("summary", "")
+                prev_chapters = prev_vol_info.get("chapters", [])
+
+                previous_volumes_section += f"\n{prev_vol_title}：\n"
+                if prev_vol_summary:
+                    previous_volumes_section += f"  卷描述：{prev_vol_summary[:200]}\n"
+                if prev_chapters:
+                    previous_volumes_section += "  已发生章节（标题 - 摘要，避免重复）：\n"
+                    for ch in prev_chapters[:12]:
+                        ch_title = ch.get("title", "")
+                        ch_summary = (ch.get("summary", "") or "")[:120]
+                        if ch_title and ch_summary:
+                            previous_volumes_section += f"   - {ch_title}：{ch_summary}\n"
+                        elif ch_title:
+                            previous_volumes_section += f"   - {ch_title}\n"
+
+            previous_volumes_section += "\n重要：你必须承接这些已发生事件，但不要重复同类冲突/同一事件的再讲一遍。\n"
+
+        # 构建后续卷的"禁止提前"信息（用于避免串到后面卷）
+        future_volumes_section = ""
+        if future_volumes_info:
+            future_volumes_section = "\n【后续卷规划（禁止提前使用）】\n"
+            for next_vol in future_volumes_info[:3]:
+                next_title = next_vol.get("title", "")
+                next_summary = (next_vol.get("summary", "") or "")[:240]
+                next_outline = (next_vol.get("outline", "") or "")[:500]
+                if next_title:
+                    future_volumes_section += f"\n{next_title}：\n"
+                    if next_summary:
+                        future_volumes_section += f"  规划简介：{next_summary}\n"
+                    if next_outline:
+                        future_volumes_section += f"  规划要点（摘要）：{next_outline}\n"
+            future_volumes_section += "\n重要：以上内容仅用于\"避雷\"。本卷不得出现这些卷的主要事件、关键反转或结局信息。\n"
+
+        prompt = f"""基于以下信息，为第 {volume_index + 1} 卷《{volume_title}》生成章节列表：
 
 【⚠️ 严格限制】
 你只能生成第 {volume_index + 1} 卷《{volume_title}》的章节列表，绝对不要包含后续卷的情节！
@@ -556,6 +699,110 @@ class GeminiProvider(AIServiceProvider):
 重要：支线剧情必须在当前卷的时间范围内，不能是后续卷的内容，也不能重复前面卷已经发生的情节。
 
 仅返回 JSON 数组，每个对象包含以下键："title"（标题，不要带章节编号）、"summary"（摘要）、"aiPromptHints"（AI提示）。"""
+        return prompt
+
+    async def _generate_text(self, contents: str, config: Dict[str, Any]) -> str:
+        """非流式生成文本；同步客户端放到工作线程执行，多个请求可以并发"""
+        if self.blocking_client:
+            response = await asyncio.to_thread(
+                self.client.models.generate_content, model=self.model, contents=contents, config=config
+            )
+        else:
+            response = self.client.models.generate_content(model=self.model, contents=contents, config=config)
+            if inspect.isawaitable(response):
+                response = await response
+        return response.text or ""
+
+    async def _generate_json_text(self, prompt: str, temperature: float = 0.7) -> str:
+        """非流式生成 JSON 文本（可并发）"""
+        return await self._generate_text(prompt, {
+            "response_mime_type": "application/json",
+            "temperature": temperature,
+        })
+
+    async def _generate_chapter_shard(
+        self,
+        prompt_kwargs: Dict[str, Any],
+        shard: ChapterShard,
+        shards: List[ChapterShard]
+    ) -> List[Dict]:
+        """生成单个分片；失败或章节数不足时重试，重试用尽后使用章节最多的一次结果"""
+        prompt = self._build_chapter_outline_prompt(
+            **prompt_kwargs, shard_instruction=build_shard_instruction(shard, shards)
+        )
+        best: List[Dict] = []
+        last_error: Optional[Exception] = None
+        for attempt in range(1 + max(0, self.chapter_shard_retries)):
+            try:
+                chapters = parse_shard_chapters(await self._generate_json_text(prompt))
+            except Exception as e:
+                if "location is not supported" in str(e) or "FAILED_PRECONDITION" in str(e):
+                    raise
+                last_error = e
+                logger.warning(f"⚠️  章节列表分片 {shard.label} 第 {attempt + 1} 次生成失败: {str(e)}")
+                continue
+            if len(chapters) >= shard.count:
+                return chapters[:shard.count]
+            if len(chapters) > len(best):
+                best = chapters
+            logger.warning(f"⚠️  章节列表分片 {shard.label} 只返回 {len(chapters)}/{shard.count} 章（第 {attempt + 1} 次）")
+        if best:
+            return best
+        raise Exception(f"{shard.label}生成失败: {str(last_error) if last_error else '返回的数据格式不正确'}")
+
+    def _start_chapter_shards(self, prompt_kwargs: Dict[str, Any], shards: List[ChapterShard]) -> List["asyncio.Task"]:
+        """所有分片同时开始生成（并发数受上游限流器约束）"""
+        logger.info(f"📚 章节列表分 {len(shards)} 片并发生成: {', '.join(shard.label for shard in shards)}")
+        return [
+            asyncio.create_task(self._generate_chapter_shard(prompt_kwargs, shard, shards))
+            for shard in shards
+        ]
+
+    @staticmethod
+    def _cancel_tasks(tasks: List["asyncio.Task"]) -> None:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    async def generate_chapter_outline(
+        self,
+        novel_title: str,
+        genre: str,
+        full_outline: str,
+        volume_title: str,
+        volume_summary: str,
+        volume_outline: str,
+        characters: List[Dict],
+        volume_index: int,
+        chapter_count: Optional[int] = None,
+        previous_volumes_info: Optional[List[Dict]] = None,
+        future_volumes_info: Optional[List[Dict]] = None
+    ) -> List[Dict]:
+        """生成章节列表（章节数超过分片大小时分片并发生成）"""
+        prompt_kwargs = dict(
+            novel_title=novel_title,
+            genre=genre,
+            volume_title=volume_title,
+            volume_summary=volume_summary,
+            volume_outline=volume_outline,
+            characters=characters,
+            volume_index=volume_index,
+            chapter_count=chapter_count,
+            previous_volumes_info=previous_volumes_info,
+            future_volumes_info=future_volumes_info
+        )
+        shards = plan_shards(chapter_count, self.chapter_shard_size)
+        if shards:
+            tasks = self._start_chapter_shards(prompt_kwargs, shards)
+            try:
+                return merge_shards(await asyncio.gather(*tasks))
+            except Exception as e:
+                raise Exception(f"生成章节列表失败: {str(e)}")
+            finally:
+                self._cancel_tasks(tasks)
+
+        try:
+            prompt = self._build_chapter_outline_prompt(**prompt_kwargs)
 
             response = self.client.models.generate_content(
                 model=self.model,
@@ -578,6 +825,55 @@ class GeminiProvider(AIServiceProvider):
         except Exception as e:
             raise Exception(f"生成章节列表失败: {str(e)}")
 
+    async def generate_chapter_outline_stream(
+        self,
+        novel_title: str,
+        genre: str,
+        full_outline: str,
+        volume_title: str,
+        volume_summary: str,
+        volume_outline: str,
+        characters: List[Dict],
+        volume_index: int,
+        chapter_count: Optional[int] = None,
+        previous_volumes_info: Optional[List[Dict]] = None,
+        future_volumes_info: Optional[List[Dict]] = None
+    ) -> AsyncGenerator[str, None]:
+        """生成章节列表（流式，每章生成完即输出；分片时按分片顺序，每个分片完成即输出该分片的章节）"""
+        prompt_kwargs = dict(
+            novel_title=novel_title,
+            genre=genre,
+            volume_title=volume_title,
+            volume_summary=volume_summary,
+            volume_outline=volume_outline,
+            characters=characters,
+            volume_index=volume_index,
+            chapter_count=chapter_count,
+            previous_volumes_info=previous_volumes_info,
+            future_volumes_info=future_volumes_info
+        )
+        shards = plan_shards(chapter_count, self.chapter_shard_size)
+        if not shards:
+            prompt = self._build_chapter_outline_prompt(**prompt_kwargs)
+            async for event in self._stream_json_items(prompt, "生成章节列表", key="chapters"):
+                yield event
+            return
+
+        tasks = self._start_chapter_shards(prompt_kwargs, shards)
+        try:
+            index = 0
+            for task in tasks:
+                for item in await task:
+                    yield item_event({**item, "title": normalize_chapter_title(item.get("title"), index + 1)}, index)
+                    index += 1
+            yield done_event(index)
+        except Exception as e:
+            error_msg = self._stream_error_message(e)
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+            raise Exception(f"生成章节列表失败: {error_msg}")
+        finally:
+            self._cancel_tasks(tasks)
+
     async def modify_outline_by_dialogue(
         self,
         outline: str,
@@ -789,27 +1085,63 @@ class GeminiProvider(AIServiceProvider):
 
     # ==================== 章节生成 ====================
 
-    async def write_chapter_content_stream(
+    @staticmethod
+    def _chapter_background_section(
+        genre: str,
+        synopsis: str,
+        characters: List[Dict],
+        world_settings: List[Dict]
+    ) -> str:
+        characters_text = "；".join([f"{c.get('name', '')}：{c.get('personality', '')}" for c in characters]) if characters else "暂无"
+        world_text = "；".join([f"{w.get('title', '')}：{w.get('description', '')}" for w in world_settings]) if world_settings else "暂无"
+        return f"""【小说背景信息】
+- 类型：{genre}
+- 完整简介：{synopsis}
+- 涉及角色：{characters_text}
+- 世界观规则：{world_text}"""
+
+    def build_chapter_prompt_prefix(
         self,
         novel_title: str,
         genre: str,
         synopsis: str,
+        characters: List[Dict],
+        world_settings: List[Dict]
+    ) -> str:
+        """构建章节提示词的稳定前缀（同一小说的各章节共用，可登记到上下文缓存）"""
+        background = self._chapter_background_section(genre, synopsis, characters, world_settings)
+        return f"""你正在为小说《{novel_title}》创作章节。以下是全书通用的背景资料与创作要求，随后会给出本次要创作的具体章节。
+
+{background}
+
+{CHAPTER_REQUIREMENTS}
+"""
+
+    def _build_chapter_prompt_sections(
+        self,
+        novel_title: str,
         chapter_title: str,
         chapter_summary: str,
         chapter_prompt_hints: str,
-        characters: List[Dict],
-        world_settings: List[Dict],
         previous_chapters_context: Optional[str] = None
-    ) -> AsyncGenerator[str, None]:
-        """生成章节内容（流式）"""
-        try:
-            characters_text = "；".join([f"{c.get('name', '')}：{c.get('personality', '')}" for c in characters]) if characters else "暂无"
-            world_text = "；".join([f"{w.get('title', '')}：{w.get('description', '')}" for w in world_settings]) if world_settings else "暂无"
-
-            # 构建前文上下文部分
-            previous_context_section = ""
-            if previous_chapters_context and previous_chapters_context.strip():
-                previous_context_section = f"""
+    ) -> Tuple[str, str]:
+        """构建章节提示词中随章节变化的部分，返回 (章节信息与上一章钩子, 前文参考)"""
+        # 从chapter_prompt_hints中提取上一章的钩子（如果有）
+        previous_chapter_hook = ""
+        if chapter_prompt_hints and "【上一章钩子】" in chapter_prompt_hints:
+            hook_part = chapter_prompt_hints.split("【上一章钩子】")
+            if len(hook_part) > 1:
+                previous_chapter_hook = hook_part[-1].strip()
+        elif chapter_prompt_hints and "【下一章钩子】" in chapter_prompt_hints:
+            # 兼容旧格式
+            hook_part = chapter_prompt_hints.split("【下一章钩子】")
+            if len(hook_part) > 1:
+                previous_chapter_hook = hook_part[-1].strip()
+
+        # 构建前文上下文部分
+        previous_context_section = ""
+        if previous_chapters_context and previous_chapters_context.strip():
+            previous_context_section = f"""
 
 【前文内容参考】：
 {previous_chapters_context}
@@ -823,50 +1155,149 @@ class GeminiProvider(AIServiceProvider):
 6. ✅ 正确做法：采用不同的叙述视角、情绪基调、描写重点
 7. ✅ 正确做法：确保本章有独特的核心事件，与前文明显区分
 
-⚠️ 注意：请认真阅读上述前文内容，确保本章内容完全原创且与前文连贯。
+⚠️ 注意：上述前文是相关章节，请认真阅读并确保本章内容完全不同。
+"""
+
+        # 构建上一章钩子部分
+        previous_hook_section = ""
+        if previous_chapter_hook:
+            previous_hook_section = f"""
+
+【上一章结尾钩子】（必须承接）：
+{previous_chapter_hook}
+
+⚠️ 重要：上一章结尾留下了这个悬念/转折点，本章开头必须自然承接这个钩子，但不能直接重复上一章的结尾内容。应该：
+1. 用1-2句话简短呼应上一章的钩子
+2. 然后立即推进新的情节发展
+3. 不要让读者感觉重复或拖沓
 """
 
-            prompt = f"""请为小说《{novel_title}》创作一个完整的章节。
+        # 清理chapter_prompt_hints，移除钩子标记（钩子已经在previous_hook_section中单独处理）
+        clean_prompt_hints = chapter_prompt_hints or ""
+        if clean_prompt_hints:
+            # 移除钩子标记，保留其他提示
+            clean_prompt_hints = clean_prompt_hints.replace("【下一章钩子】", "").replace("【上一章钩子】", "").strip()
+            # 清理多余的空行
+            clean_prompt_hints = "\n".join([line for line in clean_prompt_hints.split("\n") if line.strip()])
+
+        chapter_section = f"""请为小说《{novel_title}》创作一个完整的章节。
 
 【章节基本信息】
 - 标题：{chapter_title}
 - 情节摘要：{chapter_summary}
-- 写作提示：{chapter_prompt_hints}
-
-【小说背景信息】
-- 完整简介：{synopsis}
-- 涉及角色：{characters_text}
-- 世界观规则：{world_text}
-{previous_context_section}
+{f"- 写作提示：{clean_prompt_hints}" if clean_prompt_hints else ""}
+{previous_hook_section}"""
+        return chapter_section, previous_context_section
 
-【创作要求】
-1. 字数要求：5000-8000字（正文内容，充实饱满）
-2. 情节要求：
-   - 必须完整推进本章情节，有明确的开端、发展、高潮、结尾
-   - 核心事件必须与前文不同，避免重复情节
-   - 确保本章有独特的戏剧冲突和情感张力
-3. 叙事要求：
-   - 采用高文学品质的沉浸式描述
-   - 对话要生动自然，符合角色性格
-   - 细节描写丰富（环境、心理、动作、神态）
-   - 叙事节奏张弛有度，避免平铺直叙
-4. 原创性要求：
-   - 场景设置必须新颖独特
-   - 角色互动方式要有变化
-   - 避免使用套路化的表达和桥段
+    def _build_chapter_prompts(
+        self,
+        novel_title: str,
+        genre: str,
+        synopsis: str,
+        chapter_title: str,
+        chapter_summary: str,
+        chapter_prompt_hints: str,
+        characters: List[Dict],
+        world_settings: List[Dict],
+        previous_chapters_context: Optional[str] = None
+    ) -> Tuple[str, str, str]:
+        """构建章节提示词，返回 (稳定前缀, 可变后缀, 完整提示词)
 
-⚠️ 最重要：认真阅读【前文内容参考】，确保本章内容完全原创，不与前文重复！
+        完整提示词保持原有顺序（章节信息在前，背景与创作要求在后），未启用前缀缓存时发送；
+        启用时把稳定前缀放在最前面，命中缓存时只发送可变后缀。
+        """
+        prefix = self.build_chapter_prompt_prefix(novel_title, genre, synopsis, characters, world_settings)
+        chapter_section, context_section = self._build_chapter_prompt_sections(
+            novel_title, chapter_title, chapter_summary, chapter_prompt_hints, previous_chapters_context
+        )
+        suffix = f"{chapter_section}\n{context_section}\n\n{CHAPTER_CLOSING}"
+        background = self._chapter_background_section(genre, synopsis, characters, world_settings)
+        full_prompt = f"{chapter_section}\n\n{background}\n{context_section}\n\n{CHAPTER_REQUIREMENTS}\n\n{CHAPTER_CLOSING}"
+        return prefix, suffix, full_prompt
+
+    def _build_chapter_request(
+        self,
+        prefix: str,
+        suffix: str,
+        cache_handle: Optional[PromptCacheHandle] = None,
+        full_prompt: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """组装章节生成请求：有可用缓存句柄时只发送可变部分，未启用前缀缓存时按原有顺序发送完整提示词"""
+        config: Dict[str, Any] = {
+            "temperature": 0.9,
+            "max_output_tokens": 16384,
+        }
+        if cache_handle and cache_handle.usable:
+            config["cached_content"] = cache_handle.provider_ref
+            return suffix, config
+        if full_prompt and not settings.PROMPT_CACHE_ENABLED:
+            return full_prompt, config
+        return f"{prefix}\n{suffix}", config
+
+    @staticmethod
+    def _is_cache_error(e: Exception) -> bool:
+        error_msg = str(e)
+        return "cached" in error_msg.lower() or "NOT_FOUND" in error_msg
+
+    async def create_prefix_cache(self, prefix: str, ttl_seconds: int) -> Optional[str]:
+        """把稳定前缀登记为 Gemini cached content，返回缓存名"""
+        from google.genai import types
+
+        # 同步客户端的网络调用放到工作线程，不阻塞事件循环
+        cache = await asyncio.to_thread(
+            self.client.caches.create,
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part(text=prefix)])],
+                ttl=f"{ttl_seconds}s",
+                display_name="nova-chapter-prefix",
+            )
+        )
+        return cache.name
 
-现在请开始创作，仅输出章节正文内容（不要输出标题）："""
+    async def delete_prefix_cache(self, provider_ref: str) -> None:
+        """删除 Gemini cached content"""
+        await asyncio.to_thread(self.client.caches.delete, name=provider_ref)
 
-            stream = self.client.models.generate_content_stream(
-                model=self.model,
-                contents=prompt,
-                config={
-                    "temperature": 0.9,
-                    "max_output_tokens": 16384,
-                }
+    async def write_chapter_content_stream(
+        self,
+        novel_title: str,
+        genre: str,
+        synopsis: str,
+        chapter_title: str,
+        chapter_summary: str,
+        chapter_prompt_hints: str,
+        characters: List[Dict],
+        world_settings: List[Dict],
+        previous_chapters_context: Optional[str] = None,
+        cache_handle: Optional[PromptCacheHandle] = None
+    ) -> AsyncGenerator[str, None]:
+        """生成章节内容（流式）"""
+        stream = None
+        try:
+            prefix, suffix, full_prompt = self._build_chapter_prompts(
+                novel_title, genre, synopsis, chapter_title, chapter_summary, chapter_prompt_hints,
+                characters, world_settings, previous_chapters_context
             )
+            contents, config = self._build_chapter_request(prefix, suffix, cache_handle, full_prompt)
+
+            try:
+                stream = self.client.models.generate_content_stream(
+                    model=self.model,
+                    contents=contents,
+                    config=config
+                )
+            except Exception as e:
+                if "cached_content" not in config or not self._is_cache_error(e):
+                    raise
+                logger.warning(f"⚠️  前缀缓存不可用，改用完整提示词: {str(e)}")
+                get_prompt_cache().invalidate(self, cache_handle.key)
+                contents, config = self._build_chapter_request(prefix, suffix, full_prompt=full_prompt)
+                stream = self.client.models.generate_content_stream(
+                    model=self.model,
+                    contents=contents,
+                    config=config
+                )
 
             for chunk in stream:
                 if chunk.text:
@@ -890,6 +1321,9 @@ class GeminiProvider(AIServiceProvider):
             error_data = json.dumps({"error": error_msg})
             yield f"data: {error_data}\n\n"
             raise Exception(f"生成章节内容失败: {error_msg}")
+        finally:
+            # 调用方提前离开（客户端断开、取消）时立即关闭上游流，停止继续生成
+            self._close_stream(stream)
 
     async def write_chapter_content(
         self,
@@ -901,118 +1335,173 @@ class GeminiProvider(AIServiceProvider):
         chapter_prompt_hints: str,
         characters: List[Dict],
         world_settings: List[Dict],
-        previous_chapters_context: Optional[str] = None
+        previous_chapters_context: Optional[str] = None,
+        cache_handle: Optional[PromptCacheHandle] = None
     ) -> str:
         """生成章节内容（非流式，返回完整文本）"""
         try:
-            characters_text = "；".join([f"{c.get('name', '')}：{c.get('personality', '')}" for c in characters]) if characters else "暂无"
-            world_text = "；".join([f"{w.get('title', '')}：{w.get('description', '')}" for w in world_settings]) if world_settings else "暂无"
-
-            # 从chapter_prompt_hints中提取上一章的钩子（如果有）
-            previous_chapter_hook = ""
-            if chapter_prompt_hints and "【上一章钩子】" in chapter_prompt_hints:
-                hook_part = chapter_prompt_hints.split("【上一章钩子】")
-                if len(hook_part) > 1:
-                    previous_chapter_hook = hook_part[-1].strip()
-            elif chapter_prompt_hints and "【下一章钩子】" in chapter_prompt_hints:
-                # 兼容旧格式
-                hook_part = chapter_prompt_hints.split("【下一章钩子】")
-                if len(hook_part) > 1:
-                    previous_chapter_hook = hook_part[-1].strip()
-
-            # 构建前文上下文部分
-            previous_context_section = ""
-            if previous_chapters_context and previous_chapters_context.strip():
-                previous_context_section = f"""
-
-【前文内容参考】：
-{previous_chapters_context}
-
-🚨 【重复内容检查要求】- 必须严格遵守：
-1. ❌ 绝对禁止：重复前文中已经完整描述过的场景、事件、对话
-2. ❌ 绝对禁止：使用与前文相同的叙事结构、描写手法、语言风格
-3. ❌ 绝对禁止：让角色重复做过的事情或说过类似的话
-4. ✅ 正确做法：如需提及前文，仅用1-2句简短过渡，不展开描写
-5. ✅ 正确做法：本章必须推进全新情节，展现新的冲突和发展
-6. ✅ 正确做法：采用不同的叙述视角、情绪基调、描写重点
-7. ✅ 正确做法：确保本章有独特的核心事件，与前文明显区分
-
-⚠️ 注意：上述前文是相关章节，请认真阅读并确保本章内容完全不同。
-"""
-
-            # 构建上一章钩子部分
-            previous_hook_section = ""
-            if previous_chapter_hook:
-                previous_hook_section = f"""
-
-【上一章结尾钩子】（必须承接）：
-{previous_chapter_hook}
-
-⚠️ 重要：上一章结尾留下了这个悬念/转折点，本章开头必须自然承接这个钩子，但不能直接重复上一章的结尾内容。应该：
-1. 用1-2句话简短呼应上一章的钩子
-2. 然后立即推进新的情节发展
-3. 不要让读者感觉重复或拖沓
-"""
-
-            # 清理chapter_prompt_hints，移除钩子标记（钩子已经在previous_hook_section中单独处理）
-            clean_prompt_hints = chapter_prompt_hints or ""
-            if clean_prompt_hints:
-                # 移除钩子标记，保留其他提示
-                clean_prompt_hints = clean_prompt_hints.replace("【下一章钩子】", "").replace("【上一章钩子】", "").strip()
-                # 清理多余的空行
-                clean_prompt_hints = "\n".join([line for line in clean_prompt_hints.split("\n") if line.strip()])
-
-            prompt = f"""请为小说《{novel_title}》创作一个完整的章节。
+            prefix, suffix, full_prompt = self._build_chapter_prompts(
+                novel_title, genre, synopsis, chapter_title, chapter_summary, chapter_prompt_hints,
+                characters, world_settings, previous_chapters_context
+            )
+            contents, config = self._build_chapter_request(prefix, suffix, cache_handle, full_prompt)
 
-【章节基本信息】
-- 标题：{chapter_title}
-- 情节摘要：{chapter_summary}
-{f"- 写作提示：{clean_prompt_hints}" if clean_prompt_hints else ""}
-{previous_hook_section}
+            try:
+                response = self.client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=config
+                )
+            except Exception as e:
+                if "cached_content" not in config or not self._is_cache_error(e):
+                    raise
+                logger.warning(f"⚠️  前缀缓存不可用，改用完整提示词: {str(e)}")
+                get_prompt_cache().invalidate(self, cache_handle.key)
+                contents, config = self._build_chapter_request(prefix, suffix, full_prompt=full_prompt)
+                response = self.client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=config
+                )
 
-【小说背景信息】
-- 完整简介：{synopsis}
-- 涉及角色：{characters_text}
-- 世界观规则：{world_text}
-{previous_context_section}
+            if not response.text:
+                raise Exception("API 返回空响应")
 
-【创作要求】
-1. 字数要求：5000-8000字（正文内容，充实饱满）
-2. 情节要求：
-   - 必须完整推进本章情节，有明确的开端、发展、高潮、结尾
-   - 核心事件必须与前文不同，避免重复情节
-   - 确保本章有独特的戏剧冲突和情感张力
-3. 叙事要求：
-   - 采用高文学品质的沉浸式描述
-   - 对话要生动自然，符合角色性格
-   - 细节描写丰富（环境、心理、动作、神态）
-   - 叙事节奏张弛有度，避免平铺直叙
-4. 原创性要求：
-   - 场景设置必须新颖独特
-   - 角色互动方式要有变化
-   - 避免使用套路化的表达和桥段
+            return response.text
 
-⚠️ 最重要：认真阅读【前文内容参考】，确保本章内容完全原创，不与前文重复！
+        except Exception as e:
+            self._handle_geo_restriction_error(e, "生成章节内容")
 
-现在请开始创作，仅输出章节正文内容（不要输出标题）："""
+    async def _draft_scene(
+        self,
+        prefix: str,
+        suffix: str,
+        cache_handle: Optional[PromptCacheHandle] = None,
+        full_prompt: Optional[str] = None
+    ) -> str:
+        """写作单个场景（非流式，可并发）；前缀缓存失效时改用完整提示词"""
+        contents, config = self._build_chapter_request(prefix, suffix, cache_handle, full_prompt)
+        try:
+            text = await self._generate_text(contents, config)
+        except Exception as e:
+            if "cached_content" not in config or not self._is_cache_error(e):
+                raise
+            logger.warning(f"⚠️  前缀缓存不可用，改用完整提示词: {str(e)}")
+            get_prompt_cache().invalidate(self, cache_handle.key)
+            contents, config = self._build_chapter_request(prefix, suffix, full_prompt=full_prompt)
+            text = await self._generate_text(contents, config)
+        text = clean_scene_text(text)
+        if not text:
+            raise Exception("API 返回空响应")
+        return text
 
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt,
-                config={
-                    "temperature": 0.9,
-                    "max_output_tokens": 16384,
-                }
+    async def _scene_transition(
+        self,
+        scenes: List[Dict[str, Any]],
+        drafts: List["asyncio.Task"],
+        index: int
+    ) -> str:
+        """相邻两个场景都写完后润色交界，返回插在第 index 个场景前的过渡句（失败或不需要时为空）"""
+        previous_text, next_text = await drafts[index - 1], await drafts[index]
+        try:
+            text = await self._generate_text(
+                build_transition_prompt(scenes[index - 1], previous_text, scenes[index], next_text),
+                {"temperature": 0.6, "max_output_tokens": 256}
             )
+            return parse_transition(text)
+        except Exception as e:
+            logger.warning(f"⚠️  场景交界润色失败（跳过）: {str(e)}")
+            return ""
 
-            if not response.text:
-                raise Exception("API 返回空响应")
-
-            return response.text
+    async def write_chapter_scenes_stream(
+        self,
+        novel_title: str,
+        genre: str,
+        synopsis: str,
+        chapter_title: str,
+        chapter_summary: str,
+        chapter_prompt_hints: str,
+        characters: List[Dict],
+        world_settings: List[Dict],
+        previous_chapters_context: Optional[str] = None,
+        cache_handle: Optional[PromptCacheHandle] = None,
+        max_scenes: Optional[int] = None
+    ) -> AsyncGenerator[str, None]:
+        """场景并行写作（流式）
 
+        先规划场景，再并发写作所有场景，相邻场景写完后润色交界；按场景顺序输出，
+        每个场景（及其之前的场景）写完即输出 data: {"scene": {...}} 和该场景全文的 data: {"chunk": "..."}。
+        规划失败或只规划出一个场景时退回整章生成。
+        """
+        started = time.monotonic()
+        max_scenes = max_scenes or self.scene_max_scenes
+        scenes: List[Dict[str, Any]] = []
+        try:
+            plan_text = await self._generate_json_text(
+                build_beat_plan_prompt(
+                    novel_title, chapter_title, chapter_summary, chapter_prompt_hints,
+                    characters, previous_chapters_context, max_scenes
+                ),
+                temperature=0.5
+            )
+            scenes = parse_beat_plan(plan_text, max_scenes)
         except Exception as e:
-            self._handle_geo_restriction_error(e, "生成章节内容")
+            logger.warning(f"⚠️  场景规划失败，改为整章生成: {str(e)}")
+        if len(scenes) < 2:
+            async for event in self.write_chapter_content_stream(
+                novel_title=novel_title,
+                genre=genre,
+                synopsis=synopsis,
+                chapter_title=chapter_title,
+                chapter_summary=chapter_summary,
+                chapter_prompt_hints=chapter_prompt_hints,
+                characters=characters,
+                world_settings=world_settings,
+                previous_chapters_context=previous_chapters_context,
+                cache_handle=cache_handle
+            ):
+                yield event
+            return
+
+        plan_ms = int((time.monotonic() - started) * 1000)
+        logger.info(f"📝 {chapter_title} 拆分为 {len(scenes)} 个场景并行写作（规划 {plan_ms}ms）")
+        yield f"data: {json.dumps({'plan': scenes}, ensure_ascii=False)}\n\n"
+
+        prefix, suffix, full_prompt = self._build_chapter_prompts(
+            novel_title, genre, synopsis, chapter_title, chapter_summary, chapter_prompt_hints,
+            characters, world_settings, previous_chapters_context
+        )
+        drafts = [
+            asyncio.create_task(self._draft_scene(
+                prefix,
+                f"{suffix}\n{build_scene_instruction(scenes, index)}",
+                cache_handle,
+                f"{full_prompt}\n{build_scene_instruction(scenes, index)}"
+            ))
+            for index in range(len(scenes))
+        ]
+        transitions = {
+            index: asyncio.create_task(self._scene_transition(scenes, drafts, index))
+            for index in range(1, len(scenes))
+        } if self.scene_smoothing else {}
+        try:
+            for index, scene in enumerate(scenes):
+                text = join_scene(await drafts[index], await transitions[index] if index in transitions else "")
+                if index > 0:
+                    text = f"\n\n{text}"
+                yield f"data: {json.dumps({'scene': {'index': index, 'total': len(scenes), 'title': scene['title']}}, ensure_ascii=False)}\n\n"
+                yield f"data: {json.dumps({'chunk': text})}\n\n"
+            elapsed_ms = int((time.monotonic() - started) * 1000)
+            logger.info(f"✅ {chapter_title} 场景并行写作完成：{len(scenes)} 个场景，耗时 {elapsed_ms}ms")
+            yield f"data: {json.dumps({'done': True, 'mode': 'scenes', 'scenes': len(scenes), 'plan_ms': plan_ms, 'elapsed_ms': elapsed_ms})}\n\n"
+        except Exception as e:
+            error_msg = self._stream_error_message(e)
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+            raise Exception(f"生成章节内容失败: {error_msg}")
+        finally:
+            self._cancel_tasks(drafts + list(transitions.values()))
 
+    @cacheable_response
     async def summarize_chapter_content(
         self,
         chapter_title: str,
@@ -1051,6 +1540,51 @@ class GeminiProvider(AIServiceProvider):
 
     # ==================== 元数据生成 ====================
 
+    @staticmethod
+    def _build_characters_prompt(title: str, genre: str, synopsis: str, outline: str) -> str:
+        """角色列表提示词（流式与非流式共用）"""
+        return f"""基于以下小说信息，生成主要角色列表（3-8个角色）：
+标题：{title}
+类型：{genre}
+简介：{synopsis}
+大纲：{outline[:1000]}
+
+请为每个角色生成详细信息。仅返回 JSON 数组，每个对象包含以下键：
+- "name"（姓名）
+- "age"（年龄）
+- "role"（角色定位，如：主角、反派、配角等）
+- "personality"（性格特征）
+- "background"（背景故事）
+- "goals"（目标和动机）"""
+
+    @staticmethod
+    def _build_world_settings_prompt(title: str, genre: str, synopsis: str, outline: str) -> str:
+        """世界观设定提示词（流式与非流式共用）"""
+        return f"""基于以下小说信息，生成世界观设定列表（5-10个设定）：
+标题：{title}
+类型：{genre}
+简介：{synopsis}
+大纲：{outline[:1000]}
+
+请为每个设定生成详细信息。仅返回 JSON 数组，每个对象包含以下键：
+- "title"（设定标题）
+- "category"（分类：地理、社会、魔法/科技、历史、其他）
+- "description"（详细描述）"""
+
+    @staticmethod
+    def _build_timeline_events_prompt(title: str, genre: str, synopsis: str, outline: str) -> str:
+        """时间线事件提示词（流式与非流式共用）"""
+        return f"""基于以下小说信息，生成重要时间线事件列表（5-10个事件）：
+标题：{title}
+类型：{genre}
+简介：{synopsis}
+大纲：{outline[:1000]}
+
+请为每个事件生成详细信息。仅返回 JSON 数组，每个对象包含以下键：
+- "time"（时间/年代）
+- "event"（事件标题）
+- "impact"（事件影响和后果）"""
+
     async def generate_characters(
         self,
         title: str,
@@ -1064,19 +1598,7 @@ class GeminiProvider(AIServiceProvider):
             if progress_callback:
                 progress_callback.update(20, "开始生成角色列表...")
 
-            prompt = f"""基于以下小说信息，生成主要角色列表（3-8个角色）：
-标题：{title}
-类型：{genre}
-简介：{synopsis}
-大纲：{outline[:1000]}
-
-请为每个角色生成详细信息。仅返回 JSON 数组，每个对象包含以下键：
-- "name"（姓名）
-- "age"（年龄）
-- "role"（角色定位，如：主角、反派、配角等）
-- "personality"（性格特征）
-- "background"（背景故事）
-- "goals"（目标和动机）"""
+            prompt = self._build_characters_prompt(title, genre, synopsis, outline)
 
             if progress_callback:
                 progress_callback.update(50, "正在调用 AI 生成角色...")
@@ -1121,16 +1643,7 @@ class GeminiProvider(AIServiceProvider):
             if progress_callback:
                 progress_callback.update(20, "开始生成世界观设定...")
 
-            prompt = f"""基于以下小说信息，生成世界观设定列表（5-10个设定）：
-标题：{title}
-类型：{genre}
-简介：{synopsis}
-大纲：{outline[:1000]}
-
-请为每个设定生成详细信息。仅返回 JSON 数组，每个对象包含以下键：
-- "title"（设定标题）
-- "category"（分类：地理、社会、魔法/科技、历史、其他）
-- "description"（详细描述）"""
+            prompt = self._build_world_settings_prompt(title, genre, synopsis, outline)
 
             if progress_callback:
                 progress_callback.update(50, "正在调用 AI 生成世界观...")
@@ -1175,16 +1688,7 @@ class GeminiProvider(AIServiceProvider):
             if progress_callback:
                 progress_callback.update(20, "开始生成时间线事件...")
 
-            prompt = f"""基于以下小说信息，生成重要时间线事件列表（5-10个事件）：
-标题：{title}
-类型：{genre}
-简介：{synopsis}
-大纲：{outline[:1000]}
-
-请为每个事件生成详细信息。仅返回 JSON 数组，每个对象包含以下键：
-- "time"（时间/年代）
-- "event"（事件标题）
-- "impact"（事件影响和后果）"""
+            prompt = self._build_timeline_events_prompt(title, genre, synopsis, outline)
 
             if progress_callback:
                 progress_callback.update(50, "正在调用 AI 生成时间线...")
@@ -1216,6 +1720,42 @@ class GeminiProvider(AIServiceProvider):
         except Exception as e:
             raise Exception(f"生成时间线事件失败: {str(e)}")
 
+    async def generate_characters_stream(
+        self,
+        title: str,
+        genre: str,
+        synopsis: str,
+        outline: str
+    ) -> AsyncGenerator[str, None]:
+        """生成角色列表（流式，每个角色生成完即输出）"""
+        prompt = self._build_characters_prompt(title, genre, synopsis, outline)
+        async for event in self._stream_json_items(prompt, "生成角色列表", key="characters"):
+            yield event
+
+    async def generate_world_settings_stream(
+        self,
+        title: str,
+        genre: str,
+        synopsis: str,
+        outline: str
+    ) -> AsyncGenerator[str, None]:
+        """生成世界观设定（流式，每个设定生成完即输出）"""
+        prompt = self._build_world_settings_prompt(title, genre, synopsis, outline)
+        async for event in self._stream_json_items(prompt, "生成世界观设定", key="settings"):
+            yield event
+
+    async def generate_timeline_events_stream(
+        self,
+        title: str,
+        genre: str,
+        synopsis: str,
+        outline: str
+    ) -> AsyncGenerator[str, None]:
+        """生成时间线事件（流式，每个事件生成完即输出）"""
+        prompt = self._build_timeline_events_prompt(title, genre, synopsis, outline)
+        async for event in self._stream_json_items(prompt, "生成时间线事件", key="events"):
+            yield event
+
     async def generate_character_relations(
         self,
         title: str,
@@ -1274,6 +1814,7 @@ class GeminiProvider(AIServiceProvider):
         except Exception as e:
             raise Exception(f"生成角色关系失败: {str(e)}")
 
+    @cacheable_response
     async def generate_foreshadowings_from_outline(
         self,
         full_outline: str,
@@ -1321,6 +1862,7 @@ class GeminiProvider(AIServiceProvider):
 
     # ==================== 内容提取 ====================
 
+    @cacheable_response
     async def extract_foreshadowings_from_chapter(
         self,
         chapter_content: str
@@ -1364,6 +1906,7 @@ class GeminiProvider(AIServiceProvider):
         except Exception as e:
             raise Exception(f"提取伏笔失败: {str(e)}")
 
+    @cacheable_response
     async def extract_next_chapter_hook(
         self,
         chapter_content: str
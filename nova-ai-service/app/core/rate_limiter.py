@@ -0,0 +1,619 @@
+"""上游自适应限流
+
+按 (提供商, 模型, API Key) 维护令牌桶 + AIMD 并发上限：
+- 令牌桶控制请求速率；遇到 429/503 时速率减半，并按 Retry-After 暂停整个桶，之后随时间线性恢复
+- 并发上限成功时加性增长（每次 +1/limit），被限流时乘性减半
+令牌桶默认在进程内存中；配置 RATE_LIMIT_DB_PATH 后放在本地 SQLite（BEGIN IMMEDIATE 串行化），
+同一台机器上的多个 worker 进程共享同一个桶。SQLite 文件只在单机内共享，多台主机各自限流，
+部署到多台主机时需要按主机数拆分配额。
+"""
+
+import asyncio
+import hashlib
+import inspect
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 被限流时速率最低降到基准速率的比例
+MIN_RATE_FACTOR = 0.1
+# 速率每秒恢复基准速率的比例（加性恢复）
+RATE_RECOVERY_PER_SECOND = 0.05
+# 两次乘性减小之间的最短间隔（同一波 429 只减一次）
+DECREASE_INTERVAL_SECONDS = 1.0
+# 没有 Retry-After 时的默认暂停时间
+DEFAULT_THROTTLE_PAUSE_SECONDS = 2.0
+# 等待时单次休眠上限
+MAX_SLEEP_SECONDS = 0.5
+# 异步等待并发槽的轮询间隔
+SLOT_POLL_SECONDS = 0.05
+
+_RETRY_DELAY_PATTERN = re.compile(
+    r"retry(?:[ _-]?(?:delay|after)|\s+in)['\"]?\s*[:=]?\s*['\"]?(\d+(?:\.\d+)?)\s*s",
+    re.IGNORECASE
+)
+
+
+class RateLimitTimeout(Exception):
+    """等待上游配额超时"""
+
+
+def api_key_fingerprint(api_key: Optional[str]) -> str:
+    """API Key 指纹（只用于区分限流桶，不记录原文）"""
+    if not api_key:
+        return "-"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for candidate in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if isinstance(candidate, int):
+            return candidate
+    return None
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """是否为上游限流/过载错误（429 / 503）"""
+    status = _status_code(error)
+    if status is not None:
+        return status in (429, 503)
+    message = str(error).upper()
+    return any(marker in message for marker in ("429", "RESOURCE_EXHAUSTED", "503", "UNAVAILABLE", "RATE LIMIT"))
+
+
+def retry_after_from_error(error: BaseException) -> Optional[float]:
+    """从 Retry-After 响应头或错误信息（如 retryDelay: "7s"）中解析建议等待秒数"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = None
+    if headers is not None:
+        try:
+            value = headers.get("Retry-After") or headers.get("retry-after")
+        except Exception:
+            value = None
+    if value:
+        value = str(value).strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except Exception:
+                pass
+
+    match = _RETRY_DELAY_PATTERN.search(str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def _in_event_loop_thread() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class _OffloadedWorker:
+    """路由层为阻塞型提供商开的工作线程（线程内独立事件循环），记录本线程占用的并发槽"""
+
+    def __init__(self):
+        self.held = 0
+
+
+_offloaded_worker: ContextVar[Optional[_OffloadedWorker]] = ContextVar("rate_limit_offloaded_worker", default=None)
+
+
+def run_offloaded(fn, *args, **kwargs):
+    """在工作线程中执行 fn，并标记该线程不是服务的事件循环线程
+
+    这类线程里的独立事件循环只服务当前请求，阻塞等待并发槽与令牌不会卡住其他请求，
+    因此 acquire_sync 照常执行自适应并发上限。
+    """
+    token = _offloaded_worker.set(_OffloadedWorker())
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _offloaded_worker.reset(token)
+
+
+# ==================== 令牌桶状态 ====================
+
+def _new_state(now: float, base_rate: float, burst: int) -> Dict[str, float]:
+    return {"tokens": float(burst), "rate": base_rate, "updated_at": now, "blocked_until": 0.0}
+
+
+def _refill(state: Dict[str, float], now: float, base_rate: float, burst: int) -> None:
+    elapsed = max(0.0, now - state["updated_at"])
+    state["rate"] = min(base_rate, state["rate"] + base_rate * RATE_RECOVERY_PER_SECOND * elapsed)
+    state["tokens"] = min(float(burst), state["tokens"] + elapsed * state["rate"])
+    state["updated_at"] = now
+
+
+def _take(state: Dict[str, float], now: float, base_rate: float, burst: int) -> float:
+    """尝试取一个令牌，返回需要等待的秒数（0 表示已取得）"""
+    _refill(state, now, base_rate, burst)
+    if now < state["blocked_until"]:
+        return state["blocked_until"] - now
+    if state["tokens"] >= 1:
+        state["tokens"] -= 1
+        return 0.0
+    return (1 - state["tokens"]) / max(state["rate"], 1e-6)
+
+
+def _penalize(state: Dict[str, float], now: float, base_rate: float, burst: int, pause: float) -> None:
+    """乘性减小速率，清空令牌并暂停整个桶"""
+    _refill(state, now, base_rate, burst)
+    state["rate"] = max(base_rate * MIN_RATE_FACTOR, state["rate"] / 2)
+    state["tokens"] = min(state["tokens"], 0.0)
+    state["blocked_until"] = max(state["blocked_until"], now + pause)
+
+
+class MemoryBucketStore:
+    """进程内令牌桶存储"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, float]] = {}
+
+    def _state(self, key: str, now: float, base_rate: float, burst: int) -> Dict[str, float]:
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _new_state(now, base_rate, burst)
+        return state
+
+    def take(self, key: str, base_rate: float, burst: int) -> float:
+        with self._lock:
+            now = time.time()
+            return _take(self._state(key, now, base_rate, burst), now, base_rate, burst)
+
+    def penalize(self, key: str, base_rate: float, burst: int, pause: float) -> None:
+        with self._lock:
+            now = time.time()
+            _penalize(self._state(key, now, base_rate, burst), now, base_rate, burst, pause)
+
+    def peek(self, key: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            state = self._states.get(key)
+            return dict(state) if state else None
+
+
+class SQLiteBucketStore:
+    """SQLite 令牌桶存储（同机多个 worker 进程共享）
+
+    每次读写用 BEGIN IMMEDIATE 取得写锁，串行化所有进程对桶的修改。
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                rate REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+    def _mutate(self, key: str, base_rate: float, burst: int, apply):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT tokens, rate, updated_at, blocked_until FROM rate_buckets WHERE bucket_key = ?",
+                    (key,)
+                ).fetchone()
+                if row:
+                    state = {"tokens": row[0], "rate": row[1], "updated_at": row[2], "blocked_until": row[3]}
+                else:
+                    state = _new_state(now, base_rate, burst)
+                result = apply(state, now)
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO rate_buckets (bucket_key, tokens, rate, updated_at, blocked_until)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (key, state["tokens"], state["rate"], state["updated_at"], state["blocked_until"])
+                )
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def take(self, key: str, base_rate: float, burst: int) -> float:
+        return self._mutate(key, base_rate, burst, lambda state, now: _take(state, now, base_rate, burst))
+
+    def penalize(self, key: str, base_rate: float, burst: int, pause: float) -> None:
+        self._mutate(key, base_rate, burst, lambda state, now: _penalize(state, now, base_rate, burst, pause))
+
+    def peek(self, key: str) -> Optional[Dict[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tokens, rate, updated_at, blocked_until FROM rate_buckets WHERE bucket_key = ?",
+                (key,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"tokens": row[0], "rate": row[1], "updated_at": row[2], "blocked_until": row[3]}
+
+
+# ==================== 限流器 ====================
+
+class AdaptiveRateLimiter:
+    """令牌桶 + AIMD 并发控制的上游限流器（同时支持同步与异步调用方）"""
+
+    def __init__(
+        self,
+        key: str,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        store=None,
+        max_wait_seconds: Optional[float] = None
+    ):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.store = store or MemoryBucketStore()
+        self.max_wait_seconds = max_wait_seconds
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"acquired": 0, "throttled": 0, "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    def _try_enter(self, force: bool = False) -> bool:
+        with self._lock:
+            if force or self.in_flight < max(1, int(self.concurrency_limit)):
+                self.in_flight += 1
+                worker = _offloaded_worker.get()
+                if worker is not None:
+                    worker.held += 1
+                return True
+            return False
+
+    def _take_token(self) -> float:
+        try:
+            return self.store.take(self.key, self.rate, self.burst)
+        except Exception as e:
+            # 共享存储不可用时不阻塞业务，只靠并发上限兜底
+            logger.warning(f"⚠️  限流存储不可用，跳过令牌桶: {str(e)}")
+            return 0.0
+
+    def _check_deadline(self, deadline: Optional[float], wait: float = 0.0) -> None:
+        if deadline is not None and time.monotonic() + wait > deadline:
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise RateLimitTimeout(f"等待上游配额超时: {self.key}")
+
+    def _record_wait(self, start: float) -> None:
+        waited_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self.stats["acquired"] += 1
+            self.stats["wait_ms_total"] += waited_ms
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], waited_ms)
+
+    def _deadline(self, start: float) -> Optional[float]:
+        return start + self.max_wait_seconds if self.max_wait_seconds else None
+
+    def acquire_sync(self) -> None:
+        """同步占用并发槽并取得令牌
+
+        在事件循环线程里被调用时（同步 Gemini 客户端），不等待并发槽：
+        持有槽的流只有事件循环继续运行才会释放，在这里阻塞等待会死锁；
+        也不休眠等待令牌，拿不到令牌立即抛出 RateLimitTimeout，以免一个被限流的请求冻结整个事件循环。
+        路由工作线程（run_offloaded）不是服务的事件循环，照常等待；只有本线程已占着槽（同一循环里
+        交错的多个流）时才不等待并发槽，避免自己等自己。
+        """
+        start = time.monotonic()
+        deadline = self._deadline(start)
+        worker = _offloaded_worker.get()
+        in_loop = _in_event_loop_thread() and worker is None
+        force = in_loop or (worker is not None and worker.held > 0)
+        with self._lock:
+            self.waiting += 1
+        try:
+            while not self._try_enter(force=force):
+                self._check_deadline(deadline)
+                time.sleep(SLOT_POLL_SECONDS)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        try:
+            while True:
+                wait = self._take_token()
+                if wait <= 0:
+                    break
+                if in_loop:
+                    with self._lock:
+                        self.stats["timeouts"] += 1
+                    raise RateLimitTimeout(f"上游配额不足（事件循环线程内不等待令牌）: {self.key}")
+                self._check_deadline(deadline, wait)
+                time.sleep(min(wait, MAX_SLEEP_SECONDS))
+        except BaseException:
+            self.release()
+            raise
+        self._record_wait(start)
+
+    async def acquire_async(self) -> None:
+        """异步占用并发槽并取得令牌"""
+        start = time.monotonic()
+        deadline = self._deadline(start)
+        with self._lock:
+            self.waiting += 1
+        try:
+            while not self._try_enter():
+                self._check_deadline(deadline)
+                await asyncio.sleep(SLOT_POLL_SECONDS)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        try:
+            while True:
+                wait = self._take_token()
+                if wait <= 0:
+                    break
+                self._check_deadline(deadline, wait)
+                await asyncio.sleep(min(wait, MAX_SLEEP_SECONDS))
+        except BaseException:
+            self.release()
+            raise
+        self._record_wait(start)
+
+    def release(self) -> None:
+        """归还并发槽"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            worker = _offloaded_worker.get()
+            if worker is not None:
+                worker.held = max(0, worker.held - 1)
+
+    def on_success(self) -> None:
+        """成功：并发上限加性增长"""
+        with self._lock:
+            self.concurrency_limit = min(
+                float(self.max_concurrency),
+                self.concurrency_limit + 1.0 / max(self.concurrency_limit, 1.0)
+            )
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        """被限流：并发上限与速率乘性减小，并按 Retry-After 暂停"""
+        pause = retry_after if retry_after is not None else DEFAULT_THROTTLE_PAUSE_SECONDS
+        now = time.monotonic()
+        with self._lock:
+            self.stats["throttled"] += 1
+            if now - self._last_decrease < DECREASE_INTERVAL_SECONDS:
+                return
+            self._last_decrease = now
+            self.concurrency_limit = max(float(self.min_concurrency), self.concurrency_limit / 2)
+        try:
+            self.store.penalize(self.key, self.rate, self.burst, pause)
+        except Exception as e:
+            logger.warning(f"⚠️  限流存储不可用，无法记录限流: {str(e)}")
+        logger.warning(f"⚠️  上游限流: {self.key}, 暂停 {pause:.1f}s, 并发上限 {self.concurrency_limit:.1f}")
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """结束一次调用：归还并发槽，并按结果调整限额"""
+        self.release()
+        if error is None:
+            self.on_success()
+        elif isinstance(error, Exception) and is_throttle_error(error):
+            self.on_throttle(retry_after_from_error(error))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前限额与排队指标"""
+        with self._lock:
+            acquired = self.stats["acquired"]
+            data = {
+                "key": self.key,
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "base_rate": self.rate,
+                "burst": self.burst,
+                "acquired": acquired,
+                "throttled": self.stats["throttled"],
+                "timeouts": self.stats["timeouts"],
+                "queue_wait_ms_avg": round(self.stats["wait_ms_total"] / acquired, 2) if acquired else 0.0,
+                "queue_wait_ms_max": round(self.stats["wait_ms_max"], 2),
+            }
+        try:
+            state = self.store.peek(self.key)
+        except Exception:
+            state = None
+        if state:
+            data["current_rate"] = round(state["rate"], 3)
+            data["tokens"] = round(state["tokens"], 2)
+            data["blocked_for_seconds"] = round(max(0.0, state["blocked_until"] - time.time()), 2)
+        return data
+
+
+# ==================== 进程级登记表 ====================
+
+_limiters: Dict[Tuple[str, str, str], AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+_store = None
+
+
+def parse_rate_limits(raw: str) -> Dict[str, Tuple[float, int, int]]:
+    """解析 "名称:每秒请求数:突发容量:最大并发" 逗号分隔的限额配置"""
+    limits = {}
+    for item in (raw or "").split(","):
+        parts = [p.strip() for p in item.split(":")]
+        if len(parts) != 4 or not parts[0]:
+            continue
+        try:
+            limits[parts[0].lower()] = (float(parts[1]), int(parts[2]), int(parts[3]))
+        except ValueError:
+            logger.warning(f"⚠️  忽略无效的限流配置: {item}")
+    return limits
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        if settings.RATE_LIMIT_DB_PATH:
+            try:
+                _store = SQLiteBucketStore(settings.RATE_LIMIT_DB_PATH)
+                logger.info(f"✅ 上游限流使用共享令牌桶: {settings.RATE_LIMIT_DB_PATH}")
+            except Exception as e:
+                logger.warning(f"⚠️  共享令牌桶初始化失败，使用进程内令牌桶: {str(e)}")
+        if _store is None:
+            _store = MemoryBucketStore()
+    return _store
+
+
+def get_rate_limiter(provider: str, model: str = "", api_key: Optional[str] = None) -> AdaptiveRateLimiter:
+    """获取 (提供商, 模型, API Key) 对应的限流器"""
+    provider = (provider or "").lower()
+    ident = (provider, model or "", api_key_fingerprint(api_key))
+    with _limiters_lock:
+        limiter = _limiters.get(ident)
+        if limiter is None:
+            limits = parse_rate_limits(settings.RATE_LIMITS)
+            model_name = (model or "").split("/")[-1]
+            rate, burst, concurrency = next(
+                (limits[name] for name in (f"{provider}/{model_name}", provider, "default") if name in limits),
+                (2.0, 5, 4)
+            )
+            limiter = AdaptiveRateLimiter(
+                key=":".join(ident),
+                rate=rate,
+                burst=burst,
+                max_concurrency=concurrency,
+                store=_get_store(),
+                max_wait_seconds=settings.RATE_LIMIT_MAX_WAIT_SECONDS or None,
+            )
+            _limiters[ident] = limiter
+        return limiter
+
+
+def get_rate_limiter_stats() -> List[Dict[str, Any]]:
+    """所有限流器的指标"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.snapshot() for limiter in limiters]
+
+
+# ==================== 客户端包装 ====================
+
+class RateLimitedModels:
+    """包装提供商客户端的 models 接口，每次上游调用前取得配额，结束后按结果调整限额"""
+
+    def __init__(self, inner, provider_name: str, api_key: Optional[str] = None):
+        self._inner = inner
+        self._provider_name = provider_name
+        self._api_key = api_key
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _limiter(self, model: str) -> AdaptiveRateLimiter:
+        return get_rate_limiter(self._provider_name, model, self._api_key)
+
+    def generate_content(self, model: str, contents: Any, config: Optional[Dict] = None, **kwargs):
+        limiter = self._limiter(model)
+
+        if inspect.iscoroutinefunction(self._inner.generate_content):
+            async def _call():
+                await limiter.acquire_async()
+                try:
+                    response = await self._inner.generate_content(model=model, contents=contents, config=config, **kwargs)
+                except BaseException as e:
+                    limiter.finish(e)
+                    raise
+                limiter.finish()
+                return response
+            return _call()
+
+        limiter.acquire_sync()
+        try:
+            response = self._inner.generate_content(model=model, contents=contents, config=config, **kwargs)
+        except BaseException as e:
+            limiter.finish(e)
+            raise
+        limiter.finish()
+        return response
+
+    def generate_content_stream(self, model: str, contents: Any, config: Optional[Dict] = None, **kwargs):
+        limiter = self._limiter(model)
+
+        # 流式调用在整个迭代期间占用并发槽
+        if inspect.isasyncgenfunction(self._inner.generate_content_stream):
+            async def _stream():
+                await limiter.acquire_async()
+                try:
+                    async for chunk in self._inner.generate_content_stream(
+                        model=model, contents=contents, config=config, **kwargs
+                    ):
+                        yield chunk
+                except BaseException as e:
+                    limiter.finish(e)
+                    raise
+                limiter.finish()
+            return _stream()
+
+        def _stream_sync():
+            limiter.acquire_sync()
+            try:
+                for chunk in self._inner.generate_content_stream(
+                    model=model, contents=contents, config=config, **kwargs
+                ):
+                    yield chunk
+            except BaseException as e:
+                limiter.finish(e)
+                raise
+            limiter.finish()
+        return _stream_sync()
+
+
+class _RateLimitedClient:
+    """代理提供商客户端，只替换 models 接口，其余属性透传"""
+
+    def __init__(self, inner, models: RateLimitedModels):
+        self._inner = inner
+        self.models = models
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def enable_rate_limit(provider, provider_name: str) -> None:
+    """为提供商实例启用上游限流（应最先包装，只统计真正发往上游的调用）"""
+    client = getattr(provider, "client", None)
+    if client is None or isinstance(getattr(client, "models", None), RateLimitedModels):
+        return
+    models = getattr(client, "models", None)
+    if models is None:
+        return
+    provider.client = _RateLimitedClient(
+        client, RateLimitedModels(models, provider_name, getattr(provider, "api_key", None))
+    )
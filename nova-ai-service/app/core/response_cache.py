@@ -0,0 +1,349 @@
+"""模型响应缓存（可选）
+
+后端重试、重复的「总结章节」Agent 运行、重复提交的大纲请求都会向提供商发送完全相同的提示词。
+开启后，按 (提供商, 模型, 提示词摘要, 生成参数) 缓存完整响应：
+- 内存层：有界 LRU，带 TTL
+- 持久层：本地 SQLite 表，带 TTL 与总大小淘汰
+流式接口命中缓存时按分片重放，调用方仍然得到 SSE 流。
+只缓存确定性调用：temperature 为 0，或在标记了 @cacheable_response 的提供商方法内
+（摘要、从已有内容中抽取信息）。带采样温度的创作类调用（写章节、续写、生成大纲）每次都请求上游，
+否则「重新生成」会在 TTL 内重放同一份结果。
+请求头 X-Cache-Bypass: true（或 Cache-Control: no-cache）可跳过缓存。
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 流式重放时每个分片的字符数
+REPLAY_CHUNK_CHARS = 200
+
+
+def make_cache_key(provider: str, model: str, contents: Any, config: Optional[Dict]) -> str:
+    """计算缓存键：提供商 + 模型 + 提示词摘要 + 生成参数"""
+    prompt = contents if isinstance(contents, str) else json.dumps(contents, ensure_ascii=False, default=str)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    config_text = json.dumps(config or {}, ensure_ascii=False, sort_keys=True, default=str)
+    raw = f"{provider}\n{model}\n{prompt_hash}\n{config_text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# 当前调用链是否在 @cacheable_response 方法内（asyncio.to_thread 会复制上下文，同步客户端同样可见）
+_cache_opt_in: ContextVar[bool] = ContextVar("response_cache_opt_in", default=False)
+
+
+def cacheable_response(func):
+    """标记确定性用途的提供商方法（摘要、信息抽取）：方法内的模型调用即使带采样温度也可缓存"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _cache_opt_in.set(True)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _cache_opt_in.reset(token)
+    return wrapper
+
+
+def is_cacheable_call(config: Any) -> bool:
+    """temperature 为 0 的调用，或处于 @cacheable_response 方法内的调用可缓存"""
+    if _cache_opt_in.get():
+        return True
+    temperature = config.get("temperature") if isinstance(config, dict) else getattr(config, "temperature", None)
+    try:
+        return temperature is not None and float(temperature) == 0
+    except (TypeError, ValueError):
+        return False
+
+
+class ResponseCache:
+    """两级响应缓存（内存 LRU + SQLite）"""
+
+    def __init__(
+        self,
+        ttl_seconds: int = 86400,
+        memory_max_entries: int = 512,
+        db_path: Optional[str] = None,
+        db_max_bytes: int = 256 * 1024 * 1024
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.memory_max_entries = memory_max_entries
+        self.db_path = db_path
+        self.db_max_bytes = db_max_bytes
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if db_path:
+            self._init_db(db_path)
+
+    def _init_db(self, db_path: str) -> None:
+        try:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache(last_access)"
+            )
+            self._conn.commit()
+            logger.info(f"✅ 响应缓存持久层已启用: {db_path}")
+        except Exception as e:
+            logger.warning(f"⚠️  响应缓存持久层初始化失败，仅使用内存缓存: {str(e)}")
+            self._conn = None
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存（内存未命中时回落到 SQLite，并回填内存层）"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT response, expires_at FROM response_cache WHERE cache_key = ?",
+                        (key,)
+                    ).fetchone()
+                    if row and row[1] > now:
+                        self._conn.execute(
+                            "UPDATE response_cache SET last_access = ? WHERE cache_key = ?",
+                            (now, key)
+                        )
+                        self._conn.commit()
+                        self._remember(key, row[0], row[1])
+                        self.stats["disk_hits"] += 1
+                        return row[0]
+                    if row:
+                        self._conn.execute("DELETE FROM response_cache WHERE cache_key = ?", (key,))
+                        self._conn.commit()
+                except Exception as e:
+                    logger.warning(f"⚠️  读取响应缓存失败: {str(e)}")
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str, provider: str = "", model: str = "") -> None:
+        """写入缓存（空响应不缓存）"""
+        if not value:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self.stats["stores"] += 1
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO response_cache
+                    (cache_key, provider, model, response, size, created_at, expires_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, provider, model, value, len(value.encode("utf-8")), now, expires_at, now)
+                )
+                self._evict_disk(now)
+                self._conn.commit()
+            except Exception as e:
+                logger.warning(f"⚠️  写入响应缓存失败: {str(e)}")
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self, now: float) -> None:
+        """删除过期记录，并按最近访问时间淘汰到总大小以内"""
+        self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+        if total <= self.db_max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT cache_key, size FROM response_cache ORDER BY last_access ASC"
+        ).fetchall()
+        for cache_key, size in rows:
+            if total <= self.db_max_bytes:
+                break
+            self._conn.execute("DELETE FROM response_cache WHERE cache_key = ?", (cache_key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            disk_entries = 0
+            if self._conn is not None:
+                try:
+                    disk_entries = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+                except Exception:
+                    pass
+            return {**self.stats, "memory_entries": len(self._memory), "disk_entries": disk_entries}
+
+
+class CachedResponse:
+    """形如 Gemini 响应的缓存结果（只需要 .text）"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _replay_chunks(text: str):
+    for start in range(0, len(text), REPLAY_CHUNK_CHARS):
+        yield CachedResponse(text[start:start + REPLAY_CHUNK_CHARS])
+
+
+class CachingModels:
+    """包装提供商客户端的 models 接口，在 generate_content / generate_content_stream 外加一层缓存（仅确定性调用）
+
+    同时兼容同步客户端（Gemini）与异步客户端（DeepSeek），返回值形态与被包装的客户端一致。
+    """
+
+    def __init__(self, inner, cache: ResponseCache, provider_name: str):
+        self._inner = inner
+        self._cache = cache
+        self._provider_name = provider_name
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _key(self, model: str, contents: Any, config: Optional[Dict]) -> str:
+        return make_cache_key(self._provider_name, model, contents, config)
+
+    def generate_content(self, model: str, contents: Any, config: Optional[Dict] = None, **kwargs):
+        if not is_cacheable_call(config):
+            return self._inner.generate_content(model=model, contents=contents, config=config, **kwargs)
+        key = self._key(model, contents, config)
+        cached = self._cache.get(key)
+        is_async = inspect.iscoroutinefunction(self._inner.generate_content)
+
+        if cached is not None:
+            logger.info(f"✅ 响应缓存命中: provider={self._provider_name}, model={model}")
+            if is_async:
+                async def _hit():
+                    return CachedResponse(cached)
+                return _hit()
+            return CachedResponse(cached)
+
+        if is_async:
+            async def _call():
+                response = await self._inner.generate_content(model=model, contents=contents, config=config, **kwargs)
+                self._cache.set(key, getattr(response, "text", "") or "", self._provider_name, model)
+                return response
+            return _call()
+
+        response = self._inner.generate_content(model=model, contents=contents, config=config, **kwargs)
+        self._cache.set(key, getattr(response, "text", "") or "", self._provider_name, model)
+        return response
+
+    def generate_content_stream(self, model: str, contents: Any, config: Optional[Dict] = None, **kwargs):
+        if not is_cacheable_call(config):
+            return self._inner.generate_content_stream(model=model, contents=contents, config=config, **kwargs)
+        key = self._key(model, contents, config)
+        cached = self._cache.get(key)
+        is_async = inspect.isasyncgenfunction(self._inner.generate_content_stream)
+
+        if cached is not None:
+            logger.info(f"✅ 响应缓存命中（流式重放）: provider={self._provider_name}, model={model}")
+            if is_async:
+                async def _replay():
+                    for chunk in _replay_chunks(cached):
+                        yield chunk
+                return _replay()
+            return _replay_chunks(cached)
+
+        if is_async:
+            async def _stream():
+                parts = []
+                async for chunk in self._inner.generate_content_stream(
+                    model=model, contents=contents, config=config, **kwargs
+                ):
+                    if getattr(chunk, "text", None):
+                        parts.append(chunk.text)
+                    yield chunk
+                self._cache.set(key, "".join(parts), self._provider_name, model)
+            return _stream()
+
+        def _stream_sync():
+            parts = []
+            for chunk in self._inner.generate_content_stream(
+                model=model, contents=contents, config=config, **kwargs
+            ):
+                if getattr(chunk, "text", None):
+                    parts.append(chunk.text)
+                yield chunk
+            # 只有完整读完的流才写入缓存
+            self._cache.set(key, "".join(parts), self._provider_name, model)
+        return _stream_sync()
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """获取进程级响应缓存（单例）"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+            memory_max_entries=settings.RESPONSE_CACHE_MEMORY_MAX_ENTRIES,
+            db_path=settings.RESPONSE_CACHE_DB_PATH or None,
+            db_max_bytes=settings.RESPONSE_CACHE_DB_MAX_MB * 1024 * 1024,
+        )
+    return _response_cache
+
+
+class _CachingClient:
+    """代理提供商客户端，只替换 models 接口，其余属性（如 caches）透传"""
+
+    def __init__(self, inner, models: CachingModels):
+        self._inner = inner
+        self.models = models
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def enable_response_cache(provider, provider_name: str) -> None:
+    """为提供商实例启用响应缓存（包装其客户端的 models 接口）"""
+    client = getattr(provider, "client", None)
+    if client is None or isinstance(getattr(client, "models", None), CachingModels):
+        return
+    models = getattr(client, "models", None)
+    if models is None:
+        return
+    provider.client = _CachingClient(client, CachingModels(models, get_response_cache(), provider_name))
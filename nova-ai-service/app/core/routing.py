@@ -0,0 +1,634 @@
+"""提供商路由：延迟预算、健康评分、熔断、故障转移与对冲请求
+
+每个请求原本固定使用一个提供商（X-Provider 或 DEFAULT_AI_PROVIDER），Gemini 变慢或被地区限制时
+只能等到 GEMINI_TIMEOUT_MS 后失败。路由层在提供商实例外包一层：
+- 每种操作有延迟预算（流式操作为首个分片的等待时间）；超出预算只触发向下一个提供商的故障转移，
+  慢的那次调用不会被取消，先成功者胜出；计划中没有备用提供商时不设预算，只受提供商自身超时约束
+- 按提供商维护滚动窗口内的错误率与延迟，计算健康分；连续失败触发熔断，冷却后半开探测
+- 失败或超出预算后切换到下一个可用提供商（流式只在尚未输出内容时切换）
+- 短操作（钩子提取、摘要等）可选对冲：主请求超过对冲延迟仍未返回时向第二个提供商发同样的请求，先成功者胜出
+路由结果写入响应头（X-Routed-Provider / X-Route-Attempts / X-Route-Hedged）；流式响应的响应头在首个分片前
+已经发出，改为在首个内容分片前输出一条 route 事件。统计见 /health/routing。
+
+Gemini 客户端是同步调用，会阻塞事件循环，超时与对冲都无法生效；因此路由层把 blocking_client
+提供商的调用放到工作线程（线程内独立事件循环）执行。被放弃的线程调用无法中断，只会被丢弃结果。
+工作线程通过 run_offloaded 标记，限流器在其中照常等待并发槽与令牌，不会绕过自适应并发上限。
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.core.rate_limiter import run_offloaded
+
+logger = logging.getLogger(__name__)
+
+# 非流式的路由操作
+CALL_OPERATIONS = {
+    "generate_full_outline",
+    "generate_volume_outline",
+    "generate_chapter_outline",
+    "modify_outline_by_dialogue",
+    "write_chapter_content",
+    "summarize_chapter_content",
+    "generate_characters",
+    "generate_world_settings",
+    "generate_timeline_events",
+    "generate_character_relations",
+    "generate_foreshadowings_from_outline",
+    "extract_foreshadowings_from_chapter",
+    "extract_next_chapter_hook",
+}
+# 流式的路由操作（预算为首个分片的等待时间）
+STREAM_OPERATIONS = {
+    "generate_volume_outline_stream",
+    "write_chapter_content_stream",
+    "generate_chapter_outline_stream",
+    "generate_characters_stream",
+    "generate_world_settings_stream",
+    "generate_timeline_events_stream",
+    "write_chapter_scenes_stream",
+}
+
+_FATAL_MARKERS = ("location is not supported", "FAILED_PRECONDITION")
+
+
+def parse_budgets(raw: str) -> Dict[str, float]:
+    """解析 "操作:秒数" 逗号分隔的延迟预算"""
+    budgets = {}
+    for item in (raw or "").split(","):
+        name, _, value = item.partition(":")
+        try:
+            if name.strip():
+                budgets[name.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"⚠️  忽略无效的延迟预算: {item}")
+    return budgets
+
+
+def _is_fatal(error: BaseException) -> bool:
+    """地区限制等短时间内不会恢复的错误"""
+    message = str(error)
+    return any(marker in message for marker in _FATAL_MARKERS)
+
+
+def _describe(error: Optional[BaseException]) -> str:
+    if error is None or isinstance(error, asyncio.TimeoutError):
+        return "超出延迟预算"
+    return str(error) or type(error).__name__
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class ProviderHealth:
+    """单个提供商的滚动健康统计与熔断器"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window: int = 50, failure_threshold: int = 5, open_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.window = window
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.probe_in_flight = False
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """熔断器是否放行（打开状态冷却结束后放行一个探测请求）"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() >= self.opened_until:
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            # 探测名额被占用后若迟迟没有结果（例如排在计划后面、没有真正发出），冷却期后重新放行
+            probe_stale = time.time() - self.probe_started > self.open_seconds
+            if self.state == self.HALF_OPEN and (not self.probe_in_flight or probe_stale):
+                self.probe_in_flight = True
+                self.probe_started = time.time()
+                return True
+            return False
+
+    def record_success(self, operation: str, latency: float) -> None:
+        with self._lock:
+            self.outcomes.append(True)
+            self.latencies.setdefault(operation, deque(maxlen=self.window)).append(latency)
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                logger.info(f"✅ 提供商 {self.name} 恢复，熔断器关闭")
+            self.state = self.CLOSED
+            self.probe_in_flight = False
+
+    def record_failure(self, operation: str, latency: float, fatal: bool = False) -> None:
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if fatal or self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                # 地区限制之类的错误短时间不会恢复，熔断更久
+                duration = self.open_seconds * (10 if fatal else 1)
+                self.state = self.OPEN
+                self.opened_until = time.time() + duration
+                logger.warning(f"⚠️  提供商 {self.name} 熔断 {duration:.0f}s（连续失败 {self.consecutive_failures} 次）")
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def latency(self, operation: str, q: float = 0.5) -> Optional[float]:
+        with self._lock:
+            return _percentile(list(self.latencies.get(operation, ())), q)
+
+    def score(self, operation: str, budget: float) -> float:
+        """健康分（0~1）：成功率 × 延迟余量"""
+        success_rate = 1 - self.error_rate()
+        p50 = self.latency(operation)
+        if p50 is None or budget <= 0:
+            return success_rate
+        return success_rate * budget / (budget + p50)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            operations = {
+                op: {
+                    "p50_ms": round(_percentile(list(values), 0.5) * 1000, 1),
+                    "p95_ms": round(_percentile(list(values), 0.95) * 1000, 1),
+                    "samples": len(values),
+                }
+                for op, values in self.latencies.items() if values
+            }
+            total = len(self.outcomes)
+            return {
+                "state": self.state,
+                "error_rate": round(1 - sum(self.outcomes) / total, 3) if total else 0.0,
+                "samples": total,
+                "consecutive_failures": self.consecutive_failures,
+                "open_for_seconds": round(max(0.0, self.opened_until - time.time()), 1) if self.state == self.OPEN else 0.0,
+                "operations": operations,
+            }
+
+
+class ProviderRouter:
+    """进程级路由状态：各提供商健康度、延迟预算与路由计数"""
+
+    def __init__(
+        self,
+        budgets: Optional[Dict[str, float]] = None,
+        hedge_operations: Optional[List[str]] = None,
+        hedge_delay_seconds: float = 3.0,
+        failure_threshold: int = 5,
+        open_seconds: float = 30.0,
+    ):
+        self.budgets = budgets or {}
+        self.hedge_operations = set(hedge_operations or [])
+        self.hedge_delay_seconds = hedge_delay_seconds
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._health: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+        self.stats = {"routed": 0, "failovers": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0, "exhausted": 0}
+
+    def health(self, name: str) -> ProviderHealth:
+        with self._lock:
+            health = self._health.get(name)
+            if health is None:
+                health = self._health[name] = ProviderHealth(
+                    name, failure_threshold=self.failure_threshold, open_seconds=self.open_seconds
+                )
+            return health
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def budget(self, operation: str) -> Optional[float]:
+        value = self.budgets.get(operation, self.budgets.get("default"))
+        return value if value and value > 0 else None
+
+    def plan(self, preferred: List[str], operation: str) -> List[str]:
+        """按熔断状态与健康分排序候选提供商
+
+        默认保持调用方的偏好顺序；只有当首选的健康分不到最佳者一半时才让位。
+        所有提供商都处于熔断时仍尝试首选（强制探测），避免直接拒绝请求。
+        """
+        budget = self.budget(operation) or 60.0
+        allowed = [name for name in preferred if self.health(name).allow_request()]
+        if not allowed:
+            return preferred[:1]
+        scores = {name: self.health(name).score(operation, budget) for name in allowed}
+        best = max(scores.values())
+        return sorted(allowed, key=lambda name: (scores[name] < best * 0.5, preferred.index(name)))
+
+    def hedge_delay(self, provider: str, operation: str) -> float:
+        """对冲延迟：首选提供商该操作的 p95 延迟（无样本时用配置值），不超过预算的一半"""
+        p95 = self.health(provider).latency(operation, 0.95)
+        delay = p95 if p95 is not None else self.hedge_delay_seconds
+        budget = self.budget(operation)
+        if budget:
+            delay = min(delay, budget / 2)
+        return max(0.05, delay)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            names = list(self._health.keys())
+            stats = dict(self.stats)
+        return {
+            "stats": stats,
+            "budgets": self.budgets,
+            "hedge_operations": sorted(self.hedge_operations),
+            "providers": {name: self.health(name).snapshot() for name in names},
+        }
+
+
+_router: Optional[ProviderRouter] = None
+
+
+def get_provider_router() -> ProviderRouter:
+    """获取进程级路由状态（单例）"""
+    global _router
+    if _router is None:
+        _router = ProviderRouter(
+            budgets=parse_budgets(settings.ROUTING_LATENCY_BUDGETS),
+            hedge_operations=[
+                op.strip() for op in settings.ROUTING_HEDGE_OPERATIONS.split(",") if op.strip()
+            ] if settings.ROUTING_HEDGE_ENABLED else [],
+            hedge_delay_seconds=settings.ROUTING_HEDGE_DELAY_MS / 1000,
+            failure_threshold=settings.ROUTING_BREAKER_FAILURES,
+            open_seconds=settings.ROUTING_BREAKER_OPEN_SECONDS,
+        )
+    return _router
+
+
+# ==================== 执行方式 ====================
+
+async def _run_call(provider, operation: str, args: tuple, kwargs: dict):
+    method = getattr(provider, operation)
+    if getattr(provider, "blocking_client", False):
+        return await asyncio.to_thread(run_offloaded, lambda: asyncio.run(method(*args, **kwargs)))
+    return await method(*args, **kwargs)
+
+
+_STREAM_END = object()
+
+
+async def _iterate_stream(provider, operation: str, args: tuple, kwargs: dict):
+    """迭代提供商的流式方法；阻塞型客户端在工作线程中运行，通过队列把分片交回事件循环"""
+    method = getattr(provider, operation)
+    if not getattr(provider, "blocking_client", False):
+        async for item in method(*args, **kwargs):
+            yield item
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    async def pump():
+        agen = method(*args, **kwargs)
+        try:
+            async for item in agen:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (_STREAM_END, e))
+            return
+        finally:
+            await agen.aclose()
+        loop.call_soon_threadsafe(queue.put_nowait, (_STREAM_END, None))
+
+    worker = threading.Thread(
+        target=lambda: run_offloaded(asyncio.run, pump()), daemon=True, name=f"route-{operation}"
+    )
+    worker.start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _STREAM_END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+async def _first_chunk(stream) -> Tuple[Optional[str], Any]:
+    """等待首个内容分片，返回 (扣下的错误事件, 首个分片)；流直接结束时首个分片为 _STREAM_END
+
+    提供商在抛出异常前会先输出错误事件，先扣下确认是否紧跟异常，紧跟异常时才能切换提供商。
+    """
+    held_error_event = None
+    while True:
+        try:
+            item = await stream.__anext__()
+        except StopAsyncIteration:
+            return held_error_event, _STREAM_END
+        if _is_error_event(item) and held_error_event is None:
+            held_error_event = item
+            continue
+        return held_error_event, item
+
+
+async def _discard(task: "asyncio.Task", stream) -> None:
+    """取消落败的首分片等待并关闭其流（阻塞型客户端的工作线程在下一个分片处退出）"""
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+    try:
+        await stream.aclose()
+    except Exception as e:
+        logger.warning(f"⚠️  关闭落败的上游流失败: {str(e)}")
+
+
+def _is_error_event(chunk: Any) -> bool:
+    """提供商在抛出异常前会先输出一条 SSE 错误事件"""
+    if not isinstance(chunk, str) or not chunk.startswith("data:"):
+        return False
+    try:
+        payload = json.loads(chunk[len("data:"):].strip())
+    except (TypeError, ValueError):
+        return False
+    return isinstance(payload, dict) and "error" in payload
+
+
+# ==================== 路由提供商 ====================
+
+class RoutedProvider:
+    """按路由策略把操作分派到候选提供商的代理
+
+    路由操作（CALL_OPERATIONS / STREAM_OPERATIONS）经过故障转移与对冲，
+    其余属性（如 create_prefix_cache、model）透传给首选提供商。
+    """
+
+    def __init__(
+        self,
+        candidates: List[str],
+        factory: Callable[[str], Any],
+        response=None,
+        router: Optional[ProviderRouter] = None,
+        providers: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            candidates: 候选提供商名称（首个为调用方请求的提供商）
+            factory: 按名称创建提供商实例（备用提供商按需创建）
+            response: FastAPI Response（用于写入路由响应头，可选）
+            router: 路由状态（默认进程级单例）
+            providers: 已创建好的提供商实例（可选）
+        """
+        self.candidates = candidates
+        self.primary_name = candidates[0]
+        self._factory = factory
+        self._providers: Dict[str, Any] = dict(providers or {})
+        self._response = response
+        self._router = router or get_provider_router()
+        self.attempts: List[Tuple[str, str]] = []
+        self.routed_provider: Optional[str] = None
+        self.hedged = False
+
+    def provider(self, name: str):
+        if name not in self._providers:
+            self._providers[name] = self._factory(name)
+        return self._providers[name]
+
+    @property
+    def primary(self):
+        return self.provider(self.primary_name)
+
+    def __getattr__(self, name):
+        if name in CALL_OPERATIONS:
+            async def _routed(*args, **kwargs):
+                return await self._route_call(name, args, kwargs)
+            return _routed
+        if name in STREAM_OPERATIONS:
+            return lambda *args, **kwargs: self._route_stream(name, args, kwargs)
+        return getattr(self.primary, name)
+
+    def _kwargs_for(self, name: str, kwargs: dict) -> dict:
+        # 前缀缓存句柄属于首选提供商，切换到其他提供商时不能带上
+        if name != self.primary_name and kwargs.get("cache_handle") is not None:
+            return {**kwargs, "cache_handle": None}
+        return kwargs
+
+    def _record(self, name: str, outcome: str) -> None:
+        self.attempts.append((name, outcome))
+        if self._response is not None:
+            self._response.headers["X-Route-Attempts"] = ",".join(f"{n}:{o}" for n, o in self.attempts)
+            self._response.headers["X-Route-Hedged"] = "true" if self.hedged else "false"
+            if outcome == "ok":
+                self._response.headers["X-Routed-Provider"] = name
+
+    def _finish(self, name: str, operation: str, started: float, error: Optional[BaseException]) -> None:
+        health = self._router.health(name)
+        latency = time.monotonic() - started
+        if error is None:
+            health.record_success(operation, latency)
+            self.routed_provider = name
+            self._record(name, "ok")
+            return
+        timed_out = isinstance(error, asyncio.TimeoutError)
+        health.record_failure(operation, latency, fatal=_is_fatal(error))
+        self._record(name, "timeout" if timed_out else "error")
+
+    async def _attempt(self, name: str, operation: str, args: tuple, kwargs: dict):
+        started = time.monotonic()
+        try:
+            result = await _run_call(self.provider(name), operation, args, self._kwargs_for(name, kwargs))
+        except Exception as e:
+            self._finish(name, operation, started, e)
+            raise
+        self._finish(name, operation, started, None)
+        return result
+
+    def _budget_for(self, operation: str, plan: List[str], index: int) -> Optional[float]:
+        """第 index 个候选的延迟预算；后面没有备用提供商时不设预算（只受提供商自身超时约束）"""
+        return self._router.budget(operation) if index + 1 < len(plan) else None
+
+    def _over_budget(self, name: str) -> None:
+        self._router.count("timeouts")
+        self._record(name, "slow")
+
+    async def _route_call(self, operation: str, args: tuple, kwargs: dict):
+        self._router.count("routed")
+        plan = self._router.plan(self.candidates, operation)
+        if operation in self._router.hedge_operations and len(plan) > 1:
+            return await self._hedged_call(plan, operation, args, kwargs)
+
+        tasks: Dict[asyncio.Task, str] = {}
+        pending = set()
+        last_error: Optional[BaseException] = None
+        index = 0
+
+        def launch():
+            nonlocal index
+            name = plan[index]
+            if index > 0:
+                self._router.count("failovers")
+                logger.warning(f"⚠️  {operation} 切换到备用提供商 {name}: {_describe(last_error)}")
+            task = asyncio.create_task(self._attempt(name, operation, args, kwargs))
+            tasks[task] = name
+            pending.add(task)
+            index += 1
+
+        launch()
+        try:
+            while pending:
+                # 超出预算不取消慢的调用，只是并行启动下一个提供商，先成功者胜出
+                budget = self._budget_for(operation, plan, index - 1)
+                done, _ = await asyncio.wait(pending, timeout=budget, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                if not done:
+                    self._over_budget(plan[index - 1])
+                    last_error = None
+                    launch()
+                elif not pending and index < len(plan):
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        self._router.count("exhausted")
+        raise last_error
+
+    async def _hedged_call(self, plan: List[str], operation: str, args: tuple, kwargs: dict):
+        """主请求超过对冲延迟仍未返回时，向第二个提供商发出同样的请求，先成功者胜出"""
+        primary, secondary = plan[0], plan[1]
+        tasks = {asyncio.create_task(self._attempt(primary, operation, args, kwargs)): primary}
+        done, _ = await asyncio.wait(tasks, timeout=self._router.hedge_delay(primary, operation))
+
+        if not done or next(iter(done)).exception() is not None:
+            self.hedged = bool(not done)
+            if not done:
+                self._router.count("hedges")
+            else:
+                self._router.count("failovers")
+            tasks[asyncio.create_task(self._attempt(secondary, operation, args, kwargs))] = secondary
+
+        last_error: Optional[BaseException] = None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if self.hedged and tasks[task] == secondary:
+                            self._router.count("hedge_wins")
+                        return task.result()
+                    last_error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        self._router.count("exhausted")
+        raise last_error
+
+    def _route_event(self) -> str:
+        """流式响应的路由结果（StreamingResponse 的响应头已在首个分片前发出，无法再写入）"""
+        route = {
+            "provider": self.routed_provider,
+            "attempts": [f"{name}:{outcome}" for name, outcome in self.attempts],
+            "hedged": self.hedged,
+        }
+        return f"data: {json.dumps({'route': route})}\n\n"
+
+    async def _route_stream(self, operation: str, args: tuple, kwargs: dict):
+        """流式路由：首个内容分片之前失败或超出预算则切换提供商，之后的错误原样传给调用方
+
+        超出预算时慢的流不会被关闭，与备用提供商的流竞争首个分片，落败者才被关闭。
+        """
+        self._router.count("routed")
+        plan = self._router.plan(self.candidates, operation)
+        attempts: Dict[asyncio.Task, Tuple[str, Any, float]] = {}
+        last_error: Optional[BaseException] = None
+        index = 0
+
+        def launch():
+            nonlocal index
+            name = plan[index]
+            if index > 0:
+                self._router.count("failovers")
+                logger.warning(f"⚠️  {operation} 切换到备用提供商 {name}: {_describe(last_error)}")
+            stream = _iterate_stream(self.provider(name), operation, args, self._kwargs_for(name, kwargs))
+            attempts[asyncio.ensure_future(_first_chunk(stream))] = (name, stream, time.monotonic())
+            index += 1
+
+        launch()
+        winner = None
+        try:
+            while attempts and winner is None:
+                budget = self._budget_for(operation, plan, index - 1)
+                done, _ = await asyncio.wait(set(attempts), timeout=budget, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name, stream, started = attempts.pop(task)
+                    if winner is None and task.exception() is None:
+                        winner = (task, name, stream, started)
+                        continue
+                    if task.exception() is not None:
+                        await stream.aclose()
+                        self._finish(name, operation, started, task.exception())
+                        last_error = task.exception()
+                    else:
+                        await stream.aclose()
+                if winner is None:
+                    if not done:
+                        self._over_budget(plan[index - 1])
+                        last_error = None
+                        launch()
+                    elif not attempts and index < len(plan):
+                        launch()
+        finally:
+            for task, (_, stream, _) in attempts.items():
+                await _discard(task, stream)
+
+        if winner is None:
+            self._router.count("exhausted")
+            raise last_error
+
+        task, name, stream, started = winner
+        held_error_event, first = task.result()
+        self._finish(name, operation, started, None)
+        if first is _STREAM_END:
+            if held_error_event is not None:
+                yield held_error_event
+            return
+
+        if isinstance(first, str) and first.startswith("data:"):
+            yield self._route_event()
+        if held_error_event is not None:
+            yield held_error_event
+        yield first
+        try:
+            async for item in stream:
+                yield item
+        except Exception:
+            # 已经输出内容，不能再切换；只计入健康统计
+            self._router.health(name).record_failure(operation, time.monotonic() - started)
+            raise
+        finally:
+            await stream.aclose()
@@ -0,0 +1,154 @@
+"""章节场景并行写作
+
+一章 5000-8000 字由一次长请求顺序生成，耗时取决于上游每秒输出的 token 数。场景并行模式分两步：
+1. 先生成简短的节拍规划：把本章拆成几个连续场景，每个场景给出梗概、入场状态、出场状态与目标字数
+2. 各场景同时写作（共享章节提示词，前缀缓存照常生效），每个场景只写自己那一段，
+   开头从入场状态接起、结尾停在出场状态；最后对相邻场景的交界做一次轻量润色，只生成一两句过渡
+整章耗时约为 规划 + 最长的单个场景 + 过渡润色，而不是整章的顺序输出时间。
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+from app.core.json_stream import IncrementalArrayParser
+
+# 场景交界处带入润色的上一场景结尾 / 下一场景开头字数
+TRANSITION_CONTEXT_CHARS = 400
+# 过渡段超过这个长度视为模型没有按要求输出，丢弃
+MAX_TRANSITION_CHARS = 300
+
+_NO_TRANSITION = {"", "无", "无需过渡", "不需要", "none", "None"}
+_SCENE_HEADING_PATTERN = re.compile(r'^\s*(?:#+\s*)?(?:场景\s*[0-9一二三四五六七八九十]+|第\s*[0-9一二三四五六七八九十]+\s*场景?)[^\n]{0,30}\n+')
+
+
+def build_beat_plan_prompt(
+    novel_title: str,
+    chapter_title: str,
+    chapter_summary: str,
+    chapter_prompt_hints: str,
+    characters: List[Dict],
+    previous_chapters_context: Optional[str],
+    max_scenes: int,
+    target_chars: int = 6000
+) -> str:
+    """节拍规划提示词：只输出场景列表 JSON，输出很短"""
+    characters_text = "、".join(c.get("name", "") for c in characters[:12] if c.get("name")) or "暂无"
+    previous = (previous_chapters_context or "").strip()
+    previous_section = f"\n【前文结尾参考】\n{previous[-1200:]}\n" if previous else ""
+    return f"""你是小说《{novel_title}》的编辑，请把下面这一章拆分成 2-{max_scenes} 个连续场景，供多位作者分别写作后拼接。
+
+【章节】
+标题：{chapter_title}
+情节摘要：{chapter_summary}
+{f"写作提示：{chapter_prompt_hints}" if chapter_prompt_hints else ""}
+涉及角色：{characters_text}
+{previous_section}
+【要求】
+- 场景按时间顺序排列，合起来完整覆盖本章情节：开端 → 发展 → 高潮 → 结尾
+- entry_state 写清场景开始时的地点、在场人物、人物状态与情绪；exit_state 写清场景结束时的状态
+- 后一个场景的 entry_state 必须与前一个场景的 exit_state 衔接
+- 第一个场景承接前文/上一章；最后一个场景负责本章收尾
+- target_chars 为该场景正文字数，全部场景合计约 {target_chars} 字
+
+只返回 JSON：{{"scenes":[{{"title":"场景名","summary":"场景梗概","entry_state":"入场状态","exit_state":"出场状态","target_chars":1500}}]}}"""
+
+
+def parse_beat_plan(text: str, max_scenes: int, target_chars: int = 6000) -> List[Dict[str, Any]]:
+    """解析节拍规划（宽容解析），超出上限的场景合并到最后一个；缺少字数时平均分配"""
+    parser = IncrementalArrayParser("scenes")
+    items = parser.feed(text or "") + parser.close()
+    scenes = []
+    for item in items:
+        if not isinstance(item, dict) or not str(item.get("summary") or "").strip():
+            continue
+        try:
+            chars = int(item.get("target_chars") or 0)
+        except (TypeError, ValueError):
+            chars = 0
+        scenes.append({
+            "title": str(item.get("title") or "").strip() or f"场景{len(scenes) + 1}",
+            "summary": str(item.get("summary")).strip(),
+            "entry_state": str(item.get("entry_state") or "").strip(),
+            "exit_state": str(item.get("exit_state") or "").strip(),
+            "target_chars": chars,
+        })
+    if max_scenes > 0 and len(scenes) > max_scenes:
+        tail = scenes[max_scenes - 1:]
+        merged = dict(tail[0])
+        merged["summary"] = "；".join(scene["summary"] for scene in tail)
+        merged["exit_state"] = tail[-1]["exit_state"]
+        merged["target_chars"] = sum(scene["target_chars"] for scene in tail)
+        scenes = scenes[:max_scenes - 1] + [merged]
+    for scene in scenes:
+        if not 300 <= scene["target_chars"] <= target_chars:
+            scene["target_chars"] = target_chars // max(1, len(scenes))
+    return scenes
+
+
+def build_scene_instruction(scenes: List[Dict[str, Any]], index: int) -> str:
+    """追加在章节提示词之后的场景写作要求（优先于整章的字数与结构要求）"""
+    scene = scenes[index]
+    outline = "\n".join(
+        f"{'→ ' if i == index else '  '}{i + 1}. {s['title']}：{s['summary'][:120]}" for i, s in enumerate(scenes)
+    )
+    lines = [
+        "",
+        "【场景并行写作】（优先于上面的字数与结构要求）",
+        f"本章分为 {len(scenes)} 个场景，由不同作者同时写作后按顺序拼接。全章场景：",
+        outline,
+        "",
+        f"你只写第 {index + 1} 个场景《{scene['title']}》，约 {scene['target_chars']} 字：",
+        f"- 场景梗概：{scene['summary']}",
+    ]
+    if scene["entry_state"]:
+        lines.append(f"- 开头从这个状态接起：{scene['entry_state']}")
+    if scene["exit_state"]:
+        lines.append(f"- 结尾停在这个状态：{scene['exit_state']}")
+    if index == 0:
+        lines.append("- 这是本章开头，按要求承接上一章")
+    else:
+        lines.append("- 前面的场景已由他人写好，不要回顾或复述，不要重新交代背景，直接进入本场景")
+    if index < len(scenes) - 1:
+        lines.append("- 不要写后面场景的情节，不要给本章收尾")
+    else:
+        lines.append("- 这是本章最后一个场景，完成本章收尾")
+    lines.append("- 不要输出场景标题或编号，仅输出本场景正文")
+    return "\n".join(lines)
+
+
+def clean_scene_text(text: str) -> str:
+    """去掉模型自行加上的场景标题"""
+    return _SCENE_HEADING_PATTERN.sub("", (text or "").strip(), count=1).strip()
+
+
+def build_transition_prompt(
+    previous_scene: Dict[str, Any],
+    previous_text: str,
+    next_scene: Dict[str, Any],
+    next_text: str
+) -> str:
+    """场景交界润色提示词：只生成插入两段之间的过渡，不改写原文"""
+    return f"""下面是同一章中相邻两个场景的交界处，两个场景由不同作者分别写作。
+
+【上一场景《{previous_scene['title']}》结尾】
+{previous_text[-TRANSITION_CONTEXT_CHARS:]}
+
+【下一场景《{next_scene['title']}》开头】
+{next_text[:TRANSITION_CONTEXT_CHARS]}
+
+如果两段衔接自然，只输出“无”。
+如果时间、地点或人物状态跳跃生硬，写 1-2 句过渡（不超过 100 字）插入两段之间，风格与原文一致，不要复述两段内容。
+仅输出过渡句本身或“无”。"""
+
+
+def parse_transition(text: str) -> str:
+    """解析过渡句；“无”或明显不符合要求的输出视为不需要过渡"""
+    transition = (text or "").strip().strip("“”\"")
+    if transition in _NO_TRANSITION or len(transition) > MAX_TRANSITION_CHARS:
+        return ""
+    return transition
+
+
+def join_scene(text: str, transition: str = "") -> str:
+    """场景正文前加上与上一场景之间的过渡句"""
+    return f"{transition}\n\n{text}" if transition else text
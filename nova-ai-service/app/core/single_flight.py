@@ -0,0 +1,302 @@
+"""上游请求单飞合并
+
+双击、多标签页、重叠的后台任务经常在同一时刻发出完全相同的请求。
+这里在提供商客户端的 models 接口外加一层合并：
+- 非流式：同键并发调用共享一次上游调用的结果或异常
+- 流式：同键订阅者共享一条上游流（扇出），晚加入的订阅者先重放已收到的分片；
+  最后一个订阅者提前离开（客户端断开、取消）时关闭上游流，不再继续消耗令牌
+"""
+
+import asyncio
+import inspect
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.core.response_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+class _SharedStream:
+    """可被多个订阅者按各自进度读取的上游流（惰性拉取，类似 tee）"""
+
+    def __init__(self, upstream, is_async: bool):
+        self.upstream = upstream
+        self.is_async = is_async
+        self.buffer: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.sync_lock = threading.Lock()
+        self.async_lock = asyncio.Lock() if is_async else None
+
+
+class StreamAbandoned(Exception):
+    """所有订阅者都已离开，共享上游流被提前关闭"""
+
+
+class SingleFlightRegistry:
+    """进程内的单飞登记表与统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Any] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self.stats = {
+            "calls": 0,
+            "coalesced": 0,
+            "streams": 0,
+            "stream_subscribers_coalesced": 0,
+            "streams_abandoned": 0,
+        }
+
+    # ==================== 非流式 ====================
+
+    async def do_async(self, key: str, factory):
+        """异步调用合并：factory 返回协程
+
+        上游调用作为独立任务运行，不属于任何调用方；领头者与跟随者都通过 shield 等待，
+        某个调用方被取消（客户端断开、路由超时）只影响它自己，
+        最后一个等待者离开时才取消上游任务
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            entry = self._calls.get(key)
+            if entry is None:
+                task = asyncio.get_running_loop().create_task(factory())
+                entry = {"task": task, "waiters": 0}
+                self._calls[key] = entry
+                task.add_done_callback(lambda done, entry=entry: self._finish_call(key, entry, done))
+            else:
+                self.stats["coalesced"] += 1
+            entry["waiters"] += 1
+        task = entry["task"]
+
+        try:
+            return await asyncio.shield(task)
+        finally:
+            with self._lock:
+                entry["waiters"] -= 1
+                abandoned = entry["waiters"] == 0 and not task.done()
+            if abandoned:
+                task.cancel()
+
+    def _finish_call(self, key: str, entry: Dict[str, Any], task: "asyncio.Task") -> None:
+        with self._lock:
+            if self._calls.get(key) is entry:
+                del self._calls[key]
+        if not task.cancelled():
+            # 等待者都已离开时避免 "exception was never retrieved" 警告
+            task.exception()
+
+    def do_sync(self, key: str, fn):
+        """同步调用合并（跨线程）"""
+        with self._lock:
+            self.stats["calls"] += 1
+            entry = self._calls.get(key)
+            leader = entry is None
+            if leader:
+                entry = (threading.Event(), {})
+                self._calls[key] = entry
+            else:
+                self.stats["coalesced"] += 1
+        done, outcome = entry
+        if not leader:
+            done.wait()
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["result"]
+
+        try:
+            outcome["result"] = fn()
+            return outcome["result"]
+        except BaseException as e:
+            outcome["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            done.set()
+
+    # ==================== 流式扇出 ====================
+
+    def _join_stream(self, key: str, open_upstream, is_async: bool) -> _SharedStream:
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is not None and shared.error is None:
+                shared.subscribers += 1
+                self.stats["stream_subscribers_coalesced"] += 1
+                return shared
+            shared = _SharedStream(open_upstream(), is_async)
+            shared.subscribers = 1
+            self._streams[key] = shared
+            self.stats["streams"] += 1
+            return shared
+
+    def _finish_stream(self, key: str, shared: _SharedStream) -> None:
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+
+    def _leave_stream(self, key: str, shared: _SharedStream) -> bool:
+        """订阅者离开；返回 True 表示这是最后一个订阅者且上游未读完，需要关闭上游"""
+        with self._lock:
+            shared.subscribers -= 1
+            if shared.subscribers > 0 or shared.finished or shared.error is not None:
+                return False
+            shared.error = StreamAbandoned()
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+            self.stats["streams_abandoned"] += 1
+            return True
+
+    def subscribe_sync(self, key: str, open_upstream):
+        """订阅同步上游流（Gemini 形态），返回同步迭代器"""
+
+        def _iterate():
+            # 首次迭代时才加入，未被迭代就丢弃的迭代器不会占住共享流
+            shared = self._join_stream(key, open_upstream, is_async=False)
+            index = 0
+            try:
+                while True:
+                    with shared.sync_lock:
+                        if index < len(shared.buffer):
+                            item = shared.buffer[index]
+                        elif shared.error is not None:
+                            raise shared.error
+                        elif shared.finished:
+                            return
+                        else:
+                            try:
+                                item = next(shared.upstream)
+                                shared.buffer.append(item)
+                            except StopIteration:
+                                shared.finished = True
+                                self._finish_stream(key, shared)
+                                return
+                            except BaseException as e:
+                                shared.error = e
+                                self._finish_stream(key, shared)
+                                raise
+                    index += 1
+                    yield item
+            finally:
+                if self._leave_stream(key, shared):
+                    with shared.sync_lock:
+                        close = getattr(shared.upstream, "close", None)
+                        if close is not None:
+                            close()
+                    logger.info(f"✅ 共享流的订阅者已全部离开，已关闭上游: {key[:24]}")
+
+        return _iterate()
+
+    def subscribe_async(self, key: str, open_upstream):
+        """订阅异步上游流（DeepSeek 形态），返回异步迭代器"""
+
+        async def _iterate():
+            shared = self._join_stream(key, open_upstream, is_async=True)
+            index = 0
+            try:
+                while True:
+                    async with shared.async_lock:
+                        if index < len(shared.buffer):
+                            item = shared.buffer[index]
+                        elif shared.error is not None:
+                            raise shared.error
+                        elif shared.finished:
+                            return
+                        else:
+                            try:
+                                item = await shared.upstream.__anext__()
+                                shared.buffer.append(item)
+                            except StopAsyncIteration:
+                                shared.finished = True
+                                self._finish_stream(key, shared)
+                                return
+                            except BaseException as e:
+                                shared.error = e
+                                self._finish_stream(key, shared)
+                                raise
+                    index += 1
+                    yield item
+            finally:
+                if self._leave_stream(key, shared):
+                    aclose = getattr(shared.upstream, "aclose", None)
+                    if aclose is not None:
+                        await aclose()
+                    logger.info(f"✅ 共享流的订阅者已全部离开，已关闭上游: {key[:24]}")
+
+        return _iterate()
+
+    def snapshot(self) -> Dict[str, int]:
+        """合并统计"""
+        with self._lock:
+            return {**self.stats, "in_flight_calls": len(self._calls), "in_flight_streams": len(self._streams)}
+
+
+_registry = SingleFlightRegistry()
+
+
+def get_single_flight() -> SingleFlightRegistry:
+    """获取进程级单飞登记表"""
+    return _registry
+
+
+class SingleFlightModels:
+    """包装提供商客户端的 models 接口，合并并发的相同请求"""
+
+    def __init__(self, inner, provider_name: str, registry: Optional[SingleFlightRegistry] = None):
+        self._inner = inner
+        self._provider_name = provider_name
+        self._registry = registry or _registry
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _key(self, kind: str, model: str, contents: Any, config: Optional[Dict]) -> str:
+        return f"{kind}:{make_cache_key(self._provider_name, model, contents, config)}"
+
+    def generate_content(self, model: str, contents: Any, config: Optional[Dict] = None, **kwargs):
+        key = self._key("call", model, contents, config)
+        if inspect.iscoroutinefunction(self._inner.generate_content):
+            return self._registry.do_async(
+                key,
+                lambda: self._inner.generate_content(model=model, contents=contents, config=config, **kwargs)
+            )
+        return self._registry.do_sync(
+            key,
+            lambda: self._inner.generate_content(model=model, contents=contents, config=config, **kwargs)
+        )
+
+    def generate_content_stream(self, model: str, contents: Any, config: Optional[Dict] = None, **kwargs):
+        key = self._key("stream", model, contents, config)
+
+        def open_upstream():
+            return self._inner.generate_content_stream(model=model, contents=contents, config=config, **kwargs)
+
+        if inspect.isasyncgenfunction(self._inner.generate_content_stream):
+            return self._registry.subscribe_async(key, open_upstream)
+        return self._registry.subscribe_sync(key, lambda: iter(open_upstream()))
+
+
+class _SingleFlightClient:
+    """代理提供商客户端，只替换 models 接口，其余属性透传"""
+
+    def __init__(self, inner, models: SingleFlightModels):
+        self._inner = inner
+        self.models = models
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def enable_single_flight(provider, provider_name: str) -> None:
+    """为提供商实例启用请求合并"""
+    client = getattr(provider, "client", None)
+    if client is None or isinstance(getattr(client, "models", None), SingleFlightModels):
+        return
+    models = getattr(client, "models", None)
+    if models is None:
+        return
+    provider.client = _SingleFlightClient(client, SingleFlightModels(models, provider_name))
@@ -0,0 +1,147 @@
+"""SSE 分片事件合并
+
+提供商逐个上游分片产出 `data: {"chunk": ...}` 事件，快速模型每秒上千个小事件，每个都要单独 JSON 编码、
+HTTP 分块和前端重绘。这里把连续的分片事件在时间窗口（STREAM_COALESCE_WINDOW_MS）内
+或事件内容累计到 STREAM_COALESCE_MAX_BYTES 字节时合并成一个事件：
+- 等待下一个事件时带超时，窗口到期即输出，上游停顿时不会积压
+- 其他事件（done、error 等阶段边界）到达时先冲刷已缓冲的分片，再原样转发
+- 上游抛出异常时先输出已缓冲的分片再抛出
+"""
+
+import asyncio
+import contextlib
+import json
+from typing import AsyncIterator, List, Optional
+
+from app.config import settings
+
+_CHUNK_PREFIX = 'data: {"chunk": "'
+_CHUNK_SUFFIX = '"}\n\n'
+
+
+def _chunk_body(event: str) -> Optional[str]:
+    """只含 chunk 字段的 data 事件返回其 JSON 转义后的字符串内容，其他事件返回 None
+
+    JSON 字符串的转义序列互不跨越，多个转义后的内容直接拼接仍是拼接文本的合法转义，合并时无需解码再编码。
+    """
+    if not isinstance(event, str) or not event.startswith(_CHUNK_PREFIX) or not event.endswith(_CHUNK_SUFFIX):
+        return None
+    body = event[len(_CHUNK_PREFIX):-len(_CHUNK_SUFFIX)]
+    if '"' in body:
+        # 含转义引号或其他字段时解码确认
+        try:
+            payload = json.loads(event[len("data: "):])
+        except ValueError:
+            return None
+        if not isinstance(payload, dict) or set(payload) != {"chunk"} or not isinstance(payload["chunk"], str):
+            return None
+        return json.dumps(payload["chunk"])[1:-1]
+    return body
+
+
+def _chunk_event(bodies: List[str]) -> str:
+    return _CHUNK_PREFIX + "".join(bodies) + _CHUNK_SUFFIX
+
+
+class _Pump:
+    """在单独的任务中读取上游事件；只在缓冲区由空变为非空、遇到其他事件、达到上限或结束时唤醒消费者"""
+
+    def __init__(self, stream: AsyncIterator[str], max_bytes: int):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.items: List[object] = []
+        self.size = 0
+        self.boundary = False
+        self.started_at = 0.0
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.wake = asyncio.Event()
+
+    async def run(self) -> None:
+        try:
+            async for event in self.stream:
+                body = _chunk_body(event)
+                if body is None:
+                    self.items.append((event,))
+                    self.boundary = True
+                    self.wake.set()
+                    continue
+                self.items.append(body)
+                self.size += len(body)
+                if len(self.items) == 1:
+                    self.started_at = asyncio.get_running_loop().time()
+                    self.wake.set()
+                elif self.size >= self.max_bytes:
+                    self.wake.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self.wake.set()
+
+    def take(self) -> List[object]:
+        items, self.items, self.size, self.boundary = self.items, [], 0, False
+        self.wake.clear()
+        return items
+
+
+def _drain(items: List[object]) -> List[str]:
+    """把连续的分片内容合并成一个事件，其他事件（原样保留的字符串事件用元组包裹）按顺序穿插"""
+    events: List[str] = []
+    bodies: List[str] = []
+    for item in items:
+        if isinstance(item, tuple):
+            if bodies:
+                events.append(_chunk_event(bodies))
+                bodies = []
+            events.append(item[0])
+        else:
+            bodies.append(item)
+    if bodies:
+        events.append(_chunk_event(bodies))
+    return events
+
+
+async def coalesce_sse_events(
+    stream: AsyncIterator[str],
+    window_seconds: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """合并连续的分片事件；窗口不大于 0 时原样透传
+
+    调用方负责关闭 stream；本生成器关闭时只取消仍在读取的任务。
+    """
+    if window_seconds is None:
+        window_seconds = settings.STREAM_COALESCE_WINDOW_MS / 1000
+    if max_bytes is None:
+        max_bytes = settings.STREAM_COALESCE_MAX_BYTES
+    if window_seconds <= 0:
+        async for event in stream:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    pump = _Pump(stream, max_bytes)
+    task = asyncio.ensure_future(pump.run())
+    try:
+        while True:
+            await pump.wake.wait()
+            while not (pump.finished or pump.boundary or pump.size >= max_bytes):
+                remaining = pump.started_at + window_seconds - loop.time()
+                if remaining <= 0:
+                    break
+                pump.wake.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(pump.wake.wait(), remaining)
+            finished, error = pump.finished, pump.error
+            for event in _drain(pump.take()):
+                yield event
+            if finished:
+                if error is not None:
+                    raise error
+                return
+    finally:
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
@@ -7,6 +7,7 @@ from .requests import (
     GenerateChapterOutlineRequest,
     WriteChapterContentRequest,
     WriteChapterContentStreamRequest,
+    WriteChapterScenesRequest,
     SummarizeChapterRequest,
     GenerateCharactersRequest,
     GenerateWorldSettingsRequest,
@@ -47,6 +48,7 @@ __all__ = [
     "GenerateChapterOutlineRequest",
     "WriteChapterContentRequest",
     "WriteChapterContentStreamRequest",
+    "WriteChapterScenesRequest",
     "SummarizeChapterRequest",
     "GenerateCharactersRequest",
     "GenerateWorldSettingsRequest",
@@ -67,6 +67,8 @@ class WriteChapterContentRequest(BaseModel):
     characters: List[Dict] = Field(default_factory=list, description="角色列表")
     world_settings: List[Dict] = Field(default_factory=list, description="世界观设定列表")
     previous_chapters_context: Optional[str] = Field(None, description="前面章节的上下文（可选）")
+    prompt_cache_key: Optional[str] = Field(None, description="稳定前缀缓存键（通常为小说ID，留空则不缓存）")
+    context_version: Optional[str] = Field(None, description="小说上下文版本（变化时刷新前缀缓存）")
 
 
 class WriteChapterContentStreamRequest(BaseModel):
@@ -80,6 +82,13 @@ class WriteChapterContentStreamRequest(BaseModel):
     characters: List[Dict] = Field(default_factory=list, description="角色列表")
     world_settings: List[Dict] = Field(default_factory=list, description="世界观设定列表")
     previous_chapters_context: Optional[str] = Field(None, description="前面章节的上下文（可选）")
+    prompt_cache_key: Optional[str] = Field(None, description="稳定前缀缓存键（通常为小说ID，留空则不缓存）")
+    context_version: Optional[str] = Field(None, description="小说上下文版本（变化时刷新前缀缓存）")
+
+
+class WriteChapterScenesRequest(WriteChapterContentStreamRequest):
+    """场景并行写作章节请求（流式）"""
+    max_scenes: Optional[int] = Field(None, ge=2, le=8, description="最多拆分的场景数（留空使用服务配置）")
 
 
 class SummarizeChapterRequest(BaseModel):
@@ -0,0 +1,190 @@
+"""章节列表分片生成测试（含整卷与分片并发的耗时基准）"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+import types
+
+import pytest
+
+from app.core.chapter_shards import build_shard_instruction, merge_shards, parse_shard_chapters, plan_shards
+from app.core.providers.gemini import GeminiProvider
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    """模拟 client.models.generate_content：按提示词要求的章节数返回，耗时与章节数成正比
+
+    fail_once 中的分片第一次调用失败；async_client 时模拟 DeepSeek 的异步客户端。
+    """
+
+    def __init__(self, per_chapter=0.0, fail_once=(), short_once=(), async_client=False):
+        self.per_chapter = per_chapter
+        self.fail_once = set(fail_once)
+        self.short_once = set(short_once)
+        self.async_client = async_client
+        self.prompts = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def _respond(self, prompt):
+        match = re.search(r"你只负责第 (\d+)-(\d+) 章", prompt)
+        start, end = (int(match.group(1)), int(match.group(2))) if match else (1, int(re.search(r"请为本卷生成 (\d+) 个章节", prompt).group(1)))
+        label = f"{start}-{end}"
+        with self.lock:
+            self.prompts.append(prompt)
+            if label in self.fail_once:
+                self.fail_once.discard(label)
+                raise RuntimeError("503 UNAVAILABLE")
+            short = label in self.short_once
+            self.short_once.discard(label)
+        end = end - 2 if short else end
+        chapters = [{"title": f"第{n - start + 1}章 情节{n}", "summary": f"摘要{n}", "aiPromptHints": ""} for n in range(start, end + 1)]
+        return FakeResponse(json.dumps(chapters, ensure_ascii=False)), end - start + 1
+
+    def _enter(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def _exit(self):
+        with self.lock:
+            self.active -= 1
+
+    def generate_content(self, model, contents, config):
+        if self.async_client:
+            async def call():
+                self._enter()
+                try:
+                    response, count = self._respond(contents)
+                    await asyncio.sleep(self.per_chapter * count)
+                    return response
+                finally:
+                    self._exit()
+            return call()
+        self._enter()
+        try:
+            response, count = self._respond(contents)
+            time.sleep(self.per_chapter * count)
+            return response
+        finally:
+            self._exit()
+
+
+def make_provider(models, shard_size=10, async_client=False):
+    provider = GeminiProvider.__new__(GeminiProvider)
+    provider.model = "test-model"
+    provider.client = types.SimpleNamespace(models=models)
+    provider.chapter_shard_size = shard_size
+    provider.chapter_shard_retries = 2
+    provider.blocking_client = not async_client
+    return provider
+
+
+OUTLINE_KWARGS = dict(
+    novel_title="n", genre="g", full_outline="", volume_title="第一卷", volume_summary="",
+    volume_outline="【章节规划】：23章", characters=[], volume_index=1
+)
+
+
+def test_plan_shards():
+    """各分片章节数均匀、区间连续；章节数未知或不超过分片大小时不分片"""
+    shards = plan_shards(23, 10)
+    assert [(s.start, s.end) for s in shards] == [(1, 8), (9, 16), (17, 23)]
+    assert shards[1].progress() == "35%-70%"
+    assert plan_shards(10, 10) == []
+    assert plan_shards(None, 10) == []
+    assert plan_shards(50, 0) == []
+
+
+def test_shard_instruction_boundaries():
+    """中间分片提示前后分片的范围，既不重新开篇也不收束；首尾分片分别负责开篇与收束"""
+    shards = plan_shards(30, 10)
+    middle = build_shard_instruction(shards[1], shards)
+    assert "你只负责第 11-20 章" in middle and "恰好返回 10 个章节" in middle
+    assert "前一段（第 1-10 章）" in middle and "后一段（第 21-30 章）" in middle
+    assert "不要重新开篇" in middle and "不要收束本卷主线" in middle
+    assert "本卷开篇" in build_shard_instruction(shards[0], shards)
+    assert "本卷收束" in build_shard_instruction(shards[2], shards)
+
+
+def test_parse_and_merge():
+    """宽容解析（跳过坏元素、接受 chapters 键）；合并后去掉分片内的编号"""
+    assert parse_shard_chapters('[{"title": "一"}, {坏}, {"title": "二",}]') == [{"title": "一"}, {"title": "二"}]
+    assert parse_shard_chapters('{"chapters": [{"summary": "s"}]}') == [{"summary": "s"}]
+    merged = merge_shards([[{"title": "第1章 出山"}], [{"title": "1. 夜袭"}, {"title": ""}]])
+    assert [c["title"] for c in merged] == ["出山", "夜袭", "第3章"]
+
+
+@pytest.mark.parametrize("async_client", [False, True])
+def test_sharded_generation_merges_in_order(async_client):
+    """分片并发生成，按顺序合并为完整章节列表；同步/异步客户端都并发执行"""
+    models = FakeModels(per_chapter=0.002, async_client=async_client)
+    provider = make_provider(models, async_client=async_client)
+    chapters = asyncio.run(provider.generate_chapter_outline(**OUTLINE_KWARGS, chapter_count=23))
+    assert [c["title"] for c in chapters] == [f"情节{n}" for n in range(1, 24)]
+    assert len(models.prompts) == 3
+    assert models.peak == 3
+    # 卷大纲、前后卷信息等共享上下文每个分片都有
+    assert all("【章节规划】：23章" in prompt for prompt in models.prompts)
+
+
+def test_failed_shard_retried_alone():
+    """失败或章节数不足的分片单独重试，其他分片只调用一次"""
+    models = FakeModels(fail_once={"9-16"}, short_once={"17-23"})
+    chapters = asyncio.run(make_provider(models).generate_chapter_outline(**OUTLINE_KWARGS, chapter_count=23))
+    assert len(chapters) == 23
+    calls = [re.search(r"你只负责第 (\d+-\d+) 章", p).group(1) for p in models.prompts]
+    assert sorted(calls) == ["1-8", "17-23", "17-23", "9-16", "9-16"]
+
+
+def test_shard_failure_exhausts_retries():
+    """分片重试用尽仍失败时整体失败"""
+    models = FakeModels()
+    models.fail_once = {"1-8"}
+    provider = make_provider(models)
+    provider.chapter_shard_retries = 0
+    with pytest.raises(Exception, match="生成章节列表失败: 第 1-8 章生成失败"):
+        asyncio.run(provider.generate_chapter_outline(**OUTLINE_KWARGS, chapter_count=23))
+
+
+def test_stream_emits_shards_in_order():
+    """流式接口按分片顺序输出，序号与标题为全卷编号"""
+    provider = make_provider(FakeModels(per_chapter=0.001))
+
+    async def run():
+        return [
+            json.loads(event[len("data: "):])
+            async for event in provider.generate_chapter_outline_stream(**OUTLINE_KWARGS, chapter_count=23)
+        ]
+
+    events = asyncio.run(run())
+    assert [e["index"] for e in events[:-1]] == list(range(23))
+    assert events[4]["item"]["title"] == "情节5"
+    assert events[-1] == {"done": True, "count": 23, "skipped": 0}
+
+
+def run_benchmark(chapter_count, per_chapter):
+    """整卷一次生成与分片并发生成的耗时（模拟上游耗时与输出章节数成正比）"""
+    timings = {}
+    for label, shard_size in (("整卷", 0), ("分片", 10)):
+        provider = make_provider(FakeModels(per_chapter=per_chapter), shard_size=shard_size)
+        started = time.perf_counter()
+        chapters = asyncio.run(provider.generate_chapter_outline(**OUTLINE_KWARGS, chapter_count=chapter_count))
+        timings[label] = time.perf_counter() - started
+        assert len(chapters) == chapter_count
+    return timings
+
+
+def test_sharding_benchmark():
+    """基准：50 章（每章模拟 4ms），分片耗时接近单个分片"""
+    timings = run_benchmark(50, 0.004)
+    print(f"\n50 章: 整卷 {timings['整卷'] * 1000:.0f}ms | 分片(10 章/片) {timings['分片'] * 1000:.0f}ms")
+    assert timings["分片"] * 3 < timings["整卷"]
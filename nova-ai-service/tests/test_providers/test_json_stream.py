@@ -0,0 +1,162 @@
+"""结构化输出增量解析测试（含首个元素到达时间基准）"""
+
+import asyncio
+import json
+import time
+import types
+
+import pytest
+
+from app.core.json_stream import IncrementalArrayParser
+from app.core.providers.gemini import GeminiProvider
+
+
+def chapters(count):
+    return [
+        {
+            "title": f"第{i + 1}个转折",
+            "summary": f'主角说："别回头"，随后[{i}]号密室的门{{关上}}\\n',
+            "aiPromptHints": "紧张",
+        }
+        for i in range(count)
+    ]
+
+
+def pieces(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def feed_all(parser, parts):
+    items = []
+    for part in parts:
+        items.extend(parser.feed(part))
+    return items + parser.close()
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, 100000])
+def test_any_chunking_yields_same_items(size):
+    """任意分片方式都得到与 json.loads 相同的结果（字符串中的括号、引号、转义不影响）"""
+    data = chapters(6)
+    text = "好的，以下是章节列表：\n```json\n" + json.dumps(data, ensure_ascii=False, indent=2) + "\n```"
+    assert feed_all(IncrementalArrayParser(), pieces(text, size)) == data
+
+
+def test_items_emitted_as_soon_as_closed():
+    """元素的右括号一到就输出，不等逗号或数组结束"""
+    parser = IncrementalArrayParser()
+    assert parser.feed('[{"title": "一", "summary": "a"') == []
+    assert parser.feed("}") == [{"title": "一", "summary": "a"}]
+    assert parser.feed(', {"title": "二"}') == [{"title": "二"}]
+    assert parser.feed("]") == []
+    assert parser.finished and parser.count == 2
+
+
+def test_keyed_array_and_bare_array():
+    """指定键时跳过其他数组；模型直接返回数组时同样可以解析"""
+    parser = IncrementalArrayParser("chapters")
+    items = feed_all(parser, ['{"notes": [1, 2], "chap', 'ters": [{"title": "一"}, {"title": "二"}]}'])
+    assert items == [{"title": "一"}, {"title": "二"}]
+    assert feed_all(IncrementalArrayParser("chapters"), ['[{"title": "一"}]']) == [{"title": "一"}]
+
+
+def test_tolerant_decoding():
+    """尾逗号与字符串内的换行可以解析；坏元素跳过并计数，后续元素不受影响；截断的最后一项计为跳过"""
+    parser = IncrementalArrayParser()
+    items = feed_all(parser, ['[{"title": "一",}, {"title": "二\n行"}, {"title": 未加引号}, {"title": "三"}, {"title": "四'])
+    assert items == [{"title": "一"}, {"title": "二\n行"}, {"title": "三"}]
+    assert parser.skipped == 2
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    """模拟 client.models：流式返回预设文本的分片；async_stream 时模拟 DeepSeek 的异步迭代器"""
+
+    def __init__(self, text, size=20, delay=0.0, async_stream=False):
+        self.parts = pieces(text, size)
+        self.delay = delay
+        self.async_stream = async_stream
+        self.configs = []
+
+    def generate_content_stream(self, model, contents, config):
+        self.configs.append(config)
+        if self.async_stream:
+            async def stream():
+                for part in self.parts:
+                    await asyncio.sleep(self.delay)
+                    yield FakeChunk(part)
+            return stream()
+
+        def stream():
+            for part in self.parts:
+                time.sleep(self.delay)
+                yield FakeChunk(part)
+        return stream()
+
+
+def make_provider(models):
+    provider = GeminiProvider.__new__(GeminiProvider)
+    provider.model = "test-model"
+    provider.client = types.SimpleNamespace(models=models)
+    return provider
+
+
+def events_of(provider, method="generate_characters_stream"):
+    async def run():
+        stream = getattr(provider, method)(title="t", genre="g", synopsis="s", outline="o")
+        return [json.loads(event[len("data: "):]) async for event in stream]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("async_stream", [False, True])
+def test_provider_emits_item_events(async_stream):
+    """提供商对同步/异步上游流都逐项输出 item 事件，最后输出完成事件"""
+    data = [{"name": f"角色{i}", "role": "配角"} for i in range(4)]
+    models = FakeModels(json.dumps({"characters": data}, ensure_ascii=False), async_stream=async_stream)
+    events = events_of(make_provider(models))
+    assert [e["item"] for e in events[:-1]] == data
+    assert [e["index"] for e in events[:-1]] == [0, 1, 2, 3]
+    assert events[-1] == {"done": True, "count": 4, "skipped": 0}
+    assert models.configs[0]["response_mime_type"] == "application/json"
+
+
+def test_provider_error_when_no_items():
+    """上游没有返回任何可解析的元素时先输出错误事件再抛出"""
+    provider = make_provider(FakeModels("抱歉，无法生成"))
+    received = []
+
+    async def run():
+        async for event in provider.generate_timeline_events_stream(title="t", genre="g", synopsis="s", outline="o"):
+            received.append(json.loads(event[len("data: "):]))
+
+    with pytest.raises(Exception, match="生成时间线事件失败"):
+        asyncio.run(run())
+    assert "error" in received[-1]
+
+
+def test_first_item_arrives_early():
+    """基准：50 章、上游每 40 字符一个分片（每片 1ms），首章到达时间远早于完整响应"""
+    text = json.dumps(chapters(50), ensure_ascii=False)
+    provider = make_provider(FakeModels(text, size=40, delay=0.001))
+
+    async def run():
+        started = time.perf_counter()
+        first = None
+        count = 0
+        async for event in provider.generate_chapter_outline_stream(
+            novel_title="n", genre="g", full_outline="", volume_title="v", volume_summary="",
+            volume_outline="", characters=[], volume_index=0
+        ):
+            if "item" in json.loads(event[len("data: "):]):
+                count += 1
+                if first is None:
+                    first = time.perf_counter() - started
+        return first, time.perf_counter() - started, count
+
+    first, total, count = asyncio.run(run())
+    print(f"\n首章 {first * 1000:.1f}ms | 全部 {count} 章 {total * 1000:.1f}ms")
+    assert count == 50
+    assert first * 10 < total
@@ -0,0 +1,229 @@
+"""提示词前缀缓存测试（使用本地假客户端，不访问真实 API）"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from app.core import prompt_cache as prompt_cache_module
+from app.core.prompt_cache import PromptPrefixCache
+from app.core.providers.gemini import GeminiProvider
+
+
+class FakeModels:
+    """记录 generate_content 调用"""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_content(self, model, contents, config):
+        self.calls.append({"contents": contents, "config": dict(config)})
+        return SimpleNamespace(text="章节正文")
+
+
+class FakeCaches:
+    """模拟 Gemini cached content 接口"""
+
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+
+    def create(self, model, config):
+        self.thread = threading.current_thread()
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.created.append({"name": name, "text": config.contents[0].parts[0].text})
+        return SimpleNamespace(name=name)
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeGeminiProvider(GeminiProvider):
+    """替换掉真实客户端的 Gemini 提供商"""
+
+    def _configure_client(self):
+        self.client = SimpleNamespace(models=FakeModels(), caches=FakeCaches())
+
+
+CHARACTERS = [{"name": "林风", "personality": "冷静果断"}, {"name": "苏瑶", "personality": "机敏"}]
+WORLD = [{"title": "灵脉", "description": "天地灵气汇聚之处"}]
+
+
+def _write_batch(provider, cache, chapter_count, context_version):
+    async def run():
+        for idx in range(chapter_count):
+            prefix = provider.build_chapter_prompt_prefix("星河", "玄幻", "少年踏上修行路", CHARACTERS, WORLD)
+            handle = await cache.acquire(provider, key="novel-1", prefix=prefix, context_version=context_version)
+            await provider.write_chapter_content(
+                novel_title="星河",
+                genre="玄幻",
+                synopsis="少年踏上修行路",
+                chapter_title=f"第{idx + 1}章",
+                chapter_summary=f"第{idx + 1}章的情节",
+                chapter_prompt_hints="",
+                characters=CHARACTERS,
+                world_settings=WORLD,
+                cache_handle=handle,
+            )
+    asyncio.run(run())
+
+
+def test_prefix_reused_across_batch():
+    """同一批次只创建一次前缀缓存，每章只发送可变部分"""
+    provider = FakeGeminiProvider(api_key="test", proxy=None, model="gemini-test")
+    cache = PromptPrefixCache(ttl_seconds=600)
+
+    _write_batch(provider, cache, chapter_count=5, context_version="v1")
+
+    assert len(provider.client.caches.created) == 1
+    assert "少年踏上修行路" in provider.client.caches.created[0]["text"]
+    calls = provider.client.models.calls
+    assert len(calls) == 5
+    for idx, call in enumerate(calls):
+        assert call["config"]["cached_content"] == "cachedContents/1"
+        assert "少年踏上修行路" not in call["contents"]
+        assert f"第{idx + 1}章" in call["contents"]
+    assert cache.snapshot()["hits"] == 4
+
+
+def test_prefix_refreshed_when_context_version_changes():
+    """上下文版本变化时重新登记前缀，并删除旧缓存"""
+    provider = FakeGeminiProvider(api_key="test", proxy=None, model="gemini-test")
+    cache = PromptPrefixCache(ttl_seconds=600)
+
+    _write_batch(provider, cache, chapter_count=2, context_version="v1")
+    _write_batch(provider, cache, chapter_count=2, context_version="v2")
+
+    assert [c["name"] for c in provider.client.caches.created] == ["cachedContents/1", "cachedContents/2"]
+    assert provider.client.caches.deleted == ["cachedContents/1"]
+    assert provider.client.models.calls[-1]["config"]["cached_content"] == "cachedContents/2"
+
+
+def test_full_prompt_without_handle():
+    """没有缓存句柄时发送完整提示词"""
+    provider = FakeGeminiProvider(api_key="test", proxy=None, model="gemini-test")
+
+    asyncio.run(provider.write_chapter_content(
+        novel_title="星河",
+        genre="玄幻",
+        synopsis="少年踏上修行路",
+        chapter_title="第1章",
+        chapter_summary="情节",
+        chapter_prompt_hints="",
+        characters=CHARACTERS,
+        world_settings=WORLD,
+    ))
+
+    call = provider.client.models.calls[0]
+    assert "cached_content" not in call["config"]
+    assert "少年踏上修行路" in call["contents"]
+    assert "第1章" in call["contents"]
+
+
+def test_original_prompt_order_when_cache_disabled(monkeypatch):
+    """未启用前缀缓存时保持原有顺序：章节信息在前，背景资料在后"""
+    provider = FakeGeminiProvider(api_key="test", proxy=None, model="gemini-test")
+    monkeypatch.setattr(prompt_cache_module.settings, "PROMPT_CACHE_ENABLED", False)
+
+    asyncio.run(provider.write_chapter_content(
+        novel_title="星河",
+        genre="玄幻",
+        synopsis="少年踏上修行路",
+        chapter_title="第1章",
+        chapter_summary="情节",
+        chapter_prompt_hints="",
+        characters=CHARACTERS,
+        world_settings=WORLD,
+    ))
+
+    contents = provider.client.models.calls[0]["contents"]
+    assert contents.startswith("请为小说《星河》创作一个完整的章节。")
+    assert contents.index("【章节基本信息】") < contents.index("【小说背景信息】") < contents.index("【创作要求】")
+
+
+def test_prefix_cache_calls_run_off_the_event_loop():
+    """同步客户端的创建缓存调用在工作线程中执行"""
+    provider = FakeGeminiProvider(api_key="test", proxy=None, model="gemini-test")
+
+    asyncio.run(provider.create_prefix_cache("前缀", 600))
+
+    assert provider.client.caches.thread is not threading.main_thread()
+
+
+class FakePrefixProvider:
+    """只实现前缀缓存接口的提供商"""
+
+    model = "m"
+
+    def __init__(self, delay=0.0, model="m"):
+        self.delay = delay
+        self.model = model
+        self.created = 0
+        self.failed = False
+        self.deleted = []
+
+    async def create_prefix_cache(self, prefix, ttl_seconds):
+        await asyncio.sleep(self.delay)
+        self.created += 1
+        return f"cachedContents/{self.created}"
+
+    async def delete_prefix_cache(self, provider_ref):
+        self.deleted.append(provider_ref)
+
+
+class FlakyPrefixProvider(FakePrefixProvider):
+    """第一次创建缓存失败的提供商"""
+
+    async def create_prefix_cache(self, prefix, ttl_seconds):
+        if not self.created and not self.failed:
+            self.failed = True
+            raise RuntimeError("503 UNAVAILABLE")
+        return await super().create_prefix_cache(prefix, ttl_seconds)
+
+
+def test_locks_released_after_use():
+    """每个缓存键的锁用完即释放，键再多也不会累积；并发获取同一键时仍只创建一次"""
+    cache = PromptPrefixCache(max_entries=4)
+    provider = FakePrefixProvider(delay=0.01)
+
+    async def run():
+        await asyncio.gather(*(cache.acquire(provider, key="novel-1", prefix="前缀" * 20) for _ in range(5)))
+        for idx in range(50):
+            await cache.acquire(provider, key=f"novel-{idx}", prefix="前缀" * 20)
+
+    asyncio.run(run())
+    assert provider.created == 50
+    assert len(cache._locks) == 0
+    assert cache.snapshot()["entries"] == 4
+
+
+def test_evicted_cache_deleted_by_its_owner():
+    """淘汰的缓存由创建它的提供商删除，而不是恰好触发淘汰的提供商"""
+    cache = PromptPrefixCache(max_entries=1)
+    owner = FakePrefixProvider(model="a")
+    other = FakePrefixProvider(model="b")
+
+    async def run():
+        await cache.acquire(owner, key="novel-1", prefix="前缀" * 20)
+        await cache.acquire(other, key="novel-2", prefix="前缀" * 20)
+
+    asyncio.run(run())
+    assert owner.deleted == ["cachedContents/1"]
+    assert other.deleted == []
+
+
+def test_create_failure_retried_after_backoff(monkeypatch):
+    """创建失败后退避期内不重试，退避期过后重新创建"""
+    cache = PromptPrefixCache()
+    provider = FlakyPrefixProvider()
+
+    async def acquire():
+        return await cache.acquire(provider, key="novel-1", prefix="前缀" * 20)
+
+    assert asyncio.run(acquire()) is None
+    assert asyncio.run(acquire()) is None
+    assert provider.created == 0
+
+    monkeypatch.setattr(prompt_cache_module, "CREATE_RETRY_SECONDS", 0)
+    handle = asyncio.run(acquire())
+    assert handle.provider_ref == "cachedContents/1"
+    assert cache.snapshot()["failures"] == 1
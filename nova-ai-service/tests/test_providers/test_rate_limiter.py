@@ -0,0 +1,143 @@
+"""上游自适应限流测试"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app.core.rate_limiter import (
+    AdaptiveRateLimiter,
+    MemoryBucketStore,
+    RateLimitedModels,
+    RateLimitTimeout,
+    SQLiteBucketStore,
+    is_throttle_error,
+    parse_rate_limits,
+    retry_after_from_error,
+)
+
+
+def _http_error(status: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError("upstream error", request=request, response=response)
+
+
+def test_throttle_detection_and_retry_after():
+    """429/503 识别与 Retry-After 解析"""
+    assert is_throttle_error(_http_error(429))
+    assert is_throttle_error(_http_error(503))
+    assert not is_throttle_error(_http_error(400))
+    assert retry_after_from_error(_http_error(429, {"Retry-After": "7"})) == 7.0
+    assert retry_after_from_error(RuntimeError("429 RESOURCE_EXHAUSTED, retryDelay: '12s'")) == 12.0
+    assert retry_after_from_error(RuntimeError("boom")) is None
+
+
+def test_parse_rate_limits():
+    """限额配置解析，忽略无效项"""
+    limits = parse_rate_limits("default:2:5:4, gemini/gemini-2.0-flash:1.5:3:2,broken")
+    assert limits == {"default": (2.0, 5, 4), "gemini/gemini-2.0-flash": (1.5, 3, 2)}
+
+
+def test_aimd_concurrency():
+    """成功加性增长，限流乘性减小并暂停令牌桶"""
+    limiter = AdaptiveRateLimiter("k", rate=100, burst=10, max_concurrency=8)
+    limiter.on_throttle(retry_after=5)
+    assert limiter.concurrency_limit == 4
+    # 同一波限流只减一次
+    limiter.on_throttle(retry_after=5)
+    assert limiter.concurrency_limit == 4
+    assert limiter.snapshot()["throttled"] == 2
+    assert limiter.store.take("k", 100, 10) > 4
+
+    limiter.on_success()
+    assert limiter.concurrency_limit == pytest.approx(4.25)
+
+
+def test_token_bucket_paces_requests():
+    """令牌耗尽后需要等待"""
+    store = MemoryBucketStore()
+    assert store.take("k", 1.0, 2) == 0
+    assert store.take("k", 1.0, 2) == 0
+    assert store.take("k", 1.0, 2) > 0.5
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    """两个存储实例（模拟两个进程）共享同一个桶"""
+    path = str(tmp_path / "buckets.sqlite3")
+    a = SQLiteBucketStore(path)
+    b = SQLiteBucketStore(path)
+    assert a.take("k", 1.0, 1) == 0
+    assert b.take("k", 1.0, 1) > 0
+    b.penalize("k", 1.0, 1, pause=30)
+    assert a.peek("k")["blocked_until"] > b.peek("k")["updated_at"] + 20
+
+
+class FakeAsyncModels:
+    """异步客户端，记录峰值并发，并可先返回若干次 429"""
+
+    def __init__(self, throttle_times: int = 0):
+        self.active = 0
+        self.peak = 0
+        self.throttle_times = throttle_times
+
+    async def generate_content(self, model, contents, config):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.02)
+            if self.throttle_times > 0:
+                self.throttle_times -= 1
+                raise _http_error(429, {"Retry-After": "0"})
+            return SimpleNamespace(text="ok")
+        finally:
+            self.active -= 1
+
+
+def test_concurrency_is_capped(monkeypatch):
+    """并发不超过上限，且排队等待被记录"""
+    limiter = AdaptiveRateLimiter("deepseek:m:-", rate=1000, burst=1000, max_concurrency=2)
+    monkeypatch.setattr("app.core.rate_limiter.get_rate_limiter", lambda *args, **kwargs: limiter)
+    inner = FakeAsyncModels()
+    models = RateLimitedModels(inner, "deepseek")
+
+    async def run():
+        await asyncio.gather(*[models.generate_content(model="m", contents=str(i), config=None) for i in range(6)])
+
+    asyncio.run(run())
+    stats = limiter.snapshot()
+    assert inner.peak <= 2
+    assert stats["acquired"] == 6
+    assert stats["in_flight"] == 0
+    assert stats["queue_wait_ms_max"] > 0
+
+
+def test_throttle_response_lowers_limit(monkeypatch):
+    """上游 429 会降低并发上限并继续抛出"""
+    limiter = AdaptiveRateLimiter("deepseek:m:-", rate=1000, burst=1000, max_concurrency=4)
+    monkeypatch.setattr("app.core.rate_limiter.get_rate_limiter", lambda *args, **kwargs: limiter)
+    models = RateLimitedModels(FakeAsyncModels(throttle_times=1), "deepseek")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(models.generate_content(model="m", contents="x", config=None))
+    assert limiter.concurrency_limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_event_loop_thread_does_not_wait_for_tokens():
+    """事件循环线程内拿不到令牌时立即失败，不阻塞事件循环，并归还并发槽"""
+    limiter = AdaptiveRateLimiter("gemini:m:-", rate=0.01, burst=1, max_concurrency=4, max_wait_seconds=60)
+
+    async def run():
+        limiter.acquire_sync()
+        limiter.release()
+        started = time.monotonic()
+        with pytest.raises(RateLimitTimeout):
+            limiter.acquire_sync()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 0.1
+    assert limiter.in_flight == 0
+    assert limiter.snapshot()["timeouts"] == 1
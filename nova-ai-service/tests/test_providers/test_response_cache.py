@@ -0,0 +1,146 @@
+"""模型响应缓存测试"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from app.api.dependencies import _cache_bypassed
+from app.core.response_cache import CachingModels, ResponseCache, cacheable_response, make_cache_key
+
+
+class FakeSyncModels:
+    """同步客户端（Gemini 形态）"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, model, contents, config):
+        self.calls += 1
+        return SimpleNamespace(text=f"回答:{contents}")
+
+    def generate_content_stream(self, model, contents, config):
+        self.calls += 1
+        for part in ["第一段", "第二段", "第三段"]:
+            yield SimpleNamespace(text=part)
+
+
+class FakeAsyncModels:
+    """异步客户端（DeepSeek 形态）"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content(self, model, contents, config):
+        self.calls += 1
+        return SimpleNamespace(text=f"回答:{contents}")
+
+
+def test_key_depends_on_config():
+    """生成参数不同则缓存键不同"""
+    a = make_cache_key("gemini", "m", "提示词", {"temperature": 0.7})
+    b = make_cache_key("gemini", "m", "提示词", {"temperature": 0.9})
+    assert a != b
+    assert a == make_cache_key("gemini", "m", "提示词", {"temperature": 0.7})
+
+
+def test_sync_generate_hits_cache():
+    """相同的确定性请求（temperature 0）第二次直接命中缓存"""
+    inner = FakeSyncModels()
+    models = CachingModels(inner, ResponseCache(), "gemini")
+    first = models.generate_content(model="m", contents="总结第一章", config={"temperature": 0})
+    second = models.generate_content(model="m", contents="总结第一章", config={"temperature": 0})
+    assert first.text == second.text
+    assert inner.calls == 1
+
+
+def test_sampled_generate_not_cached():
+    """带采样温度的生成（写章节、重新生成）每次都请求上游"""
+    inner = FakeSyncModels()
+    models = CachingModels(inner, ResponseCache(), "gemini")
+    for _ in range(2):
+        models.generate_content(model="m", contents="写第一章", config={"temperature": 0.9})
+        list(models.generate_content_stream(model="m", contents="写第一章", config={"temperature": 0.9}))
+        models.generate_content(model="m", contents="写第一章", config={})
+    assert inner.calls == 6
+
+
+def test_cacheable_method_opts_in():
+    """@cacheable_response 标记的方法（摘要、信息抽取）内，带采样温度的调用同样可缓存"""
+    inner = FakeSyncModels()
+    models = CachingModels(inner, ResponseCache(), "gemini")
+
+    @cacheable_response
+    async def summarize():
+        # 与提供商实现一致：同步客户端在线程中调用，上下文随之复制
+        response = await asyncio.to_thread(
+            models.generate_content, model="m", contents="总结第一章", config={"temperature": 0.25}
+        )
+        return response.text
+
+    assert asyncio.run(summarize()) == asyncio.run(summarize())
+    assert inner.calls == 1
+    models.generate_content(model="m", contents="总结第一章", config={"temperature": 0.25})
+    assert inner.calls == 2
+
+
+def test_async_generate_hits_cache():
+    """异步客户端同样可缓存"""
+    inner = FakeAsyncModels()
+    models = CachingModels(inner, ResponseCache(), "deepseek")
+
+    async def run():
+        a = await models.generate_content(model="m", contents="大纲", config={"temperature": 0})
+        b = await models.generate_content(model="m", contents="大纲", config={"temperature": 0})
+        return a.text, b.text
+
+    a, b = asyncio.run(run())
+    assert a == b
+    assert inner.calls == 1
+
+
+def test_stream_is_replayed_from_cache():
+    """流式响应缓存后按分片重放"""
+    inner = FakeSyncModels()
+    models = CachingModels(inner, ResponseCache(), "gemini")
+    config = {"temperature": 0}
+    first = "".join(c.text for c in models.generate_content_stream(model="m", contents="写章节", config=config))
+    replay = list(models.generate_content_stream(model="m", contents="写章节", config=config))
+    assert inner.calls == 1
+    assert "".join(c.text for c in replay) == first == "第一段第二段第三段"
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    """持久层在新实例中仍可命中"""
+    db_path = str(tmp_path / "cache.sqlite3")
+    ResponseCache(db_path=db_path).set("k", "缓存内容", "gemini", "m")
+    cache = ResponseCache(db_path=db_path)
+    assert cache.get("k") == "缓存内容"
+    assert cache.stats["disk_hits"] == 1
+
+
+def test_ttl_expiry(tmp_path):
+    """过期条目不再返回"""
+    cache = ResponseCache(ttl_seconds=1, db_path=str(tmp_path / "cache.sqlite3"))
+    cache.set("k", "内容")
+    cache._memory["k"] = (time.time() - 1, "内容")
+    cache._conn.execute("UPDATE response_cache SET expires_at = ?", (time.time() - 1,))
+    assert cache.get("k") is None
+
+
+def test_size_eviction(tmp_path):
+    """超出大小上限时淘汰最久未访问的记录"""
+    cache = ResponseCache(memory_max_entries=2, db_path=str(tmp_path / "cache.sqlite3"), db_max_bytes=30)
+    for idx in range(5):
+        cache.set(f"k{idx}", "x" * 10)
+    assert len(cache._memory) == 2
+    assert cache.snapshot()["disk_entries"] == 3
+    assert cache.get("k0") is None
+    assert cache.get("k4") == "x" * 10
+
+
+def test_bypass_headers():
+    """X-Cache-Bypass 与 Cache-Control: no-cache 都会跳过缓存"""
+    assert _cache_bypassed("true", None)
+    assert _cache_bypassed(None, "no-cache")
+    assert not _cache_bypassed(None, None)
+    assert not _cache_bypassed("false", "max-age=0")
@@ -0,0 +1,231 @@
+"""提供商路由测试：故障转移、超时、熔断、对冲与流式切换"""
+
+import asyncio
+import json
+import threading
+import time
+
+from starlette.responses import Response
+
+from app.core.rate_limiter import AdaptiveRateLimiter
+from app.core.routing import ProviderHealth, ProviderRouter, RoutedProvider
+
+
+class FakeProvider:
+    """可配置延迟与失败的提供商"""
+
+    def __init__(self, name, delay=0.0, fail=None, blocking=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.blocking_client = blocking
+        self.model = f"{name}-model"
+        self.calls = 0
+        self.cache_handles = []
+
+    async def extract_next_chapter_hook(self, chapter_content):
+        self.calls += 1
+        if self.blocking_client:
+            time.sleep(self.delay)
+        else:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise Exception(self.fail)
+        return f"{self.name}:{chapter_content}"
+
+    async def write_chapter_content_stream(self, chapter_title, cache_handle=None):
+        self.calls += 1
+        self.cache_handles.append(cache_handle)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            yield f"data: {json.dumps({'error': self.fail})}\n\n"
+            raise Exception(self.fail)
+        for part in ["一", "二"]:
+            yield f"data: {json.dumps({'chunk': self.name + part})}\n\n"
+
+
+def _routed(providers, router, response=None):
+    return RoutedProvider(
+        [p.name for p in providers],
+        factory=lambda name: next(p for p in providers if p.name == name),
+        response=response,
+        router=router,
+    )
+
+
+def test_failover_on_error_sets_headers():
+    """首选失败后切换到备用提供商，并写入路由响应头"""
+    router = ProviderRouter(budgets={"default": 5})
+    gemini = FakeProvider("gemini", fail="location is not supported")
+    deepseek = FakeProvider("deepseek")
+    response = Response()
+
+    result = asyncio.run(_routed([gemini, deepseek], router, response).extract_next_chapter_hook(chapter_content="x"))
+
+    assert result == "deepseek:x"
+    assert response.headers["X-Routed-Provider"] == "deepseek"
+    assert response.headers["X-Route-Attempts"] == "gemini:error,deepseek:ok"
+    assert router.stats["failovers"] == 1
+    # 地区限制直接熔断，下一次请求不再先打到 gemini
+    assert router.health("gemini").state == ProviderHealth.OPEN
+    assert router.plan(["gemini", "deepseek"], "extract_next_chapter_hook") == ["deepseek"]
+
+
+def test_latency_budget_triggers_failover_for_blocking_client():
+    """阻塞型客户端在工作线程中执行，超出延迟预算即切换"""
+    router = ProviderRouter(budgets={"extract_next_chapter_hook": 0.1})
+    gemini = FakeProvider("gemini", delay=0.5, blocking=True)
+    deepseek = FakeProvider("deepseek")
+
+    async def run():
+        started = time.monotonic()
+        result = await _routed([gemini, deepseek], router).extract_next_chapter_hook(chapter_content="x")
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result == "deepseek:x"
+    assert elapsed < 0.45
+    assert router.stats["timeouts"] == 1
+
+
+def test_breaker_opens_after_consecutive_failures_and_half_opens():
+    """连续失败达到阈值后熔断，冷却后放行一个探测请求"""
+    health = ProviderHealth("gemini", failure_threshold=2, open_seconds=0.05)
+    health.record_failure("op", 0.1)
+    assert health.allow_request()
+    health.record_failure("op", 0.1)
+    assert not health.allow_request()
+    time.sleep(0.06)
+    assert health.allow_request()
+    assert not health.allow_request()
+    health.record_success("op", 0.1)
+    assert health.state == ProviderHealth.CLOSED
+
+
+def test_hedged_request_first_success_wins():
+    """主请求超过对冲延迟时向第二个提供商发出对冲请求，先成功者胜出"""
+    router = ProviderRouter(
+        budgets={"default": 5},
+        hedge_operations=["extract_next_chapter_hook"],
+        hedge_delay_seconds=0.05,
+    )
+    gemini = FakeProvider("gemini", delay=0.5)
+    deepseek = FakeProvider("deepseek", delay=0.01)
+    response = Response()
+
+    result = asyncio.run(_routed([gemini, deepseek], router, response).extract_next_chapter_hook(chapter_content="x"))
+
+    assert result == "deepseek:x"
+    assert response.headers["X-Route-Hedged"] == "true"
+    assert router.stats["hedges"] == 1
+    assert router.stats["hedge_wins"] == 1
+
+
+def test_stream_fails_over_before_first_chunk():
+    """流式：首个内容分片前失败则切换，错误事件不会泄露给调用方，缓存句柄不传给备用提供商"""
+    router = ProviderRouter(budgets={"default": 5})
+    gemini = FakeProvider("gemini", fail="503 UNAVAILABLE")
+    deepseek = FakeProvider("deepseek")
+
+    async def collect():
+        routed = _routed([gemini, deepseek], router)
+        return [c async for c in routed.write_chapter_content_stream(chapter_title="第一章", cache_handle="handle")]
+
+    events = [json.loads(c[len("data:"):]) for c in asyncio.run(collect())]
+    assert events[0]["route"] == {"provider": "deepseek", "attempts": ["gemini:error", "deepseek:ok"], "hedged": False}
+    assert [e["chunk"] for e in events[1:]] == ["deepseek一", "deepseek二"]
+    assert gemini.cache_handles == ["handle"]
+    assert deepseek.cache_handles == [None]
+
+
+def test_budget_does_not_kill_sole_candidate():
+    """计划中没有备用提供商时不设预算，超出预算的调用照常完成"""
+    router = ProviderRouter(budgets={"default": 0.05})
+    gemini = FakeProvider("gemini", delay=0.15, blocking=True)
+
+    result = asyncio.run(_routed([gemini], router).extract_next_chapter_hook(chapter_content="x"))
+
+    assert result == "gemini:x"
+    assert router.stats["timeouts"] == 0
+
+
+def test_slow_primary_keeps_running_after_failover():
+    """超出预算只触发故障转移，慢的首选调用不被取消，先完成者胜出"""
+    router = ProviderRouter(budgets={"default": 0.05})
+    gemini = FakeProvider("gemini", delay=0.1)
+    deepseek = FakeProvider("deepseek", delay=1)
+    response = Response()
+
+    result = asyncio.run(_routed([gemini, deepseek], router, response).extract_next_chapter_hook(chapter_content="x"))
+
+    assert result == "gemini:x"
+    assert response.headers["X-Routed-Provider"] == "gemini"
+    assert response.headers["X-Route-Attempts"] == "gemini:slow,gemini:ok"
+    assert router.stats["timeouts"] == 1
+    assert deepseek.calls == 1
+
+
+def test_stream_first_chunk_race():
+    """流式：首个分片超出预算时启动备用流竞争首个分片，落败的流被关闭；只有一个候选时不设预算"""
+    router = ProviderRouter(budgets={"default": 0.05})
+    gemini = FakeProvider("gemini", delay=0.5)
+    deepseek = FakeProvider("deepseek", delay=0.01)
+
+    async def collect(providers):
+        routed = _routed(providers, router)
+        return [json.loads(c[len("data:"):]) async for c in routed.write_chapter_content_stream(chapter_title="第一章")]
+
+    events = asyncio.run(collect([gemini, deepseek]))
+    assert events[0]["route"]["attempts"] == ["gemini:slow", "deepseek:ok"]
+    assert [e["chunk"] for e in events[1:]] == ["deepseek一", "deepseek二"]
+
+    events = asyncio.run(collect([FakeProvider("gemini", delay=0.15)]))
+    assert events[0]["route"] == {"provider": "gemini", "attempts": ["gemini:ok"], "hedged": False}
+    assert [e["chunk"] for e in events[1:]] == ["gemini一", "gemini二"]
+
+
+def test_unrouted_attributes_pass_through():
+    """非路由属性透传给首选提供商"""
+    gemini = FakeProvider("gemini")
+    routed = _routed([gemini], ProviderRouter())
+    assert routed.model == "gemini-model"
+
+
+class LimitedBlockingProvider:
+    """阻塞型提供商：每次调用像同步客户端一样经过 acquire_sync，记录峰值并发"""
+
+    blocking_client = True
+
+    def __init__(self, limiter):
+        self.name = "gemini"
+        self.limiter = limiter
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    async def extract_next_chapter_hook(self, chapter_content):
+        self.limiter.acquire_sync()
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+        self.limiter.finish()
+        return chapter_content
+
+
+def test_routed_blocking_calls_respect_concurrency_cap():
+    """路由工作线程中的同步调用同样受自适应并发上限约束"""
+    limiter = AdaptiveRateLimiter("gemini:m:-", rate=1000, burst=1000, max_concurrency=1)
+    provider = LimitedBlockingProvider(limiter)
+    router = ProviderRouter(budgets={"default": 5})
+
+    async def run():
+        return await asyncio.gather(*[
+            _routed([provider], router).extract_next_chapter_hook(chapter_content=str(i)) for i in range(4)
+        ])
+
+    assert asyncio.run(run()) == ["0", "1", "2", "3"]
+    assert provider.peak == 1
+    assert limiter.in_flight == 0
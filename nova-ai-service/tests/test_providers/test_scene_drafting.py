@@ -0,0 +1,198 @@
+"""场景并行写作测试（含与整章单次生成的完成耗时对比）"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+import types
+
+import pytest
+
+from app.core.providers.gemini import GeminiProvider
+from app.core.scene_drafting import build_scene_instruction, clean_scene_text, parse_beat_plan, parse_transition
+
+CHAPTER_CHARS = 6000
+
+
+def plan_json(count):
+    return json.dumps({"scenes": [
+        {
+            "title": f"场景{i + 1}",
+            "summary": f"第{i + 1}段情节",
+            "entry_state": f"状态{i}",
+            "exit_state": f"状态{i + 1}",
+            "target_chars": CHAPTER_CHARS // count,
+        }
+        for i in range(count)
+    ]}, ensure_ascii=False)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    """模拟 client.models：按提示词类型返回规划 / 场景正文 / 过渡句，写作耗时与输出字数成正比"""
+
+    def __init__(self, scene_count=4, per_char=0.0, plan_text=None, fail_scene=None, bridge_at=()):
+        self.plan_text = plan_json(scene_count) if plan_text is None else plan_text
+        self.per_char = per_char
+        self.fail_scene = fail_scene
+        self.bridge_at = set(bridge_at)
+        self.prompts = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def generate_content(self, model, contents, config):
+        with self.lock:
+            self.prompts.append(contents)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if "拆分成" in contents:
+                time.sleep(self.per_char * 200)
+                return FakeResponse(self.plan_text)
+            if "相邻两个场景的交界处" in contents:
+                time.sleep(self.per_char * 50)
+                title = re.search(r"【下一场景《(.+?)》开头】", contents).group(1)
+                return FakeResponse(f"过渡到{title}。" if title in self.bridge_at else "无")
+            match = re.search(r"你只写第 (\d+) 个场景《.+?》，约 (\d+) 字", contents)
+            index, chars = int(match.group(1)), int(match.group(2))
+            if index == self.fail_scene:
+                raise RuntimeError("503 UNAVAILABLE")
+            time.sleep(self.per_char * chars)
+            return FakeResponse(f"场景{index}\n\n第{index}段正文。")
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def generate_content_stream(self, model, contents, config):
+        """整章单次生成：每 100 字一个分片"""
+        self.prompts.append(contents)
+
+        def stream():
+            for i in range(CHAPTER_CHARS // 100):
+                time.sleep(self.per_char * 100)
+                yield FakeResponse("文" * 100)
+        return stream()
+
+
+def make_provider(models):
+    provider = GeminiProvider.__new__(GeminiProvider)
+    provider.model = "test-model"
+    provider.client = types.SimpleNamespace(models=models)
+    return provider
+
+
+CHAPTER_KWARGS = dict(
+    novel_title="n", genre="g", synopsis="s", chapter_title="夜袭", chapter_summary="潜入敌营",
+    chapter_prompt_hints="", characters=[{"name": "林风"}], world_settings=[]
+)
+
+
+def events_of(provider, **kwargs):
+    async def run():
+        return [
+            json.loads(event[len("data: "):])
+            async for event in provider.write_chapter_scenes_stream(**CHAPTER_KWARGS, **kwargs)
+        ]
+    return asyncio.run(run())
+
+
+def content_of(events):
+    return "".join(e["chunk"] for e in events if "chunk" in e)
+
+
+def test_parse_beat_plan():
+    """空梗概跳过；超出上限的场景合并到最后一个；不合理的字数按平均分配"""
+    text = json.dumps({"scenes": [
+        {"title": "一", "summary": "a", "exit_state": "x1", "target_chars": 2000},
+        {"title": "二", "summary": ""},
+        {"title": "三", "summary": "b", "target_chars": "很多"},
+        {"title": "四", "summary": "c", "exit_state": "x4", "target_chars": 1000},
+    ]}, ensure_ascii=False)
+    scenes = parse_beat_plan(text, max_scenes=2)
+    assert [s["title"] for s in scenes] == ["一", "三"]
+    assert scenes[1]["summary"] == "b；c" and scenes[1]["exit_state"] == "x4"
+    assert scenes[0]["target_chars"] == 2000 and scenes[1]["target_chars"] == 1000
+    assert [s["target_chars"] for s in parse_beat_plan(text, max_scenes=4)] == [2000, 2000, 1000]
+    assert parse_beat_plan("无法规划", 4) == []
+
+
+def test_scene_instruction_and_cleanup():
+    """中间场景既不重新开篇也不收尾；入场/出场状态写入要求；去掉模型自加的场景标题"""
+    scenes = parse_beat_plan(plan_json(3), 4)
+    middle = build_scene_instruction(scenes, 1)
+    assert "你只写第 2 个场景《场景2》" in middle
+    assert "开头从这个状态接起：状态1" in middle and "结尾停在这个状态：状态2" in middle
+    assert "不要回顾或复述" in middle and "不要给本章收尾" in middle
+    assert "完成本章收尾" in build_scene_instruction(scenes, 2)
+    assert clean_scene_text("场景二：夜色\n\n正文") == "正文"
+    assert parse_transition("无") == "" and parse_transition("“风停了。”") == "风停了。"
+    assert parse_transition("长" * 400) == ""
+
+
+def test_scenes_drafted_concurrently_and_streamed_in_order():
+    """所有场景并发写作，按顺序输出场景事件与正文；需要时插入过渡句"""
+    models = FakeModels(scene_count=4, per_char=0.00001, bridge_at={"场景3"})
+    events = events_of(make_provider(models))
+    assert "plan" in events[0] and len(events[0]["plan"]) == 4
+    assert [e["scene"]["index"] for e in events if "scene" in e] == [0, 1, 2, 3]
+    assert content_of(events) == (
+        "第1段正文。\n\n第2段正文。\n\n过渡到场景3。\n\n第3段正文。\n\n第4段正文。"
+    )
+    assert events[-1]["done"] and events[-1]["mode"] == "scenes" and events[-1]["scenes"] == 4
+    assert models.peak >= 4
+    scene_prompts = [p for p in models.prompts if "你只写第" in p]
+    # 每个场景都带完整的章节提示词（前缀缓存与整章模式一致）
+    assert len(scene_prompts) == 4 and all("请为小说《n》创作一个完整的章节" in p for p in scene_prompts)
+
+
+def test_falls_back_to_single_call_without_plan():
+    """规划不可用时退回整章流式生成"""
+    events = events_of(make_provider(FakeModels(plan_text="抱歉")))
+    assert not any("plan" in e or "scene" in e for e in events)
+    assert len(content_of(events)) == CHAPTER_CHARS and events[-1] == {"done": True}
+
+
+def test_scene_failure_reports_error():
+    """场景写作失败时输出错误事件并抛出"""
+    received = []
+
+    async def run():
+        async for event in make_provider(FakeModels(fail_scene=2)).write_chapter_scenes_stream(**CHAPTER_KWARGS):
+            received.append(json.loads(event[len("data: "):]))
+
+    with pytest.raises(Exception, match="生成章节内容失败"):
+        asyncio.run(run())
+    assert "error" in received[-1]
+
+
+def time_to_complete(provider, method):
+    async def run():
+        started = time.perf_counter()
+        first = None
+        async for event in getattr(provider, method)(**CHAPTER_KWARGS):
+            if first is None and '"chunk"' in event:
+                first = time.perf_counter() - started
+        return first, time.perf_counter() - started
+    return asyncio.run(run())
+
+
+def run_benchmark(per_char, scene_count=4):
+    single = time_to_complete(make_provider(FakeModels(per_char=per_char)), "write_chapter_content_stream")
+    scenes = time_to_complete(make_provider(FakeModels(scene_count, per_char=per_char)), "write_chapter_scenes_stream")
+    return single, scenes
+
+
+def test_scene_mode_benchmark():
+    """基准：6000 字（每字模拟 50µs 输出耗时）、4 个场景，完成耗时约为 规划 + 单个场景 + 过渡"""
+    (single_first, single_total), (scene_first, scene_total) = run_benchmark(0.00005)
+    print(
+        f"\n整章单次: 首段 {single_first * 1000:.0f}ms / 完成 {single_total * 1000:.0f}ms | "
+        f"场景并行: 首段 {scene_first * 1000:.0f}ms / 完成 {scene_total * 1000:.0f}ms"
+    )
+    assert scene_total * 2 < single_total
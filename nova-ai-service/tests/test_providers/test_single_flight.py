@@ -0,0 +1,240 @@
+"""上游请求单飞合并测试"""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from app.core.single_flight import SingleFlightModels, SingleFlightRegistry
+
+
+class FakeAsyncModels:
+    """异步客户端（DeepSeek 形态），调用会挂起一小段时间"""
+
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.stream_calls = 0
+        self.fail = fail
+
+    async def generate_content(self, model, contents, config):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise RuntimeError("上游 503")
+        return SimpleNamespace(text=f"回答:{contents}")
+
+    async def generate_content_stream(self, model, contents, config):
+        self.stream_calls += 1
+        for part in ["第一段", "第二段", "第三段"]:
+            await asyncio.sleep(0.01)
+            yield SimpleNamespace(text=part)
+
+
+class FakeSyncModels:
+    """同步客户端（Gemini 形态）"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, model, contents, config):
+        self.calls += 1
+        time.sleep(0.05)
+        return SimpleNamespace(text=f"回答:{contents}")
+
+
+def test_concurrent_async_calls_are_coalesced():
+    """并发的相同请求只调用一次上游"""
+    inner = FakeAsyncModels()
+    registry = SingleFlightRegistry()
+    models = SingleFlightModels(inner, "deepseek", registry)
+
+    async def run():
+        return await asyncio.gather(*[
+            models.generate_content(model="m", contents="同一提示词", config={"temperature": 0.7})
+            for _ in range(5)
+        ])
+
+    results = asyncio.run(run())
+    assert inner.calls == 1
+    assert {r.text for r in results} == {"回答:同一提示词"}
+    assert registry.snapshot()["coalesced"] == 4
+    assert registry.snapshot()["in_flight_calls"] == 0
+
+
+def test_different_requests_are_not_coalesced():
+    """提示词不同的请求各自调用上游"""
+    inner = FakeAsyncModels()
+    models = SingleFlightModels(inner, "deepseek", SingleFlightRegistry())
+
+    async def run():
+        return await asyncio.gather(
+            models.generate_content(model="m", contents="提示词A", config=None),
+            models.generate_content(model="m", contents="提示词B", config=None),
+        )
+
+    asyncio.run(run())
+    assert inner.calls == 2
+
+
+def test_error_is_shared_with_followers():
+    """上游异常传给所有等待者，且不会留下登记项"""
+    inner = FakeAsyncModels(fail=True)
+    registry = SingleFlightRegistry()
+    models = SingleFlightModels(inner, "deepseek", registry)
+
+    async def run():
+        return await asyncio.gather(*[
+            models.generate_content(model="m", contents="提示词", config=None)
+            for _ in range(3)
+        ], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert inner.calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert registry.snapshot()["in_flight_calls"] == 0
+
+
+def test_sync_calls_across_threads_are_coalesced():
+    """同步客户端的跨线程并发调用被合并"""
+    inner = FakeSyncModels()
+    models = SingleFlightModels(inner, "gemini", SingleFlightRegistry())
+    results = []
+
+    def worker():
+        results.append(models.generate_content(model="m", contents="提示词", config=None).text)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert inner.calls == 1
+    assert results == ["回答:提示词"] * 4
+
+
+def test_stream_fan_out():
+    """同时订阅同一流的调用方共享一条上游流，并各自收到完整分片"""
+    inner = FakeAsyncModels()
+    registry = SingleFlightRegistry()
+    models = SingleFlightModels(inner, "deepseek", registry)
+
+    async def consume():
+        parts = []
+        async for chunk in models.generate_content_stream(model="m", contents="提示词", config=None):
+            parts.append(chunk.text)
+        return "".join(parts)
+
+    async def run():
+        return await asyncio.gather(consume(), consume(), consume())
+
+    results = asyncio.run(run())
+    assert inner.stream_calls == 1
+    assert results == ["第一段第二段第三段"] * 3
+    assert registry.snapshot()["stream_subscribers_coalesced"] == 2
+    assert registry.snapshot()["in_flight_streams"] == 0
+
+
+def test_abandoned_sync_stream_closes_upstream():
+    """唯一订阅者提前离开时关闭上游流，并从登记表移除"""
+    closed = []
+
+    def upstream():
+        try:
+            for part in ["第一段", "第二段", "第三段"]:
+                yield SimpleNamespace(text=part)
+        finally:
+            closed.append(True)
+
+    inner = SimpleNamespace(generate_content_stream=lambda model, contents, config: upstream())
+    registry = SingleFlightRegistry()
+    models = SingleFlightModels(inner, "gemini", registry)
+
+    stream = models.generate_content_stream(model="m", contents="提示词", config=None)
+    assert next(stream).text == "第一段"
+    stream.close()
+
+    assert closed == [True]
+    snapshot = registry.snapshot()
+    assert snapshot["in_flight_streams"] == 0
+    assert snapshot["streams_abandoned"] == 1
+
+
+def test_async_stream_kept_open_while_other_subscribers_remain():
+    """还有其他订阅者时不关闭上游；全部离开后才关闭"""
+    closed = []
+
+    class SlowModels:
+        async def generate_content_stream(self, model, contents, config):
+            try:
+                for part in ["第一段", "第二段", "第三段"]:
+                    await asyncio.sleep(0.01)
+                    yield SimpleNamespace(text=part)
+            finally:
+                closed.append(True)
+
+    registry = SingleFlightRegistry()
+    models = SingleFlightModels(SlowModels(), "deepseek", registry)
+
+    async def run():
+        first = models.generate_content_stream(model="m", contents="提示词", config=None)
+        second = models.generate_content_stream(model="m", contents="提示词", config=None)
+        assert (await first.__anext__()).text == "第一段"
+        assert (await second.__anext__()).text == "第一段"
+        await first.aclose()
+        assert closed == []
+        assert (await second.__anext__()).text == "第二段"
+        await second.aclose()
+
+    asyncio.run(run())
+    assert closed == [True]
+    assert registry.snapshot()["in_flight_streams"] == 0
+
+
+def test_cancelled_leader_does_not_fail_followers():
+    """领头者被取消时，跟随者仍拿到上游结果"""
+    inner = FakeAsyncModels()
+    registry = SingleFlightRegistry()
+    models = SingleFlightModels(inner, "deepseek", registry)
+
+    async def run():
+        leader = asyncio.ensure_future(models.generate_content(model="m", contents="提示词", config=None))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(models.generate_content(model="m", contents="提示词", config=None))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        result = await follower
+        assert leader.cancelled()
+        return result
+
+    assert asyncio.run(run()).text == "回答:提示词"
+    assert inner.calls == 1
+    assert registry.snapshot()["in_flight_calls"] == 0
+
+
+def test_upstream_cancelled_when_all_waiters_leave():
+    """所有等待者都取消后，上游任务被取消且不留下登记项"""
+    registry = SingleFlightRegistry()
+    started = []
+    cancelled = []
+
+    async def upstream():
+        started.append(True)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        callers = [asyncio.ensure_future(registry.do_async("k", upstream)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert started == [True]
+    assert cancelled == [True]
+    assert registry.snapshot()["in_flight_calls"] == 0
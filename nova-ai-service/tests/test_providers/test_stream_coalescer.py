@@ -0,0 +1,154 @@
+"""SSE 分片事件合并测试（含事件速率与每 token CPU 开销基准）"""
+
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from app.core.stream_coalescer import coalesce_sse_events
+
+
+def chunk_event(text):
+    return f"data: {json.dumps({'chunk': text})}\n\n"
+
+
+async def fast_provider(count, burst=5, pause=0.001):
+    """模拟快速模型的提供商流：每 burst 个 token 停顿 pause 秒，最后发送完成事件"""
+    for i in range(count):
+        if i % burst == 0:
+            await asyncio.sleep(pause)
+        yield chunk_event("字词")
+    yield f"data: {json.dumps({'done': True})}\n\n"
+
+
+def parse(events):
+    return [json.loads(event[len("data: "):]) for event in events]
+
+
+async def collect(stream, **kwargs):
+    return [event async for event in coalesce_sse_events(stream, **kwargs)]
+
+
+def test_chunks_merged_and_flushed_before_done():
+    """窗口内的分片合并，完成事件前先冲刷，内容不变"""
+    events = parse(asyncio.run(collect(fast_provider(200), window_seconds=0.04, max_bytes=10000)))
+    assert events[-1] == {"done": True}
+    assert "".join(e["chunk"] for e in events[:-1]) == "字词" * 200
+    assert len(events) < 40
+
+
+def test_window_flush_while_upstream_stalls():
+    """上游停顿时按窗口输出已缓冲的分片，不等下一个事件"""
+    async def stalled():
+        yield chunk_event("前半")
+        await asyncio.sleep(0.5)
+        yield chunk_event("后半")
+
+    async def run():
+        started = time.monotonic()
+        iterator = coalesce_sse_events(stalled(), window_seconds=0.03, max_bytes=10000)
+        first = await iterator.__anext__()
+        elapsed = time.monotonic() - started
+        rest = [event async for event in iterator]
+        return first, elapsed, rest
+
+    first, elapsed, rest = asyncio.run(run())
+    assert parse([first]) == [{"chunk": "前半"}]
+    assert elapsed < 0.3
+    assert parse(rest) == [{"chunk": "后半"}]
+
+
+def test_error_event_passes_through_after_flush():
+    """错误事件前先冲刷分片；上游异常在输出缓冲内容后抛出"""
+    async def failing():
+        yield chunk_event("a")
+        yield chunk_event("b")
+        yield f"data: {json.dumps({'error': '上游 503'})}\n\n"
+        yield chunk_event("c")
+        raise RuntimeError("上游 503")
+
+    received = []
+
+    async def run():
+        async for event in coalesce_sse_events(failing(), window_seconds=10, max_bytes=10000):
+            received.append(event)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert parse(received) == [{"chunk": "ab"}, {"error": "上游 503"}, {"chunk": "c"}]
+
+
+def test_disabled_window_passes_through():
+    """窗口为 0 时原样透传"""
+    events = asyncio.run(collect(fast_provider(10), window_seconds=0, max_bytes=10000))
+    assert len(events) == 11
+
+
+def test_close_cancels_pending_read():
+    """调用方提前关闭时取消挂起的读取，上游流随后可正常关闭"""
+    async def endless():
+        while True:
+            await asyncio.sleep(0.005)
+            yield chunk_event("x")
+
+    async def run():
+        stream = endless()
+        events = coalesce_sse_events(stream, window_seconds=0.02, max_bytes=10000)
+        await events.__anext__()
+        await events.aclose()
+        await stream.aclose()
+
+    asyncio.run(run())
+
+
+def run_benchmark(window_seconds, tokens=3000):
+    """经 StreamingResponse 写入本地 socket（每个事件一次 HTTP 分块写入），返回事件数、事件速率与每 token 的 CPU 微秒数"""
+    from starlette.responses import StreamingResponse
+
+    reader, writer = socket.socketpair()
+    drained = threading.Thread(target=lambda: [None for _ in iter(lambda: reader.recv(65536), b"")], daemon=True)
+    drained.start()
+    events = []
+
+    async def send(message):
+        body = message.get("body", b"")
+        if body:
+            events.append(len(body))
+            writer.sendall(b"%x\r\n%s\r\n" % (len(body), body))
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def run():
+        response = StreamingResponse(
+            coalesce_sse_events(fast_provider(tokens), window_seconds=window_seconds, max_bytes=4096),
+            media_type="text/event-stream",
+        )
+        await response({"type": "http"}, receive, send)
+
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    asyncio.run(run())
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    writer.close()
+    drained.join(timeout=1)
+    reader.close()
+    return len(events), len(events) / wall, cpu * 1e6 / tokens
+
+
+def test_benchmark_fewer_events_less_cpu():
+    """合并后事件数下降一个数量级以上，每 token 的 CPU 开销下降"""
+    raw_events, raw_rate, raw_cpu = run_benchmark(0)
+    merged_events, merged_rate, merged_cpu = run_benchmark(0.04)
+    print(
+        f"\n   逐片发送: {raw_events} 个事件, {raw_rate:.0f} 事件/秒, CPU {raw_cpu:.1f}µs/token"
+        f"\n   40ms 合并: {merged_events} 个事件, {merged_rate:.0f} 事件/秒, CPU {merged_cpu:.1f}µs/token"
+    )
+    assert raw_events == 3001
+    assert merged_events * 10 < raw_events
+    assert merged_cpu < raw_cpu
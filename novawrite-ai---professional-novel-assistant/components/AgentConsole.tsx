@@ -26,6 +26,12 @@ interface StreamEventPayload {
   run_id?: string;
   message?: string;
   chapter_id?: string;
+  elapsed_ms?: number;
+  waited_ms?: number;
+  speculative?: boolean;
+  mode?: 'paragraph' | 'rewrite';
+  paragraphs?: string[];
+  timings?: Record<string, number>;
 }
 
 const stageLabels: Record<string, string> = {
@@ -33,9 +39,12 @@ const stageLabels: Record<string, string> = {
   writer: '写作',
   critic: '批评',
   archivist: '档案',
+  summaries: '摘要',
   flow: '流程',
 };
 
+const MAX_STREAM_RECONNECTS = 3;
+
 const createId = () => `${Date.now()}-${Math.random().toString(16).slice(2)}`;
 
 const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
@@ -70,6 +79,22 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
     return stageLabels[stage] || stage;
   };
 
+  const getStatusText = (data: StreamEventPayload) => {
+    const prefix = data.speculative ? '预执行 · ' : '';
+    if (data.status === 'retry') {
+      return data.mode === 'paragraph' && Array.isArray(data.paragraphs)
+        ? `局部修订 ${data.paragraphs.join('、')}`
+        : '重试';
+    }
+    if (data.status === 'discarded') return `${prefix}结果已丢弃（需重写）`;
+    if (data.status === 'done') {
+      const seconds = typeof data.elapsed_ms === 'number' ? (data.elapsed_ms / 1000).toFixed(1) : '-';
+      const waited = typeof data.waited_ms === 'number' ? `，等待 ${(data.waited_ms / 1000).toFixed(1)}s` : '';
+      return `${prefix}完成（${seconds}s${waited}）`;
+    }
+    return `${prefix}执行`;
+  };
+
   const findChapterTitle = (chapterId?: string) => {
     if (!chapterId) return '';
     for (const volume of volumes) {
@@ -173,8 +198,13 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
   const parseSseEvent = (raw: string) => {
     const lines = raw.split(/\r?\n/);
     let event = 'message';
+    let id: number | null = null;
     const dataLines: string[] = [];
     for (const line of lines) {
+      if (line.startsWith('id:')) {
+        const parsedId = Number(line.slice(3).trim());
+        id = Number.isFinite(parsedId) ? parsedId : null;
+      }
       if (line.startsWith('event:')) {
         event = line.slice(6).trim();
       }
@@ -183,17 +213,18 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
       }
     }
     const dataString = dataLines.join('\n');
-    if (!dataString) return { event, data: null };
+    if (!dataString) return { event, id, data: null };
     try {
-      return { event, data: JSON.parse(dataString) };
+      return { event, id, data: JSON.parse(dataString) };
     } catch {
-      return { event, data: dataString };
+      return { event, id, data: dataString };
     }
   };
 
   const consumeSse = async (
     response: Response,
-    onEvent: (event: string, data: StreamEventPayload | string | null) => void
+    onEvent: (event: string, data: StreamEventPayload | string | null) => void,
+    onEventId?: (id: number) => void
   ) => {
     if (!response.body) {
       throw new Error('Stream response has no body');
@@ -211,11 +242,45 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
         buffer = buffer.slice(index + 2);
         if (!rawEvent) continue;
         const parsed = parseSseEvent(rawEvent);
+        if (parsed.id !== null && onEventId) onEventId(parsed.id);
         onEvent(parsed.event, parsed.data);
       }
     }
   };
 
+  // 流程生成在服务端独立运行：断线后带 Last-Event-ID 重连，补发错过的事件并接上当前生成
+  const consumeFlowWithReconnect = async (
+    response: Response,
+    onEvent: (event: string, data: StreamEventPayload | string | null) => void
+  ) => {
+    let runId = response.headers.get('X-Run-Id');
+    let lastEventId = 0;
+    let finished = false;
+    const trackedOnEvent = (event: string, data: StreamEventPayload | string | null) => {
+      if (data && typeof data === 'object' && data.run_id) runId = data.run_id;
+      if (event === 'done' || event === 'error' || event === 'cancelled') finished = true;
+      onEvent(event, data);
+    };
+    let current = response;
+    for (let attempt = 0; ; attempt += 1) {
+      try {
+        await consumeSse(current, trackedOnEvent, (id) => {
+          lastEventId = id;
+        });
+        if (finished || !runId) return;
+      } catch (err) {
+        if (finished || !runId || attempt >= MAX_STREAM_RECONNECTS) throw err;
+      }
+      if (attempt >= MAX_STREAM_RECONNECTS) return;
+      await new Promise((resolve) => setTimeout(resolve, 1000 * (attempt + 1)));
+      current = await agentApi.runEvents(runId, lastEventId);
+      if (!current.ok) {
+        const errorData = await current.json().catch(() => ({}));
+        throw new Error(errorData.detail || `重连失败: ${current.status}`);
+      }
+    }
+  };
+
   const streamFlow = async (content: string) => {
     if (!novel?.id || isPlaceholderNovel) return;
     setLoading(true);
@@ -236,6 +301,8 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
         summarize_chapters: true,
         overwrite_summaries: false,
         provider,
+        speculative: true,
+        revision_mode: 'paragraph',
       });
 
       if (!response.ok) {
@@ -243,7 +310,7 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
         throw new Error(errorData.detail || `请求失败: ${response.status}`);
       }
 
-      await consumeSse(response, (event, data) => {
+      await consumeFlowWithReconnect(response, (event, data) => {
         if (!data) return;
         if (event === 'status' && typeof data === 'object') {
           if (data.status === 'saved' && data.chapter_id) {
@@ -260,7 +327,7 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
           }
           const stage = data.stage || 'agent';
           const stageLabel = getStageLabel(stage);
-          const statusText = data.status === 'retry' ? '重试' : '执行';
+          const statusText = getStatusText(data);
           if (data.run_id) {
             setCurrentRunId(data.run_id);
             setLastFlowRunId(data.run_id);
@@ -283,7 +350,8 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
           return;
         }
         if (event === 'done' && typeof data === 'object') {
-          setNotice(`流程完成 · 评分 ${data.score ?? '-'}`);
+          const totalSeconds = data.timings?.total ? ` · 用时 ${(data.timings.total / 1000).toFixed(1)}s` : '';
+          setNotice(`流程完成 · 评分 ${data.score ?? '-'}${totalSeconds}`);
           setLastFlowRunId(null);
           setLastFlowStage(null);
           setCurrentRunId(null);
@@ -341,7 +409,7 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
         const errorData = await response.json().catch(() => ({}));
         throw new Error(errorData.detail || `请求失败: ${response.status}`);
       }
-      await consumeSse(response, (event, data) => {
+      await consumeFlowWithReconnect(response, (event, data) => {
         if (!data) return;
         if (event === 'status' && typeof data === 'object') {
           if (data.status === 'saved' && data.chapter_id) {
@@ -358,7 +426,7 @@ const AgentConsole: React.FC<AgentConsoleProps> = ({ novel, loadNovels }) => {
           }
           const stage = data.stage || 'agent';
           const stageLabel = getStageLabel(stage);
-          const statusText = data.status === 'retry' ? '重试' : '执行';
+          const statusText = getStatusText(data);
           if (data.run_id) {
             setCurrentRunId(data.run_id);
             setLastFlowRunId(data.run_id);
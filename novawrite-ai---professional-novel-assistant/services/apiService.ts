@@ -1170,7 +1170,7 @@ export const agentApi = {
       body: JSON.stringify(payload),
     });
   },
-  flowStream: async (payload: { novel_id: string; message?: string; volume_id?: string; chapter_id?: string; max_retries?: number; critic_threshold?: number; summarize_chapters?: boolean; overwrite_summaries?: boolean; provider?: string }): Promise<Response> => {
+  flowStream: async (payload: { novel_id: string; message?: string; volume_id?: string; chapter_id?: string; max_retries?: number; critic_threshold?: number; summarize_chapters?: boolean; overwrite_summaries?: boolean; provider?: string; speculative?: boolean; revision_mode?: 'paragraph' | 'rewrite' }): Promise<Response> => {
     return apiFetch('/api/agents/flow/stream', {
       method: 'POST',
       body: JSON.stringify(payload),
@@ -1182,6 +1182,11 @@ export const agentApi = {
       body: JSON.stringify(payload),
     });
   },
+  runEvents: async (runId: string, lastEventId: number): Promise<Response> => {
+    return apiFetch(`/api/agents/runs/${encodeURIComponent(runId)}/events`, {
+      headers: { 'Last-Event-ID': String(lastEventId) },
+    });
+  },
   cancelRun: async (payload: { run_id: string }): Promise<any> => {
     return apiRequest<any>('/api/agents/cancel', {
       method: 'POST',
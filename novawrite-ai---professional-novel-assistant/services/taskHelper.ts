@@ -36,6 +36,10 @@ export async function waitForTask<T = any>(
       throw new Error(task.error_message || '任务执行失败');
     }
 
+    if (task.status === 'cancelled') {
+      throw new Error(task.progress_message || '任务已取消');
+    }
+
     // 如果任务还在运行或等待中，继续轮询
     if (task.status === 'running' || task.status === 'pending') {
       await new Promise(resolve => setTimeout(resolve, pollInterval));
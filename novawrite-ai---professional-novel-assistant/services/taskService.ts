@@ -6,7 +6,7 @@ export interface Task {
   id: string;
   novel_id: string;
   task_type: string;
-  status: 'pending' | 'running' | 'completed' | 'failed';
+  status: 'pending' | 'running' | 'completed' | 'failed' | 'cancelled';
   progress: number;
   progress_message?: string;
   result?: any;
@@ -56,7 +56,7 @@ export function startPolling(
         return;
       }
 
-      if (task.status === 'failed') {
+      if (task.status === 'failed' || task.status === 'cancelled') {
         clearInterval(pollingIntervals.get(taskId)!);
         pollingIntervals.delete(taskId);
         pollingErrorCounts.delete(taskId);
@@ -141,6 +141,16 @@ export async function getTask(taskId: string): Promise<Task> {
   return apiRequest<Task>(`/api/tasks/${taskId}`);
 }
 
+/**
+ * 取消任务（进行中的 AI 请求会被中断，已生成的内容保留）
+ * @param taskId 任务ID
+ */
+export async function cancelTask(taskId: string): Promise<{ status: string; task_id: string }> {
+  return apiRequest<{ status: string; task_id: string }>(`/api/tasks/${taskId}/cancel`, {
+    method: 'POST',
+  });
+}
+
 /**
  * 获取当前用户的所有活跃任务（pending 或 running）
  * @returns 任务列表
@@ -157,7 +167,7 @@ export async function getActiveTasks(): Promise<Task[]> {
  */
 export async function getNovelTasks(
   novelId: string,
-  status?: 'pending' | 'running' | 'completed' | 'failed'
+  status?: 'pending' | 'running' | 'completed' | 'failed' | 'cancelled'
 ): Promise<Task[]> {
   const url = status
     ? `/api/tasks/novel/${novelId}?status=${status}`